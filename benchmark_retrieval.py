@@ -0,0 +1,561 @@
+#!/usr/bin/env python3
+"""
+Retrieval Quality and Latency Benchmark
+
+Measures whether a RAG change helps or hurts, offline, with the local
+embedding model:
+
+1. build: samples NCERT PDFs from ncert_content/pdfs, derives a labeled
+   query set (question -> expected subject/class/chapter/page) from their
+   text, and indexes the sampled PDFs into a separate benchmark vector store
+2. run: queries RAGSystem.retrieve and SearchService.search under each
+   vector backend / retrieval option and writes a JSON report with
+   recall@k, MRR, p50/p95/p99 latency, start-up time and memory
+
+Queries are made from sentences of a page: definitions become "What is
+X?" questions, other sentences keyword queries. A result counts as a hit
+when it comes from the expected chapter (chapter metrics) and also lies
+within one page of the source page (page metrics).
+
+The report has no timestamps and sorted keys, so two runs can be diffed
+in review.
+
+Usage:
+    python benchmark_retrieval.py build [--pdfs 24] [--per-pdf 4]
+    python benchmark_retrieval.py run [--out benchmark_report.json]
+"""
+
+import os
+import re
+import gc
+import sys
+import json
+import time
+import random
+import hashlib
+import logging
+import argparse
+import platform
+import contextlib
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+BENCHMARK_DIR = Config.VECTOR_STORE_DIR / 'benchmark'
+DEFAULT_QUERY_SET = BENCHMARK_DIR / 'queries.json'
+
+K_VALUES = (1, 5, 10)
+PAGE_TOLERANCE = 1
+
+# Backend / retrieval options compared by run (Config overrides)
+VARIANTS: Dict[str, Dict[str, Any]] = {
+    'chroma-vector': {'VECTOR_BACKEND': 'chroma', 'RAG_RETRIEVAL_MODE': 'vector', 'VECTOR_PARTITIONS_ENABLED': False},
+    'chroma-hybrid': {'VECTOR_BACKEND': 'chroma', 'RAG_RETRIEVAL_MODE': 'hybrid', 'VECTOR_PARTITIONS_ENABLED': False},
+    'partitioned-hybrid': {'VECTOR_BACKEND': 'chroma', 'RAG_RETRIEVAL_MODE': 'hybrid', 'VECTOR_PARTITIONS_ENABLED': True},
+    'flat-hybrid': {'VECTOR_BACKEND': 'flat', 'RAG_RETRIEVAL_MODE': 'hybrid', 'VECTOR_QUANTIZATION': 'none'},
+    'flat-int8-hybrid': {'VECTOR_BACKEND': 'flat', 'RAG_RETRIEVAL_MODE': 'hybrid', 'VECTOR_QUANTIZATION': 'int8'},
+}
+
+# SearchService.search options compared for every variant
+SEARCH_OPTIONS: Dict[str, Dict[str, Any]] = {
+    'default': {'include_context': True, 'merge_adjacent': False},
+    'merged': {'include_context': True, 'merge_adjacent': True},
+}
+
+_DEFINITION = re.compile(
+    r"^(?:The |An? )?([A-Za-z][A-Za-z\- ]{2,40}?) (?:is|are) (?:called |defined as |known as |the |an? )",
+)
+
+_STOPWORDS = {
+    'the', 'and', 'that', 'this', 'with', 'from', 'which', 'these', 'those', 'their', 'there',
+    'have', 'been', 'were', 'they', 'them', 'into', 'also', 'such', 'than', 'then', 'when',
+    'where', 'what', 'will', 'would', 'should', 'could', 'each', 'other', 'some', 'more',
+    'most', 'many', 'much', 'very', 'only', 'over', 'under', 'about', 'because', 'between',
+}
+
+
+def _flat_index_dir(vector_store_path: Path, quantization: str) -> Path:
+    return vector_store_path / f"flat_index_{quantization}"
+
+
+@contextlib.contextmanager
+def override_config(**values) -> Iterator[None]:
+    """
+    Temporarily set Config attributes.
+    
+    Args:
+        **values: Attribute values
+    """
+    previous = {name: getattr(Config, name) for name in values}
+    for name, value in values.items():
+        setattr(Config, name, value)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            setattr(Config, name, value)
+
+
+def offline_config(model: str) -> Dict[str, Any]:
+    """
+    Config overrides for offline runs with the local embedding model.
+    
+    Args:
+        model: sentence-transformers model name
+    
+    Returns:
+        Config overrides
+    """
+    return {
+        'USE_CLOUDFLARE_AI': False,
+        'EMBEDDING_MODEL_ID': model,
+        'EMBEDDING_CACHE_ENABLED': False,
+        'RESPONSE_CACHE_ENABLED': False,
+    }
+
+
+def sample_pdfs(pdf_dir: Path, limit: int) -> List[Path]:
+    """
+    Pick PDFs spread evenly over subjects and classes.
+    
+    Args:
+        pdf_dir: Directory of NCERT PDFs (Subject_Class_ChNN.pdf)
+        limit: Number of PDFs
+    
+    Returns:
+        Sorted list of PDF paths
+    """
+    groups: Dict[str, List[Path]] = {}
+    for pdf_path in sorted(pdf_dir.glob('*.pdf')):
+        groups.setdefault('_'.join(pdf_path.stem.split('_')[:2]), []).append(pdf_path)
+    
+    # Evenly spaced chapters from every group, then trimmed round-robin
+    per_group = -(-limit // max(1, len(groups)))
+    spread = [
+        [paths[i * len(paths) // min(per_group, len(paths))] for i in range(min(per_group, len(paths)))]
+        for paths in groups.values()
+    ]
+    picked: List[Path] = []
+    for i in range(per_group):
+        for paths in spread:
+            if i < len(paths) and len(picked) < limit:
+                picked.append(paths[i])
+    
+    return sorted(set(picked))
+
+
+def make_question(sentence: str) -> Optional[Tuple[str, str]]:
+    """
+    Turn a textbook sentence into a query.
+    
+    Args:
+        sentence: A sentence from a page
+    
+    Returns:
+        Tuple of (query, kind) with kind 'definition' or 'keywords', or None
+        if the sentence is not usable (too short, too long, mostly symbols)
+    """
+    sentence = ' '.join(sentence.split())
+    words = sentence.split()
+    if not 8 <= len(words) <= 40:
+        return None
+    letters = sum(c.isalpha() for c in sentence)
+    if letters < 0.7 * len(sentence.replace(' ', '')):
+        return None
+    
+    match = _DEFINITION.match(sentence)
+    if match and len(match.group(1).split()) <= 5:
+        return f"What is {match.group(1).strip().lower()}?", 'definition'
+    
+    keywords = [
+        word for word in (w.strip('.,;:()[]"\'').lower() for w in words)
+        if len(word) > 3 and word.isalpha() and word not in _STOPWORDS
+    ]
+    if len(keywords) < 5:
+        return None
+    return ' '.join(keywords[:8]), 'keywords'
+
+
+def build_query_set(pdf_paths: List[Path], per_pdf: int = 4, seed: int = 13) -> List[Dict[str, Any]]:
+    """
+    Build labeled queries from the text of the sampled PDFs.
+    
+    Args:
+        pdf_paths: PDFs to sample from
+        per_pdf: Queries per PDF
+        seed: Sampling seed (queries are stable for a given seed and PDF set)
+    
+    Returns:
+        List of query dictionaries with the expected subject/class/chapter/page
+    """
+    from services.ncert_processor import NCERTProcessor
+    
+    queries = []
+    for pdf_path in pdf_paths:
+        metadata = NCERTProcessor.parse_pdf_metadata(pdf_path.name)
+        candidates = []
+        for page in NCERTProcessor.iter_pdf_pages(pdf_path):
+            for sentence in re.split(r'(?<=[.?!])\s+', page['text']):
+                question = make_question(sentence)
+                if question:
+                    candidates.append((question, page['page_number']))
+        
+        rng = random.Random(f"{seed}:{pdf_path.name}")
+        # Prefer definitions, which read like real student questions
+        definitions = [c for c in candidates if c[0][1] == 'definition']
+        others = [c for c in candidates if c[0][1] != 'definition']
+        rng.shuffle(definitions)
+        rng.shuffle(others)
+        
+        for (query, kind), page_number in (definitions + others)[:per_pdf]:
+            queries.append({
+                'id': f"{pdf_path.stem}_{len(queries)}",
+                'query': query,
+                'kind': kind,
+                'subject': metadata['subject'],
+                'class_level': metadata['class_level'],
+                'chapter': metadata['chapter'],
+                'file_name': pdf_path.name,
+                'page': page_number
+            })
+        logger.info(f"{pdf_path.name}: {min(per_pdf, len(candidates))} queries from {len(candidates)} candidate sentences")
+    
+    return queries
+
+
+def build_index(pdf_paths: List[Path], vector_store_path: Path, model: str) -> Dict[str, Any]:
+    """
+    Index the sampled PDFs into the benchmark vector store (and export flat indexes).
+    
+    Args:
+        pdf_paths: PDFs to index
+        vector_store_path: Benchmark vector store directory
+        model: Local embedding model
+    
+    Returns:
+        Dictionary with chunk count and indexing time
+    """
+    from services.ncert_processor import NCERTProcessor
+    from services.vector_backends import export_chroma_collection, flat_index_dir_for
+    
+    pdf_dir = vector_store_path / 'pdfs'
+    pdf_dir.mkdir(parents=True, exist_ok=True)
+    wanted = {pdf_path.name for pdf_path in pdf_paths}
+    for link in pdf_dir.glob('*.pdf'):
+        if link.name not in wanted:
+            link.unlink()
+    for pdf_path in pdf_paths:
+        link = pdf_dir / pdf_path.name
+        if not link.exists():
+            link.symlink_to(pdf_path.resolve())
+    
+    start = time.perf_counter()
+    with override_config(**offline_config(model)):
+        processor = NCERTProcessor(pdf_dir, vector_store_path)
+        processor.process_all_pdfs()
+        for quantization in ('none', 'int8'):
+            export_chroma_collection(
+                processor.collection,
+                flat_index_dir_for(processor.collection.name, _flat_index_dir(vector_store_path, quantization)),
+                quantization=quantization
+            )
+    
+    return {
+        'chunks': processor.collection.count(),
+        'collection': processor.collection.name,
+        'index_seconds': round(time.perf_counter() - start, 1)
+    }
+
+
+def _rss_mb() -> float:
+    """Current resident set size in MB."""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        import resource
+        # ru_maxrss is the peak (kB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def _label(metadata: Dict[str, Any]) -> Tuple[str, str, str, Optional[int]]:
+    """(subject, class, chapter, page) of a retrieve() or search() result."""
+    page = metadata.get('page_number', metadata.get('page'))
+    try:
+        page = int(page)
+    except (TypeError, ValueError):
+        page = None
+    return (
+        str(metadata.get('subject')),
+        str(metadata.get('class_level', metadata.get('class'))),
+        str(metadata.get('chapter')),
+        page
+    )
+
+
+def score_rankings(queries: List[Dict[str, Any]], rankings: List[List[Dict[str, Any]]]) -> Dict[str, Any]:
+    """
+    Compute recall@k and MRR at chapter and page level.
+    
+    Args:
+        queries: Labeled queries
+        rankings: Result metadata lists, one per query, best first
+    
+    Returns:
+        Dictionary of metrics
+    """
+    metrics: Dict[str, Any] = {}
+    for level in ('chapter', 'page'):
+        first_hits = []
+        for query, ranking in zip(queries, rankings):
+            expected = (query['subject'], str(query['class_level']), query['chapter'])
+            first_hit = None
+            for rank, metadata in enumerate(ranking, start=1):
+                subject, class_level, chapter, page = _label(metadata)
+                if (subject, class_level, chapter) != expected:
+                    continue
+                if level == 'page' and (page is None or abs(page - query['page']) > PAGE_TOLERANCE):
+                    continue
+                first_hit = rank
+                break
+            first_hits.append(first_hit)
+        
+        for k in K_VALUES:
+            metrics[f"{level}_recall@{k}"] = round(
+                sum(1 for hit in first_hits if hit is not None and hit <= k) / len(first_hits), 4
+            )
+        metrics[f"{level}_mrr"] = round(sum(1.0 / hit for hit in first_hits if hit) / len(first_hits), 4)
+    
+    return metrics
+
+
+def _latency(timings: List[float]) -> Dict[str, float]:
+    values = np.asarray(timings) * 1000
+    return {
+        'p50_ms': round(float(np.percentile(values, 50)), 2),
+        'p95_ms': round(float(np.percentile(values, 95)), 2),
+        'p99_ms': round(float(np.percentile(values, 99)), 2),
+        'mean_ms': round(float(values.mean()), 2)
+    }
+
+
+def run_variant(
+    name: str,
+    queries: List[Dict[str, Any]],
+    vector_store_path: Path,
+    model: str,
+    use_filters: bool = False
+) -> Dict[str, Any]:
+    """
+    Benchmark one backend / retrieval option.
+    
+    Args:
+        name: Variant name (key of VARIANTS)
+        queries: Labeled queries
+        vector_store_path: Benchmark vector store directory
+        model: Local embedding model
+        use_filters: Pass each query's subject and class as filters
+    
+    Returns:
+        Dictionary with retrieve and search metrics, latency, start-up time and memory
+    """
+    from services.rag_system import RAGSystem
+    from services.search_service import SearchService
+    
+    overrides = dict(VARIANTS[name])
+    quantization = overrides.pop('VECTOR_QUANTIZATION', None)
+    if quantization is not None:
+        overrides['FLAT_INDEX_DIR'] = _flat_index_dir(vector_store_path, quantization)
+    top_k = max(K_VALUES)
+    
+    gc.collect()
+    rss_before = _rss_mb()
+    
+    with override_config(**offline_config(model), **overrides):
+        start = time.perf_counter()
+        rag = RAGSystem(vector_store_path=str(vector_store_path))
+        init_seconds = time.perf_counter() - start
+        rss_loaded = _rss_mb()
+        
+        filters = [
+            {'$and': [{'subject': query['subject']}, {'class_level': str(query['class_level'])}]}
+            if use_filters else None
+            for query in queries
+        ]
+        
+        # Warm up (first query loads lazy indexes)
+        rag.retrieve(queries[0]['query'], top_k=top_k, filters=filters[0])
+        
+        rankings, timings = [], []
+        for query, query_filters in zip(queries, filters):
+            start = time.perf_counter()
+            results = rag.retrieve(query['query'], top_k=top_k, filters=query_filters)
+            timings.append(time.perf_counter() - start)
+            rankings.append([result['metadata'] for result in results])
+        
+        report = {
+            'config': {key: str(value) for key, value in VARIANTS[name].items()},
+            'filters': use_filters,
+            'init_seconds': round(init_seconds, 2),
+            'retrieve': {**score_rankings(queries, rankings), 'latency': _latency(timings)},
+            'search': {}
+        }
+        
+        search_service = SearchService(rag)
+        for option_name, options in SEARCH_OPTIONS.items():
+            rankings, timings = [], []
+            for query in queries:
+                start = time.perf_counter()
+                # Subject only: SearchService sends multi-field filters as a flat dict
+                response = search_service.search(
+                    query['query'],
+                    subject=query['subject'] if use_filters else None,
+                    top_k=top_k,
+                    include_diagrams=False,
+                    **options
+                )
+                timings.append(time.perf_counter() - start)
+                rankings.append([result['metadata'] for result in response.get('results', [])])
+            report['search'][option_name] = {**score_rankings(queries, rankings), 'latency': _latency(timings)}
+        
+        report['memory_mb'] = {
+            'loaded_delta': round(rss_loaded - rss_before, 1),
+            'after_queries_delta': round(_rss_mb() - rss_before, 1)
+        }
+    
+    del search_service, rag
+    gc.collect()
+    return report
+
+
+def run_benchmark(
+    query_set_path: Path,
+    vector_store_path: Path,
+    model: str,
+    variants: Optional[List[str]] = None,
+    limit: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    Run every variant over the query set.
+    
+    Args:
+        query_set_path: Query set written by build
+        vector_store_path: Benchmark vector store directory
+        model: Local embedding model
+        variants: Variant names (default: all)
+        limit: Use only the first limit queries
+    
+    Returns:
+        JSON-serializable report
+    """
+    with open(query_set_path, 'rb') as f:
+        raw = f.read()
+    queries = json.loads(raw)['queries'][:limit]
+    
+    report: Dict[str, Any] = {
+        'environment': {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'embedding_model': model,
+            'local_embedding_backend': Config.LOCAL_EMBEDDING_BACKEND
+        },
+        'query_set': {
+            'path': str(query_set_path),
+            'sha256': hashlib.sha256(raw).hexdigest(),
+            'queries': len(queries),
+            'kinds': {kind: sum(1 for q in queries if q['kind'] == kind) for kind in sorted({q['kind'] for q in queries})}
+        },
+        'k_values': list(K_VALUES),
+        'page_tolerance': PAGE_TOLERANCE,
+        'variants': {}
+    }
+    
+    for name in variants or list(VARIANTS):
+        logger.info(f"Benchmarking {name}...")
+        report['variants'][name] = run_variant(name, queries, vector_store_path, model)
+        if VARIANTS[name].get('VECTOR_PARTITIONS_ENABLED'):
+            # Partitions only pay off for filtered queries
+            report['variants'][f"{name}-filtered"] = run_variant(
+                name, queries, vector_store_path, model, use_filters=True
+            )
+    
+    report['peak_rss_mb'] = round(_peak_rss_mb(), 1)
+    return report
+
+
+def _peak_rss_mb() -> float:
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+    except ImportError:
+        return _rss_mb()
+
+
+def main():
+    """
+    Command-line entry point for building the benchmark and running it.
+    """
+    parser = argparse.ArgumentParser(description='Benchmark retrieval quality and latency')
+    parser.add_argument('--store', default=str(BENCHMARK_DIR), help='Benchmark vector store directory')
+    parser.add_argument('--queries', default=str(DEFAULT_QUERY_SET), help='Query set JSON file')
+    parser.add_argument('--model', default=Config.EMBEDDING_MODEL_NAME, help='Local embedding model')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    build_parser = subparsers.add_parser('build', help='Build the labeled query set and the benchmark index')
+    build_parser.add_argument('--pdf-dir', default=str(Config.NCERT_PDF_DIR), help='Directory of NCERT PDFs')
+    build_parser.add_argument('--pdfs', type=int, default=24, help='Number of PDFs to sample')
+    build_parser.add_argument('--per-pdf', type=int, default=4, help='Queries per PDF')
+    build_parser.add_argument('--seed', type=int, default=13, help='Sampling seed')
+    build_parser.add_argument('--queries-only', action='store_true', help='Do not (re)build the index')
+    
+    run_parser = subparsers.add_parser('run', help='Run the benchmark and write a JSON report')
+    run_parser.add_argument('--variant', action='append', choices=sorted(VARIANTS), help='Variant to run (repeatable; default: all)')
+    run_parser.add_argument('--limit', type=int, help='Use only the first N queries')
+    run_parser.add_argument('--out', help='Report file (default: stdout)')
+    
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    
+    store = Path(args.store)
+    query_set_path = Path(args.queries)
+    
+    if args.command == 'build':
+        pdf_paths = sample_pdfs(Path(args.pdf_dir), args.pdfs)
+        if not pdf_paths:
+            parser.error(f"No PDFs found in {args.pdf_dir}")
+        
+        queries = build_query_set(pdf_paths, per_pdf=args.per_pdf, seed=args.seed)
+        query_set_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(query_set_path, 'w', encoding='utf-8') as f:
+            json.dump({'seed': args.seed, 'pdfs': [p.name for p in pdf_paths], 'queries': queries}, f, indent=2)
+        print(f"Wrote {len(queries)} queries to {query_set_path}")
+        
+        if not args.queries_only:
+            print(json.dumps(build_index(pdf_paths, store, args.model), indent=2))
+    
+    elif args.command == 'run':
+        # Everything is local; never reach for the model hub
+        os.environ.setdefault('HF_HUB_OFFLINE', '1')
+        os.environ.setdefault('TRANSFORMERS_OFFLINE', '1')
+        
+        report = run_benchmark(query_set_path, store, args.model, args.variant, args.limit)
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if args.out:
+            with open(args.out, 'w', encoding='utf-8') as f:
+                f.write(output + '\n')
+            print(f"Report written to {args.out}")
+        else:
+            print(output)
+
+
+if __name__ == "__main__":
+    main()
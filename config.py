@@ -27,6 +27,9 @@ class Config:
     MODEL_DIR = BASE_DIR / 'ai_models'
     LLM_MODEL_PATH = MODEL_DIR / 'qwen2.5-7b-instruct-q4_k_m.gguf'
     EMBEDDING_MODEL_NAME = 'sentence-transformers/all-mpnet-base-v2'  # 768 dims to match vector DB
+    LOCAL_EMBEDDING_BACKEND = os.getenv('LOCAL_EMBEDDING_BACKEND', 'torch')  # 'torch', 'onnx' or 'onnx-int8'
+    ONNX_MODEL_DIR = MODEL_DIR / 'onnx'  # Exported (and quantized) embedding models
+    ONNX_THREADS = int(os.getenv('ONNX_THREADS', '0'))  # ONNX Runtime intra-op threads (0 = one per core)
     
     # Google Gemini Configuration (Free - Best Quality)
     USE_GEMINI = os.getenv('USE_GEMINI', 'false').lower() == 'true'
@@ -39,6 +42,8 @@ class Config:
     USE_CLOUDFLARE_AI = os.getenv('USE_CLOUDFLARE_AI', 'false').lower() == 'true'
     CLOUDFLARE_ACCOUNT_ID = os.getenv('CLOUDFLARE_ACCOUNT_ID', '')
     CLOUDFLARE_API_TOKEN = os.getenv('CLOUDFLARE_API_TOKEN', '')
+    CLOUDFLARE_API_BASE_URL = os.getenv('CLOUDFLARE_API_BASE_URL', 'https://api.cloudflare.com/client/v4')  # utils/cloudflare_stub_server.py for local testing
+    CLOUDFLARE_HTTP_POOL_SIZE = int(os.getenv('CLOUDFLARE_HTTP_POOL_SIZE', '16'))  # Keep-alive connections to the API per process
     
     # Cloudflare AI Models
     CLOUDFLARE_CHAT_MODEL = '@cf/meta/llama-3.1-8b-instruct'
@@ -67,11 +72,21 @@ class Config:
     VECTOR_STORE_DIR = BASE_DIR / 'vector_store'
     CHROMA_DB_PATH = VECTOR_STORE_DIR  # Use vector_store for consistency
     CHROMA_COLLECTION_NAME = 'ncert_content'
+    VECTOR_BACKEND = os.getenv('VECTOR_BACKEND', 'chroma')  # 'chroma' or 'flat' (memory-mapped exact search)
+    FLAT_INDEX_DIR = VECTOR_STORE_DIR / 'flat_index'  # One subdirectory per text collection
+    VECTOR_QUANTIZATION = os.getenv('VECTOR_QUANTIZATION', 'none')  # Flat index coarse pass: 'none', 'float16' or 'int8'
+    VECTOR_RESCORE_FACTOR = int(os.getenv('VECTOR_RESCORE_FACTOR', '10'))  # float32 rescoring candidates per result
+    DIAGRAM_VECTOR_BACKEND = os.getenv('DIAGRAM_VECTOR_BACKEND', 'chroma')  # 'chroma' or 'flat'
+    DIAGRAM_FLAT_INDEX_DIR = VECTOR_STORE_DIR / 'diagram_flat_index'
+    VECTOR_PARTITIONS_ENABLED = os.getenv('VECTOR_PARTITIONS_ENABLED', 'true').lower() == 'true'  # Per subject/class collections
+    EMBEDDING_MODEL_ID = os.getenv('EMBEDDING_MODEL_ID', '')  # Model for new collections ('' = Cloudflare BGE if enabled, else local)
     
     # NCERT Content
     NCERT_CONTENT_DIR = BASE_DIR / 'ncert_content'
     NCERT_PDF_DIR = NCERT_CONTENT_DIR / 'pdfs'
     DIAGRAMS_DIR = BASE_DIR / 'diagrams'
+    DIAGRAM_DB_PATH = BASE_DIR / 'diagrams.db'
+    DIAGRAM_DB_IMMUTABLE = os.getenv('DIAGRAM_DB_IMMUTABLE', 'false').lower() == 'true'  # Only if diagrams.db never changes while serving
     PREVIOUS_PAPERS_DIR = BASE_DIR / 'previous_papers'
     
     # RAG Settings
@@ -79,6 +94,48 @@ class Config:
     RAG_CHUNK_SIZE = 500
     RAG_CHUNK_OVERLAP = 50
     
+    # Ingestion pipeline (extract -> chunk -> embed -> store, streamed in batches)
+    INGEST_TOKENIZER = os.getenv('INGEST_TOKENIZER', 'nltk')  # Sentence word counter: 'nltk' or 'regex'
+    INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', '64'))  # Chunks per pipeline batch
+    INGEST_QUEUE_SIZE = int(os.getenv('INGEST_QUEUE_SIZE', '4'))  # Batches buffered between stages
+    
+    # Hybrid Retrieval (BM25 + vector search fused with reciprocal-rank fusion)
+    RAG_RETRIEVAL_MODE = os.getenv('RAG_RETRIEVAL_MODE', 'hybrid')  # 'hybrid' or 'vector'
+    RAG_HYBRID_CANDIDATES = 20  # Candidates taken from each ranking before fusion
+    RAG_RRF_K = 60  # Reciprocal-rank fusion constant
+    
+    # Neighbor-chunk context (merge adjacent hits so chunk overlaps reach the LLM once)
+    RAG_MERGE_ADJACENT = os.getenv('RAG_MERGE_ADJACENT', 'true').lower() == 'true'
+    
+    # Out-of-scope pre-classifier (answers obvious off-topic requests before retrieval)
+    SCOPE_PRECLASSIFIER_ENABLED = os.getenv('SCOPE_PRECLASSIFIER_ENABLED', 'true').lower() == 'true'
+    SCOPE_PRECLASSIFIER_CONFIDENCE = float(os.getenv('SCOPE_PRECLASSIFIER_CONFIDENCE', '0.85'))  # Off-topic confidence to skip retrieval
+    
+    # Query Embedding Cache (skips the embedding hop for repeated queries)
+    EMBEDDING_CACHE_ENABLED = os.getenv('EMBEDDING_CACHE_ENABLED', 'true').lower() == 'true'
+    EMBEDDING_CACHE_MAX_SIZE = int(os.getenv('EMBEDDING_CACHE_MAX_SIZE', '2048'))
+    EMBEDDING_CACHE_TTL = int(os.getenv('EMBEDDING_CACHE_TTL', '86400'))  # 24 hours in seconds
+    
+    # Semantic Response Cache (serves near-identical questions without LLM calls)
+    RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+    RESPONSE_CACHE_SIMILARITY_THRESHOLD = float(os.getenv('RESPONSE_CACHE_SIMILARITY_THRESHOLD', '0.95'))
+    RESPONSE_CACHE_MAX_SIZE = int(os.getenv('RESPONSE_CACHE_MAX_SIZE', '1000'))
+    RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', '3600'))  # 1 hour in seconds
+    
+    # Query pipeline (independent stages of a query run concurrently, each with a time limit)
+    QUERY_STAGE_WORKERS = int(os.getenv('QUERY_STAGE_WORKERS', '16'))  # Threads for blocking stages per process
+    QUERY_GENERATION_WORKERS = int(os.getenv('QUERY_GENERATION_WORKERS', '4'))  # Threads for blocking LLM stages per process
+    QUERY_RETRIEVAL_TIMEOUT = float(os.getenv('QUERY_RETRIEVAL_TIMEOUT', '20'))  # Seconds
+    QUERY_DIAGRAM_TIMEOUT = float(os.getenv('QUERY_DIAGRAM_TIMEOUT', '5'))  # Seconds; the answer is sent without diagrams after this
+    QUERY_GENERATION_TIMEOUT = float(os.getenv('QUERY_GENERATION_TIMEOUT', '90'))  # Seconds
+    QUERY_QUIZ_TIMEOUT = float(os.getenv('QUERY_QUIZ_TIMEOUT', '60'))  # Seconds; the answer is sent without a quiz after this
+    QUIZ_FROM_CONTEXT = os.getenv('QUIZ_FROM_CONTEXT', 'true').lower() == 'true'  # Quiz from retrieved context, generated alongside the answer
+    STRUCTURED_ANSWER = os.getenv('STRUCTURED_ANSWER', 'false').lower() == 'true'  # One generation returns explanation + quiz as JSON
+    SINGLE_FLIGHT_ENABLED = os.getenv('SINGLE_FLIGHT_ENABLED', 'true').lower() == 'true'  # Identical concurrent LLM/embedding calls share one call
+    
+    # Multi-worker serving (gunicorn.conf.py loads read-only assets once, before forking workers)
+    PRELOAD_ASSETS = os.getenv('PRELOAD_ASSETS', 'true').lower() == 'true'
+    
     # OCR Settings
     TESSERACT_CMD = os.getenv('TESSERACT_CMD', 'tesseract')
     OCR_LANGUAGES = ['eng']
@@ -0,0 +1,44 @@
+"""
+Gunicorn configuration for multi-worker deployment.
+
+With PRELOAD_ASSETS=true (the default) the app is imported in the master
+process, the read-only serving assets are loaded once (services/preload.py)
+and the forked workers share them copy-on-write. Each worker then recreates
+its own connections and builds its RAG system (ChromaDB client) lazily on
+the first API request, as before.
+
+Usage:
+    gunicorn -c gunicorn.conf.py app:app
+
+Environment:
+    PORT               Port to bind (default: 5001)
+    WEB_CONCURRENCY    Number of worker processes (default: 2)
+    GUNICORN_THREADS   Threads per worker (default: 4)
+    PRELOAD_ASSETS     Load shared assets in the master before forking (default: true)
+"""
+
+import os
+
+from config import Config
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5001')}"
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+worker_class = 'gthread'
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))  # LLM calls can take a while
+
+preload_app = Config.PRELOAD_ASSETS
+
+
+def when_ready(server):
+    """Load the shared read-only assets in the master, before any worker forks."""
+    if preload_app:
+        from services.preload import preload_assets
+        preload_assets()
+
+
+def post_fork(server, worker):
+    """Recreate per-process handles inherited from the master."""
+    if preload_app:
+        from services.preload import reinit_after_fork
+        reinit_after_fork()
@@ -0,0 +1,44 @@
+"""
+Diagram page model for GuruAI application.
+Stores the metadata of NCERT textbook pages that contain diagrams (diagrams.db).
+"""
+from sqlalchemy import Column, String, Integer, Text, Index
+from models.database import Base
+
+
+class DiagramPage(Base):
+    """Database model for storing complete page metadata."""
+    __tablename__ = 'diagram_pages'
+    
+    page_id = Column(String(255), primary_key=True)
+    subject = Column(String(100), nullable=False)
+    class_level = Column(Integer, nullable=False)
+    chapter = Column(Integer, nullable=False)
+    page_number = Column(Integer, nullable=False)
+    figures = Column(Text)  # Comma-separated figure numbers
+    captions = Column(Text)  # JSON string of figure_number: caption
+    file_path = Column(String(500), nullable=False)
+    source_pdf = Column(String(255))
+    image_hash = Column(String(64))
+    width = Column(Integer)
+    height = Column(Integer)
+    
+    # Chapter -> pages lookups (services.diagram_chapter_cache)
+    __table_args__ = (
+        Index('idx_diagram_pages_chapter', 'subject', 'class_level', 'chapter', 'page_number'),
+    )
+    
+    def to_dict(self):
+        return {
+            'page_id': self.page_id,
+            'subject': self.subject,
+            'class_level': self.class_level,
+            'chapter': self.chapter,
+            'page_number': self.page_number,
+            'figures': self.figures.split(',') if self.figures else [],
+            'captions': self.captions,
+            'file_path': self.file_path,
+            'source_pdf': self.source_pdf,
+            'width': self.width,
+            'height': self.height
+        }
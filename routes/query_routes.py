@@ -3,16 +3,18 @@ Query Routes for GuruAI - Flask API endpoints for text-based queries.
 
 Provides REST API endpoints for:
 - Processing text queries
+- Streaming answers as server-sent events (/api/ask/stream)
 - Retrieving query statistics
 - Validating queries
 
 Requirements: 1.1, 1.2, 1.3, 1.4
 """
 
+import json
 import logging
 import asyncio
 import os
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 from typing import Dict, Any
 
 from services.query_handler import QueryHandler
@@ -213,6 +215,86 @@ def ask_question():
         }), 500
 
 
+@query_bp.route('/ask/stream', methods=['POST'])
+def ask_question_stream():
+    """
+    Process a text-based query, streaming the answer as server-sent events.
+    
+    Request JSON: same as /api/ask
+    
+    Response (text/event-stream), in order:
+        event: context   {"references": [...], "diagrams": [...], "metadata": {...}}
+        event: token     {"text": "..."}  (repeated, explanation fragments)
+        event: quiz      {"quiz": {...}}  (if include_quiz)
+        event: done      {complete response, as returned by /api/ask}
+    or, on failure at any point:
+        event: error     {"success": false, "error": "...", ...}
+    
+    Status Codes:
+        200: Stream started
+        400: Bad request (invalid input)
+    """
+    data = request.get_json(silent=True)
+    
+    if not data:
+        return jsonify({
+            'success': False,
+            'error': 'No JSON data provided'
+        }), 400
+    
+    query = data.get('query')
+    user_id = data.get('user_id')
+    include_quiz = data.get('include_quiz', True)
+    include_diagrams = data.get('include_diagrams', True)
+    
+    if not query or not query.strip():
+        return jsonify({
+            'success': False,
+            'error': 'Query parameter is required'
+        }), 400
+    
+    handler = get_query_handler()
+    
+    is_valid, error_msg = handler.validate_query(query)
+    if not is_valid:
+        return jsonify({
+            'success': False,
+            'error': error_msg
+        }), 400
+    
+    def generate():
+        for event, payload in handler.stream_query(
+            query=query,
+            user_id=user_id,
+            include_quiz=include_quiz,
+            include_diagrams=include_diagrams
+        ):
+            yield format_sse(event, payload)
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # Don't let nginx buffer the stream
+        }
+    )
+
+
+def format_sse(event: str, payload: Dict[str, Any]) -> str:
+    """
+    Format one server-sent event.
+    
+    Args:
+        event: Event name
+        payload: Event data (sent as JSON)
+    
+    Returns:
+        Event text, terminated by a blank line
+    """
+    return f"event: {event}\ndata: {json.dumps(payload, default=str)}\n\n"
+
+
 @query_bp.route('/validate-query', methods=['POST'])
 def validate_query():
     """
@@ -9,7 +9,7 @@ Requirements: 9.1, 9.2, 9.3, 9.4, 9.5
 
 import logging
 from flask import Blueprint, request, jsonify
-from typing import Optional
+from typing import Optional, Tuple
 
 from services.search_service import SearchService
 from services.rag_system import RAGSystem
@@ -28,6 +28,9 @@ search_bp = Blueprint('search', __name__, url_prefix='/api/search')
 # Global search service instance
 _search_service: Optional[SearchService] = None
 
+# Maximum number of queries accepted by /api/search/batch
+MAX_BATCH_QUERIES = 20
+
 
 def init_search_service():
     """
@@ -81,6 +84,8 @@ def search():
         top_k (int): Number of results to return (default: 10)
         include_context (bool): Include surrounding context (default: true)
         include_diagrams (bool): Include matching diagrams (default: true)
+        context_window (int): Neighboring chunks on each side used as context (default: 1)
+        merge_adjacent (bool): Merge consecutive chunks into one result (default: false)
     
     Returns:
         JSON response with search results, diagrams, and metadata
@@ -97,6 +102,8 @@ def search():
         top_k_str = request.args.get('top_k', '10')
         include_context_str = request.args.get('include_context', 'true')
         include_diagrams_str = request.args.get('include_diagrams', 'true')
+        context_window = request.args.get('context_window', 1, type=int)
+        merge_adjacent_str = request.args.get('merge_adjacent', 'false')
         
         # Validate required parameters
         if not query:
@@ -145,6 +152,10 @@ def search():
         
         include_context = include_context_str.lower() in ['true', '1', 'yes']
         include_diagrams = include_diagrams_str.lower() in ['true', '1', 'yes']
+        merge_adjacent = merge_adjacent_str.lower() in ['true', '1', 'yes']
+        
+        if context_window < 0 or context_window > 3:
+            context_window = 1  # Default to 1 if out of range
         
         # Get search service
         search_service = get_search_service()
@@ -159,7 +170,9 @@ def search():
             chapter=chapter,
             top_k=top_k,
             include_context=include_context,
-            include_diagrams=include_diagrams
+            include_diagrams=include_diagrams,
+            context_window=context_window,
+            merge_adjacent=merge_adjacent
         )
         
         # Return response
@@ -177,6 +190,162 @@ def search():
         }), 500
 
 
+def _parse_class_level(value) -> Tuple[Optional[int], Optional[str]]:
+    """
+    Validate a class level filter from a JSON body.
+    
+    Returns:
+        (class level, None), or (None, error message)
+    """
+    try:
+        class_level = int(value)
+    except (TypeError, ValueError):
+        return None, 'Invalid class level parameter'
+    if class_level not in [11, 12]:
+        return None, 'Class level must be 11 or 12'
+    return class_level, None
+
+
+def _parse_chapter(value) -> Tuple[Optional[int], Optional[str]]:
+    """
+    Validate a chapter filter from a JSON body.
+    
+    Returns:
+        (chapter, None), or (None, error message)
+    """
+    try:
+        chapter = int(value)
+    except (TypeError, ValueError):
+        return None, 'Invalid chapter parameter'
+    if chapter < 1:
+        return None, 'Chapter must be a positive integer'
+    return chapter, None
+
+
+@search_bp.route('/batch', methods=['POST'])
+def search_batch():
+    """
+    Search NCERT content for several queries in one request.
+    
+    All queries are embedded in one batch and answered with one multi-query
+    vector search per filter set; shared diagram lookups run once.
+    
+    Request Body (JSON):
+        queries (list): Query strings, or objects with "q" and optional
+            "subject", "class", "chapter" overriding the shared filters (required)
+        subject (str): Shared subject filter (optional)
+        class (int): Shared class level filter (optional)
+        chapter (int): Shared chapter filter (optional)
+        top_k (int): Number of results per query (default: 10)
+        include_context (bool): Include surrounding context (default: true)
+        include_diagrams (bool): Include matching diagrams (default: true)
+        context_window (int): Neighboring chunks on each side used as context (default: 1)
+        merge_adjacent (bool): Merge consecutive chunks into one result (default: false)
+    
+    Returns:
+        JSON response with one result per query entry, in request order
+    
+    Example:
+        POST /api/search/batch
+        {"queries": ["Newton laws", {"q": "enthalpy", "subject": "Chemistry"}], "class": 11}
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        queries = data.get('queries')
+        
+        # Validate required parameters
+        if not isinstance(queries, list) or not queries:
+            return jsonify({
+                'success': False,
+                'error': 'Field "queries" must be a non-empty list'
+            }), 400
+        
+        if len(queries) > MAX_BATCH_QUERIES:
+            return jsonify({
+                'success': False,
+                'error': f'At most {MAX_BATCH_QUERIES} queries are allowed per batch'
+            }), 400
+        
+        # Per-entry filters get the same checks as the shared ones and are passed on as ints
+        entries = []
+        for position, entry in enumerate(queries):
+            if not isinstance(entry, (str, dict)):
+                return jsonify({
+                    'success': False,
+                    'error': 'Each query must be a string or an object with "q"'
+                }), 400
+            
+            if isinstance(entry, dict):
+                entry = dict(entry)
+                for field, parse in (('class', _parse_class_level), ('chapter', _parse_chapter)):
+                    if entry.get(field) is not None:
+                        value, error = parse(entry[field])
+                        if error:
+                            return jsonify({
+                                'success': False,
+                                'error': f'Query {position + 1}: {error}'
+                            }), 400
+                        entry[field] = value
+            entries.append(entry)
+        
+        class_level = data.get('class')
+        if class_level is not None:
+            class_level, error = _parse_class_level(class_level)
+            if error:
+                return jsonify({'success': False, 'error': error}), 400
+        
+        chapter = data.get('chapter')
+        if chapter is not None:
+            chapter, error = _parse_chapter(chapter)
+            if error:
+                return jsonify({'success': False, 'error': error}), 400
+        
+        try:
+            top_k = int(data.get('top_k', 10))
+            if top_k < 1 or top_k > 50:
+                top_k = 10  # Default to 10 if out of range
+        except (TypeError, ValueError):
+            top_k = 10
+        
+        try:
+            context_window = int(data.get('context_window', 1))
+            if context_window < 0 or context_window > 3:
+                context_window = 1  # Default to 1 if out of range
+        except (TypeError, ValueError):
+            context_window = 1
+        
+        # Get search service
+        search_service = get_search_service()
+        
+        logger.info(f"Batch search request: {len(queries)} queries, subject={data.get('subject')}, class={class_level}")
+        
+        response = search_service.search_many(
+            queries=entries,
+            subject=data.get('subject'),
+            class_level=class_level,
+            chapter=chapter,
+            top_k=top_k,
+            include_context=str(data.get('include_context', True)).lower() in ['true', '1', 'yes'],
+            include_diagrams=str(data.get('include_diagrams', True)).lower() in ['true', '1', 'yes'],
+            context_window=context_window,
+            merge_adjacent=str(data.get('merge_adjacent', False)).lower() in ['true', '1', 'yes']
+        )
+        
+        # Return response
+        if response.get('success'):
+            return jsonify(response), 200
+        else:
+            return jsonify(response), 400
+    
+    except Exception as e:
+        logger.error(f"Error in batch search endpoint: {e}", exc_info=True)
+        return jsonify({
+            'success': False,
+            'error': 'Internal server error',
+            'details': str(e)
+        }), 500
+
+
 @search_bp.route('/autocomplete', methods=['GET'])
 def autocomplete():
     """
@@ -0,0 +1,237 @@
+"""
+Chunk Neighbor Index for NCERT Content
+
+Maps every chunk ID to its position in its source PDF, so the chunks just
+before and after a search hit can be fetched with one batched
+collection.get by ID instead of extra vector queries.
+
+The order comes from the index manifest written by NCERTProcessor. Stores
+indexed before the manifest existed fall back to sorting the collection's
+metadata by (file_name, page_number, chunk_index).
+
+Also provides overlap-aware joining of adjacent chunks, which removes the
+sentence overlap the chunker adds between consecutive chunks.
+"""
+
+import json
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from services.index_manifest import MANIFEST_FILENAME
+
+logger = logging.getLogger(__name__)
+
+# Longest chunk overlap (in words) looked for when joining adjacent chunks
+MAX_OVERLAP_WORDS = 120
+
+
+def overlap_size(first_words: List[str], second_words: List[str], max_overlap: int = MAX_OVERLAP_WORDS) -> int:
+    """
+    Count the words shared by the end of one chunk and the start of the next.
+    
+    Args:
+        first_words: Words of the earlier chunk
+        second_words: Words of the later chunk
+        max_overlap: Longest overlap to look for, in words
+    
+    Returns:
+        Length of the longest suffix of first_words that is a prefix of second_words
+    """
+    for size in range(min(max_overlap, len(first_words), len(second_words)), 0, -1):
+        if first_words[-size:] == second_words[:size]:
+            return size
+    return 0
+
+
+def join_overlapping(first: str, second: str, max_overlap: int = MAX_OVERLAP_WORDS) -> str:
+    """
+    Join two consecutive chunks, dropping the words they share.
+    
+    The chunker repeats up to ~50 words from the end of a chunk at the start
+    of the next one; that overlap is emitted only once.
+    
+    Args:
+        first: Earlier chunk text
+        second: Later chunk text
+        max_overlap: Longest overlap to look for, in words
+    
+    Returns:
+        Joined text
+    """
+    first_words = first.split()
+    second_words = second.split()
+    size = overlap_size(first_words, second_words, max_overlap)
+    return ' '.join(first_words + second_words[size:])
+
+
+def _int_or_zero(value) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+class ChunkNeighborIndex:
+    """
+    Chunk ID -> (file, position) index with neighbor lookups.
+    """
+    
+    def __init__(self, order: Dict[str, List[str]]):
+        """
+        Build the index from ordered chunk IDs per file.
+        
+        Args:
+            order: Mapping of file name to its chunk IDs in document order
+        """
+        self._order = order
+        self._positions: Dict[str, Tuple[str, int]] = {}
+        for file_name, chunk_ids in order.items():
+            for position, chunk_id in enumerate(chunk_ids):
+                self._positions[chunk_id] = (file_name, position)
+    
+    def __len__(self) -> int:
+        return len(self._positions)
+    
+    @classmethod
+    def from_manifest(cls, vector_store_path: Path, collection_name: str) -> Optional['ChunkNeighborIndex']:
+        """
+        Build the index from the index manifest.
+        
+        Args:
+            vector_store_path: ChromaDB directory holding the manifest
+            collection_name: Collection the manifest must describe
+        
+        Returns:
+            The index, or None if there is no usable manifest
+        """
+        path = Path(vector_store_path) / MANIFEST_FILENAME
+        if not path.exists():
+            return None
+        
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.warning(f"Could not read index manifest for neighbor lookups: {e}")
+            return None
+        
+        if data.get('collection') != collection_name:
+            return None
+        
+        order = {name: entry['chunks'] for name, entry in data.get('files', {}).items()}
+        return cls(order)
+    
+    @classmethod
+    def from_collection(cls, collection, page_size: int = 1000) -> 'ChunkNeighborIndex':
+        """
+        Build the index from collection metadata.
+        
+        Args:
+            collection: ChromaDB collection
+            page_size: Chunks fetched per request
+        
+        Returns:
+            The index
+        """
+        entries: Dict[str, List[Tuple[int, int, str]]] = {}
+        
+        offset = 0
+        while True:
+            page = collection.get(include=['metadatas'], limit=page_size, offset=offset)
+            ids = page.get('ids') or []
+            if not ids:
+                break
+            for chunk_id, metadata in zip(ids, page['metadatas']):
+                metadata = metadata or {}
+                entries.setdefault(metadata.get('file_name', ''), []).append((
+                    _int_or_zero(metadata.get('page_number')),
+                    _int_or_zero(metadata.get('chunk_index')),
+                    chunk_id
+                ))
+            offset += len(ids)
+        
+        order = {
+            file_name: [chunk_id for _, _, chunk_id in sorted(chunks)]
+            for file_name, chunks in entries.items()
+        }
+        return cls(order)
+    
+    def position(self, chunk_id: str) -> Optional[Tuple[str, int]]:
+        """
+        Get the (file name, position) of a chunk.
+        
+        Args:
+            chunk_id: Chunk ID
+        
+        Returns:
+            (file name, position) or None if the chunk is unknown
+        """
+        return self._positions.get(chunk_id)
+    
+    def neighbors(self, chunk_id: str, window: int = 1) -> Tuple[List[str], List[str]]:
+        """
+        Get the IDs of the chunks around a chunk.
+        
+        Args:
+            chunk_id: Chunk ID
+            window: Number of chunks to take on each side
+        
+        Returns:
+            Tuple of (IDs before, IDs after), both in document order
+        """
+        location = self._positions.get(chunk_id)
+        if location is None or window <= 0:
+            return [], []
+        
+        file_name, position = location
+        chunk_ids = self._order[file_name]
+        before = chunk_ids[max(0, position - window):position]
+        after = chunk_ids[position + 1:position + 1 + window]
+        return before, after
+
+
+class NeighborIndexProvider:
+    """
+    Lazily builds a ChunkNeighborIndex and rebuilds it when the manifest changes.
+    """
+    
+    def __init__(self, vector_store_path: Path, collection_name: str, collection):
+        """
+        Initialize the provider.
+        
+        Args:
+            vector_store_path: ChromaDB directory
+            collection_name: Collection name
+            collection: ChromaDB collection (used when there is no manifest)
+        """
+        self.vector_store_path = Path(vector_store_path)
+        self.collection_name = collection_name
+        self.collection = collection
+        self._index: Optional[ChunkNeighborIndex] = None
+        self._manifest_mtime: Optional[float] = None
+        self._lock = threading.Lock()
+    
+    def get(self) -> ChunkNeighborIndex:
+        """
+        Get the current neighbor index, building it on first use.
+        
+        Returns:
+            The neighbor index
+        """
+        manifest_path = self.vector_store_path / MANIFEST_FILENAME
+        mtime = manifest_path.stat().st_mtime if manifest_path.exists() else None
+        
+        with self._lock:
+            if self._index is not None and mtime == self._manifest_mtime:
+                return self._index
+            
+            index = ChunkNeighborIndex.from_manifest(self.vector_store_path, self.collection_name) if mtime else None
+            if index is None:
+                index = ChunkNeighborIndex.from_collection(self.collection)
+            
+            self._index = index
+            self._manifest_mtime = mtime
+            logger.info(f"Built chunk neighbor index with {len(index)} chunks")
+            return index
@@ -2,17 +2,31 @@
 Cloudflare Workers AI integration for VidyaTid.
 Provides chat, embeddings, and image recognition using Cloudflare AI models.
 Includes fallback to local models for reliability.
+
+All synchronous calls share one keep-alive connection pool per process
+(get_http_session); AsyncCloudflareAI offers chat and embeddings over an
+httpx.AsyncClient for callers running in an event loop, and
+run_on_async_client shares one such client per process.
 """
+import json
+import atexit
+import asyncio
 import requests
 import logging
-from typing import List, Dict, Any, Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Awaitable, Callable, Iterator, Optional, Tuple, TypeVar
 import time
 
+import httpx
+from requests.adapters import HTTPAdapter
+
 # Load environment variables first
 from dotenv import load_dotenv
 load_dotenv()
 
 from config import Config
+from services.single_flight import flight_key, get_single_flight
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +35,135 @@ MAX_RETRIES = 3
 RETRY_DELAY = 1  # seconds
 TIMEOUT = 30  # seconds
 
+# Batch embedding configuration (BGE accepts a list of texts per request)
+EMBEDDING_BATCH_SIZE = 100  # max texts per request
+EMBEDDING_BATCH_MAX_CHARS = 60000  # keep request payloads well under the API limit
+EMBEDDING_BATCH_CONCURRENCY = 4  # max requests in flight at once
+
+T = TypeVar('T')
+
+# Process-wide keep-alive session (see get_http_session)
+_http_session: Optional[requests.Session] = None
+_http_session_lock = threading.Lock()
+
+# Process-wide async client and the event loop thread it lives on (see run_on_async_client)
+_async_runtime: Optional[Tuple[asyncio.AbstractEventLoop, 'AsyncCloudflareAI']] = None
+_async_runtime_lock = threading.Lock()
+
+
+def get_http_session() -> requests.Session:
+    """
+    Get the process-wide HTTP session used for Cloudflare API calls.
+    
+    Connections are kept alive and reused, so only the first request to the
+    API pays the TCP and TLS handshakes. The pool holds up to
+    Config.CLOUDFLARE_HTTP_POOL_SIZE connections, enough for the concurrent
+    embedding batches plus the request threads of a web worker.
+    
+    Returns:
+        Shared requests.Session
+    """
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            session = requests.Session()
+            # Retries are handled by CloudflareAI._make_request
+            adapter = HTTPAdapter(
+                pool_connections=2,
+                pool_maxsize=Config.CLOUDFLARE_HTTP_POOL_SIZE,
+                max_retries=0
+            )
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _http_session = session
+        return _http_session
+
+
+def reset_http_session_after_fork() -> None:
+    """
+    Forget the sessions inherited from a parent process (called in forked workers).
+    
+    The inherited connections are dropped, not shut down, so the parent's
+    connections stay usable; the worker opens its own on first use. The
+    async client's event loop thread does not survive the fork either.
+    """
+    global _http_session, _http_session_lock, _async_runtime, _async_runtime_lock
+    _http_session_lock = threading.Lock()
+    _http_session = None
+    _async_runtime_lock = threading.Lock()
+    _async_runtime = None
+
+
+def api_run_url(account_id: str) -> str:
+    """
+    Get the Workers AI "run" endpoint of an account.
+    
+    Args:
+        account_id: Cloudflare account ID
+    
+    Returns:
+        URL prefix; the model ID is appended to it
+    """
+    return f"{Config.CLOUDFLARE_API_BASE_URL.rstrip('/')}/accounts/{account_id}/ai/run"
+
+
+def parse_chat_result(result: Dict[str, Any]) -> str:
+    """
+    Extract the generated text from a chat model response.
+    
+    Args:
+        result: API response
+    
+    Returns:
+        Generated text
+    """
+    if 'result' in result and 'response' in result['result']:
+        return result['result']['response']
+    elif 'result' in result and 'choices' in result['result']:
+        return result['result']['choices'][0]['message']['content']
+    else:
+        logger.error(f"Unexpected response format: {result}")
+        raise Exception("Could not parse response")
+
+
+def parse_stream_event(event: Dict[str, Any]) -> str:
+    """
+    Extract the text of one server-sent event of a streamed chat response.
+    
+    Args:
+        event: Decoded "data:" payload
+    
+    Returns:
+        Text fragment (empty for events without text)
+    """
+    if event.get('response'):
+        return event['response']
+    choices = event.get('choices') or []
+    if choices:
+        return (choices[0].get('delta') or {}).get('content') or ''
+    return ''
+
+
+def parse_embeddings_result(result: Dict[str, Any], expected: Optional[int] = None) -> List[List[float]]:
+    """
+    Extract the embeddings from an embedding model response.
+    
+    Args:
+        result: API response
+        expected: Number of embeddings the request asked for (checked if given)
+    
+    Returns:
+        List of embeddings, in request order
+    """
+    if 'result' in result and 'data' in result['result']:
+        embeddings = result['result']['data']
+        if expected is not None and len(embeddings) != expected:
+            raise Exception(f"Expected {expected} embeddings, got {len(embeddings)}")
+        return embeddings
+    else:
+        logger.error(f"Unexpected embedding format: {result}")
+        raise Exception("Could not parse embeddings")
+
 
 class CloudflareAI:
     """
@@ -28,6 +171,7 @@ class CloudflareAI:
     
     Features:
     - Automatic retry with exponential backoff
+    - Keep-alive connections shared by all instances (get_http_session)
     - Fallback to local models on failure
     - Request timeout handling
     - Error logging and monitoring
@@ -42,7 +186,7 @@ class CloudflareAI:
         """
         self.account_id = Config.CLOUDFLARE_ACCOUNT_ID
         self.api_token = Config.CLOUDFLARE_API_TOKEN
-        self.base_url = f"https://api.cloudflare.com/client/v4/accounts/{self.account_id}/ai/run"
+        self.base_url = api_run_url(self.account_id)
         self.enable_fallback = enable_fallback
         self.local_model = None
         
@@ -77,6 +221,24 @@ class CloudflareAI:
         Returns:
             API response as dictionary
         
+        Raises:
+            Exception: If all retries fail
+        """
+        return self._post(model, data, retries).json()
+    
+    def _post(self, model: str, data: Dict[str, Any], retries=MAX_RETRIES, stream: bool = False) -> requests.Response:
+        """
+        POST to a model endpoint with retry logic.
+        
+        Args:
+            model: Model identifier
+            data: Request payload
+            retries: Number of attempts
+            stream: Return before the body is read (for streamed responses)
+        
+        Returns:
+            Successful HTTP response
+        
         Raises:
             Exception: If all retries fail
         """
@@ -88,19 +250,21 @@ class CloudflareAI:
             "Authorization": f"Bearer {self.api_token}",
             "Content-Type": "application/json"
         }
+        session = get_http_session()
         
         last_error = None
         
         for attempt in range(retries):
             try:
-                response = requests.post(
+                response = session.post(
                     url, 
                     headers=headers, 
                     json=data, 
-                    timeout=TIMEOUT
+                    timeout=TIMEOUT,
+                    stream=stream
                 )
                 response.raise_for_status()
-                return response.json()
+                return response
                 
             except requests.exceptions.Timeout as e:
                 last_error = e
@@ -110,6 +274,8 @@ class CloudflareAI:
                     
             except requests.exceptions.HTTPError as e:
                 last_error = e
+                # Release the connection of a failed streamed response before retrying
+                e.response.close()
                 # Don't retry on 4xx errors (client errors)
                 if 400 <= e.response.status_code < 500:
                     logger.error(f"Cloudflare AI client error: {e}")
@@ -154,17 +320,13 @@ class CloudflareAI:
                 "max_tokens": max_tokens
             }
             
-            result = self._make_request(Config.CLOUDFLARE_CHAT_MODEL, data)
+            # Identical concurrent requests share one API call
+            result = get_single_flight('cloudflare-chat').do(
+                flight_key(Config.CLOUDFLARE_CHAT_MODEL, data),
+                self._make_request, Config.CLOUDFLARE_CHAT_MODEL, data
+            )
+            return parse_chat_result(result)
             
-            # Extract response text
-            if 'result' in result and 'response' in result['result']:
-                return result['result']['response']
-            elif 'result' in result and 'choices' in result['result']:
-                return result['result']['choices'][0]['message']['content']
-            else:
-                logger.error(f"Unexpected response format: {result}")
-                raise Exception("Could not parse response")
-                
         except Exception as e:
             logger.error(f"Cloudflare chat generation failed: {e}")
             
@@ -178,6 +340,58 @@ class CloudflareAI:
             
             raise Exception(f"Chat generation failed: {e}")
     
+    def chat_stream(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.7,
+        max_tokens: int = 1024,
+        use_fallback: bool = True
+    ) -> Iterator[str]:
+        """
+        Generate chat response, yielding tokens as the API streams them (server-sent events).
+        
+        If the request fails before the first token, the local model fallback
+        (when available) answers in one piece.
+        
+        Args:
+            messages: List of message dicts with 'role' and 'content'
+            temperature: Sampling temperature (0-1)
+            max_tokens: Maximum tokens to generate
+            use_fallback: Whether to use local model fallback on failure
+        
+        Yields:
+            Generated text fragments
+        """
+        started = False
+        try:
+            data = {
+                "messages": messages,
+                "temperature": temperature,
+                "max_tokens": max_tokens,
+                "stream": True
+            }
+            with self._post(Config.CLOUDFLARE_CHAT_MODEL, data, stream=True) as response:
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith('data:'):
+                        continue
+                    payload = line[len('data:'):].strip()
+                    if payload == '[DONE]':
+                        break
+                    text = parse_stream_event(json.loads(payload))
+                    if text:
+                        started = True
+                        yield text
+        
+        except Exception as e:
+            logger.error(f"Cloudflare chat streaming failed: {e}")
+            
+            if not started and use_fallback and self.enable_fallback and self.local_model:
+                logger.info("Falling back to local model for chat generation")
+                yield self._chat_fallback(messages, temperature, max_tokens)
+                return
+            
+            raise Exception(f"Chat generation failed: {e}")
+    
     def _chat_fallback(
         self,
         messages: List[Dict[str, str]],
@@ -228,6 +442,7 @@ class CloudflareAI:
         max_tokens: int = 512,
         use_fallback: bool = True,
         stop: Optional[List[str]] = None,
+        json_schema: Optional[Dict[str, Any]] = None,
         **kwargs
     ) -> Dict[str, Any]:
         """
@@ -239,6 +454,7 @@ class CloudflareAI:
             max_tokens: Maximum tokens to generate
             use_fallback: Whether to use local model fallback on failure
             stop: Stop sequences (ignored for Cloudflare AI, kept for compatibility)
+            json_schema: Answer in JSON matching this schema (requested by a system prompt)
             **kwargs: Additional arguments (ignored, kept for compatibility)
             
         Returns:
@@ -246,9 +462,7 @@ class CloudflareAI:
         """
         try:
             # Convert prompt to chat format
-            messages = [
-                {"role": "user", "content": prompt}
-            ]
+            messages = self._prompt_messages(prompt, json_schema)
             
             response_text = self.chat(messages, temperature, max_tokens, use_fallback)
             
@@ -268,6 +482,57 @@ class CloudflareAI:
                 'error': str(e)
             }
     
+    def generate_stream(
+        self,
+        prompt: str,
+        temperature: float = 0.7,
+        max_tokens: int = 512,
+        use_fallback: bool = True,
+        stop: Optional[List[str]] = None,
+        json_schema: Optional[Dict[str, Any]] = None,
+        **kwargs
+    ) -> Iterator[str]:
+        """
+        Stream a text completion (compatible with ModelManager.generate_stream).
+        
+        Args:
+            prompt: Input prompt text
+            temperature: Sampling temperature (0-1)
+            max_tokens: Maximum tokens to generate
+            use_fallback: Whether to use local model fallback on failure
+            stop: Stop sequences (ignored for Cloudflare AI, kept for compatibility)
+            json_schema: Answer in JSON matching this schema (requested by a system prompt)
+            **kwargs: Additional arguments (ignored, kept for compatibility)
+        
+        Yields:
+            Generated text fragments
+        """
+        messages = self._prompt_messages(prompt, json_schema)
+        yield from self.chat_stream(messages, temperature, max_tokens, use_fallback)
+    
+    @staticmethod
+    def _prompt_messages(prompt: str, json_schema: Optional[Dict[str, Any]] = None) -> List[Dict[str, str]]:
+        """
+        Build the chat messages of a plain completion.
+        
+        Args:
+            prompt: Input prompt text
+            json_schema: Optional JSON schema the answer must follow
+        
+        Returns:
+            User message, preceded by a system message describing the schema if given
+        """
+        messages = [
+            {"role": "user", "content": prompt}
+        ]
+        if json_schema is not None:
+            messages.insert(0, {
+                "role": "system",
+                "content": "Respond only with one JSON object (no code fences, no text around it) "
+                           f"that matches this JSON schema:\n{json.dumps(json_schema)}"
+            })
+        return messages
+    
     def get_status(self) -> Dict[str, Any]:
         """
         Get status information (compatible with ModelManager interface).
@@ -297,15 +562,12 @@ class CloudflareAI:
         """
         try:
             data = {"text": text}
-            result = self._make_request(Config.CLOUDFLARE_EMBEDDING_MODEL, data)
-            
-            # Extract embeddings
-            if 'result' in result and 'data' in result['result']:
-                return result['result']['data'][0]
-            else:
-                logger.error(f"Unexpected embedding format: {result}")
-                raise Exception("Could not parse embeddings")
-                
+            result = get_single_flight('cloudflare-embedding').do(
+                flight_key(Config.CLOUDFLARE_EMBEDDING_MODEL, data),
+                self._make_request, Config.CLOUDFLARE_EMBEDDING_MODEL, data
+            )
+            return parse_embeddings_result(result)[0]
+            
         except Exception as e:
             logger.error(f"Cloudflare embedding generation failed: {e}")
             
@@ -319,6 +581,105 @@ class CloudflareAI:
             
             raise Exception(f"Embedding generation failed: {e}")
     
+    def generate_embeddings_batch(
+        self,
+        texts: List[str],
+        use_fallback: bool = True,
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+        max_chars: int = EMBEDDING_BATCH_MAX_CHARS,
+        max_concurrency: int = EMBEDDING_BATCH_CONCURRENCY,
+        model: Optional[str] = None
+    ) -> List[List[float]]:
+        """
+        Generate embeddings for many texts using batched BGE requests.
+        
+        Texts are split into request batches of at most batch_size texts and
+        max_chars characters, and up to max_concurrency batches are sent in
+        parallel. Output order matches input order.
+        
+        Args:
+            texts: Texts to embed
+            use_fallback: Whether to embed failed batches with the local model
+            batch_size: Maximum number of texts per request
+            max_chars: Maximum total characters per request
+            max_concurrency: Maximum number of concurrent requests
+            model: Embedding model (default: Config.CLOUDFLARE_EMBEDDING_MODEL)
+        
+        Returns:
+            List of embeddings, one per input text
+        """
+        if not texts:
+            return []
+        
+        batches = self._split_embedding_batches(texts, batch_size, max_chars)
+        model = model or Config.CLOUDFLARE_EMBEDDING_MODEL
+        
+        def embed_batch(batch: List[str]) -> List[List[float]]:
+            try:
+                result = self._make_request(model, {"text": batch})
+                return parse_embeddings_result(result, expected=len(batch))
+            
+            except Exception as e:
+                logger.error(f"Cloudflare batch embedding failed ({len(batch)} texts): {e}")
+                
+                if use_fallback and self.enable_fallback:
+                    logger.info("Falling back to local embeddings for batch")
+                    try:
+                        return self._embeddings_fallback_batch(batch)
+                    except Exception as fallback_error:
+                        logger.error(f"Local embeddings fallback also failed: {fallback_error}")
+                
+                raise Exception(f"Batch embedding generation failed: {e}")
+        
+        if len(batches) == 1:
+            return embed_batch(batches[0])
+        
+        workers = max(1, min(max_concurrency, len(batches)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='cf-embed') as executor:
+            results = list(executor.map(embed_batch, batches))
+        
+        embeddings = []
+        for batch_embeddings in results:
+            embeddings.extend(batch_embeddings)
+        return embeddings
+    
+    @staticmethod
+    def _split_embedding_batches(
+        texts: List[str],
+        batch_size: int,
+        max_chars: int
+    ) -> List[List[str]]:
+        """
+        Split texts into request batches bounded by count and total characters.
+        
+        A single text longer than max_chars gets a batch of its own.
+        
+        Args:
+            texts: Texts to split
+            batch_size: Maximum number of texts per batch
+            max_chars: Maximum total characters per batch
+        
+        Returns:
+            List of text batches, in input order
+        """
+        batches = []
+        current = []
+        current_chars = 0
+        
+        for text in texts:
+            text_chars = len(text)
+            if current and (len(current) >= batch_size or current_chars + text_chars > max_chars):
+                batches.append(current)
+                current = []
+                current_chars = 0
+            current.append(text)
+            current_chars += text_chars
+        
+        if current:
+            batches.append(current)
+        
+        return batches
+    
     def _embeddings_fallback(self, text: str) -> List[float]:
         """
         Fallback to local embeddings model.
@@ -330,14 +691,12 @@ class CloudflareAI:
             List of embedding values
         """
         try:
-            from sentence_transformers import SentenceTransformer
+            from services.local_embedding import load_local_encoder
             
-            # Load local embedding model (cached after first load)
+            # Load local embedding model (cached after first load; PyTorch or ONNX)
             if not hasattr(self, '_local_embedding_model'):
                 logger.info("Loading local embedding model...")
-                self._local_embedding_model = SentenceTransformer(
-                    Config.EMBEDDING_MODEL_NAME
-                )
+                self._local_embedding_model = load_local_encoder(Config.EMBEDDING_MODEL_NAME)
             
             # Generate embeddings
             embeddings = self._local_embedding_model.encode(text)
@@ -347,6 +706,23 @@ class CloudflareAI:
             logger.error(f"Local embedding generation failed: {e}")
             raise
     
+    def _embeddings_fallback_batch(self, texts: List[str]) -> List[List[float]]:
+        """
+        Fallback to local embeddings model for a batch of texts.
+        
+        Args:
+            texts: Texts to embed
+        
+        Returns:
+            List of embeddings
+        """
+        # Load the model through the single-text fallback, then encode in one pass
+        if not hasattr(self, '_local_embedding_model'):
+            self._embeddings_fallback(texts[0])
+        
+        embeddings = self._local_embedding_model.encode(texts)
+        return embeddings.tolist()
+    
     def analyze_image(self, image_bytes: bytes) -> Dict[str, Any]:
         """
         Analyze image using ResNet-50
@@ -387,6 +763,44 @@ class CloudflareAI:
         Returns:
             Generated answer
         """
+        return self.chat(self._context_messages(question, context, system_prompt))
+    
+    def chat_with_context_stream(
+        self,
+        question: str,
+        context: str,
+        system_prompt: Optional[str] = None
+    ) -> Iterator[str]:
+        """
+        Generate answer with RAG, yielding tokens as they are generated.
+        
+        Args:
+            question: User's question
+            context: Retrieved context from NCERT
+            system_prompt: Optional system prompt
+        
+        Yields:
+            Generated text fragments
+        """
+        yield from self.chat_stream(self._context_messages(question, context, system_prompt))
+    
+    @staticmethod
+    def _context_messages(
+        question: str,
+        context: str,
+        system_prompt: Optional[str] = None
+    ) -> List[Dict[str, str]]:
+        """
+        Build the chat messages of a RAG answer.
+        
+        Args:
+            question: User's question
+            context: Retrieved context from NCERT
+            system_prompt: Optional system prompt
+        
+        Returns:
+            System and user messages
+        """
         if system_prompt is None:
             system_prompt = (
                 "You are VidyaTid, an AI tutor for JEE & NEET preparation. "
@@ -402,12 +816,302 @@ Question: {question}
 Provide a clear, accurate answer based on the NCERT content above. 
 Include relevant examples and explanations."""
         
-        messages = [
+        return [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt}
         ]
+
+
+class AsyncCloudflareAI:
+    """
+    Asynchronous Cloudflare Workers AI client for chat and embeddings.
+    
+    Features:
+    - One httpx.AsyncClient per instance, so concurrent calls multiplex over
+      a few keep-alive connections instead of one thread each
+    - Retry with exponential backoff that waits with asyncio.sleep
+      (the event loop keeps serving other calls meanwhile)
+    - Same response parsing, single-flight coalescing and local fallback as
+      CloudflareAI; the local models run in a worker thread
+    
+    An httpx.AsyncClient belongs to the event loop it is first used in and
+    holds open connections. Request handlers, whose event loops live for one
+    request, should go through run_on_async_client so connections outlive
+    the request; code owning a long-lived loop can use its own client with
+    "async with AsyncCloudflareAI() as ai:", so it is closed before the loop is.
+    """
+    
+    def __init__(self, enable_fallback: bool = True, max_connections: Optional[int] = None):
+        """
+        Initialize the async client.
+        
+        Args:
+            enable_fallback: Whether to fallback to local models on failure
+            max_connections: Connection pool size (default: Config.CLOUDFLARE_HTTP_POOL_SIZE)
+        """
+        self.account_id = Config.CLOUDFLARE_ACCOUNT_ID
+        self.api_token = Config.CLOUDFLARE_API_TOKEN
+        self.base_url = api_run_url(self.account_id)
+        self.enable_fallback = enable_fallback
+        self.enabled = bool(self.account_id and self.api_token)
+        
+        pool_size = max_connections or Config.CLOUDFLARE_HTTP_POOL_SIZE
+        self.client = httpx.AsyncClient(
+            headers={
+                "Authorization": f"Bearer {self.api_token}",
+                "Content-Type": "application/json"
+            },
+            timeout=TIMEOUT,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        )
+    
+    async def __aenter__(self) -> 'AsyncCloudflareAI':
+        return self
+    
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+    
+    async def aclose(self) -> None:
+        """Close the pooled connections."""
+        await self.client.aclose()
+    
+    async def _make_request(self, model: str, data: Dict[str, Any], retries=MAX_RETRIES) -> Dict[str, Any]:
+        """
+        Make request to Cloudflare AI API with retry logic.
+        
+        Args:
+            model: Model identifier
+            data: Request payload
+            retries: Number of attempts
+        
+        Returns:
+            API response as dictionary
+        
+        Raises:
+            Exception: If all retries fail
+        """
+        if not self.enabled:
+            raise Exception("Cloudflare AI not configured")
+        
+        url = f"{self.base_url}/{model}"
+        last_error = None
+        
+        for attempt in range(retries):
+            try:
+                response = await self.client.post(url, json=data)
+                response.raise_for_status()
+                return response.json()
+            
+            except httpx.HTTPStatusError as e:
+                last_error = e
+                # Don't retry on 4xx errors (client errors)
+                if 400 <= e.response.status_code < 500:
+                    logger.error(f"Cloudflare AI client error: {e}")
+                    raise
+                logger.warning(f"Cloudflare AI server error (attempt {attempt + 1}/{retries}): {e}")
+            
+            except httpx.HTTPError as e:
+                last_error = e
+                logger.warning(f"Cloudflare AI request failed (attempt {attempt + 1}/{retries}): {e!r}")
+            
+            if attempt < retries - 1:
+                await asyncio.sleep(RETRY_DELAY * (2 ** attempt))  # Exponential backoff
+        
+        logger.error(f"Cloudflare AI request failed after {retries} attempts: {last_error!r}")
+        raise Exception(f"Cloudflare AI request failed: {last_error!r}")
+    
+    async def chat(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.7,
+        max_tokens: int = 1024,
+        use_fallback: bool = True
+    ) -> str:
+        """
+        Generate chat response using Llama 3.1 8B with fallback support.
+        
+        Args:
+            messages: List of message dicts with 'role' and 'content'
+            temperature: Sampling temperature (0-1)
+            max_tokens: Maximum tokens to generate
+            use_fallback: Whether to use local model fallback on failure
+        
+        Returns:
+            Generated response text
+        """
+        try:
+            data = {
+                "messages": messages,
+                "temperature": temperature,
+                "max_tokens": max_tokens
+            }
+            
+            # Identical concurrent requests (async or blocking) share one API call
+            result = await get_single_flight('cloudflare-chat').do_async(
+                flight_key(Config.CLOUDFLARE_CHAT_MODEL, data),
+                self._make_request, Config.CLOUDFLARE_CHAT_MODEL, data
+            )
+            return parse_chat_result(result)
+        
+        except Exception as e:
+            logger.error(f"Cloudflare chat generation failed: {e}")
+            
+            fallback = get_cloudflare_ai()
+            if use_fallback and self.enable_fallback and fallback.local_model:
+                logger.info("Falling back to local model for chat generation")
+                try:
+                    return await asyncio.to_thread(fallback._chat_fallback, messages, temperature, max_tokens)
+                except Exception as fallback_error:
+                    logger.error(f"Local model fallback also failed: {fallback_error}")
+            
+            raise Exception(f"Chat generation failed: {e}")
+    
+    async def generate_embeddings(self, text: str, use_fallback: bool = True) -> List[float]:
+        """
+        Generate embeddings using BGE-Base-en-v1.5 with fallback support.
+        
+        Args:
+            text: Text to embed
+            use_fallback: Whether to use local model fallback on failure
+        
+        Returns:
+            List of embedding values
+        """
+        try:
+            data = {"text": text}
+            result = await get_single_flight('cloudflare-embedding').do_async(
+                flight_key(Config.CLOUDFLARE_EMBEDDING_MODEL, data),
+                self._make_request, Config.CLOUDFLARE_EMBEDDING_MODEL, data
+            )
+            return parse_embeddings_result(result)[0]
+        
+        except Exception as e:
+            logger.error(f"Cloudflare embedding generation failed: {e}")
+            
+            if use_fallback and self.enable_fallback:
+                logger.info("Falling back to local embeddings")
+                try:
+                    return await asyncio.to_thread(get_cloudflare_ai()._embeddings_fallback, text)
+                except Exception as fallback_error:
+                    logger.error(f"Local embeddings fallback also failed: {fallback_error}")
+            
+            raise Exception(f"Embedding generation failed: {e}")
+    
+    async def generate_embeddings_batch(
+        self,
+        texts: List[str],
+        use_fallback: bool = True,
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+        max_chars: int = EMBEDDING_BATCH_MAX_CHARS,
+        max_concurrency: int = EMBEDDING_BATCH_CONCURRENCY,
+        model: Optional[str] = None
+    ) -> List[List[float]]:
+        """
+        Generate embeddings for many texts using batched BGE requests.
+        
+        Batches are split as in CloudflareAI.generate_embeddings_batch and up
+        to max_concurrency of them are in flight at once.
+        
+        Args:
+            texts: Texts to embed
+            use_fallback: Whether to embed failed batches with the local model
+            batch_size: Maximum number of texts per request
+            max_chars: Maximum total characters per request
+            max_concurrency: Maximum number of concurrent requests
+            model: Embedding model (default: Config.CLOUDFLARE_EMBEDDING_MODEL)
+        
+        Returns:
+            List of embeddings, one per input text
+        """
+        if not texts:
+            return []
+        
+        batches = CloudflareAI._split_embedding_batches(texts, batch_size, max_chars)
+        model = model or Config.CLOUDFLARE_EMBEDDING_MODEL
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        
+        async def embed_batch(batch: List[str]) -> List[List[float]]:
+            try:
+                async with semaphore:
+                    result = await self._make_request(model, {"text": batch})
+                return parse_embeddings_result(result, expected=len(batch))
+            
+            except Exception as e:
+                logger.error(f"Cloudflare batch embedding failed ({len(batch)} texts): {e}")
+                
+                if use_fallback and self.enable_fallback:
+                    logger.info("Falling back to local embeddings for batch")
+                    try:
+                        return await asyncio.to_thread(get_cloudflare_ai()._embeddings_fallback_batch, batch)
+                    except Exception as fallback_error:
+                        logger.error(f"Local embeddings fallback also failed: {fallback_error}")
+                
+                raise Exception(f"Batch embedding generation failed: {e}")
+        
+        results = await asyncio.gather(*(embed_batch(batch) for batch in batches))
         
-        return self.chat(messages)
+        embeddings = []
+        for batch_embeddings in results:
+            embeddings.extend(batch_embeddings)
+        return embeddings
+
+
+def _get_async_runtime() -> Tuple[asyncio.AbstractEventLoop, AsyncCloudflareAI]:
+    """Get (or start) the process-wide event loop thread and its async client."""
+    global _async_runtime
+    with _async_runtime_lock:
+        if _async_runtime is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='cloudflare-async', daemon=True).start()
+            _async_runtime = (loop, AsyncCloudflareAI())
+        return _async_runtime
+
+
+async def run_on_async_client(call: Callable[[AsyncCloudflareAI], Awaitable[T]]) -> T:
+    """
+    Run a call on the process-wide AsyncCloudflareAI, from any event loop.
+    
+    Flask request threads each run a short-lived event loop, and a client
+    tied to one of them would take its connections down with it. The shared
+    client lives on a dedicated event loop thread instead, so every request
+    of a worker reuses the same keep-alive connections; the caller's loop
+    only waits. Cancelling the caller (e.g. a stage timeout) cancels the call.
+    
+    Args:
+        call: Function of the client returning the coroutine to run,
+            e.g. lambda ai: ai.chat(messages)
+    
+    Returns:
+        The coroutine's result
+    """
+    loop, client = _get_async_runtime()
+    if asyncio.get_running_loop() is loop:
+        return await call(client)
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(call(client), loop))
+
+
+def close_async_client(timeout: float = 5.0) -> None:
+    """
+    Close the process-wide async client and stop its event loop (runs at exit).
+    
+    Args:
+        timeout: Seconds to wait for the connections to close
+    """
+    global _async_runtime
+    with _async_runtime_lock:
+        runtime, _async_runtime = _async_runtime, None
+    if runtime is None:
+        return
+    
+    loop, client = runtime
+    try:
+        asyncio.run_coroutine_threadsafe(client.aclose(), loop).result(timeout=timeout)
+    except Exception as e:
+        logger.warning(f"Could not close the async Cloudflare client: {e!r}")
+    loop.call_soon_threadsafe(loop.stop)
+
+
+atexit.register(close_async_client)
 
 
 # Global instance
@@ -454,7 +1158,9 @@ async def health_check() -> Dict[str, Any]:
             test_messages = [
                 {"role": "user", "content": "Hello"}
             ]
-            response = ai.chat(test_messages, max_tokens=10, use_fallback=False)
+            response = await run_on_async_client(
+                lambda client: client.chat(test_messages, max_tokens=10, use_fallback=False)
+            )
             health_status['cloudflare_ai']['status'] = 'healthy'
             health_status['cloudflare_ai']['test_response'] = response[:50]
         except Exception as e:
@@ -503,5 +1209,14 @@ def get_service_info() -> Dict[str, Any]:
             'max_retries': MAX_RETRIES,
             'retry_delay': RETRY_DELAY,
             'timeout': TIMEOUT
+        },
+        'connection_pool': {
+            'pool_size': Config.CLOUDFLARE_HTTP_POOL_SIZE,
+            'keep_alive': True
+        },
+        'embedding_batch_config': {
+            'batch_size': EMBEDDING_BATCH_SIZE,
+            'max_chars': EMBEDDING_BATCH_MAX_CHARS,
+            'max_concurrency': EMBEDDING_BATCH_CONCURRENCY
         }
     }
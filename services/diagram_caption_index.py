@@ -0,0 +1,284 @@
+"""
+Full-Text Caption Index for Diagram Pages
+
+SQLite FTS5 table over the figure numbers and caption text of every row in
+diagram_pages, stored in diagrams.db next to it. Caption search becomes a
+single indexed query, ranked with bm25 and limited in SQL, instead of
+loading every page and scanning its captions JSON in Python.
+
+Features:
+- Figure numbers ("8.1") are kept as single tokens; sentence punctuation is not
+- Keyword queries match word prefixes ("photo" finds "photosynthesis"),
+  combined with OR and ranked with bm25 (more matching keywords rank higher).
+  Unlike the substring scan this replaces, a keyword no longer matches
+  inside a word: "cell" finds "cells" and "cellular" but not "subcellular"
+- Subject / class / chapter filters and LIMIT applied in the same statement
+- Kept in sync by DiagramProcessor.index_page (same transaction as the page)
+- Created and backfilled from diagram_pages when missing or out of sync
+
+Usage:
+    python -m services.diagram_caption_index rebuild [--db diagrams.db]
+    python -m services.diagram_caption_index search "plant cell" [--subject Biology]
+"""
+
+import re
+import json
+import logging
+import argparse
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import create_engine, text
+
+logger = logging.getLogger(__name__)
+
+CAPTION_FTS_TABLE = 'diagram_caption_fts'
+
+# Dots are token characters so figure numbers stay whole ('8.1', '10.12')
+_CREATE_TABLE = text(
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {CAPTION_FTS_TABLE} USING fts5("
+    "page_id UNINDEXED, figures, captions, "
+    "tokenize = \"unicode61 tokenchars '.'\")"
+)
+
+# ...so dots that are not inside a number are turned into spaces before indexing
+_NON_NUMERIC_DOT = re.compile(r'(?<!\d)\.|\.(?!\d)')
+
+# Query tokens: figure numbers whole, otherwise words
+_KEYWORD = re.compile(r'\d+(?:\.\d+)+|\w+')
+
+# Filter fields accepted by search_captions, mapped to diagram_pages columns
+_FILTER_COLUMNS = {'subject': 'subject', 'class_level': 'class_level', 'chapter': 'chapter'}
+
+
+def normalize_fts_text(value: str) -> str:
+    """
+    Prepare text for the caption index (keeps the dots of figure numbers only).
+    
+    Args:
+        value: Caption or figure text
+    
+    Returns:
+        Text to index
+    """
+    return _NON_NUMERIC_DOT.sub(' ', value or '')
+
+
+def caption_text(captions: Optional[str]) -> str:
+    """
+    Get the indexable text of a captions JSON string.
+    
+    Args:
+        captions: JSON object of figure number -> caption (as stored in diagram_pages)
+    
+    Returns:
+        Caption texts, one per line
+    """
+    if not captions:
+        return ''
+    try:
+        data = json.loads(captions)
+    except (TypeError, ValueError):
+        return normalize_fts_text(str(captions))
+    if isinstance(data, dict):
+        return normalize_fts_text('\n'.join(str(caption) for caption in data.values()))
+    return normalize_fts_text(str(data))
+
+
+def figures_text(figures: Optional[str]) -> str:
+    """
+    Get the indexable text of a comma-separated figure list.
+    
+    Args:
+        figures: Figure numbers as stored in diagram_pages ("8.1,8.2")
+    
+    Returns:
+        Space-separated figure numbers
+    """
+    return ' '.join(figure.strip() for figure in (figures or '').split(',') if figure.strip())
+
+
+def create_caption_index(connection) -> None:
+    """
+    Create the FTS5 table if it does not exist.
+    
+    Args:
+        connection: SQLAlchemy connection or session on diagrams.db
+    """
+    connection.execute(_CREATE_TABLE)
+
+
+def index_page_captions(connection, page_id: str, figures: Optional[str], captions: Optional[str]) -> None:
+    """
+    Insert or replace the caption index row of a diagram page.
+    
+    Runs in the caller's transaction, so the page and its index row are
+    committed together.
+    
+    Args:
+        connection: SQLAlchemy connection or session on diagrams.db
+        page_id: Diagram page ID
+        figures: Comma-separated figure numbers
+        captions: Captions JSON string
+    """
+    connection.execute(text(f"DELETE FROM {CAPTION_FTS_TABLE} WHERE page_id = :page_id"), {'page_id': page_id})
+    connection.execute(
+        text(f"INSERT INTO {CAPTION_FTS_TABLE} (page_id, figures, captions) VALUES (:page_id, :figures, :captions)"),
+        {'page_id': page_id, 'figures': figures_text(figures), 'captions': caption_text(captions)}
+    )
+
+
+def rebuild_caption_index(connection) -> int:
+    """
+    Rebuild the caption index from every row of diagram_pages.
+    
+    Args:
+        connection: SQLAlchemy connection or session on diagrams.db
+    
+    Returns:
+        Number of indexed pages
+    """
+    create_caption_index(connection)
+    connection.execute(text(f"DELETE FROM {CAPTION_FTS_TABLE}"))
+    
+    rows = connection.execute(text("SELECT page_id, figures, captions FROM diagram_pages")).fetchall()
+    if rows:
+        connection.execute(
+            text(f"INSERT INTO {CAPTION_FTS_TABLE} (page_id, figures, captions) VALUES (:page_id, :figures, :captions)"),
+            [
+                {'page_id': page_id, 'figures': figures_text(figures), 'captions': caption_text(captions)}
+                for page_id, figures, captions in rows
+            ]
+        )
+    return len(rows)
+
+
+def ensure_caption_index(engine) -> bool:
+    """
+    Make sure the caption index exists and covers every diagram page.
+    
+    The index is rebuilt if its row count differs from diagram_pages
+    (e.g. pages indexed before the caption index existed).
+    
+    Args:
+        engine: SQLAlchemy engine on diagrams.db
+    
+    Returns:
+        True if the index is usable, False if SQLite lacks FTS5 or the
+        database has no diagram_pages table
+    """
+    try:
+        with engine.begin() as connection:
+            create_caption_index(connection)
+            pages = connection.execute(text("SELECT COUNT(*) FROM diagram_pages")).scalar()
+            indexed = connection.execute(text(f"SELECT COUNT(*) FROM {CAPTION_FTS_TABLE}")).scalar()
+            if pages != indexed:
+                count = rebuild_caption_index(connection)
+                logger.info(f"Rebuilt diagram caption index ({count} pages)")
+        return True
+    except Exception as e:
+        logger.warning(f"Diagram caption index unavailable, using caption scans: {e}")
+        return False
+
+
+def build_match_expression(keywords: Iterable[str]) -> Optional[str]:
+    """
+    Build an FTS5 query matching any of the keywords as a word prefix.
+    
+    Args:
+        keywords: Search keywords
+    
+    Returns:
+        MATCH expression, or None if no keyword has searchable characters
+    """
+    terms = []
+    for keyword in keywords:
+        for token in _KEYWORD.findall(keyword.lower()):
+            term = f'"{token}"*'
+            if term not in terms:
+                terms.append(term)
+    return ' OR '.join(terms) if terms else None
+
+
+def search_captions(
+    session,
+    page_model,
+    keywords: Iterable[str],
+    filters: Optional[Dict[str, Any]] = None,
+    limit: int = 5
+) -> List[Any]:
+    """
+    Find the diagram pages whose captions or figure numbers best match keywords.
+    
+    Args:
+        session: SQLAlchemy session on diagrams.db
+        page_model: DiagramPage model class (rows are returned as instances)
+        keywords: Search keywords (any may match)
+        filters: Optional subject / class_level / chapter equality filters
+        limit: Maximum number of pages
+    
+    Returns:
+        DiagramPage instances, best match first
+    """
+    match = build_match_expression(keywords)
+    if match is None:
+        return []
+    
+    conditions = [f"{CAPTION_FTS_TABLE} MATCH :match"]
+    params: Dict[str, Any] = {'match': match, 'limit': int(limit)}
+    for field, column in _FILTER_COLUMNS.items():
+        value = (filters or {}).get(field)
+        if value is None or value == '':
+            continue
+        conditions.append(f"p.{column} = :{field}")
+        params[field] = value if field == 'subject' else int(value)
+    
+    statement = text(
+        f"SELECT p.* FROM {CAPTION_FTS_TABLE} "
+        f"JOIN diagram_pages AS p ON p.page_id = {CAPTION_FTS_TABLE}.page_id "
+        f"WHERE {' AND '.join(conditions)} "
+        f"ORDER BY bm25({CAPTION_FTS_TABLE}) "
+        f"LIMIT :limit"
+    )
+    return session.query(page_model).from_statement(statement).params(**params).all()
+
+
+def main():
+    """Command-line entry point."""
+    from sqlalchemy.orm import sessionmaker
+    
+    parser = argparse.ArgumentParser(description='Diagram caption full-text index')
+    parser.add_argument('--db', default=str(Path(__file__).parent.parent / 'diagrams.db'), help='Diagram database')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    subparsers.add_parser('rebuild', help='Rebuild the index from diagram_pages')
+    
+    search_parser = subparsers.add_parser('search', help='Search captions')
+    search_parser.add_argument('query', help='Keywords')
+    search_parser.add_argument('--subject', help='Subject filter')
+    search_parser.add_argument('--class-level', type=int, help='Class filter')
+    search_parser.add_argument('--chapter', type=int, help='Chapter filter')
+    search_parser.add_argument('--limit', type=int, default=5, help='Maximum results')
+    
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    
+    engine = create_engine(f'sqlite:///{args.db}')
+    
+    if args.command == 'rebuild':
+        with engine.begin() as connection:
+            count = rebuild_caption_index(connection)
+        print(f"Indexed captions of {count} diagram pages")
+        return
+    
+    from models.diagram_page import DiagramPage
+    
+    ensure_caption_index(engine)
+    session = sessionmaker(bind=engine)()
+    filters = {'subject': args.subject, 'class_level': args.class_level, 'chapter': args.chapter}
+    for page in search_captions(session, DiagramPage, args.query.split(), filters, args.limit):
+        print(f"{page.page_id}  figures={page.figures}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""
+Chapter -> Diagram Lookup with Read-Through Cache
+
+Diagram pages of the chapters found in a retrieval result are loaded with
+one query for all chapters, served by a composite index, instead of one
+query per chapter. The chapters are matched as an OR of (subject, class,
+chapter) equalities rather than a row-value IN list, because SQLite only
+seeks the index for the former (it scans the table for a multi-row IN).
+Since diagrams.db only changes when diagrams are re-indexed, the lists are
+kept in an in-process cache owned by the diagram repository
+(services.diagram_repository) and dropped as soon as the database file
+changes.
+
+Features:
+- Composite index (subject, class_level, chapter, page_number) on diagram_pages,
+  added to existing databases on startup
+- Single batched query for all chapters not cached yet
+- Chapters without diagrams are cached too (no repeated empty lookups)
+- Invalidated by the modification time and size of diagrams.db (and its WAL)
+- Can be filled completely before forking web workers (services.preload)
+"""
+
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, or_
+
+logger = logging.getLogger(__name__)
+
+# (subject, class_level, chapter)
+ChapterKey = Tuple[str, int, int]
+
+
+def ensure_chapter_index(engine, page_model) -> bool:
+    """
+    Create the composite chapter index on an existing diagram_pages table.
+    
+    Args:
+        engine: SQLAlchemy engine on diagrams.db
+        page_model: DiagramPage model class
+    
+    Returns:
+        True if the index exists
+    """
+    try:
+        for index in page_model.__table__.indexes:
+            index.create(bind=engine, checkfirst=True)
+        return True
+    except Exception as e:
+        logger.warning(f"Could not create diagram chapter index: {e}")
+        return False
+
+
+class ChapterDiagramCache:
+    """
+    Read-through cache of chapter -> diagram pages (as to_dict() dictionaries).
+    """
+    
+    def __init__(self, db_path: Path):
+        """
+        Create a cache for a diagram database.
+        
+        Args:
+            db_path: Path of diagrams.db (its changes invalidate the cache)
+        """
+        self.db_path = Path(db_path)
+        self._chapters: Dict[ChapterKey, List[Dict[str, Any]]] = {}
+        self._stamp = self._db_stamp()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def _db_stamp(self) -> Tuple:
+        stamp = []
+        for path in (self.db_path, self.db_path.with_name(self.db_path.name + '-wal')):
+            try:
+                stat = path.stat()
+                stamp.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                stamp.append(None)
+        return tuple(stamp)
+    
+    def get_many(
+        self,
+        session,
+        page_model,
+        chapters: Iterable[ChapterKey],
+        limit: Optional[int] = None
+    ) -> Dict[ChapterKey, List[Dict[str, Any]]]:
+        """
+        Get the diagram pages of several chapters, loading missing ones in one query.
+        
+        Args:
+            session: SQLAlchemy session on diagrams.db
+            page_model: DiagramPage model class
+            chapters: (subject, class_level, chapter) keys
+            limit: Maximum pages per chapter (default: all), in page order
+        
+        Returns:
+            Dictionary mapping every requested chapter to its diagram dictionaries
+        """
+        chapters = list(dict.fromkeys(chapters))
+        if not chapters:
+            return {}
+        
+        stamp = self._db_stamp()
+        with self._lock:
+            if stamp != self._stamp:
+                if self._chapters:
+                    logger.info("Diagram database changed, clearing chapter diagram cache")
+                self._chapters = {}
+                self._stamp = stamp
+            cached = {key: self._chapters[key] for key in chapters if key in self._chapters}
+        
+        missing = [key for key in chapters if key not in cached]
+        self.hits += len(cached)
+        self.misses += len(missing)
+        
+        if missing:
+            loaded: Dict[ChapterKey, List[Dict[str, Any]]] = {key: [] for key in missing}
+            pages = session.query(page_model).filter(or_(*[
+                and_(page_model.subject == subject, page_model.class_level == class_level, page_model.chapter == chapter)
+                for subject, class_level, chapter in missing
+            ])).order_by(
+                page_model.subject, page_model.class_level, page_model.chapter, page_model.page_number
+            ).all()
+            for page in pages:
+                key = (page.subject, page.class_level, page.chapter)
+                if key in loaded:
+                    loaded[key].append(page.to_dict())
+            
+            with self._lock:
+                # Skip if the cache was invalidated while the query ran
+                if self._stamp == stamp:
+                    self._chapters.update(loaded)
+            cached.update(loaded)
+        
+        return {
+            key: [dict(diagram) for diagram in cached[key][:limit]]
+            for key in chapters
+        }
+    
+    def load_all(self, session, page_model) -> int:
+        """
+        Load every chapter in one query (e.g. in the master before forking workers).
+        
+        Args:
+            session: SQLAlchemy session on diagrams.db
+            page_model: DiagramPage model class
+        
+        Returns:
+            Number of chapters with diagrams
+        """
+        stamp = self._db_stamp()
+        chapters: Dict[ChapterKey, List[Dict[str, Any]]] = {}
+        pages = session.query(page_model).order_by(
+            page_model.subject, page_model.class_level, page_model.chapter, page_model.page_number
+        ).all()
+        for page in pages:
+            chapters.setdefault((page.subject, page.class_level, page.chapter), []).append(page.to_dict())
+        
+        with self._lock:
+            self._chapters = chapters
+            self._stamp = stamp
+        return len(chapters)
+    
+    def after_fork(self) -> None:
+        """Replace the lock, which another thread may have held when the process forked."""
+        self._lock = threading.Lock()
+    
+    def clear(self) -> None:
+        """Drop every cached chapter."""
+        with self._lock:
+            self._chapters = {}
+    
+    def get_stats(self) -> Dict[str, int]:
+        """Cache statistics."""
+        return {'chapters': len(self._chapters), 'hits': self.hits, 'misses': self.misses}
+
@@ -17,13 +17,11 @@ import logging
 import json
 from pathlib import Path
 from typing import List, Dict, Optional
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
 import numpy as np
 from PIL import Image
 
-from services.diagram_processor_final import DiagramPage
-from models.database import Base
+from models.diagram_page import DiagramPage
+from services.diagram_repository import get_diagram_repository
 from config import Config
 
 logger = logging.getLogger(__name__)
@@ -48,14 +46,8 @@ class DiagramDisplayService:
             db_path: Path to diagrams database
             diagrams_directory: Root directory for diagram images
         """
-        # Initialize database connection
-        if db_path is None:
-            db_path = Path(__file__).parent.parent / 'diagrams.db'
-        
-        self.engine = create_engine(f'sqlite:///{db_path}')
-        Base.metadata.create_all(self.engine)
-        Session = sessionmaker(bind=self.engine)
-        self.session = Session()
+        # Shared read-only diagram metadata (one engine per process)
+        self.diagrams = get_diagram_repository(db_path)
         
         # Set diagrams directory
         if diagrams_directory is None:
@@ -75,7 +67,7 @@ class DiagramDisplayService:
         Returns:
             Dictionary with diagram data and metadata, or None if not found
         """
-        page = self.session.query(DiagramPage).filter_by(page_id=page_id).first()
+        page = self.diagrams.get_page(page_id)
         
         if not page:
             logger.warning(f"Diagram page not found: {page_id}")
@@ -95,11 +87,7 @@ class DiagramDisplayService:
         Returns:
             List of diagram dictionaries
         """
-        pages = self.session.query(DiagramPage).filter_by(
-            subject=subject,
-            class_level=class_level,
-            chapter=chapter
-        ).order_by(DiagramPage.page_number).all()
+        pages = self.diagrams.get_chapter_pages(subject, class_level, chapter)
         
         return [self._format_diagram_response(page) for page in pages]
     
@@ -117,11 +105,7 @@ class DiagramDisplayService:
             Diagram dictionary or None if not found
         """
         # Query pages that contain this figure number
-        pages = self.session.query(DiagramPage).filter_by(
-            subject=subject,
-            class_level=class_level,
-            chapter=chapter
-        ).all()
+        pages = self.diagrams.get_chapter_pages(subject, class_level, chapter)
         
         for page in pages:
             figures = page.figures.split(',') if page.figures else []
@@ -146,15 +130,7 @@ class DiagramDisplayService:
         """
         query_lower = query.lower()
         
-        # Build base query
-        base_query = self.session.query(DiagramPage)
-        
-        if subject:
-            base_query = base_query.filter_by(subject=subject)
-        if class_level:
-            base_query = base_query.filter_by(class_level=class_level)
-        
-        pages = base_query.all()
+        pages = self.diagrams.get_pages(subject, class_level)
         
         # Filter by caption match
         matching_pages = []
@@ -181,7 +157,7 @@ class DiagramDisplayService:
         Returns:
             Absolute path to diagram file, or None if not found
         """
-        page = self.session.query(DiagramPage).filter_by(page_id=page_id).first()
+        page = self.diagrams.get_page(page_id)
         
         if not page:
             return None
@@ -205,7 +181,7 @@ class DiagramDisplayService:
         Returns:
             Dictionary with labeled parts and explanations
         """
-        page = self.session.query(DiagramPage).filter_by(page_id=page_id).first()
+        page = self.diagrams.get_page(page_id)
         
         if not page:
             return {"error": "Diagram not found"}
@@ -353,5 +329,5 @@ class DiagramDisplayService:
         return self.search_diagrams_by_caption(concept, subject=subject)
     
     def close(self):
-        """Close database session."""
-        self.session.close()
+        """Close this thread's database session (the shared engine stays open)."""
+        self.diagrams.session.remove()
@@ -3,7 +3,7 @@ Final Diagram Processor - Complete Page Capture with Indexing
 
 Combines:
 - V3 Extractor: Captures complete pages with diagrams
-- Indexing: Database storage and visual embeddings
+- Indexing: Database storage, caption full-text index and visual embeddings
 
 Requirements: 5.1, 13.2
 """
@@ -38,50 +38,18 @@ except ImportError:
     chromadb = None
     Settings = None
 
-from sqlalchemy import Column, String, Integer, Text, JSON, create_engine
 from sqlalchemy.orm import sessionmaker
 
-from models.database import Base
 from config import Config
+from models.diagram_page import DiagramPage  # re-exported for existing imports
 from services.diagram_extractor_v3 import DiagramExtractor
+from services.diagram_caption_index import index_page_captions
+from services.diagram_repository import create_writable_engine, prepare_diagram_database
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 
-class DiagramPage(Base):
-    """Database model for storing complete page metadata."""
-    __tablename__ = 'diagram_pages'
-    
-    page_id = Column(String(255), primary_key=True)
-    subject = Column(String(100), nullable=False)
-    class_level = Column(Integer, nullable=False)
-    chapter = Column(Integer, nullable=False)
-    page_number = Column(Integer, nullable=False)
-    figures = Column(Text)  # Comma-separated figure numbers
-    captions = Column(Text)  # JSON string of figure_number: caption
-    file_path = Column(String(500), nullable=False)
-    source_pdf = Column(String(255))
-    image_hash = Column(String(64))
-    width = Column(Integer)
-    height = Column(Integer)
-    
-    def to_dict(self):
-        return {
-            'page_id': self.page_id,
-            'subject': self.subject,
-            'class_level': self.class_level,
-            'chapter': self.chapter,
-            'page_number': self.page_number,
-            'figures': self.figures.split(',') if self.figures else [],
-            'captions': self.captions,
-            'file_path': self.file_path,
-            'source_pdf': self.source_pdf,
-            'width': self.width,
-            'height': self.height
-        }
-
-
 class DiagramProcessor:
     """
     Final processor using complete page capture.
@@ -97,10 +65,11 @@ class DiagramProcessor:
         
         # Initialize database
         if db_path is None:
-            db_path = Path(__file__).parent.parent / 'diagrams.db'
+            db_path = Config.DIAGRAM_DB_PATH
         
-        self.engine = create_engine(f'sqlite:///{db_path}')
-        Base.metadata.create_all(self.engine)
+        # The processor is the only writer; the app reads through services.diagram_repository
+        self.engine = create_writable_engine(db_path)
+        prepare_diagram_database(self.engine)
         Session = sessionmaker(bind=self.engine)
         self.session = Session()
         
@@ -261,6 +230,8 @@ class DiagramProcessor:
         
         try:
             self.session.add(page)
+            # Caption full-text row, committed together with the page
+            index_page_captions(self.session, page_id, page.figures, page.captions)
             self.session.commit()
         except Exception as e:
             logger.error(f"Database error for {page_id}: {e}")
@@ -0,0 +1,364 @@
+"""
+Diagram Repository - Shared Read-Only Access to diagrams.db
+
+One repository per diagram database, shared by every service that reads
+diagram metadata (QueryHandler, SearchService, ImageProcessor,
+DiagramDisplayService). It replaces the per-service engines and the
+long-lived sessions that were shared across Flask threads.
+
+Features:
+- One pooled engine per process, opened through a SQLite URI in read-only
+  mode (mode=ro), or immutable mode (immutable=1, no locking at all) when
+  Config.DIAGRAM_DB_IMMUTABLE is set for deployments that never rewrite
+  the file while serving
+- Thread-local scoped sessions; every helper closes its session's
+  transaction when it returns, so readers never hold a lock on the file
+- Query helpers built once at import (SQLAlchemy caches their compiled
+  form), returning DiagramPage rows or to_dict() dictionaries
+- Caption search through the FTS5 caption index and chapter lookups
+  through the chapter cache (services.diagram_caption_index and
+  services.diagram_chapter_cache)
+- Serving processes never write: schema upkeep (tables, composite chapter
+  index, caption index) is done by DiagramProcessor, by preload_assets
+  once before workers fork, or from the command line
+
+DiagramProcessor, which writes diagrams.db, uses create_writable_engine and
+prepare_diagram_database from this module instead.
+
+Usage:
+    python -m services.diagram_repository prepare [--db diagrams.db]
+"""
+
+import os
+import logging
+import argparse
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import bindparam, create_engine, func, select, text
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from models.diagram_page import DiagramPage
+from services.diagram_caption_index import CAPTION_FTS_TABLE, ensure_caption_index, search_captions
+from services.diagram_chapter_cache import ChapterDiagramCache, ChapterKey, ensure_chapter_index
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Prebuilt statements (compiled once, then served from SQLAlchemy's statement cache)
+_PAGE_BY_ID = select(DiagramPage).where(DiagramPage.page_id == bindparam('page_id'))
+_CHAPTER_PAGES = select(DiagramPage).where(
+    DiagramPage.subject == bindparam('subject'),
+    DiagramPage.class_level == bindparam('class_level'),
+    DiagramPage.chapter == bindparam('chapter')
+).order_by(DiagramPage.page_number).limit(bindparam('limit'))
+_PAGE_COUNT = select(func.count()).select_from(DiagramPage)
+_HAS_CAPTION_INDEX = text("SELECT 1 FROM sqlite_master WHERE name = :name").bindparams(name=CAPTION_FTS_TABLE)
+
+
+def diagram_db_url(db_path: Path, immutable: bool = False) -> str:
+    """
+    Get the SQLAlchemy URL that opens a diagram database read-only.
+    
+    Args:
+        db_path: Path of diagrams.db
+        immutable: Open with immutable=1 (the file must not change while open)
+    
+    Returns:
+        sqlite:// URL using a file: URI
+    """
+    uri = Path(db_path).resolve().as_uri()
+    options = 'mode=ro&immutable=1' if immutable else 'mode=ro'
+    return f"sqlite:///{uri}?{options}&uri=true"
+
+
+def create_writable_engine(db_path: Path):
+    """
+    Create a writable engine for ingestion and schema upkeep.
+    
+    Args:
+        db_path: Path of diagrams.db
+    
+    Returns:
+        SQLAlchemy engine
+    """
+    return create_engine(f'sqlite:///{db_path}')
+
+
+def prepare_diagram_database(engine) -> bool:
+    """
+    Create the diagram table and its indexes if missing.
+    
+    Args:
+        engine: Writable engine on diagrams.db
+    
+    Returns:
+        True if the FTS5 caption index is available
+    """
+    DiagramPage.__table__.create(bind=engine, checkfirst=True)
+    ensure_chapter_index(engine, DiagramPage)
+    return ensure_caption_index(engine)
+
+
+def prepare_diagram_database_file(db_path: Optional[Path] = None) -> bool:
+    """
+    Run schema upkeep on a diagram database through a short-lived writable engine.
+    
+    Skipped for immutable databases and read-only directories.
+    
+    Args:
+        db_path: Path of diagrams.db (default: Config.DIAGRAM_DB_PATH)
+    
+    Returns:
+        True if the FTS5 caption index is available
+    """
+    db_path = Path(db_path or Config.DIAGRAM_DB_PATH)
+    if Config.DIAGRAM_DB_IMMUTABLE or not os.access(db_path.parent, os.W_OK):
+        logger.info(f"Not preparing {db_path} (immutable or read-only)")
+        return False
+    
+    writable = create_writable_engine(db_path)
+    try:
+        return prepare_diagram_database(writable)
+    finally:
+        writable.dispose()
+
+
+class DiagramRepository:
+    """
+    Thread-safe, read-only access to one diagram database.
+    """
+    
+    def __init__(self, db_path: Optional[Path] = None, immutable: Optional[bool] = None):
+        """
+        Open a diagram database read-only (no schema upkeep, see prepare_diagram_database_file).
+        
+        Args:
+            db_path: Path of diagrams.db (default: Config.DIAGRAM_DB_PATH)
+            immutable: Open in immutable mode (default: Config.DIAGRAM_DB_IMMUTABLE)
+        """
+        self.db_path = Path(db_path or Config.DIAGRAM_DB_PATH)
+        self.immutable = Config.DIAGRAM_DB_IMMUTABLE if immutable is None else immutable
+        
+        self.engine = create_engine(
+            diagram_db_url(self.db_path, self.immutable),
+            connect_args={'check_same_thread': False}
+        )
+        self.session = scoped_session(sessionmaker(bind=self.engine, autoflush=False))
+        self.chapter_cache = ChapterDiagramCache(self.db_path)
+        
+        with self.session_scope() as session:
+            self.caption_index_ready = session.execute(_HAS_CAPTION_INDEX).first() is not None
+        
+        logger.info(
+            f"Diagram repository opened {self.db_path} "
+            f"({'immutable' if self.immutable else 'read-only'}, caption index: {self.caption_index_ready})"
+        )
+    
+    @contextmanager
+    def session_scope(self) -> Iterator[Any]:
+        """
+        Use this thread's session, ending its read transaction afterwards.
+        
+        Yields:
+            SQLAlchemy session
+        """
+        try:
+            yield self.session()
+        finally:
+            self.session.close()
+    
+    def get_page(self, page_id: str) -> Optional[DiagramPage]:
+        """
+        Get a diagram page by ID.
+        
+        Args:
+            page_id: Unique page identifier
+        
+        Returns:
+            DiagramPage (detached), or None if not found
+        """
+        with self.session_scope() as session:
+            return session.execute(_PAGE_BY_ID, {'page_id': page_id}).scalar_one_or_none()
+    
+    def get_chapter_pages(self, subject: str, class_level: int, chapter: int, limit: Optional[int] = None) -> List[DiagramPage]:
+        """
+        Get the diagram pages of one chapter in page order.
+        
+        Args:
+            subject: Subject name
+            class_level: Class level (11 or 12)
+            chapter: Chapter number
+            limit: Maximum number of pages (default: all)
+        
+        Returns:
+            DiagramPage rows (detached)
+        """
+        params = {
+            'subject': subject,
+            'class_level': int(class_level),
+            'chapter': int(chapter),
+            'limit': -1 if limit is None else int(limit)
+        }
+        with self.session_scope() as session:
+            return list(session.execute(_CHAPTER_PAGES, params).scalars())
+    
+    def get_pages(self, subject: Optional[str] = None, class_level: Optional[int] = None) -> List[DiagramPage]:
+        """
+        Get all diagram pages, optionally filtered by subject and class.
+        
+        Args:
+            subject: Optional subject filter
+            class_level: Optional class level filter
+        
+        Returns:
+            DiagramPage rows (detached)
+        """
+        statement = select(DiagramPage)
+        if subject:
+            statement = statement.where(DiagramPage.subject == subject)
+        if class_level:
+            statement = statement.where(DiagramPage.class_level == int(class_level))
+        with self.session_scope() as session:
+            return list(session.execute(statement).scalars())
+    
+    def count(self) -> int:
+        """Number of diagram pages."""
+        with self.session_scope() as session:
+            return session.execute(_PAGE_COUNT).scalar_one()
+    
+    def get_chapter_diagrams(
+        self,
+        chapters: Iterable[ChapterKey],
+        limit: Optional[int] = None
+    ) -> Dict[ChapterKey, List[Dict[str, Any]]]:
+        """
+        Get the diagrams of several chapters (cached, one query for the uncached ones).
+        
+        Args:
+            chapters: (subject, class_level, chapter) keys
+            limit: Maximum diagrams per chapter (default: all)
+        
+        Returns:
+            Dictionary mapping every requested chapter to its diagram dictionaries
+        """
+        with self.session_scope() as session:
+            return self.chapter_cache.get_many(session, DiagramPage, chapters, limit=limit)
+    
+    def search_captions(
+        self,
+        keywords: List[str],
+        filters: Optional[Dict[str, Any]] = None,
+        limit: int = 5
+    ) -> List[Dict[str, Any]]:
+        """
+        Find diagrams whose captions match any of the keywords.
+        
+        Uses the FTS5 caption index (bm25-ranked, filtered and limited in SQL,
+        keywords match word prefixes); without it, captions are
+        substring-scanned in Python, where keywords also match inside words.
+        
+        Args:
+            keywords: Search keywords
+            filters: Optional subject / class_level / chapter filters
+            limit: Maximum number of diagrams
+        
+        Returns:
+            Diagram dictionaries (DiagramPage.to_dict()), best match first
+        """
+        if not keywords:
+            return []
+        
+        with self.session_scope() as session:
+            if self.caption_index_ready:
+                return [page.to_dict() for page in search_captions(session, DiagramPage, keywords, filters, limit)]
+            
+            statement = select(DiagramPage)
+            for field in ('subject', 'class_level', 'chapter'):
+                value = (filters or {}).get(field)
+                if value:
+                    column = getattr(DiagramPage, field)
+                    statement = statement.where(column == (value if field == 'subject' else int(value)))
+            
+            keywords = [keyword.lower() for keyword in keywords]
+            diagrams = []
+            for page in session.execute(statement).scalars():
+                captions = page.captions.lower() if page.captions else ''
+                if any(keyword in captions for keyword in keywords):
+                    diagrams.append(page.to_dict())
+                    if len(diagrams) >= limit:
+                        break
+            return diagrams
+    
+    def load_chapter_cache(self) -> int:
+        """
+        Fill the chapter cache with every chapter (e.g. before forking workers).
+        
+        Returns:
+            Number of chapters with diagrams
+        """
+        with self.session_scope() as session:
+            return self.chapter_cache.load_all(session, DiagramPage)
+    
+    def after_fork(self) -> None:
+        """
+        Drop pooled connections inherited from the parent process (without closing them).
+        
+        The chapter cache keeps its entries, but its lock is replaced: another
+        thread may have held it when the process forked.
+        """
+        self.engine.dispose(close=False)
+        self.session = scoped_session(sessionmaker(bind=self.engine, autoflush=False))
+        self.chapter_cache.after_fork()
+
+
+_repositories: Dict[Tuple[str, bool], DiagramRepository] = {}
+_repositories_lock = threading.Lock()
+
+
+def get_diagram_repository(db_path: Optional[Path] = None) -> DiagramRepository:
+    """
+    Get the process-wide repository for a diagram database.
+    
+    Args:
+        db_path: Path of diagrams.db (default: Config.DIAGRAM_DB_PATH)
+    
+    Returns:
+        Shared DiagramRepository
+    """
+    db_path = Path(db_path or Config.DIAGRAM_DB_PATH)
+    key = (str(db_path.resolve()), Config.DIAGRAM_DB_IMMUTABLE)
+    with _repositories_lock:
+        repository = _repositories.get(key)
+        if repository is None:
+            repository = _repositories[key] = DiagramRepository(db_path)
+        return repository
+
+
+def reset_diagram_repositories_after_fork() -> None:
+    """Recreate the per-process state of every repository in a forked worker."""
+    global _repositories_lock
+    _repositories_lock = threading.Lock()
+    for repository in _repositories.values():
+        repository.after_fork()
+
+
+def main():
+    """Command-line entry point."""
+    parser = argparse.ArgumentParser(description='Diagram database upkeep')
+    parser.add_argument('--db', default=str(Config.DIAGRAM_DB_PATH), help='Diagram database')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('prepare', help='Create missing tables, the chapter index and the caption index')
+    
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    
+    if args.command == 'prepare':
+        ready = prepare_diagram_database_file(Path(args.db))
+        print(f"Prepared {args.db} (caption index: {ready})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""
+Query Embedding Cache for GuruAI
+
+Bounded, thread-safe LRU cache with TTL expiry for query embeddings.
+Students ask the same questions repeatedly, so caching the query vector
+lets repeat queries skip the Cloudflare BGE round-trip or the local
+SentenceTransformer forward pass entirely.
+
+Features:
+- LRU eviction with a configurable maximum size
+- Per-entry time-to-live (TTL)
+- Keys scoped by embedding backend/model so vectors never mix
+- Hit/miss/eviction counters for monitoring
+"""
+
+import re
+import time
+import threading
+import logging
+from collections import OrderedDict
+from typing import List, Optional, Tuple, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingCache:
+    """
+    Thread-safe LRU + TTL cache mapping (model, normalized query) to embeddings.
+    """
+    
+    def __init__(self, max_size: int = 2048, ttl: Optional[float] = 86400):
+        """
+        Initialize the embedding cache.
+        
+        Args:
+            max_size: Maximum number of cached embeddings
+            ttl: Time-to-live for each entry in seconds (None or 0 disables expiry)
+        """
+        self.max_size = max(1, int(max_size))
+        self.ttl = ttl if ttl and ttl > 0 else None
+        
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, List[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+    
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        """
+        Normalize a query so trivially different spellings share an entry.
+        
+        Collapses whitespace and case-folds the text.
+        
+        Args:
+            query: Raw query string
+        
+        Returns:
+            Normalized query string
+        """
+        return re.sub(r'\s+', ' ', query or '').strip().casefold()
+    
+    def _make_key(self, model: str, query: str) -> Tuple[str, str]:
+        return (model, self.normalize_query(query))
+    
+    def get(self, model: str, query: str) -> Optional[List[float]]:
+        """
+        Look up a cached embedding.
+        
+        Args:
+            model: Embedding backend/model identifier
+            query: Query string
+        
+        Returns:
+            Cached embedding, or None on a miss
+        """
+        key = self._make_key(model, query)
+        
+        with self._lock:
+            entry = self._entries.get(key)
+            
+            if entry is None:
+                self.misses += 1
+                return None
+            
+            stored_at, embedding = entry
+            if self.ttl is not None and time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            
+            # Mark as most recently used
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return list(embedding)
+    
+    def put(self, model: str, query: str, embedding: List[float]) -> None:
+        """
+        Store an embedding in the cache.
+        
+        Args:
+            model: Embedding backend/model identifier
+            query: Query string
+            embedding: Embedding vector
+        """
+        key = self._make_key(model, query)
+        
+        with self._lock:
+            self._entries[key] = (time.monotonic(), list(embedding))
+            self._entries.move_to_end(key)
+            
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def clear(self) -> None:
+        """Remove all cached embeddings (statistics are kept)."""
+        with self._lock:
+            self._entries.clear()
+        logger.info("Embedding cache cleared")
+    
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get cache statistics.
+        
+        Returns:
+            Dictionary with size, capacity, hits, misses and hit rate
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': (self.hits / lookups) if lookups else 0.0
+            }
@@ -0,0 +1,717 @@
+"""
+Versioned Embedding Collections
+
+Every embedding model gets its own ChromaDB collection, named after the
+model and its dimension (e.g. ncert_content__bge_base_en_v1_5_768_a1b2c3),
+and an alias file in the vector store maps the logical collection name
+(Config.CHROMA_COLLECTION_NAME) to the one currently serving.
+
+Features:
+- Embedder: one embedding model, used for both documents and queries
+  (no silent fallback to a model of another dimension)
+- Alias file written atomically (temp file + rename); RAGSystem checks its
+  mtime on every retrieval and swaps to the new collection in place
+- Background re-embed job: copies every chunk into a new collection with
+  the new model while the old collection keeps serving, catches up with
+  chunks indexed meanwhile, rebuilds the BM25, partition and flat indexes
+  for the new collection, then switches the alias
+- Collections indexed before aliases existed are served as they are; the
+  alias is recorded only when their model is known (collection metadata
+  or 'adopt --model'), never guessed from the current configuration
+
+Usage:
+    python -m services.embedding_collections status
+    python -m services.embedding_collections reembed --model @cf/baai/bge-large-en-v1.5
+    python -m services.embedding_collections switch --collection <name>
+    python -m services.embedding_collections adopt --model sentence-transformers/all-mpnet-base-v2
+"""
+
+import re
+import json
+import time
+import shutil
+import hashlib
+import logging
+import argparse
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import Config
+from services.index_manifest import IndexManifest, MANIFEST_FILENAME
+from services.local_embedding import load_local_encoder
+from services.sparse_index import index_path_for
+from utils.atomic_file import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+ALIASES_FILENAME = 'collection_aliases.json'
+
+# Output dimensions of known models (others are probed on first use)
+KNOWN_DIMENSIONS = {
+    '@cf/baai/bge-small-en-v1.5': 384,
+    '@cf/baai/bge-base-en-v1.5': 768,
+    '@cf/baai/bge-large-en-v1.5': 1024,
+    'all-MiniLM-L6-v2': 384,
+    'sentence-transformers/all-MiniLM-L6-v2': 384,
+    'sentence-transformers/all-mpnet-base-v2': 768,
+}
+
+# Catch-up passes over chunks indexed into the old collection during a re-embed
+MAX_CATCH_UP_PASSES = 3
+
+# Local models are shared by every Embedder in the process
+_local_models: Dict[str, Any] = {}
+_local_models_lock = threading.Lock()
+
+
+def default_embedding_model_id() -> str:
+    """
+    Get the embedding model used for new collections.
+    
+    Returns:
+        Config.EMBEDDING_MODEL_ID if set, otherwise the Cloudflare model when
+        Cloudflare AI is enabled, otherwise the local sentence-transformers model
+    """
+    if Config.EMBEDDING_MODEL_ID:
+        return Config.EMBEDDING_MODEL_ID
+    
+    from services.cloudflare_ai import is_cloudflare_ai_enabled
+    if is_cloudflare_ai_enabled():
+        return Config.CLOUDFLARE_EMBEDDING_MODEL
+    return Config.EMBEDDING_MODEL_NAME
+
+
+class Embedder:
+    """
+    Embeds documents and queries with one model.
+    
+    Model IDs starting with '@cf/' are Cloudflare Workers AI models; anything
+    else is a sentence-transformers model run locally (see services.local_embedding).
+    """
+    
+    def __init__(self, model_id: str):
+        """
+        Create an embedder (local models are loaded on first use).
+        
+        Args:
+            model_id: Embedding model ID
+        """
+        self.model_id = model_id
+        self.backend = 'cloudflare' if model_id.startswith('@cf/') else 'local'
+        self._dimension: Optional[int] = KNOWN_DIMENSIONS.get(model_id)
+    
+    def _local_model(self):
+        with _local_models_lock:
+            model = _local_models.get(self.model_id)
+            if model is None:
+                # PyTorch or ONNX Runtime, per Config.LOCAL_EMBEDDING_BACKEND
+                model = load_local_encoder(self.model_id)
+                _local_models[self.model_id] = model
+            return model
+    
+    @property
+    def dimension(self) -> int:
+        """Output dimension of the model."""
+        if self._dimension is None:
+            if self.backend == 'local':
+                self._dimension = int(self._local_model().get_sentence_embedding_dimension())
+            else:
+                self._dimension = len(self.embed(['dimension probe'])[0])
+        return self._dimension
+    
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed texts.
+        
+        Args:
+            texts: Texts to embed
+        
+        Returns:
+            List of embeddings, in input order
+        """
+        if not texts:
+            return []
+        
+        if self.backend == 'cloudflare':
+            from services.cloudflare_ai import get_cloudflare_ai
+            # No local fallback: its vectors would not match this collection
+            return get_cloudflare_ai().generate_embeddings_batch(texts, use_fallback=False, model=self.model_id)
+        
+        return self._local_model().encode(texts).tolist()
+    
+    def warm_up(self) -> None:
+        """Load a local model and run one inference, so the first query is not slow."""
+        if self.backend == 'local':
+            start = time.perf_counter()
+            self.embed(['warm up'])
+            logger.info(f"Warmed up {self.model_id} in {(time.perf_counter() - start) * 1000:.0f} ms")
+    
+    def embed_one(self, text: str) -> List[float]:
+        """
+        Embed a single text.
+        
+        Args:
+            text: Text to embed
+        
+        Returns:
+            Embedding as a list of floats
+        """
+        return self.embed([text])[0]
+
+
+def versioned_collection_name(base_name: str, model_id: str, dimension: int) -> str:
+    """
+    Build the collection name for a model, e.g. ncert_content__bge_base_en_v1_5_768_a1b2c3.
+    
+    Args:
+        base_name: Logical collection name
+        model_id: Embedding model ID
+        dimension: Embedding dimension
+    
+    Returns:
+        Collection name (at most 63 characters, as ChromaDB requires)
+    """
+    slug = re.sub(r'[^a-z0-9]+', '_', model_id.rsplit('/', 1)[-1].lower()).strip('_')[:24]
+    digest = hashlib.sha1(model_id.encode('utf-8')).hexdigest()[:6]
+    suffix = f"__{slug}_{dimension}_{digest}"
+    return base_name[:63 - len(suffix)] + suffix
+
+
+def stored_dimension(collection) -> Optional[int]:
+    """
+    Get the dimension of the embeddings stored in a collection.
+    
+    Args:
+        collection: ChromaDB collection
+    
+    Returns:
+        Embedding dimension, or None if the collection is empty
+    """
+    page = collection.get(limit=1, include=['embeddings'])
+    embeddings = page.get('embeddings')
+    if embeddings is None or len(embeddings) == 0:
+        return None
+    return len(embeddings[0])
+
+
+class CollectionAliases:
+    """
+    Alias -> serving collection mapping, stored as JSON in the vector store.
+    """
+    
+    def __init__(self, vector_store_path: Path):
+        """
+        Args:
+            vector_store_path: ChromaDB directory
+        """
+        self.path = Path(vector_store_path) / ALIASES_FILENAME
+    
+    def _read(self) -> Dict[str, Dict[str, Any]]:
+        if not self.path.exists():
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable collection aliases {self.path}: {e}")
+            return {}
+    
+    def get(self, alias: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the collection an alias points to.
+        
+        Args:
+            alias: Logical collection name
+        
+        Returns:
+            Dictionary with 'collection', 'embedding_model', 'dimension' and
+            'switched_at', or None if the alias is not set
+        """
+        return self._read().get(alias)
+    
+    def set(self, alias: str, collection_name: str, embedding_model: str, dimension: int) -> None:
+        """
+        Point an alias at a collection (atomic: temp file + rename).
+        
+        Args:
+            alias: Logical collection name
+            collection_name: Collection to serve
+            embedding_model: Model the collection was embedded with
+            dimension: Embedding dimension
+        """
+        data = self._read()
+        data[alias] = {
+            'collection': collection_name,
+            'embedding_model': embedding_model,
+            'dimension': dimension,
+            'switched_at': time.time()
+        }
+        write_json_atomic(self.path, data, indent=2)
+    
+    def mtime(self) -> Optional[float]:
+        """Modification time of the alias file (None if it does not exist)."""
+        try:
+            return self.path.stat().st_mtime
+        except OSError:
+            return None
+
+
+def resolve_collection_name(vector_store_path: Path, alias: str) -> str:
+    """
+    Get the name of the collection serving an alias.
+    
+    Args:
+        vector_store_path: ChromaDB directory
+        alias: Logical collection name
+    
+    Returns:
+        The alias target, or the alias itself for stores without aliases
+    """
+    entry = CollectionAliases(vector_store_path).get(alias)
+    return entry['collection'] if entry else alias
+
+
+def create_embedding_collection(client, base_name: str, embedder: Embedder):
+    """
+    Get or create the versioned collection for an embedding model.
+    
+    Args:
+        client: ChromaDB client
+        base_name: Logical collection name
+        embedder: Embedder the collection is for
+    
+    Returns:
+        ChromaDB collection
+    """
+    return client.get_or_create_collection(
+        name=versioned_collection_name(base_name, embedder.model_id, embedder.dimension),
+        metadata={
+            "description": "NCERT textbook content for JEE/NEET preparation",
+            "embedding_model": embedder.model_id,
+            "embedding_dimension": embedder.dimension
+        }
+    )
+
+
+def open_serving_collection(
+    client,
+    vector_store_path: Path,
+    alias: str,
+    default_model_id: Optional[str] = None
+) -> Tuple[Any, Embedder]:
+    """
+    Open the collection an alias serves, with the embedder it was built with.
+    
+    A store without an alias serves its existing un-versioned collection.
+    The alias is only written when the collection metadata records its
+    model; otherwise the default model is assumed for this process alone,
+    since a dimension check cannot tell two models of the same dimension
+    apart (record the real model with 'adopt --model'). An empty store gets
+    a versioned collection for the default model.
+    
+    Args:
+        client: ChromaDB client
+        vector_store_path: ChromaDB directory
+        alias: Logical collection name
+        default_model_id: Model for new collections (default: default_embedding_model_id())
+    
+    Returns:
+        Tuple of (collection, embedder)
+    """
+    aliases = CollectionAliases(vector_store_path)
+    entry = aliases.get(alias)
+    if entry:
+        collection = client.get_collection(name=entry['collection'])
+        return collection, Embedder(entry['embedding_model'])
+    
+    default_model_id = default_model_id or default_embedding_model_id()
+    
+    try:
+        legacy = client.get_collection(name=alias)
+    except Exception:
+        legacy = None
+    
+    if legacy is not None and legacy.count() > 0:
+        recorded_model = (legacy.metadata or {}).get('embedding_model')
+        embedder = Embedder(recorded_model or default_model_id)
+        dimension = stored_dimension(legacy)
+        if dimension is not None and dimension != embedder.dimension:
+            logger.error(
+                f"Collection '{alias}' holds {dimension}-d embeddings but {embedder.model_id} produces "
+                f"{embedder.dimension}-d vectors; re-embed it with "
+                f"'python -m services.embedding_collections reembed --model <model>'"
+            )
+            return legacy, embedder
+        
+        if recorded_model:
+            aliases.set(alias, legacy.name, embedder.model_id, dimension or embedder.dimension)
+            logger.info(f"Serving existing collection '{legacy.name}' ({embedder.model_id})")
+        else:
+            logger.warning(
+                f"Collection '{legacy.name}' does not record its embedding model; assuming "
+                f"{embedder.model_id} without saving an alias (record the real model with "
+                f"'python -m services.embedding_collections adopt --model <model>')"
+            )
+        return legacy, embedder
+    
+    embedder = Embedder(default_model_id)
+    collection = create_embedding_collection(client, alias, embedder)
+    aliases.set(alias, collection.name, embedder.model_id, embedder.dimension)
+    logger.info(f"Created collection '{collection.name}' for {embedder.model_id}")
+    return collection, embedder
+
+
+class ReembedJob:
+    """
+    Re-embeds the serving collection with another model into a new collection.
+    
+    The old collection keeps serving until the new one is complete; the
+    alias is then switched and every RAGSystem picks it up on its next query.
+    """
+    
+    def __init__(
+        self,
+        client,
+        vector_store_path: Path,
+        alias: str,
+        model_id: str,
+        page_size: int = 256,
+        switch: bool = True
+    ):
+        """
+        Prepare a re-embed job.
+        
+        Args:
+            client: ChromaDB client
+            vector_store_path: ChromaDB directory
+            alias: Logical collection name
+            model_id: Embedding model for the new collection
+            page_size: Chunks read, embedded and written per step
+            switch: Whether to switch the alias when the copy is complete
+        """
+        self.client = client
+        self.vector_store_path = Path(vector_store_path)
+        self.alias = alias
+        self.embedder = Embedder(model_id)
+        self.page_size = page_size
+        self.switch = switch
+        
+        self.state = 'pending'
+        self.error: Optional[str] = None
+        self.source_name: Optional[str] = None
+        self.target_name: Optional[str] = None
+        self.copied = 0
+        self.updated = 0
+        self.deleted = 0
+        self._thread: Optional[threading.Thread] = None
+    
+    def start(self) -> threading.Thread:
+        """
+        Run the job in a background thread.
+        
+        Returns:
+            The thread
+        """
+        self._thread = threading.Thread(target=self._run_logged, name='reembed', daemon=True)
+        self._thread.start()
+        return self._thread
+    
+    def _run_logged(self) -> None:
+        try:
+            self.run()
+        except Exception as e:
+            logger.error(f"Re-embed into {self.target_name} failed: {e}")
+    
+    def status(self) -> Dict[str, Any]:
+        """
+        Get the job's progress.
+        
+        Returns:
+            Dictionary with state, collections, counts and any error
+        """
+        return {
+            'state': self.state,
+            'source': self.source_name,
+            'target': self.target_name,
+            'embedding_model': self.embedder.model_id,
+            'copied': self.copied,
+            'updated': self.updated,
+            'deleted': self.deleted,
+            'error': self.error
+        }
+    
+    def _sync_pass(self, source, target) -> int:
+        """
+        Bring target up to date with source once.
+        
+        Returns:
+            Number of chunks added, updated or deleted
+        """
+        target_metadatas: Dict[str, Any] = {}
+        offset = 0
+        while True:
+            page = target.get(include=['metadatas'], limit=self.page_size, offset=offset)
+            if not page['ids']:
+                break
+            target_metadatas.update(zip(page['ids'], page['metadatas']))
+            offset += len(page['ids'])
+        
+        changes = 0
+        source_ids = set()
+        offset = 0
+        while True:
+            page = source.get(include=['documents', 'metadatas'], limit=self.page_size, offset=offset)
+            if not page['ids']:
+                break
+            offset += len(page['ids'])
+            source_ids.update(page['ids'])
+            
+            new = [
+                (chunk_id, doc, metadata)
+                for chunk_id, doc, metadata in zip(page['ids'], page['documents'], page['metadatas'])
+                if chunk_id not in target_metadatas
+            ]
+            if new:
+                ids, docs, metadatas = zip(*new)
+                target.add(
+                    ids=list(ids),
+                    embeddings=self.embedder.embed(list(docs)),
+                    documents=list(docs),
+                    metadatas=list(metadatas)
+                )
+                self.copied += len(new)
+                changes += len(new)
+            
+            # Chunk IDs are content hashes, so only metadata can change in place
+            changed = [
+                (chunk_id, metadata)
+                for chunk_id, metadata in zip(page['ids'], page['metadatas'])
+                if chunk_id in target_metadatas and target_metadatas[chunk_id] != metadata
+            ]
+            if changed:
+                ids, metadatas = zip(*changed)
+                target.update(ids=list(ids), metadatas=list(metadatas))
+                self.updated += len(changed)
+                changes += len(changed)
+            
+            logger.info(f"Re-embed: {self.copied} chunks embedded into {target.name}")
+        
+        orphans = [chunk_id for chunk_id in target_metadatas if chunk_id not in source_ids]
+        for i in range(0, len(orphans), self.page_size):
+            target.delete(ids=orphans[i:i+self.page_size])
+        self.deleted += len(orphans)
+        changes += len(orphans)
+        
+        return changes
+    
+    def _rebuild_indexes(self, target) -> None:
+        """Build the BM25, partition and flat indexes for the new collection."""
+        source_bm25 = index_path_for(self.vector_store_path, self.source_name)
+        if source_bm25.exists():
+            # BM25 only depends on chunk text, which is unchanged
+            shutil.copyfile(source_bm25, index_path_for(self.vector_store_path, self.target_name))
+        
+        if Config.VECTOR_PARTITIONS_ENABLED:
+            from services.vector_partitions import sync_partitions
+            sync_partitions(self.client, target, self.vector_store_path)
+        
+        if Config.VECTOR_BACKEND == 'flat':
+            # Exported next to the serving collection's index, which stays in use until the switch
+            from services.vector_backends import export_chroma_collection, flat_index_dir_for
+            export_chroma_collection(target, flat_index_dir_for(target.name), quantization=Config.VECTOR_QUANTIZATION)
+    
+    def run(self) -> Dict[str, Any]:
+        """
+        Run the job in the current thread.
+        
+        Returns:
+            Final status (see status())
+        """
+        self.state = 'running'
+        try:
+            source, source_embedder = open_serving_collection(self.client, self.vector_store_path, self.alias)
+            self.source_name = source.name
+            
+            target = create_embedding_collection(self.client, self.alias, self.embedder)
+            self.target_name = target.name
+            if target.name == source.name:
+                raise ValueError(f"'{self.alias}' is already served by {self.embedder.model_id}")
+            logger.info(f"Re-embedding {source.count()} chunks from {source.name} into {target.name}")
+            
+            # Ingestion may keep writing to the old collection meanwhile
+            for _ in range(MAX_CATCH_UP_PASSES):
+                if self._sync_pass(source, target) == 0:
+                    break
+            if target.count() != source.count():
+                raise RuntimeError(
+                    f"{target.name} has {target.count()} chunks but {source.name} has {source.count()}; "
+                    f"run the job again once indexing has finished"
+                )
+            
+            self.state = 'indexing'
+            self._rebuild_indexes(target)
+            
+            if self.switch:
+                switch_alias(
+                    self.client, self.vector_store_path, self.alias, target.name,
+                    from_collection=source.name, from_model=source_embedder.model_id
+                )
+                self.state = 'switched'
+            else:
+                self.state = 'complete'
+        except Exception as e:
+            self.state = 'failed'
+            self.error = str(e)
+            raise
+        
+        return self.status()
+
+
+def switch_alias(
+    client,
+    vector_store_path: Path,
+    alias: str,
+    collection_name: str,
+    from_collection: Optional[str] = None,
+    from_model: Optional[str] = None
+) -> None:
+    """
+    Point an alias at another collection.
+    
+    The index manifest is retargeted first (its chunk IDs are unchanged),
+    so incremental indexing continues against the new collection.
+    
+    Args:
+        client: ChromaDB client
+        vector_store_path: ChromaDB directory
+        alias: Logical collection name
+        collection_name: Collection to serve
+        from_collection: Collection served until now (default: current alias target)
+        from_model: Model of the collection served until now
+    """
+    collection = client.get_collection(name=collection_name)
+    metadata = collection.metadata or {}
+    model_id = metadata.get('embedding_model')
+    if not model_id:
+        raise ValueError(f"Collection '{collection_name}' does not record its embedding model")
+    dimension = int(metadata.get('embedding_dimension') or stored_dimension(collection) or Embedder(model_id).dimension)
+    
+    aliases = CollectionAliases(vector_store_path)
+    if from_collection is None:
+        current = aliases.get(alias)
+        from_collection = current['collection'] if current else alias
+    
+    IndexManifest.retarget(
+        Path(vector_store_path) / MANIFEST_FILENAME,
+        from_collection,
+        collection_name,
+        model_id
+    )
+    aliases.set(alias, collection_name, model_id, dimension)
+    logger.info(
+        f"Alias '{alias}' switched from {from_collection}"
+        f"{f' ({from_model})' if from_model else ''} to {collection_name} ({model_id})"
+    )
+
+
+def adopt_legacy_collection(client, vector_store_path: Path, alias: str, model_id: str) -> None:
+    """
+    Record the embedding model of a collection indexed before aliases existed.
+    
+    Args:
+        client: ChromaDB client
+        vector_store_path: ChromaDB directory
+        alias: Logical collection name (also the legacy collection's name)
+        model_id: Model the collection was embedded with
+    
+    Raises:
+        ValueError: If the alias is already set or the dimensions disagree
+    """
+    aliases = CollectionAliases(vector_store_path)
+    if aliases.get(alias):
+        raise ValueError(f"Alias '{alias}' is already set; use 'switch' to serve another collection")
+    
+    legacy = client.get_collection(name=alias)
+    embedder = Embedder(model_id)
+    dimension = stored_dimension(legacy)
+    if dimension is not None and dimension != embedder.dimension:
+        raise ValueError(
+            f"Collection '{alias}' holds {dimension}-d embeddings but {model_id} produces {embedder.dimension}-d vectors"
+        )
+    
+    aliases.set(alias, legacy.name, model_id, dimension or embedder.dimension)
+    logger.info(f"Alias '{alias}' records {legacy.name} as embedded with {model_id}")
+
+
+def main():
+    """
+    Command-line entry point for managing versioned embedding collections.
+    """
+    parser = argparse.ArgumentParser(description='Manage versioned embedding collections')
+    parser.add_argument('--alias', default=Config.CHROMA_COLLECTION_NAME, help='Logical collection name')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    subparsers.add_parser('status', help='Show the serving collection and all embedding collections')
+    
+    reembed_parser = subparsers.add_parser('reembed', help='Re-embed the serving collection with another model')
+    reembed_parser.add_argument('--model', required=True, help="Embedding model ID ('@cf/...' for Cloudflare)")
+    reembed_parser.add_argument('--page-size', type=int, default=256, help='Chunks embedded per step')
+    reembed_parser.add_argument('--no-switch', action='store_true', help='Build the collection without serving it')
+    
+    switch_parser = subparsers.add_parser('switch', help='Serve another (already built) collection')
+    switch_parser.add_argument('--collection', required=True, help='Collection to serve')
+    
+    adopt_parser = subparsers.add_parser('adopt', help='Record the model of a collection indexed before aliases')
+    adopt_parser.add_argument('--model', required=True, help='Embedding model the collection was built with')
+    
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    
+    import chromadb
+    from chromadb.config import Settings
+    
+    client = chromadb.PersistentClient(
+        path=str(Config.CHROMA_DB_PATH),
+        settings=Settings(anonymized_telemetry=False)
+    )
+    
+    if args.command == 'status':
+        collections = []
+        for collection in client.list_collections():
+            if not hasattr(collection, 'metadata'):
+                collection = client.get_collection(name=str(collection))
+            metadata = collection.metadata or {}
+            if 'partition_of' in metadata:
+                continue
+            if collection.name == args.alias or (collection.name.startswith(f"{args.alias}__") and metadata.get('embedding_model')):
+                collections.append({
+                    'name': collection.name,
+                    'embedding_model': metadata.get('embedding_model'),
+                    'count': collection.count()
+                })
+        print(json.dumps({
+            'alias': args.alias,
+            'serving': CollectionAliases(Config.CHROMA_DB_PATH).get(args.alias),
+            'collections': collections
+        }, indent=2))
+    
+    elif args.command == 'reembed':
+        job = ReembedJob(
+            client, Config.CHROMA_DB_PATH, args.alias, args.model,
+            page_size=args.page_size, switch=not args.no_switch
+        )
+        print(json.dumps(job.run(), indent=2))
+    
+    elif args.command == 'switch':
+        switch_alias(client, Config.CHROMA_DB_PATH, args.alias, args.collection)
+        print(json.dumps(CollectionAliases(Config.CHROMA_DB_PATH).get(args.alias), indent=2))
+    
+    elif args.command == 'adopt':
+        adopt_legacy_collection(client, Config.CHROMA_DB_PATH, args.alias, args.model)
+        print(json.dumps(CollectionAliases(Config.CHROMA_DB_PATH).get(args.alias), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,9 +6,11 @@ Get API key from: https://makersuite.google.com/app/apikey
 import os
 import logging
 import google.generativeai as genai
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, Iterator, List, Optional
 import time
 
+from services.single_flight import flight_key, get_single_flight
+
 logger = logging.getLogger(__name__)
 
 class GeminiAI:
@@ -116,8 +118,33 @@ class GeminiAI:
         self.failed_keys[key_index] = time.time()
         logger.warning(f"⚠️ API key #{key_index + 1} marked as rate-limited (cooldown: {self.key_cooldown}s)")
     
+    def _generation_config(self, temperature: float, max_tokens: int, stop: Optional[List[str]],
+                           json_schema: Optional[Dict[str, Any]] = None):
+        """
+        Build the generation config, in JSON mode when a schema is given
+        
+        JSON mode needs google-generativeai >= 0.7; with older versions the
+        schema is only conveyed by the prompt.
+        """
+        options = {
+            'temperature': temperature,
+            'max_output_tokens': max_tokens,
+            'stop_sequences': stop if stop else None
+        }
+        if json_schema is not None:
+            try:
+                return genai.types.GenerationConfig(
+                    **options,
+                    response_mime_type='application/json',
+                    response_schema=json_schema
+                )
+            except TypeError:
+                logger.warning("Installed google-generativeai has no JSON mode, relying on the prompt")
+        return genai.types.GenerationConfig(**options)
+    
     def generate(self, prompt: str, temperature: float = 0.7, max_tokens: int = 2000, 
-                 stop: Optional[List[str]] = None, **kwargs) -> Dict[str, Any]:
+                 stop: Optional[List[str]] = None, json_schema: Optional[Dict[str, Any]] = None,
+                 **kwargs) -> Dict[str, Any]:
         """
         Generate text completion using Gemini
         Compatible with ModelManager interface
@@ -127,22 +154,28 @@ class GeminiAI:
             temperature: Sampling temperature (0-1)
             max_tokens: Maximum tokens to generate
             stop: Stop sequences (optional)
+            json_schema: Answer in JSON matching this schema (JSON mode, optional)
             **kwargs: Additional arguments (ignored for compatibility)
         
         Returns:
             Dictionary with 'text', 'success', 'tokens_used', 'error'
         """
+        # Identical concurrent requests share one API call
+        key = flight_key(self.model.model_name, prompt, temperature, max_tokens, stop, json_schema)
+        return get_single_flight('gemini').do(
+            key, self._generate, prompt, temperature, max_tokens, stop, json_schema
+        )
+    
+    def _generate(self, prompt: str, temperature: float, max_tokens: int,
+                  stop: Optional[List[str]], json_schema: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Generate text completion using Gemini (one call, see generate)"""
         # Try with current key, rotate on rate limit
         max_retries = len(self.api_keys)
         
         for attempt in range(max_retries):
             try:
                 # Configure generation
-                generation_config = genai.types.GenerationConfig(
-                    temperature=temperature,
-                    max_output_tokens=max_tokens,
-                    stop_sequences=stop if stop else None
-                )
+                generation_config = self._generation_config(temperature, max_tokens, stop, json_schema)
                 
                 # Generate response
                 response = self.model.generate_content(
@@ -242,6 +275,73 @@ class GeminiAI:
             'error': 'Unknown error'
         }
     
+    def generate_stream(self, prompt: str, temperature: float = 0.7, max_tokens: int = 2000,
+                        stop: Optional[List[str]] = None, json_schema: Optional[Dict[str, Any]] = None,
+                        **kwargs) -> Iterator[str]:
+        """
+        Generate text completion using Gemini, yielding it as it arrives
+        
+        Rate-limited keys are rotated like in generate() as long as no text
+        has been yielded yet.
+        
+        Args:
+            prompt: Input prompt
+            temperature: Sampling temperature (0-1)
+            max_tokens: Maximum tokens to generate
+            stop: Stop sequences (optional)
+            json_schema: Answer in JSON matching this schema (JSON mode, optional)
+            **kwargs: Additional arguments (ignored for compatibility)
+        
+        Yields:
+            Generated text fragments
+        
+        Raises:
+            Exception: 'RATE_LIMIT_EXCEEDED' if every key is rate-limited, or the API error
+        """
+        max_retries = len(self.api_keys)
+        
+        for attempt in range(max_retries):
+            started = False
+            try:
+                generation_config = self._generation_config(temperature, max_tokens, stop, json_schema)
+                
+                response = self.model.generate_content(
+                    prompt,
+                    generation_config=generation_config,
+                    stream=True
+                )
+                
+                for chunk in response:
+                    try:
+                        text = chunk.text
+                    except (IndexError, AttributeError, ValueError):
+                        # Chunks without text parts (e.g. the final safety/usage chunk)
+                        continue
+                    if text:
+                        started = True
+                        yield text
+                
+                logger.info(f"✅ Gemini streaming successful with key #{self.current_key_index + 1}")
+                return
+            
+            except Exception as e:
+                error_msg = str(e)
+                is_rate_limit = '429' in error_msg or 'quota' in error_msg.lower() or 'rate limit' in error_msg.lower()
+                
+                # Only retry while nothing has been sent to the caller
+                if started or not is_rate_limit:
+                    logger.error(f"❌ Gemini streaming failed: {e}")
+                    raise
+                
+                logger.warning(f"⚠️ Rate limit hit on key #{self.current_key_index + 1}: {error_msg}")
+                self._mark_key_failed(self.current_key_index)
+                if attempt < max_retries - 1:
+                    self._rotate_key()
+                    logger.info(f"🔄 Retrying with key #{self.current_key_index + 1}...")
+        
+        logger.error("❌ All API keys rate-limited!")
+        raise Exception('RATE_LIMIT_EXCEEDED')
+    
     def chat(self, messages: List[Dict[str, str]], temperature: float = 0.7, 
              max_tokens: int = 1024) -> str:
         """
@@ -14,7 +14,6 @@ import io
 import logging
 import os
 import platform
-from pathlib import Path
 from typing import Dict, Optional, Tuple, List
 import numpy as np
 from PIL import Image, ImageEnhance, ImageFilter
@@ -30,9 +29,6 @@ except ImportError:
     models = None
     transforms = None
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-
 try:
     import chromadb
     from chromadb.config import Settings
@@ -43,7 +39,8 @@ except ImportError:
     Settings = None
 
 from config import Config
-from services.diagram_processor_final import DiagramPage
+from services.diagram_repository import get_diagram_repository
+from services.vector_backends import create_vector_backend
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -85,13 +82,8 @@ class ImageProcessor:
             db_path: Path to SQLite database with diagram metadata
             chroma_path: Path to ChromaDB vector store
         """
-        # Initialize database connection
-        if db_path is None:
-            db_path = Path(__file__).parent.parent / 'diagrams.db'
-        
-        self.engine = create_engine(f'sqlite:///{db_path}')
-        Session = sessionmaker(bind=self.engine)
-        self.session = Session()
+        # Shared read-only diagram metadata (one engine per process)
+        self.diagrams = get_diagram_repository(db_path)
         
         # Initialize EasyOCR reader (supports English and Hindi)
         logger.info("Initializing EasyOCR reader...")
@@ -128,6 +120,15 @@ class ImageProcessor:
         except Exception as e:
             logger.warning(f"Could not load diagram collection: {e}")
             self.diagram_collection = None
+        
+        # Vector search backend (flat index with quantized storage, or ChromaDB)
+        self.diagram_backend = None
+        if self.diagram_collection is not None:
+            self.diagram_backend = create_vector_backend(
+                Config.DIAGRAM_VECTOR_BACKEND,
+                self.diagram_collection,
+                Config.DIAGRAM_FLAT_INDEX_DIR
+            )
     
     def _preprocess_image(self, image: Image.Image) -> Tuple[Image.Image, np.ndarray]:
         """
@@ -317,11 +318,8 @@ class ImageProcessor:
             # Generate embedding
             embedding = self._generate_visual_embedding(image)
             
-            # Query ChromaDB for similar diagrams
-            results = self.diagram_collection.query(
-                query_embeddings=[embedding.tolist()],
-                n_results=top_k
-            )
+            # Query the vector backend for similar diagrams
+            results = self.diagram_backend.query(embedding.tolist(), top_k)
             
             if not results['ids'] or len(results['ids'][0]) == 0:
                 logger.info("No matching diagrams found")
@@ -340,7 +338,7 @@ class ImageProcessor:
             
             # Get full diagram information from database
             page_id = best_match_id
-            diagram_page = self.session.query(DiagramPage).filter_by(page_id=page_id).first()
+            diagram_page = self.diagrams.get_page(page_id)
             
             if diagram_page:
                 match_info = {
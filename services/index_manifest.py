@@ -0,0 +1,288 @@
+"""
+Index Manifest for the NCERT Vector Store
+
+Records what has been indexed into a ChromaDB collection so re-indexing
+can be incremental. The manifest is a JSON file stored next to the
+collection and holds, for every PDF:
+- the SHA-256 of the file (plus size and mtime as a cheap pre-check)
+- the ordered list of content-hashed chunk IDs created from it
+
+Chunk IDs are derived from the chunk text, so unchanged chunks keep their
+IDs (and embeddings) when a PDF is re-chunked, and IDs that disappear are
+known to be orphans.
+"""
+
+import json
+import hashlib
+import logging
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from utils.atomic_file import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILENAME = 'ncert_manifest.json'
+MANIFEST_VERSION = 1
+
+
+def hash_file(path: Path, block_size: int = 1024 * 1024) -> str:
+    """
+    Compute the SHA-256 of a file.
+    
+    Args:
+        path: File path
+        block_size: Read block size in bytes
+    
+    Returns:
+        Hex digest
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def hash_text(text: str) -> str:
+    """
+    Compute the SHA-256 of a chunk of text.
+    
+    Args:
+        text: Chunk text
+    
+    Returns:
+        Hex digest
+    """
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class ChunkIdFactory:
+    """
+    Builds content-hashed chunk IDs one chunk at a time (for streaming ingestion).
+    """
+    
+    def __init__(self, stem: str):
+        """
+        Start IDs for one PDF.
+        
+        Args:
+            stem: PDF file stem
+        """
+        self.stem = stem
+        self._seen: Dict[str, int] = {}
+    
+    def __call__(self, page_number: Any, chunk_hash: str) -> str:
+        """
+        Build the ID of the next chunk.
+        
+        Args:
+            page_number: Page number of the chunk
+            chunk_hash: Content hash of the chunk
+        
+        Returns:
+            Chunk ID
+        """
+        chunk_id = f"{self.stem}_p{page_number}_{chunk_hash[:16]}"
+        count = self._seen.get(chunk_id, 0)
+        self._seen[chunk_id] = count + 1
+        if count:
+            chunk_id = f"{chunk_id}_{count}"
+        return chunk_id
+
+
+def make_chunk_ids(stem: str, page_numbers: List[Any], chunk_hashes: List[str]) -> List[str]:
+    """
+    Build content-hashed chunk IDs of the form {stem}_p{page}_{hash[:16]}.
+    
+    Identical chunks on the same page get a numeric suffix so IDs stay unique.
+    
+    Args:
+        stem: PDF file stem
+        page_numbers: Page number of each chunk
+        chunk_hashes: Content hash of each chunk
+    
+    Returns:
+        List of chunk IDs, in input order
+    """
+    make_id = ChunkIdFactory(stem)
+    return [make_id(page_number, chunk_hash) for page_number, chunk_hash in zip(page_numbers, chunk_hashes)]
+
+
+class IndexManifest:
+    """
+    Per-file content hashes and chunk IDs for a vector store collection.
+    """
+    
+    def __init__(self, path: Path, collection_name: str, embedding_model: str):
+        """
+        Load (or start) a manifest.
+        
+        A manifest written for a different collection or embedding model is
+        discarded, since none of its embeddings can be reused.
+        
+        Args:
+            path: Manifest file path
+            collection_name: Name of the collection it describes
+            embedding_model: Identifier of the embedding model in use
+        """
+        self.path = Path(path)
+        self.collection_name = collection_name
+        self.embedding_model = embedding_model
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self._load()
+    
+    def _load(self) -> None:
+        if not self.path.exists():
+            return
+        
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable index manifest {self.path}: {e}")
+            return
+        
+        if data.get('version') != MANIFEST_VERSION:
+            logger.info("Index manifest version changed, starting fresh")
+            return
+        if data.get('collection') != self.collection_name or data.get('embedding_model') != self.embedding_model:
+            logger.info(
+                f"Index manifest was built for {data.get('collection')} / {data.get('embedding_model')}, "
+                f"starting fresh for {self.collection_name} / {self.embedding_model}"
+            )
+            return
+        
+        self.files = data.get('files', {})
+        logger.info(f"Loaded index manifest with {len(self.files)} files")
+    
+    @staticmethod
+    def retarget(path: Path, from_collection: str, collection_name: str, embedding_model: str) -> bool:
+        """
+        Point a manifest at a re-embedded copy of its collection.
+        
+        Chunk IDs are kept, since the copy holds the same chunks.
+        
+        Args:
+            path: Manifest file path
+            from_collection: Collection the manifest must currently describe
+            collection_name: New collection name
+            embedding_model: Embedding model of the new collection
+        
+        Returns:
+            True if the manifest was rewritten
+        """
+        path = Path(path)
+        if not path.exists():
+            return False
+        
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('collection') != from_collection:
+            logger.warning(f"Index manifest describes {data.get('collection')}, not {from_collection}; leaving it")
+            return False
+        
+        data['collection'] = collection_name
+        data['embedding_model'] = embedding_model
+        write_json_atomic(path, data)
+        return True
+    
+    def save(self) -> None:
+        """Write the manifest atomically (temp file + rename)."""
+        data = {
+            'version': MANIFEST_VERSION,
+            'collection': self.collection_name,
+            'embedding_model': self.embedding_model,
+            'files': self.files
+        }
+        
+        write_json_atomic(self.path, data)
+    
+    def changed_hash(self, pdf_path: Path) -> Optional[str]:
+        """
+        Get the SHA-256 of a PDF that changed since it was indexed.
+        
+        Size and mtime are compared first; the file is only hashed when they
+        differ. An entry whose hash still matches gets its stat refreshed.
+        
+        Args:
+            pdf_path: PDF file path
+        
+        Returns:
+            The file's current SHA-256 if it is new or changed, None if unchanged
+        """
+        stat = pdf_path.stat()
+        entry = self.files.get(pdf_path.name)
+        
+        if entry and entry.get('size') == stat.st_size and entry.get('mtime') == stat.st_mtime:
+            return None
+        
+        file_hash = hash_file(pdf_path)
+        if entry and entry.get('sha256') == file_hash:
+            entry['size'] = stat.st_size
+            entry['mtime'] = stat.st_mtime
+            return None
+        
+        return file_hash
+    
+    def get_chunk_ids(self, file_name: str) -> Optional[List[str]]:
+        """
+        Get the ordered chunk IDs recorded for a file.
+        
+        Args:
+            file_name: PDF file name
+        
+        Returns:
+            List of chunk IDs, or None if the file is not in the manifest
+        """
+        entry = self.files.get(file_name)
+        return list(entry['chunks']) if entry else None
+    
+    def set_file(self, pdf_path: Path, file_hash: str, chunk_ids: List[str]) -> None:
+        """
+        Record a freshly indexed file.
+        
+        Args:
+            pdf_path: PDF file path
+            file_hash: SHA-256 of the file
+            chunk_ids: Ordered chunk IDs created from the file
+        """
+        stat = pdf_path.stat()
+        self.files[pdf_path.name] = {
+            'sha256': file_hash,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'chunks': list(chunk_ids)
+        }
+    
+    def set_incomplete(self, file_name: str, chunk_ids: List[str]) -> None:
+        """
+        Record the chunks of a file whose indexing did not complete.
+        
+        The entry has no hash, size or mtime, so the file counts as changed
+        on the next run and is indexed again; its chunk IDs are kept so
+        chunks already stored are reused and removed with the file.
+        
+        Args:
+            file_name: PDF file name
+            chunk_ids: Chunk IDs stored in the collection for the file
+        """
+        self.files[file_name] = {
+            'sha256': None,
+            'size': None,
+            'mtime': None,
+            'chunks': list(chunk_ids)
+        }
+    
+    def remove_file(self, file_name: str) -> Optional[List[str]]:
+        """
+        Forget a file.
+        
+        Args:
+            file_name: PDF file name
+        
+        Returns:
+            The file's chunk IDs, or None if it was not in the manifest
+        """
+        entry = self.files.pop(file_name, None)
+        return entry['chunks'] if entry else None
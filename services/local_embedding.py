@@ -0,0 +1,365 @@
+"""
+Local Sentence Embedding Backends
+
+Runs the local sentence-transformers embedding model on CPU, selected by
+Config.LOCAL_EMBEDDING_BACKEND:
+- 'torch': sentence-transformers with PyTorch (the reference)
+- 'onnx': the model's transformer exported to ONNX and run with ONNX Runtime
+- 'onnx-int8': the ONNX export with dynamic int8 quantization of the weights
+
+Features:
+- Models are exported once into Config.ONNX_MODEL_DIR (ONNX graph, fast
+  tokenizer and pooling settings); loading an export needs only
+  onnxruntime, tokenizers and numpy, so PyTorch is never imported
+- Pooling (mean/CLS/max) and normalization follow the sentence-transformers
+  model, so vectors match the PyTorch ones and existing collections
+- Texts are sorted by length before batching to minimise padding
+- Parity check against the PyTorch vectors (cosine similarity, latency)
+
+Usage:
+    python -m services.local_embedding export [--model ...]
+    python -m services.local_embedding parity [--backend onnx-int8] [--texts queries.txt]
+"""
+
+import re
+import json
+import time
+import shutil
+import logging
+import argparse
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+LOCAL_BACKENDS = ('torch', 'onnx', 'onnx-int8')
+
+ONNX_MODEL_FILE = 'model.onnx'
+ONNX_INT8_MODEL_FILE = 'model.int8.onnx'
+ENCODER_CONFIG_FILE = 'encoder.json'
+
+DEFAULT_PARITY_TEXTS = [
+    "What is Newton's first law of motion?",
+    "Explain photosynthesis in plants",
+    "What is the derivative of x squared?",
+    "Describe the structure of benzene",
+    "State Ohm's law and define resistance.",
+    "How does the human heart pump blood through the body?",
+    "Balance the chemical equation for the combustion of methane.",
+    "Find the area under the curve y = x^2 between x = 0 and x = 2.",
+]
+
+
+def onnx_model_dir(model_name: str) -> Path:
+    """
+    Get the export directory of a model.
+    
+    Args:
+        model_name: sentence-transformers model name
+    
+    Returns:
+        Directory under Config.ONNX_MODEL_DIR
+    """
+    return Path(Config.ONNX_MODEL_DIR) / re.sub(r'[^A-Za-z0-9._-]+', '__', model_name)
+
+
+class OnnxSentenceEncoder:
+    """
+    Sentence encoder running an exported transformer with ONNX Runtime.
+    
+    Mirrors the parts of the SentenceTransformer API the app uses
+    (encode and get_sentence_embedding_dimension).
+    """
+    
+    def __init__(self, model_dir: Path, quantized: bool = True, threads: int = 0):
+        """
+        Load an exported model.
+        
+        Args:
+            model_dir: Directory written by export_onnx_model()
+            quantized: Use the int8 model instead of the float32 one
+            threads: Intra-op threads (0 = ONNX Runtime default)
+        """
+        import onnxruntime
+        from tokenizers import Tokenizer
+        
+        self.model_dir = Path(model_dir)
+        with open(self.model_dir / ENCODER_CONFIG_FILE, 'r', encoding='utf-8') as f:
+            self.config: Dict[str, Any] = json.load(f)
+        
+        model_path = self.model_dir / (ONNX_INT8_MODEL_FILE if quantized else ONNX_MODEL_FILE)
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(
+            str(model_path), sess_options=options, providers=['CPUExecutionProvider']
+        )
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+        
+        self.tokenizer = Tokenizer.from_file(str(self.model_dir / 'tokenizer.json'))
+        self.tokenizer.enable_truncation(max_length=self.config['max_seq_length'])
+        self.tokenizer.enable_padding(pad_id=self.config['pad_token_id'], pad_token=self.config['pad_token'])
+        
+        logger.info(f"Loaded ONNX embedding model {model_path}")
+    
+    def get_sentence_embedding_dimension(self) -> int:
+        """Output dimension of the model."""
+        return int(self.config['dimension'])
+    
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        features = {
+            'input_ids': np.array([e.ids for e in encodings], dtype=np.int64),
+            'attention_mask': np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            'token_type_ids': np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        token_embeddings = self.session.run(None, {name: features[name] for name in self.input_names})[0]
+        
+        mask = features['attention_mask'][..., None].astype(np.float32)
+        pooling = self.config['pooling']
+        if pooling == 'cls':
+            embeddings = token_embeddings[:, 0]
+        elif pooling == 'max':
+            embeddings = np.where(mask > 0, token_embeddings, -1e9).max(axis=1)
+        else:
+            embeddings = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        
+        if self.config['normalize']:
+            embeddings = embeddings / np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        return embeddings.astype(np.float32)
+    
+    def encode(self, sentences: Union[str, List[str]], batch_size: int = 32) -> np.ndarray:
+        """
+        Embed sentences.
+        
+        Args:
+            sentences: A sentence or a list of sentences
+            batch_size: Sentences per inference call
+        
+        Returns:
+            Array of shape (len(sentences), dimension), or (dimension,) for a single sentence
+        """
+        if isinstance(sentences, str):
+            return self.encode([sentences], batch_size)[0]
+        if not sentences:
+            return np.zeros((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+        
+        # Batch similar lengths together so little padding is computed
+        order = sorted(range(len(sentences)), key=lambda i: -len(sentences[i]))
+        embeddings = np.empty((len(sentences), self.get_sentence_embedding_dimension()), dtype=np.float32)
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            embeddings[batch] = self._encode_batch([sentences[i] for i in batch])
+        return embeddings
+
+
+def export_onnx_model(model_name: str, out_dir: Optional[Path] = None, quantize: bool = True) -> Path:
+    """
+    Export a sentence-transformers model to ONNX (needs torch and sentence-transformers).
+    
+    The export is written to a temporary directory and swapped in at the end.
+    
+    Args:
+        model_name: sentence-transformers model name
+        out_dir: Export directory (default: onnx_model_dir(model_name))
+        quantize: Also write a dynamically int8-quantized model
+    
+    Returns:
+        Export directory
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+    
+    out_dir = Path(out_dir or onnx_model_dir(model_name))
+    tmp_dir = out_dir.with_name(out_dir.name + '.tmp')
+    if tmp_dir.exists():
+        shutil.rmtree(tmp_dir)
+    tmp_dir.mkdir(parents=True)
+    
+    model = SentenceTransformer(model_name, device='cpu')
+    transformer = model[0]
+    tokenizer = transformer.tokenizer
+    pooling = next((module for module in model if hasattr(module, 'get_pooling_mode_str')), None)
+    input_names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in tokenizer.model_input_names]
+    
+    class TokenEmbeddings(torch.nn.Module):
+        def __init__(self, auto_model):
+            super().__init__()
+            self.auto_model = auto_model
+        
+        def forward(self, *inputs):
+            return self.auto_model(**dict(zip(input_names, inputs)), return_dict=False)[0]
+    
+    sample = tokenizer(['An export sample sentence.', 'Another one'], padding=True, return_tensors='pt')
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names + ['token_embeddings']}
+    
+    with torch.no_grad():
+        torch.onnx.export(
+            TokenEmbeddings(transformer.auto_model).eval(),
+            tuple(sample[name] for name in input_names),
+            str(tmp_dir / ONNX_MODEL_FILE),
+            input_names=input_names,
+            output_names=['token_embeddings'],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+            do_constant_folding=True
+        )
+    
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(
+            str(tmp_dir / ONNX_MODEL_FILE),
+            str(tmp_dir / ONNX_INT8_MODEL_FILE),
+            weight_type=QuantType.QInt8
+        )
+    
+    tokenizer.save_pretrained(str(tmp_dir))
+    with open(tmp_dir / ENCODER_CONFIG_FILE, 'w', encoding='utf-8') as f:
+        json.dump({
+            'model_name': model_name,
+            'dimension': model.get_sentence_embedding_dimension(),
+            'max_seq_length': model.max_seq_length,
+            'pooling': pooling.get_pooling_mode_str() if pooling is not None else 'mean',
+            'normalize': any(type(module).__name__ == 'Normalize' for module in model),
+            'pad_token': tokenizer.pad_token,
+            'pad_token_id': tokenizer.pad_token_id,
+            'quantized': quantize
+        }, f, indent=2)
+    
+    if out_dir.exists():
+        shutil.rmtree(out_dir)
+    tmp_dir.rename(out_dir)
+    logger.info(f"Exported {model_name} to {out_dir}")
+    return out_dir
+
+
+def load_local_encoder(model_name: str, backend: Optional[str] = None):
+    """
+    Load a local sentence encoder with the configured backend.
+    
+    ONNX models are exported on first use if needed (which needs PyTorch
+    once; run the export command at build time to avoid it). If the ONNX
+    backend cannot be loaded, the PyTorch model is used instead.
+    
+    Args:
+        model_name: sentence-transformers model name
+        backend: 'torch', 'onnx' or 'onnx-int8' (default: Config.LOCAL_EMBEDDING_BACKEND)
+    
+    Returns:
+        Encoder with encode() and get_sentence_embedding_dimension()
+    """
+    backend = backend or Config.LOCAL_EMBEDDING_BACKEND
+    if backend not in LOCAL_BACKENDS:
+        logger.warning(f"Unknown local embedding backend '{backend}', using torch")
+        backend = 'torch'
+    
+    if backend != 'torch':
+        quantized = backend == 'onnx-int8'
+        model_dir = onnx_model_dir(model_name)
+        try:
+            model_file = model_dir / (ONNX_INT8_MODEL_FILE if quantized else ONNX_MODEL_FILE)
+            if not model_file.exists():
+                logger.info(f"No ONNX export of {model_name} yet, exporting to {model_dir}")
+                export_onnx_model(model_name, model_dir, quantize=True)
+            return OnnxSentenceEncoder(model_dir, quantized=quantized, threads=Config.ONNX_THREADS)
+        except Exception as e:
+            logger.error(f"Could not load ONNX embedding model for {model_name}, using PyTorch: {e}")
+    
+    from sentence_transformers import SentenceTransformer
+    logger.info(f"Loading local embedding model: {model_name}")
+    return SentenceTransformer(model_name, device='cpu')
+
+
+def _latency_ms(encoder, texts: List[str]) -> Dict[str, float]:
+    timings = []
+    for text in texts:
+        start = time.perf_counter()
+        encoder.encode([text])
+        timings.append((time.perf_counter() - start) * 1000)
+    return {
+        'p50': round(float(np.percentile(timings, 50)), 2),
+        'p95': round(float(np.percentile(timings, 95)), 2)
+    }
+
+
+def check_parity(model_name: str, texts: List[str], backend: str = 'onnx-int8') -> Dict[str, Any]:
+    """
+    Compare an ONNX backend with the PyTorch vectors.
+    
+    Args:
+        model_name: sentence-transformers model name
+        texts: Sample texts
+        backend: 'onnx' or 'onnx-int8'
+    
+    Returns:
+        Dictionary with cosine similarity statistics and per-query latency of both backends
+    """
+    reference = load_local_encoder(model_name, 'torch')
+    candidate = load_local_encoder(model_name, backend)
+    if not isinstance(candidate, OnnxSentenceEncoder):
+        raise RuntimeError(f"The {backend} backend could not be loaded")
+    
+    expected = np.asarray(reference.encode(texts), dtype=np.float32)
+    actual = np.asarray(candidate.encode(texts), dtype=np.float32)
+    cosine = (expected * actual).sum(axis=1) / (
+        np.linalg.norm(expected, axis=1) * np.linalg.norm(actual, axis=1)
+    )
+    
+    # Warm both up before timing
+    reference.encode(texts[:1])
+    candidate.encode(texts[:1])
+    
+    return {
+        'model': model_name,
+        'backend': backend,
+        'texts': len(texts),
+        'min_cosine': round(float(cosine.min()), 6),
+        'mean_cosine': round(float(cosine.mean()), 6),
+        'max_abs_difference': round(float(np.abs(expected - actual).max()), 6),
+        'latency_ms': {'torch': _latency_ms(reference, texts), backend: _latency_ms(candidate, texts)}
+    }
+
+
+def main():
+    """
+    Command-line entry point for exporting ONNX models and checking their parity.
+    """
+    parser = argparse.ArgumentParser(description='Local sentence embedding backends')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    export_parser = subparsers.add_parser('export', help='Export the embedding model to ONNX (float32 and int8)')
+    export_parser.add_argument('--model', default=Config.EMBEDDING_MODEL_NAME, help='sentence-transformers model')
+    export_parser.add_argument('--no-quantize', action='store_true', help='Skip the int8 model')
+    
+    parity_parser = subparsers.add_parser('parity', help='Compare ONNX vectors with the PyTorch ones')
+    parity_parser.add_argument('--model', default=Config.EMBEDDING_MODEL_NAME, help='sentence-transformers model')
+    parity_parser.add_argument('--backend', default='onnx-int8', choices=['onnx', 'onnx-int8'], help='Backend to check')
+    parity_parser.add_argument('--texts', help='Text file with one sample per line (default: built-in queries)')
+    parity_parser.add_argument('--min-cosine', type=float, default=0.99, help='Fail below this cosine similarity')
+    
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    
+    if args.command == 'export':
+        print(export_onnx_model(args.model, quantize=not args.no_quantize))
+    
+    elif args.command == 'parity':
+        texts = DEFAULT_PARITY_TEXTS
+        if args.texts:
+            with open(args.texts, 'r', encoding='utf-8') as f:
+                texts = [line.strip() for line in f if line.strip()]
+        
+        report = check_parity(args.model, texts, args.backend)
+        print(json.dumps(report, indent=2))
+        if report['min_cosine'] < args.min_cosine:
+            raise SystemExit(f"Parity check failed: min cosine {report['min_cosine']} < {args.min_cosine}")
+
+
+if __name__ == "__main__":
+    main()
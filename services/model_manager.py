@@ -4,17 +4,21 @@ Implements lazy loading and automatic unloading based on idle timeout.
 """
 import time
 import gc
+import json
 import threading
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Iterator
 try:
-    from llama_cpp import Llama
+    from llama_cpp import Llama, LlamaGrammar
     LLAMA_CPP_AVAILABLE = True
 except ImportError:
     LLAMA_CPP_AVAILABLE = False
     Llama = None
+    LlamaGrammar = None
 import logging
 
+from services.single_flight import flight_key, get_single_flight
+
 logger = logging.getLogger(__name__)
 
 
@@ -58,6 +62,9 @@ class ModelManager:
         self.temperature = config.get('temperature', 0.7)
         self.max_tokens = config.get('max_tokens', 512)
         
+        # Grammars for JSON-constrained generation, by schema
+        self._grammars: Dict[str, Any] = {}
+        
         # Validate model path
         if not self.model_path.exists():
             raise FileNotFoundError(f"Model file not found: {self.model_path}")
@@ -193,7 +200,8 @@ class ModelManager:
         max_tokens: Optional[int] = None,
         temperature: Optional[float] = None,
         top_p: float = 0.9,
-        stop: Optional[list] = None
+        stop: Optional[list] = None,
+        json_schema: Optional[Dict[str, Any]] = None
     ) -> Dict[str, Any]:
         """
         Generate text using the model.
@@ -204,6 +212,7 @@ class ModelManager:
             temperature: Sampling temperature (uses default if None)
             top_p: Nucleus sampling parameter
             stop: List of stop sequences
+            json_schema: Constrain the output to JSON matching this schema (grammar-based sampling)
         
         Returns:
             Dictionary with generation results:
@@ -212,6 +221,22 @@ class ModelManager:
                 - success: Whether generation succeeded
                 - error: Error message if failed
         """
+        # Identical concurrent requests share one generation instead of each running the model
+        key = flight_key(str(self.model_path), prompt, max_tokens, temperature, top_p, stop, json_schema)
+        return get_single_flight('local-llm').do(
+            key, self._generate, prompt, max_tokens, temperature, top_p, stop, json_schema
+        )
+    
+    def _generate(
+        self,
+        prompt: str,
+        max_tokens: Optional[int],
+        temperature: Optional[float],
+        top_p: float,
+        stop: Optional[list],
+        json_schema: Optional[Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """Run one generation (see generate)."""
         # Ensure model is loaded
         if not self.is_loaded():
             logger.info("Model not loaded, loading now...")
@@ -242,7 +267,8 @@ class ModelManager:
                 temperature=temperature,
                 top_p=top_p,
                 stop=stop,
-                echo=False
+                echo=False,
+                grammar=self._get_grammar(json_schema)
             )
             
             generated_text = response['choices'][0]['text'].strip()
@@ -266,6 +292,80 @@ class ModelManager:
                 'error': str(e)
             }
     
+    def generate_stream(
+        self,
+        prompt: str,
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        top_p: float = 0.9,
+        stop: Optional[list] = None,
+        json_schema: Optional[Dict[str, Any]] = None
+    ) -> Iterator[str]:
+        """
+        Generate text using the model, yielding it piece by piece as it is sampled.
+        
+        Args:
+            prompt: Input prompt for generation
+            max_tokens: Maximum tokens to generate (uses default if None)
+            temperature: Sampling temperature (uses default if None)
+            top_p: Nucleus sampling parameter
+            stop: List of stop sequences
+            json_schema: Constrain the output to JSON matching this schema (grammar-based sampling)
+        
+        Yields:
+            Generated text fragments
+        
+        Raises:
+            Exception: If the model cannot be loaded or generation fails
+        """
+        if not self.is_loaded():
+            logger.info("Model not loaded, loading now...")
+            if not self.load_model():
+                raise Exception('Failed to load model')
+        
+        if max_tokens is None:
+            max_tokens = self.max_tokens
+        if temperature is None:
+            temperature = self.temperature
+        
+        logger.info(f"Streaming response (max_tokens={max_tokens}, temp={temperature})")
+        
+        for chunk in self.model(
+            prompt,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            stop=stop,
+            echo=False,
+            stream=True,
+            grammar=self._get_grammar(json_schema)
+        ):
+            self.last_used = time.time()
+            text = chunk['choices'][0]['text']
+            if text:
+                yield text
+    
+    def _get_grammar(self, json_schema: Optional[Dict[str, Any]]):
+        """
+        Get the llama.cpp grammar for a JSON schema (compiled once per schema).
+        
+        Args:
+            json_schema: JSON schema, or None for unconstrained sampling
+        
+        Returns:
+            LlamaGrammar, or None
+        """
+        if json_schema is None or LlamaGrammar is None:
+            return None
+        
+        key = json.dumps(json_schema, sort_keys=True)
+        grammar = self._grammars.get(key)
+        if grammar is None:
+            # Property order of the schema is kept, so streamed JSON follows it
+            grammar = LlamaGrammar.from_json_schema(json.dumps(json_schema), verbose=False)
+            self._grammars[key] = grammar
+        return grammar
+    
     def generate_with_context(
         self,
         query: str,
@@ -4,16 +4,27 @@ NCERT Content Processing Pipeline
 This module handles:
 1. Extracting text from NCERT PDFs
 2. Chunking text into 500-word chunks with overlap
-3. Generating embeddings using sentence-transformers
-4. Storing embeddings in ChromaDB vector store
+3. Generating embeddings in batches (Cloudflare BGE or sentence-transformers)
+4. Storing embeddings in ChromaDB vector store (single writer), in the
+   versioned collection for the embedding model currently serving
+5. Optional process-parallel extraction and chunking (--workers)
+6. Incremental re-indexing from a manifest of content hashes (--full to rebuild)
+7. BM25 keyword index over chunk text for hybrid retrieval
+8. Streaming extract -> chunk -> embed -> store pipeline with bounded queues,
+   so peak memory stays flat regardless of PDF size
 
 Requirements: 1.1, 13.1
 """
 
 import os
 import re
+import time
+import queue
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
-from typing import List, Dict, Tuple
+from typing import Any, Iterator, List, Dict, Optional, Set, Tuple
 import logging
 
 # Load environment variables first
@@ -26,16 +37,8 @@ import pdfplumber
 
 # Text Processing
 import nltk
-from nltk.tokenize import word_tokenize, sent_tokenize
-
-# Embeddings and Vector Store
-try:
-    from sentence_transformers import SentenceTransformer
-    SENTENCE_TRANSFORMERS_AVAILABLE = True
-except ImportError:
-    SENTENCE_TRANSFORMERS_AVAILABLE = False
-    SentenceTransformer = None
 
+# Vector Store
 try:
     import chromadb
     from chromadb.config import Settings
@@ -47,6 +50,14 @@ except ImportError:
 
 # Configuration
 from config import Config
+from services.index_manifest import (
+    ChunkIdFactory, IndexManifest, MANIFEST_FILENAME, hash_file, hash_text
+)
+from services.text_chunking import chunk_text as chunk_sentences_text
+from services.stream_pipeline import batched, prefetch
+from services.sparse_index import BM25Index, index_path_for
+from services.vector_partitions import registry_path_for, sync_partitions as sync_partition_collections
+from services.embedding_collections import open_serving_collection
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -69,20 +80,6 @@ class NCERTProcessor:
         self.pdf_directory = Path(pdf_directory)
         self.vector_store_path = Path(vector_store_path)
         
-        # Initialize embedding model (use Cloudflare if available)
-        from services.cloudflare_ai import get_cloudflare_ai, is_cloudflare_ai_enabled
-        
-        self.use_cloudflare = is_cloudflare_ai_enabled()
-        
-        if self.use_cloudflare:
-            logger.info("Using Cloudflare AI for embeddings (768d)")
-            self.cloudflare_ai = get_cloudflare_ai()
-            self.embedding_model = None
-        else:
-            logger.info("Loading local embedding model (384d)...")
-            self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-            self.cloudflare_ai = None
-        
         # Initialize ChromaDB client
         logger.info("Initializing ChromaDB...")
         self.chroma_client = chromadb.PersistentClient(
@@ -90,11 +87,36 @@ class NCERTProcessor:
             settings=Settings(anonymized_telemetry=False)
         )
         
-        # Get or create collection
-        self.collection = self.chroma_client.get_or_create_collection(
-            name="ncert_content",
-            metadata={"description": "NCERT textbook content for JEE/NEET preparation"}
+        # Index into the collection currently serving (versioned per embedding
+        # model), embedding with the model that collection was built with
+        self.collection, self.embedder = open_serving_collection(
+            self.chroma_client,
+            self.vector_store_path,
+            Config.CHROMA_COLLECTION_NAME
+        )
+        self.embedding_model_name = self.embedder.model_id
+        logger.info(
+            f"Indexing into '{self.collection.name}' with {self.embedding_model_name} "
+            f"({self.embedder.dimension}d)"
+        )
+        
+        # Manifest of indexed files and chunks (enables incremental re-indexing)
+        self.manifest = IndexManifest(
+            self.vector_store_path / MANIFEST_FILENAME,
+            collection_name=self.collection.name,
+            embedding_model=self.embedding_model_name
+        )
+        
+        # BM25 keyword index over chunk text, kept in sync with the collection
+        self.sparse_index = BM25Index.load_or_build(
+            index_path_for(self.vector_store_path, self.collection.name),
+            self.collection
         )
+        self._sparse_index_dirty = False
+        
+        # Partition collections are synced after every run that changed the collection
+        # (and on the first run, when they do not exist yet)
+        self._partitions_dirty = not registry_path_for(self.vector_store_path, self.collection.name).exists()
         
         # Download NLTK data if needed
         try:
@@ -109,37 +131,71 @@ class NCERTProcessor:
             logger.info("Downloading NLTK punkt_tab tokenizer...")
             nltk.download('punkt_tab', quiet=True)
     
-    def extract_text_from_pdf(self, pdf_path: Path) -> List[Dict[str, any]]:
+    @staticmethod
+    def iter_pdf_pages(pdf_path: Path) -> Iterator[Dict[str, Any]]:
         """
-        Extract text from a PDF file with page numbers.
+        Extract text from a PDF file page by page.
+        
+        Each page's parsed layout is released before the next page is read,
+        so memory does not grow with the size of the PDF.
         
         Args:
             pdf_path: Path to the PDF file
-            
-        Returns:
-            List of dictionaries containing page text and metadata
+        
+        Yields:
+            Dictionaries containing page text and metadata
+        
+        Raises:
+            Exception: If the PDF cannot be read (a partial page list must
+                not be mistaken for the whole file)
         """
-        pages_data = []
+        page_count = 0
         
         try:
             with pdfplumber.open(pdf_path) as pdf:
                 for page_num, page in enumerate(pdf.pages, start=1):
                     text = page.extract_text()
+                    if hasattr(page, 'close'):
+                        page.close()
+                    else:
+                        page.flush_cache()
+                    
                     if text and text.strip():
-                        pages_data.append({
+                        page_count += 1
+                        yield {
                             'text': text.strip(),
                             'page_number': page_num,
                             'file_name': pdf_path.name
-                        })
-                        
-            logger.info(f"Extracted {len(pages_data)} pages from {pdf_path.name}")
+                        }
             
+            logger.info(f"Extracted {page_count} pages from {pdf_path.name}")
+        
         except Exception as e:
             logger.error(f"Error extracting text from {pdf_path}: {e}")
+            raise
+    
+    @staticmethod
+    def extract_text_from_pdf(pdf_path: Path) -> List[Dict[str, any]]:
+        """
+        Extract text from a PDF file with page numbers.
+        
+        Args:
+            pdf_path: Path to the PDF file
             
+        Returns:
+            List of dictionaries containing page text and metadata (the pages
+            read before an extraction error)
+        """
+        pages_data = []
+        try:
+            for page_data in NCERTProcessor.iter_pdf_pages(pdf_path):
+                pages_data.append(page_data)
+        except Exception:
+            pass  # already logged
         return pages_data
     
-    def parse_pdf_metadata(self, filename: str) -> Dict[str, str]:
+    @staticmethod
+    def parse_pdf_metadata(filename: str) -> Dict[str, str]:
         """
         Parse metadata from PDF filename.
         Expected format: Subject_Class_ChapterNumber.pdf
@@ -165,10 +221,14 @@ class NCERTProcessor:
         
         return metadata
     
-    def chunk_text(self, text: str, chunk_size: int = 500, overlap: int = 50) -> List[str]:
+    @staticmethod
+    def chunk_text(text: str, chunk_size: int = 500, overlap: int = 50) -> List[str]:
         """
         Split text into chunks of approximately chunk_size words with overlap.
         
+        Sentence word counts are memoized and reused for the overlap window;
+        the word counter is chosen by Config.INGEST_TOKENIZER.
+        
         Args:
             text: Text to chunk
             chunk_size: Target number of words per chunk
@@ -177,80 +237,90 @@ class NCERTProcessor:
         Returns:
             List of text chunks
         """
-        # Tokenize into sentences
-        sentences = sent_tokenize(text)
+        return chunk_sentences_text(text, chunk_size, overlap)
+    
+    def embed_documents(self, documents: List[str]) -> List[Optional[List[float]]]:
+        """
+        Generate embeddings for a list of documents with the collection's model.
         
-        chunks = []
-        current_chunk = []
-        current_word_count = 0
+        Embeddings are requested in batches; if a batch cannot be embedded at
+        all, its documents get None so ingestion continues without them (see
+        _drop_failed_embeddings).
         
-        for sentence in sentences:
-            words = word_tokenize(sentence)
-            word_count = len(words)
-            
-            # If adding this sentence exceeds chunk_size, save current chunk
-            if current_word_count + word_count > chunk_size and current_chunk:
-                chunks.append(' '.join(current_chunk))
-                
-                # Keep last few sentences for overlap
-                overlap_sentences = []
-                overlap_words = 0
-                for sent in reversed(current_chunk):
-                    sent_words = len(word_tokenize(sent))
-                    if overlap_words + sent_words <= overlap:
-                        overlap_sentences.insert(0, sent)
-                        overlap_words += sent_words
-                    else:
-                        break
-                
-                current_chunk = overlap_sentences
-                current_word_count = overlap_words
-            
-            current_chunk.append(sentence)
-            current_word_count += word_count
+        Args:
+            documents: Texts to embed
+        
+        Returns:
+            List of embeddings (None where embedding failed), one per document
+        """
+        if not documents:
+            return []
         
-        # Add the last chunk
-        if current_chunk:
-            chunks.append(' '.join(current_chunk))
+        try:
+            return self.embedder.embed(documents)
+        except Exception as e:
+            logger.error(f"Batch embedding failed: {e}")
+        
+        # Retry per request batch so one bad batch doesn't zero the whole file
+        from services.cloudflare_ai import EMBEDDING_BATCH_SIZE
         
-        return chunks
+        embeddings = []
+        for i in range(0, len(documents), EMBEDDING_BATCH_SIZE):
+            batch_docs = documents[i:i+EMBEDDING_BATCH_SIZE]
+            try:
+                embeddings.extend(self.embedder.embed(batch_docs))
+            except Exception as e:
+                logger.error(f"Embedding failed: {e}")
+                embeddings.extend([None] * len(batch_docs))
+        
+        return embeddings
     
-    def process_pdf(self, pdf_path: Path) -> int:
+    @staticmethod
+    def _drop_failed_embeddings(plan: Dict[str, Any], embeddings: List[Optional[List[float]]]) -> List[List[float]]:
         """
-        Process a single PDF file: extract text, chunk it, generate embeddings, and store.
+        Remove the chunks whose embedding failed from a batch plan.
+        
+        They are not stored (a placeholder vector under their content-hash ID
+        would never be replaced); plan['failed'] counts them so the file is
+        retried on the next run.
         
         Args:
-            pdf_path: Path to the PDF file
-            
+            plan: Batch plan from _split_batch (modified in place)
+            embeddings: Embeddings for plan['new_documents'], None where embedding failed
+        
         Returns:
-            Number of chunks processed
+            Embeddings for the remaining plan['new_documents']
         """
-        logger.info(f"Processing {pdf_path.name}...")
+        ok = [i for i, embedding in enumerate(embeddings) if embedding is not None]
+        plan['failed'] = plan.get('failed', 0) + len(embeddings) - len(ok)
+        if len(ok) < len(embeddings):
+            for key in ('new_documents', 'new_metadatas', 'new_ids'):
+                plan[key] = [plan[key][i] for i in ok]
+        return [embeddings[i] for i in ok]
+    
+    @staticmethod
+    def iter_pdf_chunks(pdf_path: Path) -> Iterator[Tuple[str, Dict[str, str], str]]:
+        """
+        Extract and chunk a PDF file lazily, one page at a time.
         
-        # Extract text from PDF
-        pages_data = self.extract_text_from_pdf(pdf_path)
+        Chunk IDs are content-hashed ({stem}_p{page}_{hash[:16]}), so an
+        unchanged chunk keeps its ID when the file is re-chunked.
         
-        if not pages_data:
-            logger.warning(f"No text extracted from {pdf_path.name}")
-            return 0
+        Args:
+            pdf_path: Path to the PDF file
         
+        Yields:
+            Tuples of (document, metadata, id), in document order
+        """
         # Parse metadata from filename
-        file_metadata = self.parse_pdf_metadata(pdf_path.name)
-        
-        # Process each page
-        total_chunks = 0
-        documents = []
-        metadatas = []
-        ids = []
+        file_metadata = NCERTProcessor.parse_pdf_metadata(pdf_path.name)
+        make_id = ChunkIdFactory(pdf_path.stem)
         
-        for page_data in pages_data:
+        for page_data in NCERTProcessor.iter_pdf_pages(pdf_path):
             # Chunk the page text
-            chunks = self.chunk_text(page_data['text'])
+            chunks = NCERTProcessor.chunk_text(page_data['text'])
             
             for chunk_idx, chunk in enumerate(chunks):
-                # Create unique ID
-                chunk_id = f"{pdf_path.stem}_p{page_data['page_number']}_c{chunk_idx}"
-                
                 # Create metadata
                 metadata = {
                     'subject': file_metadata['subject'],
@@ -258,52 +328,460 @@ class NCERTProcessor:
                     'chapter': file_metadata['chapter'],
                     'page_number': str(page_data['page_number']),
                     'file_name': pdf_path.name,
-                    'chunk_index': str(chunk_idx)
+                    'chunk_index': str(chunk_idx),
+                    'chunk_hash': hash_text(chunk)
                 }
                 
-                documents.append(chunk)
-                metadatas.append(metadata)
-                ids.append(chunk_id)
-                total_chunks += 1
+                yield chunk, metadata, make_id(metadata['page_number'], metadata['chunk_hash'])
+    
+    @staticmethod
+    def prepare_pdf_chunks(pdf_path: Path) -> Tuple[List[str], List[Dict[str, str]], List[str]]:
+        """
+        Extract and chunk a PDF file, without embedding or storing anything.
+        
+        Only uses static helpers, so it can run in a worker process.
+        
+        Args:
+            pdf_path: Path to the PDF file
+        
+        Returns:
+            Tuple of (documents, metadatas, ids)
+        """
+        documents = []
+        metadatas = []
+        ids = []
+        
+        for document, metadata, chunk_id in NCERTProcessor.iter_pdf_chunks(pdf_path):
+            documents.append(document)
+            metadatas.append(metadata)
+            ids.append(chunk_id)
+        
+        if not documents:
+            logger.warning(f"No text extracted from {pdf_path.name}")
         
-        # Generate embeddings and store in batches
-        batch_size = 100
+        return documents, metadatas, ids
+    
+    def store_chunks(
+        self,
+        documents: List[str],
+        metadatas: List[Dict[str, str]],
+        ids: List[str],
+        embeddings: List[List[float]],
+        batch_size: int = 100
+    ) -> None:
+        """
+        Upsert embedded chunks into the ChromaDB collection in batches.
+        
+        Args:
+            documents: Chunk texts
+            metadatas: Chunk metadata
+            ids: Chunk IDs
+            embeddings: Chunk embeddings
+            batch_size: Number of chunks per collection.upsert call
+        """
         for i in range(0, len(documents), batch_size):
             batch_docs = documents[i:i+batch_size]
-            batch_meta = metadatas[i:i+batch_size]
-            batch_ids = ids[i:i+batch_size]
-            
-            # Generate embeddings (Cloudflare or local)
-            if self.use_cloudflare:
-                embeddings = []
-                for doc in batch_docs:
-                    try:
-                        embedding = self.cloudflare_ai.generate_embeddings(doc)
-                        embeddings.append(embedding)
-                    except Exception as e:
-                        logger.error(f"Cloudflare embedding failed: {e}")
-                        # Use zero vector as fallback
-                        embeddings.append([0.0] * 768)
-            else:
-                embeddings = self.embedding_model.encode(batch_docs).tolist()
             
-            # Add to collection
-            self.collection.add(
+            # Add to collection (upsert so re-runs never fail on existing IDs)
+            self.collection.upsert(
                 documents=batch_docs,
-                metadatas=batch_meta,
-                ids=batch_ids,
-                embeddings=embeddings
+                metadatas=metadatas[i:i+batch_size],
+                ids=ids[i:i+batch_size],
+                embeddings=embeddings[i:i+batch_size]
             )
             
             logger.info(f"Stored batch {i//batch_size + 1} ({len(batch_docs)} chunks)")
+    
+    def _get_indexed_ids(self, file_name: str) -> List[str]:
+        """
+        Get the chunk IDs currently indexed for a file.
+        
+        Uses the manifest, or the collection itself for files indexed before
+        the manifest existed (legacy {stem}_p{page}_c{idx} IDs).
+        
+        Args:
+            file_name: PDF file name
+        
+        Returns:
+            List of chunk IDs
+        """
+        chunk_ids = self.manifest.get_chunk_ids(file_name)
+        if chunk_ids is not None:
+            return chunk_ids
+        
+        try:
+            return self.collection.get(where={'file_name': file_name}, include=[])['ids']
+        except Exception as e:
+            logger.warning(f"Could not look up indexed chunks for {file_name}: {e}")
+            return []
+    
+    def _indexed_state(self, file_name: str, full: bool = False) -> Tuple[List[str], Set[str], bool]:
+        """
+        Get the chunk IDs already indexed for a file and whether every chunk must be re-embedded.
+        
+        Args:
+            file_name: PDF file name
+            full: Re-embed every chunk, even if its ID is already indexed
+        
+        Returns:
+            Tuple of (indexed IDs in order, indexed ID set, full)
+        """
+        indexed_ids = self._get_indexed_ids(file_name)
+        
+        # Only chunks recorded in the manifest are known to carry embeddings
+        # from the current model; anything else is re-embedded
+        if self.manifest.get_chunk_ids(file_name) is None:
+            full = True
+        
+        return indexed_ids, set(indexed_ids), full
+    
+    @staticmethod
+    def _split_batch(
+        documents: List[str],
+        metadatas: List[Dict[str, str]],
+        ids: List[str],
+        indexed: Set[str],
+        full: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Split chunks into those that must be embedded and those that keep their embeddings.
+        
+        Args:
+            documents: Chunk texts
+            metadatas: Chunk metadata
+            ids: Content-hashed chunk IDs
+            indexed: IDs already indexed for the file
+            full: Re-embed every chunk
+        
+        Returns:
+            Batch plan for _store_batch
+        """
+        embed_idx = [i for i, chunk_id in enumerate(ids) if full or chunk_id not in indexed]
+        keep_idx = [i for i, chunk_id in enumerate(ids) if not full and chunk_id in indexed]
+        
+        return {
+            'new_documents': [documents[i] for i in embed_idx],
+            'new_metadatas': [metadatas[i] for i in embed_idx],
+            'new_ids': [ids[i] for i in embed_idx],
+            'kept_metadatas': [metadatas[i] for i in keep_idx],
+            'kept_ids': [ids[i] for i in keep_idx]
+        }
+    
+    def _plan_file_update(
+        self,
+        pdf_path: Path,
+        file_hash: str,
+        documents: List[str],
+        metadatas: List[Dict[str, str]],
+        ids: List[str],
+        full: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Work out which chunks of a changed file must be embedded, updated or deleted.
+        
+        Args:
+            pdf_path: Path to the PDF file
+            file_hash: SHA-256 of the file
+            documents: Chunk texts
+            metadatas: Chunk metadata
+            ids: Content-hashed chunk IDs
+            full: Re-embed every chunk, even if its ID is already indexed
+        
+        Returns:
+            Update plan for _apply_file_update
+        """
+        indexed_ids, indexed, full = self._indexed_state(pdf_path.name, full)
+        
+        plan = self._split_batch(documents, metadatas, ids, indexed, full)
+        plan.update({
+            'pdf_path': pdf_path,
+            'file_hash': file_hash,
+            'ids': ids,
+            'indexed_ids': indexed_ids
+        })
+        return plan
+    
+    def _store_batch(self, plan: Dict[str, Any], embeddings: List[List[float]], batch_size: int = 100) -> None:
+        """
+        Write one batch of chunks to ChromaDB and the BM25 index.
+        
+        Args:
+            plan: Batch plan from _split_batch (or a whole-file plan)
+            embeddings: Embeddings for plan['new_documents']
+            batch_size: Number of chunks per collection call
+        """
+        self.store_chunks(plan['new_documents'], plan['new_metadatas'], plan['new_ids'], embeddings, batch_size)
+        
+        # Unchanged chunks keep their embeddings; refresh position metadata only
+        kept_ids = plan['kept_ids']
+        for i in range(0, len(kept_ids), batch_size):
+            self.collection.update(
+                ids=kept_ids[i:i+batch_size],
+                metadatas=plan['kept_metadatas'][i:i+batch_size]
+            )
+        
+        self.sparse_index.add(plan['new_ids'], plan['new_documents'], plan['new_metadatas'])
+        self.sparse_index.update_metadata(kept_ids, plan['kept_metadatas'])
+        self._sparse_index_dirty = True
+    
+    def _finish_file(
+        self,
+        pdf_path: Path,
+        file_hash: str,
+        ids: List[str],
+        indexed_ids: List[str],
+        batch_size: int = 100
+    ) -> List[str]:
+        """
+        Delete a file's orphaned chunks and record the file in the manifest.
+        
+        Args:
+            pdf_path: Path to the PDF file
+            file_hash: SHA-256 of the file
+            ids: Chunk IDs now indexed for the file, in order
+            indexed_ids: Chunk IDs indexed for the file before this update
+            batch_size: Number of chunks per collection call
+        
+        Returns:
+            The deleted orphan IDs
+        """
+        current = set(ids)
+        orphan_ids = [chunk_id for chunk_id in indexed_ids if chunk_id not in current]
+        for i in range(0, len(orphan_ids), batch_size):
+            self.collection.delete(ids=orphan_ids[i:i+batch_size])
+        
+        self.sparse_index.remove(orphan_ids)
+        self._sparse_index_dirty = True
+        
+        self.manifest.set_file(pdf_path, file_hash, ids)
+        self.manifest.save()
+        return orphan_ids
+    
+    def _mark_incomplete(self, pdf_path: Path, indexed_ids: List[str], stored_ids: List[str], failed: int) -> None:
+        """
+        Record a file whose chunks could not all be embedded, for a retry on the next run.
+        
+        Orphans are not deleted and the file hash is not recorded.
+        
+        Args:
+            pdf_path: Path to the PDF file
+            indexed_ids: Chunk IDs indexed for the file before this update
+            stored_ids: Chunk IDs stored by this update
+            failed: Number of chunks left out
+        """
+        self.manifest.set_incomplete(pdf_path.name, list(dict.fromkeys(indexed_ids + stored_ids)))
+        self.manifest.save()
+        logger.warning(f"{pdf_path.name}: {failed} chunks could not be embedded, will retry on the next run")
+    
+    def _apply_file_update(self, plan: Dict[str, Any], embeddings: List[List[float]], batch_size: int = 100) -> int:
+        """
+        Write a file update to ChromaDB and record it in the manifest.
+        
+        Args:
+            plan: Plan from _plan_file_update
+            embeddings: Embeddings for plan['new_documents']
+            batch_size: Number of chunks per collection call
+        
+        Returns:
+            Number of chunks indexed for the file
+        """
+        pdf_path = plan['pdf_path']
+        
+        embeddings = self._drop_failed_embeddings(plan, embeddings)
+        self._store_batch(plan, embeddings, batch_size)
+        if plan['failed']:
+            self._mark_incomplete(pdf_path, plan['indexed_ids'], plan['new_ids'], plan['failed'])
+            return len(plan['ids']) - plan['failed']
+        
+        orphan_ids = self._finish_file(pdf_path, plan['file_hash'], plan['ids'], plan['indexed_ids'], batch_size)
+        
+        logger.info(
+            f"{pdf_path.name}: {len(plan['new_ids'])} embedded, {len(plan['kept_ids'])} reused, "
+            f"{len(orphan_ids)} orphans deleted"
+        )
+        return len(plan['ids'])
+    
+    def _changed_hash(self, pdf_path: Path, full: bool = False) -> Optional[str]:
+        """
+        Get the SHA-256 of a PDF that needs re-indexing.
+        
+        Args:
+            pdf_path: Path to the PDF file
+            full: Treat every file as changed
+        
+        Returns:
+            The file's SHA-256 if it must be indexed, or None if it is unchanged
+        """
+        if full:
+            return hash_file(pdf_path)
+        return self.manifest.changed_hash(pdf_path)
+    
+    def _index_pdf(self, pdf_path: Path, file_hash: str, full: bool = False) -> int:
+        """
+        Extract, chunk, embed and store a changed PDF file as a streaming pipeline.
+        
+        Stages run concurrently and hand over batches of INGEST_BATCH_SIZE
+        chunks through bounded queues:
+        extract + chunk (thread) -> embed (thread) -> store (this thread).
+        At most a few batches are in memory at once, whatever the PDF size.
+        
+        Args:
+            pdf_path: Path to the PDF file
+            file_hash: SHA-256 of the file
+            full: Re-embed every chunk
+        
+        Returns:
+            Number of chunks indexed for the file
+        """
+        indexed_ids, indexed, full = self._indexed_state(pdf_path.name, full)
+        queue_size = Config.INGEST_QUEUE_SIZE
+        
+        def plan_and_embed(batches):
+            for batch in batches:
+                documents, metadatas, ids = (list(column) for column in zip(*batch))
+                plan = self._split_batch(documents, metadatas, ids, indexed, full)
+                plan['ids'] = ids
+                
+                # Only new or changed chunks are embedded (batched, concurrent requests)
+                embeddings = self.embed_documents(plan['new_documents'])
+                yield plan, self._drop_failed_embeddings(plan, embeddings)
+        
+        chunk_batches = prefetch(
+            batched(self.iter_pdf_chunks(pdf_path), Config.INGEST_BATCH_SIZE),
+            maxsize=queue_size,
+            name='ncert-chunker'
+        )
+        embedded_batches = prefetch(plan_and_embed(chunk_batches), maxsize=queue_size, name='ncert-embedder')
+        
+        ids: List[str] = []
+        stored_new_ids: List[str] = []
+        num_embedded = 0
+        num_reused = 0
+        num_failed = 0
+        
+        try:
+            for plan, embeddings in embedded_batches:
+                self._store_batch(plan, embeddings)
+                ids.extend(plan['ids'])
+                stored_new_ids.extend(chunk_id for chunk_id in plan['new_ids'] if chunk_id not in indexed)
+                num_embedded += len(plan['new_ids'])
+                num_reused += len(plan['kept_ids'])
+                num_failed += plan['failed']
+        except Exception:
+            # Don't leave chunks behind that no manifest entry accounts for
+            if stored_new_ids:
+                for i in range(0, len(stored_new_ids), 100):
+                    self.collection.delete(ids=stored_new_ids[i:i+100])
+                self.sparse_index.remove(stored_new_ids)
+            raise
+        
+        if not ids:
+            logger.warning(f"No text extracted from {pdf_path.name}")
+            return 0
+        
+        if num_failed:
+            self._mark_incomplete(pdf_path, indexed_ids, stored_new_ids, num_failed)
+            return len(ids) - num_failed
+        
+        orphan_ids = self._finish_file(pdf_path, file_hash, ids, indexed_ids)
+        
+        logger.info(
+            f"{pdf_path.name}: {num_embedded} embedded, {num_reused} reused, "
+            f"{len(orphan_ids)} orphans deleted"
+        )
+        return len(ids)
+    
+    def save_sparse_index(self) -> None:
+        """Persist the BM25 index if it changed since it was last saved."""
+        if self._sparse_index_dirty:
+            self.sparse_index.save()
+            self._sparse_index_dirty = False
+            self._partitions_dirty = True
+    
+    def sync_partitions(self) -> None:
+        """Bring the per-(subject, class) partition collections up to date if the collection changed."""
+        if not Config.VECTOR_PARTITIONS_ENABLED or not self._partitions_dirty:
+            return
+        
+        try:
+            counts = sync_partition_collections(self.chroma_client, self.collection, self.vector_store_path)
+            self._partitions_dirty = False
+            logger.info(f"Synced {len(counts)} subject/class partitions")
+        except Exception as e:
+            logger.error(f"Failed to sync partitions: {e}")
+    
+    def process_pdf(self, pdf_path: Path, full: bool = False) -> int:
+        """
+        Process a single PDF file: extract text, chunk it, generate embeddings, and store.
+        
+        Unchanged files are skipped, and only new or changed chunks are embedded.
+        
+        Args:
+            pdf_path: Path to the PDF file
+            full: Re-index and re-embed the file even if it is unchanged
+        
+        Returns:
+            Number of chunks processed
+        """
+        total_chunks = self._process_pdf(pdf_path, full)
+        self.save_sparse_index()
+        self.sync_partitions()
+        return total_chunks
+    
+    def _process_pdf(self, pdf_path: Path, full: bool = False) -> int:
+        """
+        Process a single PDF file without persisting the BM25 index.
+        
+        Args:
+            pdf_path: Path to the PDF file
+            full: Re-index and re-embed the file even if it is unchanged
+        
+        Returns:
+            Number of chunks processed
+        """
+        file_hash = self._changed_hash(pdf_path, full)
+        if file_hash is None:
+            total_chunks = len(self.manifest.get_chunk_ids(pdf_path.name) or [])
+            logger.info(f"Skipping unchanged {pdf_path.name} ({total_chunks} chunks)")
+            return total_chunks
+        
+        logger.info(f"Processing {pdf_path.name}...")
+        
+        total_chunks = self._index_pdf(pdf_path, file_hash, full)
         
         logger.info(f"Completed processing {pdf_path.name}: {total_chunks} chunks created")
         return total_chunks
     
-    def process_all_pdfs(self) -> Dict[str, int]:
+    def _remove_deleted_pdfs(self, pdf_files: List[Path]) -> None:
+        """
+        Delete chunks of PDFs that are in the manifest but no longer on disk.
+        
+        Args:
+            pdf_files: PDF files currently in the directory
+        """
+        present = {pdf_path.name for pdf_path in pdf_files}
+        
+        for file_name in [name for name in self.manifest.files if name not in present]:
+            chunk_ids = self.manifest.remove_file(file_name) or []
+            for i in range(0, len(chunk_ids), 100):
+                self.collection.delete(ids=chunk_ids[i:i+100])
+            self.sparse_index.remove(chunk_ids)
+            self._sparse_index_dirty = True
+            logger.info(f"Removed {len(chunk_ids)} chunks of deleted file {file_name}")
+            self.manifest.save()
+    
+    def process_all_pdfs(self, workers: int = 1, full: bool = False) -> Dict[str, int]:
         """
         Process all PDF files in the configured directory.
         
+        Re-indexing is incremental: unchanged files are skipped, only new or
+        changed chunks are embedded, and chunks of deleted files are removed.
+        
+        Args:
+            workers: Number of processes for PDF extraction and chunking
+                (1 processes files one at a time in this process)
+            full: Re-index and re-embed every file
+        
         Returns:
             Dictionary mapping filenames to number of chunks processed
         """
@@ -319,14 +797,23 @@ class NCERTProcessor:
         
         logger.info(f"Found {len(pdf_files)} PDF files to process")
         
-        results = {}
-        for pdf_path in pdf_files:
-            try:
-                chunk_count = self.process_pdf(pdf_path)
-                results[pdf_path.name] = chunk_count
-            except Exception as e:
-                logger.error(f"Failed to process {pdf_path.name}: {e}")
-                results[pdf_path.name] = 0
+        self._remove_deleted_pdfs(pdf_files)
+        
+        if workers > 1 and len(pdf_files) > 1:
+            results = self._process_pdfs_parallel(pdf_files, workers, full)
+        else:
+            results = {}
+            for file_num, pdf_path in enumerate(pdf_files, start=1):
+                try:
+                    chunk_count = self._process_pdf(pdf_path, full)
+                    results[pdf_path.name] = chunk_count
+                except Exception as e:
+                    logger.error(f"Failed to process {pdf_path.name}: {e}")
+                    results[pdf_path.name] = 0
+                logger.info(f"[{file_num}/{len(pdf_files)}] {pdf_path.name}: {results[pdf_path.name]} chunks")
+        
+        self.save_sparse_index()
+        self.sync_partitions()
         
         # Summary
         total_chunks = sum(results.values())
@@ -334,6 +821,120 @@ class NCERTProcessor:
         
         return results
     
+    def _process_pdfs_parallel(self, pdf_files: List[Path], workers: int, full: bool = False) -> Dict[str, int]:
+        """
+        Process PDF files with a pool of extraction processes and a single writer.
+        
+        Unchanged files are skipped up front. Worker processes extract and
+        chunk the changed PDFs. As each file is ready its new chunks are
+        embedded here (Cloudflare requests are batched and concurrent), then
+        handed to one writer thread, which is the only code that writes to
+        ChromaDB and the manifest. The writer queue is bounded so extraction
+        cannot run far ahead of storage.
+        
+        Args:
+            pdf_files: PDF files to process
+            workers: Number of extraction processes
+            full: Re-index and re-embed every file
+        
+        Returns:
+            Dictionary mapping filenames to number of chunks processed
+        """
+        # Keep the same keys and order as sequential processing
+        results = {pdf_path.name: 0 for pdf_path in pdf_files}
+        total_files = len(pdf_files)
+        completed = [0]
+        results_lock = threading.Lock()
+        write_queue = queue.Queue(maxsize=max(2, workers))
+        
+        def record(file_name: str, chunk_count: int) -> None:
+            with results_lock:
+                results[file_name] = chunk_count
+                completed[0] += 1
+                logger.info(f"[{completed[0]}/{total_files}] {file_name}: {chunk_count} chunks")
+        
+        # Skip unchanged files before starting any workers
+        changed_files = {}
+        for pdf_path in pdf_files:
+            try:
+                file_hash = self._changed_hash(pdf_path, full)
+            except Exception as e:
+                logger.error(f"Failed to hash {pdf_path.name}: {e}")
+                record(pdf_path.name, 0)
+                continue
+            
+            if file_hash is None:
+                record(pdf_path.name, len(self.manifest.get_chunk_ids(pdf_path.name) or []))
+            else:
+                changed_files[pdf_path] = file_hash
+        
+        if not changed_files:
+            logger.info("All files are up to date")
+            return results
+        
+        def writer() -> None:
+            while True:
+                item = write_queue.get()
+                try:
+                    if item is None:
+                        return
+                    plan, embeddings = item
+                    file_name = plan['pdf_path'].name
+                    try:
+                        record(file_name, self._apply_file_update(plan, embeddings))
+                    except Exception as e:
+                        logger.error(f"Failed to store {file_name}: {e}")
+                        record(file_name, 0)
+                finally:
+                    write_queue.task_done()
+        
+        writer_thread = threading.Thread(target=writer, name='ncert-writer', daemon=True)
+        writer_thread.start()
+        
+        logger.info(
+            f"Processing {len(changed_files)} changed files with {workers} extraction workers "
+            f"and a single writer"
+        )
+        start_time = time.time()
+        
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {
+                    executor.submit(NCERTProcessor.prepare_pdf_chunks, pdf_path): pdf_path
+                    for pdf_path in changed_files
+                }
+                
+                for future in as_completed(futures):
+                    pdf_path = futures[future]
+                    try:
+                        documents, metadatas, ids = future.result()
+                    except Exception as e:
+                        logger.error(f"Failed to process {pdf_path.name}: {e}")
+                        record(pdf_path.name, 0)
+                        continue
+                    
+                    if not documents:
+                        record(pdf_path.name, 0)
+                        continue
+                    
+                    try:
+                        plan = self._plan_file_update(
+                            pdf_path, changed_files[pdf_path], documents, metadatas, ids, full
+                        )
+                        embeddings = self.embed_documents(plan['new_documents'])
+                    except Exception as e:
+                        logger.error(f"Failed to embed {pdf_path.name}: {e}")
+                        record(pdf_path.name, 0)
+                        continue
+                    
+                    write_queue.put((plan, embeddings))
+        finally:
+            write_queue.put(None)
+            writer_thread.join()
+        
+        logger.info(f"Parallel processing finished in {time.time() - start_time:.1f}s")
+        return results
+    
     def query_vector_store(self, query: str, top_k: int = 5) -> Dict:
         """
         Query the vector store for relevant content.
@@ -345,11 +946,8 @@ class NCERTProcessor:
         Returns:
             Dictionary containing results with documents, metadata, and distances
         """
-        # Generate query embedding (Cloudflare or local)
-        if self.use_cloudflare:
-            query_embedding = [self.cloudflare_ai.generate_embeddings(query)]
-        else:
-            query_embedding = self.embedding_model.encode([query]).tolist()
+        # Generate query embedding with the collection's model
+        query_embedding = [self.embedder.embed_one(query)]
         
         # Query the collection
         results = self.collection.query(
@@ -379,6 +977,20 @@ def main():
     """
     Main function to run the NCERT processing pipeline.
     """
+    parser = argparse.ArgumentParser(description='Index NCERT PDFs into the vector store')
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='Number of processes for PDF extraction and chunking (default: 1)'
+    )
+    parser.add_argument(
+        '--full',
+        action='store_true',
+        help='Re-index and re-embed every PDF instead of only changed ones'
+    )
+    args = parser.parse_args()
+    
     # Configuration
     pdf_dir = Config.NCERT_PDF_DIR
     vector_store_dir = Config.VECTOR_STORE_DIR
@@ -387,7 +999,7 @@ def main():
     processor = NCERTProcessor(pdf_dir, vector_store_dir)
     
     # Process all PDFs
-    results = processor.process_all_pdfs()
+    results = processor.process_all_pdfs(workers=max(1, args.workers), full=args.full)
     
     # Display results
     print("\n" + "="*50)
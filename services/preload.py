@@ -0,0 +1,276 @@
+"""
+Preloaded Assets for Multi-Worker Serving
+
+Lets a pre-forking server (gunicorn with preload_app, see gunicorn.conf.py)
+load the large read-only serving assets once in the master process, so
+every worker shares the same pages copy-on-write instead of loading its
+own copy.
+
+Features:
+- Process-wide registry of read-only assets (shared_asset), keyed by file
+  path and reloaded when the file changes; the RAG systems of the query and
+  search routes also share one copy inside a worker
+- preload_assets (master, before fork): local embedding model weights, the
+  memory-mapped flat vector index, the BM25 index, the diagram database
+  schema upkeep (the only write, so workers open it read-only), the diagram
+  service and every chapter's diagram list (services.diagram_repository);
+  the chapter catalogs are module constants and come with the app import
+- reinit_after_fork (worker): recreates every per-process handle (SQLAlchemy
+  connection pools, the Cloudflare HTTP session, the query stage pools,
+  single-flight groups, locks); ChromaDB clients are only ever opened in
+  workers
+- gc.freeze() after preloading, so garbage collection in the workers does not
+  touch (and copy) the shared objects
+
+What is deliberately not preloaded:
+- ChromaDB clients (SQLite connections and background threads do not
+  survive a fork), so RAGSystem itself is still built lazily per worker
+- ONNX Runtime sessions (not fork-safe); with an ONNX backend each worker
+  loads its own session
+- The llama.cpp model: llama.cpp memory-maps GGUF weights, so worker
+  copies already share the page cache
+
+Usage:
+    gunicorn -c gunicorn.conf.py app:app
+    python -m services.preload       # Preload in this process and report
+"""
+
+import gc
+import os
+import json
+import time
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple, TypeVar
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# (kind, path) -> (file stamp, asset)
+_assets: Dict[Tuple[str, str], Tuple[Any, Any]] = {}
+_assets_lock = threading.Lock()
+
+
+def _file_stamp(path: Path) -> Optional[Tuple[float, int]]:
+    """Modification time and size of a file (None if it does not exist)."""
+    try:
+        stat = Path(path).stat()
+        return stat.st_mtime, stat.st_size
+    except OSError:
+        return None
+
+
+def shared_asset(kind: str, path: Path, loader: Callable[[], Optional[T]], stamp_path: Optional[Path] = None) -> Optional[T]:
+    """
+    Get a read-only asset loaded from a file, loading it once per process.
+    
+    Assets loaded in the master before fork are inherited by every worker.
+    The asset is reloaded when the file's modification time or size changes.
+    Callers must not modify the returned object. Assets may define an
+    after_fork() method, called in new workers by reinit_after_fork.
+    
+    Args:
+        kind: Asset kind (e.g. 'sparse_index')
+        path: File or directory the asset is loaded from
+        loader: Loads the asset (returning None means "not available")
+        stamp_path: File whose changes invalidate the asset (default: path)
+    
+    Returns:
+        The asset, or None if the loader returned None
+    """
+    key = (kind, str(Path(path).resolve()))
+    stamp = _file_stamp(stamp_path or path)
+    
+    with _assets_lock:
+        cached = _assets.get(key)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        
+        asset = loader()
+        if asset is not None and stamp is not None:
+            _assets[key] = (stamp, asset)
+        else:
+            _assets.pop(key, None)
+        return asset
+
+
+def shared_asset_count() -> int:
+    """Number of assets in the registry."""
+    return len(_assets)
+
+
+def _preload_embedding_model(alias: str) -> Optional[str]:
+    """Load the local embedding model of the serving collection (no inference)."""
+    from services.embedding_collections import CollectionAliases, Embedder, default_embedding_model_id
+    
+    entry = CollectionAliases(Config.CHROMA_DB_PATH).get(alias)
+    model_id = entry['embedding_model'] if entry else default_embedding_model_id()
+    
+    embedder = Embedder(model_id)
+    if embedder.backend != 'local':
+        return None
+    if Config.LOCAL_EMBEDDING_BACKEND != 'torch':
+        logger.info("ONNX Runtime sessions are not fork-safe; each worker loads its own embedding model")
+        return None
+    
+    # Loading the weights is enough; running inference here would start
+    # thread pools that the forked workers cannot use
+    dimension = embedder.dimension
+    logger.info(f"Loaded embedding model {model_id} ({dimension}d) for the workers to share")
+    return model_id
+
+
+def _preload_flat_index(collection_name: str) -> Optional[int]:
+    """Open the memory-mapped flat vector index and fault its pages in."""
+    from services.vector_backends import flat_index_dir_for, open_flat_index
+    
+    backend = open_flat_index(flat_index_dir_for(collection_name), Config.VECTOR_RESCORE_FACTOR)
+    if backend.collection_name and backend.collection_name != collection_name:
+        logger.warning(
+            f"Flat index was exported from '{backend.collection_name}', not '{collection_name}'; not preloading it"
+        )
+        return None
+    
+    # Read the matrices once so the page cache holds them before workers start
+    for matrix in (backend.embeddings, backend.coarse):
+        if matrix is not None and len(matrix):
+            float(matrix[:, 0].sum())
+    return backend.count()
+
+
+def _preload_sparse_index(collection_name: str) -> Optional[int]:
+    """Load the BM25 index of the serving collection."""
+    from services.sparse_index import BM25Index, index_path_for
+    
+    index = BM25Index.load_shared(index_path_for(Config.CHROMA_DB_PATH, collection_name))
+    return len(index) if index is not None else None
+
+
+def _prepare_diagram_database() -> bool:
+    """Bring the diagram database schema up to date once, before any worker opens it."""
+    from services.diagram_repository import prepare_diagram_database_file
+    
+    return prepare_diagram_database_file()
+
+
+def _preload_diagram_service() -> bool:
+    """Create the diagram display service (opens the shared diagram repository)."""
+    from routes import diagram_routes
+    
+    if diagram_routes.diagram_service is None:
+        diagram_routes.init_diagram_service()
+    return diagram_routes.diagram_service is not None
+
+
+def _preload_diagram_metadata() -> int:
+    """Load every chapter's diagram list into the diagram repository's chapter cache."""
+    from services.diagram_repository import get_diagram_repository
+    
+    repository = get_diagram_repository()
+    count = repository.load_chapter_cache()
+    # No connection may be inherited by the workers
+    repository.engine.dispose()
+    return count
+
+
+def preload_assets() -> Dict[str, Any]:
+    """
+    Load the read-only serving assets in this process.
+    
+    Call this in the master process after the app is imported and before
+    workers are forked. Failures are logged and skipped (the workers then
+    load the asset lazily, as without preloading).
+    
+    Returns:
+        Dictionary with what was preloaded and how long it took
+    """
+    from services.embedding_collections import resolve_collection_name
+    
+    start = time.perf_counter()
+    alias = Config.CHROMA_COLLECTION_NAME
+    collection_name = resolve_collection_name(Config.CHROMA_DB_PATH, alias)
+    summary: Dict[str, Any] = {'collection': collection_name}
+    
+    steps = [('embedding_model', lambda: _preload_embedding_model(alias))]
+    if Config.VECTOR_BACKEND == 'flat':
+        steps.append(('flat_index_rows', lambda: _preload_flat_index(collection_name)))
+    if Config.RAG_RETRIEVAL_MODE == 'hybrid':
+        steps.append(('sparse_index_chunks', lambda: _preload_sparse_index(collection_name)))
+    steps.append(('diagram_caption_index', _prepare_diagram_database))
+    steps.append(('diagram_service', _preload_diagram_service))
+    steps.append(('diagram_chapters', _preload_diagram_metadata))
+    
+    for name, step in steps:
+        step_start = time.perf_counter()
+        try:
+            summary[name] = step()
+            logger.info(f"Preloaded {name} in {(time.perf_counter() - step_start) * 1000:.0f} ms")
+        except Exception as e:
+            summary[name] = None
+            logger.error(f"Could not preload {name}: {e}")
+    
+    # Keep the collector away from the inherited objects (otherwise it
+    # writes to their headers and every worker ends up with a private copy)
+    gc.collect()
+    gc.freeze()
+    
+    summary['shared_assets'] = shared_asset_count()
+    summary['seconds'] = round(time.perf_counter() - start, 3)
+    logger.info(f"Preloaded serving assets in {summary['seconds']}s: {summary}")
+    return summary
+
+
+def reinit_after_fork() -> None:
+    """
+    Recreate per-process handles in a freshly forked worker.
+    
+    Connections inherited from the master are dropped without being closed
+    (closing them would also close the master's sockets and files), and
+    locks that might have been held while forking are replaced.
+    """
+    global _assets_lock
+    _assets_lock = threading.Lock()
+    for _, asset in _assets.values():
+        after_fork = getattr(asset, 'after_fork', None)
+        if after_fork is not None:
+            after_fork()
+    
+    from services import embedding_collections
+    embedding_collections._local_models_lock = threading.Lock()
+    
+    from models import database
+    if database.engine is not None:
+        database.engine.dispose(close=False)
+    
+    from services.diagram_repository import reset_diagram_repositories_after_fork
+    reset_diagram_repositories_after_fork()
+    
+    from services.cloudflare_ai import reset_http_session_after_fork
+    reset_http_session_after_fork()
+    
+    from services.query_pipeline import reset_stage_executor_after_fork
+    reset_stage_executor_after_fork()
+    
+    from services.single_flight import reset_single_flights_after_fork
+    reset_single_flights_after_fork()
+    
+    logger.info(f"Worker {os.getpid()} reinitialized after fork ({shared_asset_count()} shared assets)")
+
+
+def main():
+    """Command-line entry point."""
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Preload the read-only serving assets and report')
+    parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    print(json.dumps(preload_assets(), indent=2, default=str))
+
+
+if __name__ == '__main__':
+    main()
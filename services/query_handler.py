@@ -11,6 +11,8 @@ Features:
 - Response formatting with references
 - Error handling for failed retrievals
 - Quiz generation for adaptive learning
+- Combined mode: explanation and quiz from one structured generation
+- Semantic response cache for near-identical questions
 
 Requirements: 1.1, 1.2, 1.3, 1.4
 """
@@ -18,12 +20,17 @@ Requirements: 1.1, 1.2, 1.3, 1.4
 import logging
 import json
 import re
-from typing import Dict, List, Optional, Any
-from pathlib import Path
+import time
+from typing import Dict, Iterator, List, Optional, Any, Tuple
 
 from services.rag_system import RAGSystem
 from services.model_manager import ModelManager
-from services.cloudflare_ai import get_cloudflare_ai, is_cloudflare_ai_enabled
+from services.cloudflare_ai import get_cloudflare_ai, is_cloudflare_ai_enabled, run_on_async_client
+from services.response_cache import SemanticResponseCache, make_scope, query_numbers
+from services.diagram_repository import get_diagram_repository
+from services.query_pipeline import GENERATION_POOL, StageError, StageGraph, get_stage_pool, get_stage_pool_stats, run_blocking
+from services.single_flight import get_single_flight_stats
+from services.structured_answer import ANSWER_SCHEMA, StructuredAnswerParser, envelope_instructions, parse_structured_answer
 from config import Config
 
 # Setup logging
@@ -67,9 +74,18 @@ class QueryHandler:
         self.problem_solver = problem_solver  # Groq for problem-solving
         
         # Initialize diagram retrieval
-        self.diagram_db_path = diagram_db_path or (Path(__file__).parent.parent / 'diagrams.db')
+        self.diagram_db_path = diagram_db_path or Config.DIAGRAM_DB_PATH
         self._init_diagram_retrieval()
         
+        # Semantic response cache (skips retrieval and LLM calls for near-identical questions)
+        self.response_cache = None
+        if Config.RESPONSE_CACHE_ENABLED:
+            self.response_cache = SemanticResponseCache(
+                similarity_threshold=Config.RESPONSE_CACHE_SIMILARITY_THRESHOLD,
+                max_size=Config.RESPONSE_CACHE_MAX_SIZE,
+                ttl=Config.RESPONSE_CACHE_TTL
+            )
+        
         if self.problem_solver:
             logger.info("QueryHandler initialized with hybrid AI (Groq for problems, Cloudflare for chat)")
         else:
@@ -78,20 +94,12 @@ class QueryHandler:
     def _init_diagram_retrieval(self):
         """Initialize diagram retrieval system."""
         try:
-            from sqlalchemy import create_engine
-            from sqlalchemy.orm import sessionmaker
-            from services.diagram_processor_final import DiagramPage
-            
-            self.diagram_engine = create_engine(f'sqlite:///{self.diagram_db_path}')
-            Session = sessionmaker(bind=self.diagram_engine)
-            self.diagram_session = Session()
-            self.DiagramPage = DiagramPage
-            
+            # Shared, thread-safe read-only access (one engine per process)
+            self.diagrams = get_diagram_repository(self.diagram_db_path)
             logger.info(f"Diagram retrieval initialized with database: {self.diagram_db_path}")
         except Exception as e:
             logger.warning(f"Could not initialize diagram retrieval: {e}")
-            self.diagram_session = None
-            self.DiagramPage = None
+            self.diagrams = None
     
     def _is_problem_solving_query(self, query: str) -> bool:
         """
@@ -134,6 +142,14 @@ class QueryHandler:
         Process a user query and generate a complete response.
         Routes to Groq for problem-solving, Cloudflare for general queries.
         
+        Blocking work runs on the query stage executor with per-stage
+        timeouts. After retrieval, diagram lookup, answer generation and quiz
+        generation run as a stage graph (services.query_pipeline): the
+        diagrams overlap the answer whenever the model's prompt does not list
+        them, and the quiz is generated from the retrieved context alongside
+        the answer (Config.QUIZ_FROM_CONTEXT) unless it has to share a local
+        model with it.
+        
         Args:
             query: User's question
             user_id: Optional user identifier for personalization
@@ -152,37 +168,51 @@ class QueryHandler:
         try:
             logger.info(f"Processing query: {query[:100]}...")
             
-            # Detect if this is a problem-solving query
-            is_problem = self._is_problem_solving_query(query)
+            # Answer obviously off-topic requests before paying for embedding and retrieval
+            prescreened = self.rag.prescreen_query(query)
+            if prescreened is not None:
+                return self._format_out_of_scope_response(prescreened)
             
-            # Choose appropriate model
-            if is_problem and self.problem_solver:
-                logger.info("🧮 Detected problem-solving query → Using Groq 70B")
-                selected_model = self.problem_solver
-            else:
-                logger.info("💬 General query → Using Cloudflare AI")
-                selected_model = self.llm
+            # Detect if this is a problem-solving query and choose the model
+            is_problem, selected_model = self._select_model(query)
             
-            # Step 1: Retrieve relevant NCERT context
-            context_data = self.rag.get_context_for_llm(
-                query,
+            # Step 0: Serve near-identical questions from the semantic response cache
+            cache_scope = make_scope(
+                self._get_model_name(selected_model),
+                filters=None,
                 top_k=Config.RAG_TOP_K,
-                include_references=True
+                include_quiz=include_quiz,
+                include_diagrams=include_diagrams,
+                numbers=query_numbers(query)
             )
+            try:
+                query_embedding = await run_blocking(
+                    'query_embedding', self._lookup_embedding, query, timeout=Config.QUERY_RETRIEVAL_TIMEOUT
+                )
+            except StageError as e:
+                # The lookup only serves the response cache: treat it as a miss
+                logger.warning(f"{e}; skipping the response cache")
+                query_embedding = None
+            cached_response = self._get_cached_response(query_embedding, cache_scope)
+            if cached_response is not None:
+                return cached_response
+            
+            # Step 1: Retrieve relevant NCERT context
+            retrieval_start = time.perf_counter()
+            context_data = await run_blocking(
+                'retrieval', self._retrieve_context, query, timeout=Config.QUERY_RETRIEVAL_TIMEOUT
+            )
+            retrieval_ms = round((time.perf_counter() - retrieval_start) * 1000, 1)
             
             # Check if query is out of scope
             if context_data.get('out_of_scope'):
                 return self._format_out_of_scope_response(context_data)
             
-            # Step 2: Find relevant diagrams
-            diagrams = []
-            if include_diagrams:
-                diagrams = self._retrieve_diagrams(query, context_data)
-            
-            # Step 3: Generate response using selected model
-            explanation = self._generate_response(
-                query, context_data, diagrams, model=selected_model
-            )
+            # Steps 2-4: diagrams, explanation and quiz, concurrently where independent
+            graph = self._build_answer_graph(query, selected_model, include_quiz, include_diagrams)
+            results = await graph.run(initial={'context_data': context_data})
+            diagrams = results['diagrams']
+            explanation = results['explanation']
             
             # Check for generation errors
             if not explanation.get('success'):
@@ -191,45 +221,488 @@ class QueryHandler:
                     explanation.get('error')
                 )
             
-            # Step 4: Generate quiz questions
             quiz = None
             if include_quiz:
-                logger.info("Generating quiz questions...")
-                quiz = self._generate_quiz(query, explanation['text'], context_data)
+                quiz = results['quiz']
                 if quiz:
                     logger.info(f"Quiz generated with {len(quiz.get('questions', []))} questions")
                 else:
                     logger.warning("Quiz generation returned None")
             
             # Step 5: Format complete response
-            response = {
-                'success': True,
-                'explanation': explanation['text'],
-                'diagrams': diagrams,
-                'quiz': quiz,
-                'references': context_data.get('references', []),
-                'metadata': {
-                    'multi_chapter': context_data.get('multi_chapter', False),
-                    'num_sources': context_data.get('num_results', 0),
-                    'relevance_score': context_data.get('top_relevance_score', 0.0),
-                    'tokens_used': explanation.get('tokens_used', 0),
-                    'model_used': 'Groq 70B' if (is_problem and self.problem_solver) else 'Cloudflare AI'
-                }
-            }
+            response = self._build_response(
+                explanation['text'], diagrams, quiz, context_data,
+                tokens_used=explanation.get('tokens_used', 0),
+                is_problem=is_problem
+            )
+            response['metadata']['stage_timings_ms'] = {'retrieval': retrieval_ms, **graph.timings}
+            
+            # Remember the answer for near-identical follow-up questions
+            if self.response_cache is not None and query_embedding is not None:
+                self.response_cache.store(query_embedding, cache_scope, response, query=query)
             
             logger.info(f"Query processed successfully (tokens: {explanation.get('tokens_used', 0)})")
             return response
             
+        except StageError as e:
+            logger.error(f"Error processing query: {e}")
+            return self._format_error_response("Query processing failed", str(e))
         except Exception as e:
             logger.error(f"Error processing query: {e}", exc_info=True)
             return self._format_error_response("Query processing failed", str(e))
     
+    def _retrieve_context(self, query: str) -> Dict[str, Any]:
+        """
+        Retrieve the NCERT context of a query.
+        
+        Args:
+            query: User's question
+        
+        Returns:
+            Context data from RAGSystem.get_context_for_llm
+        """
+        return self.rag.get_context_for_llm(
+            query,
+            top_k=Config.RAG_TOP_K,
+            include_references=True
+        )
+    
+    def _build_answer_graph(
+        self,
+        query: str,
+        model: Any,
+        include_quiz: bool,
+        include_diagrams: bool
+    ) -> StageGraph:
+        """
+        Build the stages that follow retrieval (all depend on 'context_data').
+        
+        - diagrams: optional, falls back to no diagrams on error or timeout
+        - explanation: required; waits for the diagrams only if the model's
+          prompt lists them (generate-style models, not chat_with_context)
+        - quiz: optional; from the retrieved context, concurrently with the
+          explanation, if QUIZ_FROM_CONTEXT is set and the quiz does not run
+          on the same local model as the explanation (through the async
+          Cloudflare client when it is enabled), otherwise from the
+          explanation once it is done
+        
+        In combined mode (STRUCTURED_ANSWER) the explanation stage generates
+        the quiz too; the quiz stage only generates one separately if the
+        model's answer had no usable quiz.
+        
+        Args:
+            query: User's question
+            model: Model generating the explanation
+            include_quiz: Whether to generate quiz questions
+            include_diagrams: Whether to retrieve relevant diagrams
+        
+        Returns:
+            Stage graph, to be run with initial={'context_data': ...}
+        """
+        graph = StageGraph()
+        
+        def find_diagrams(context_data):
+            return self._retrieve_diagrams(query, context_data) if include_diagrams else []
+        
+        graph.add('diagrams', find_diagrams, depends_on=['context_data'],
+                  timeout=Config.QUERY_DIAGRAM_TIMEOUT, fallback=[])
+        
+        quiz_questions = self._structured_quiz_questions(include_quiz)
+        
+        def explain(context_data, diagrams=()):
+            result = self._generate_response(query, context_data, list(diagrams), model=model,
+                                             quiz_questions=quiz_questions)
+            if quiz_questions and result.get('success'):
+                result['text'], result['quiz'] = parse_structured_answer(result['text'])
+                if not result['text']:
+                    result.update(success=False, error='Empty explanation in structured answer')
+            return result
+        
+        prompt_uses_diagrams = bool(quiz_questions) or not hasattr(model, 'chat_with_context')
+        graph.add('explanation', explain,
+                  depends_on=['context_data', 'diagrams'] if prompt_uses_diagrams else ['context_data'],
+                  timeout=Config.QUERY_GENERATION_TIMEOUT, pool=GENERATION_POOL)
+        
+        if include_quiz:
+            if quiz_questions:
+                def quiz_from_answer(context_data, explanation):
+                    if not explanation.get('success'):
+                        return None
+                    if explanation.get('quiz'):
+                        return explanation['quiz']
+                    logger.info("Structured answer had no quiz, generating it separately...")
+                    return self._generate_quiz(query, explanation['text'], context_data)
+                
+                graph.add('quiz', quiz_from_answer,
+                          depends_on=['context_data', 'explanation'],
+                          timeout=Config.QUERY_QUIZ_TIMEOUT, fallback=None, pool=GENERATION_POOL)
+            elif self._quiz_runs_concurrently():
+                logger.info("Generating quiz questions from the retrieved context...")
+                if is_cloudflare_ai_enabled():
+                    async def quiz_from_context(context_data):
+                        return await self._generate_quiz_async(query, context_data)
+                else:
+                    def quiz_from_context(context_data):
+                        return self._generate_quiz(query, None, context_data)
+                
+                graph.add('quiz', quiz_from_context,
+                          depends_on=['context_data'], timeout=Config.QUERY_QUIZ_TIMEOUT, fallback=None, pool=GENERATION_POOL)
+            else:
+                def quiz_from_explanation(context_data, explanation):
+                    if not explanation.get('success'):
+                        return None
+                    return self._generate_quiz(query, explanation['text'], context_data)
+                
+                graph.add('quiz', quiz_from_explanation,
+                          depends_on=['context_data', 'explanation'],
+                          timeout=Config.QUERY_QUIZ_TIMEOUT, fallback=None, pool=GENERATION_POOL)
+        
+        return graph
+    
+    def _quiz_runs_concurrently(self) -> bool:
+        """
+        Whether the quiz can be generated from the context, alongside the explanation.
+        
+        The quiz goes to Cloudflare AI when it is enabled, otherwise to
+        self.llm; a local llama.cpp model cannot serve two generations at once.
+        """
+        if not Config.QUIZ_FROM_CONTEXT:
+            return False
+        return is_cloudflare_ai_enabled() or not isinstance(self.llm, ModelManager)
+    
+    def _structured_quiz_questions(self, include_quiz: bool) -> int:
+        """
+        Number of quiz questions to generate together with the explanation.
+        
+        Args:
+            include_quiz: Whether the response includes a quiz
+        
+        Returns:
+            Number of questions in combined mode, 0 if the quiz is generated separately
+        """
+        return 3 if include_quiz and Config.STRUCTURED_ANSWER else 0
+    
+    def stream_query(
+        self,
+        query: str,
+        user_id: Optional[str] = None,
+        include_quiz: bool = True,
+        include_diagrams: bool = True
+    ) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Process a user query, streaming the explanation as it is generated.
+        
+        Runs the same pipeline as process_query, but yields events instead
+        of returning one response:
+        - 'context': references, diagrams and metadata, before generation starts
+        - 'token': a fragment of the explanation ({'text': ...})
+        - 'quiz': the quiz, once the explanation is complete ({'quiz': ...})
+        - 'done': the complete response, as process_query would return it
+        - 'error': an error response (last event)
+        
+        Cached and out-of-scope answers are sent the same way, with the whole
+        explanation in one 'token' event.
+        
+        Args:
+            query: User's question
+            user_id: Optional user identifier for personalization
+            include_quiz: Whether to generate quiz questions
+            include_diagrams: Whether to retrieve relevant diagrams
+        
+        Yields:
+            (event name, event data) tuples
+        """
+        start = time.perf_counter()
+        try:
+            logger.info(f"Streaming query: {query[:100]}...")
+            
+            prescreened = self.rag.prescreen_query(query)
+            if prescreened is not None:
+                yield from self._stream_complete_response(self._format_out_of_scope_response(prescreened))
+                return
+            
+            is_problem, selected_model = self._select_model(query)
+            
+            cache_scope = make_scope(
+                self._get_model_name(selected_model),
+                filters=None,
+                top_k=Config.RAG_TOP_K,
+                include_quiz=include_quiz,
+                include_diagrams=include_diagrams,
+                numbers=query_numbers(query)
+            )
+            query_embedding = self._lookup_embedding(query)
+            cached_response = self._get_cached_response(query_embedding, cache_scope)
+            if cached_response is not None:
+                yield from self._stream_complete_response(cached_response)
+                return
+            
+            context_data = self.rag.get_context_for_llm(
+                query,
+                top_k=Config.RAG_TOP_K,
+                include_references=True
+            )
+            if context_data.get('out_of_scope'):
+                yield from self._stream_complete_response(self._format_out_of_scope_response(context_data))
+                return
+            
+            diagrams = []
+            if include_diagrams:
+                diagrams = self._retrieve_diagrams(query, context_data)
+            
+            # References and diagrams are known before the first token
+            yield 'context', {
+                'references': context_data.get('references', []),
+                'diagrams': diagrams,
+                'metadata': self._response_metadata(context_data, is_problem)
+            }
+            
+            # In combined mode the explanation is parsed out of the streamed envelope
+            quiz_questions = self._structured_quiz_questions(include_quiz)
+            parser = StructuredAnswerParser() if quiz_questions else None
+            
+            # Otherwise the quiz can be generated from the context while the answer streams
+            quiz_pool = get_stage_pool(GENERATION_POOL)
+            quiz_future = None
+            if include_quiz and not quiz_questions and self._quiz_runs_concurrently():
+                try:
+                    quiz_future = quiz_pool.submit(self._generate_quiz, query, None, context_data)
+                except Exception as e:
+                    logger.warning(f"Quiz generation not started: {e}")
+            
+            def explanation_fragments():
+                for raw in self._stream_response(query, context_data, diagrams, model=selected_model,
+                                                 quiz_questions=quiz_questions):
+                    yield parser.feed(raw) if parser else raw
+                if parser:
+                    yield parser.finish()[0]
+            
+            fragments = []
+            first_token_ms = None
+            for fragment in explanation_fragments():
+                if not fragment:
+                    continue
+                if first_token_ms is None:
+                    first_token_ms = round((time.perf_counter() - start) * 1000, 1)
+                    logger.info(f"First token after {first_token_ms} ms")
+                fragments.append(fragment)
+                yield 'token', {'text': fragment}
+            
+            explanation = ''.join(fragments).strip()
+            if not explanation:
+                yield 'error', self._format_error_response("Failed to generate response", "Empty response from model")
+                return
+            
+            quiz = None
+            if parser is not None:
+                quiz = parser.quiz
+                if quiz is None:
+                    logger.info("Structured answer had no quiz, generating it separately...")
+                    quiz = self._generate_quiz(query, explanation, context_data)
+                yield 'quiz', {'quiz': quiz}
+            elif quiz_future is not None:
+                try:
+                    quiz = quiz_future.result(timeout=Config.QUERY_QUIZ_TIMEOUT)
+                except Exception as e:
+                    logger.warning(f"Quiz generation failed or timed out: {e!r}")
+                    quiz_pool.abandon(quiz_future)
+                yield 'quiz', {'quiz': quiz}
+            elif include_quiz:
+                logger.info("Generating quiz questions...")
+                quiz = self._generate_quiz(query, explanation, context_data)
+                yield 'quiz', {'quiz': quiz}
+            
+            response = self._build_response(
+                explanation, diagrams, quiz, context_data,
+                tokens_used=len(explanation.split()),  # Approximate
+                is_problem=is_problem
+            )
+            response['metadata']['time_to_first_token_ms'] = first_token_ms
+            
+            if self.response_cache is not None and query_embedding is not None:
+                self.response_cache.store(query_embedding, cache_scope, response, query=query)
+            
+            logger.info(f"Streamed query in {time.perf_counter() - start:.2f}s (first token: {first_token_ms} ms)")
+            yield 'done', response
+        
+        except Exception as e:
+            logger.error(f"Error streaming query: {e}", exc_info=True)
+            yield 'error', self._format_error_response("Query processing failed", str(e))
+    
+    def _stream_complete_response(self, response: Dict[str, Any]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Send an already complete response as stream events.
+        
+        Args:
+            response: Response dictionary (cached or out-of-scope)
+        
+        Yields:
+            (event name, event data) tuples
+        """
+        yield 'context', {
+            'references': response.get('references', []),
+            'diagrams': response.get('diagrams', []),
+            'metadata': response.get('metadata', {})
+        }
+        yield 'token', {'text': response.get('explanation', '')}
+        if response.get('quiz'):
+            yield 'quiz', {'quiz': response['quiz']}
+        yield 'done', response
+    
+    def _select_model(self, query: str) -> Tuple[bool, Any]:
+        """
+        Choose the model for a query (problem solver for problem-solving queries).
+        
+        Args:
+            query: User's question
+        
+        Returns:
+            (is_problem, model) tuple
+        """
+        is_problem = self._is_problem_solving_query(query)
+        
+        if is_problem and self.problem_solver:
+            logger.info("🧮 Detected problem-solving query → Using Groq 70B")
+            return is_problem, self.problem_solver
+        
+        logger.info("💬 General query → Using Cloudflare AI")
+        return is_problem, self.llm
+    
+    def _response_metadata(self, context_data: Dict, is_problem: bool) -> Dict[str, Any]:
+        """
+        Get the response metadata that is known once the context is retrieved.
+        
+        Args:
+            context_data: Retrieved context from RAG
+            is_problem: Whether the query is a problem-solving query
+        
+        Returns:
+            Metadata dictionary
+        """
+        return {
+            'multi_chapter': context_data.get('multi_chapter', False),
+            'num_sources': context_data.get('num_results', 0),
+            'relevance_score': context_data.get('top_relevance_score', 0.0),
+            'model_used': 'Groq 70B' if (is_problem and self.problem_solver) else 'Cloudflare AI'
+        }
+    
+    def _build_response(
+        self,
+        explanation: str,
+        diagrams: List[Dict],
+        quiz: Optional[Dict],
+        context_data: Dict,
+        tokens_used: int,
+        is_problem: bool
+    ) -> Dict[str, Any]:
+        """
+        Format the complete response of a query.
+        
+        Args:
+            explanation: Generated explanation text
+            diagrams: Relevant diagrams
+            quiz: Quiz questions (or None)
+            context_data: Retrieved context from RAG
+            tokens_used: Tokens used by the explanation
+            is_problem: Whether the query is a problem-solving query
+        
+        Returns:
+            Response dictionary
+        """
+        metadata = self._response_metadata(context_data, is_problem)
+        metadata['tokens_used'] = tokens_used
+        return {
+            'success': True,
+            'explanation': explanation,
+            'diagrams': diagrams,
+            'quiz': quiz,
+            'references': context_data.get('references', []),
+            'metadata': metadata
+        }
+    
+    def _get_model_name(self, model: Optional[Any]) -> str:
+        """
+        Get a stable name for a model, used to scope cached responses.
+        
+        Args:
+            model: Model instance (Gemini, Cloudflare AI or local model)
+        
+        Returns:
+            Model name string
+        """
+        if model is None:
+            return 'none'
+        
+        name = type(model).__name__
+        try:
+            status = model.get_status()
+            if status.get('model'):
+                name = f"{name}:{status['model']}"
+        except Exception:
+            pass
+        
+        return name
+    
+    def _lookup_embedding(self, query: str) -> Optional[List[float]]:
+        """
+        Get the query embedding for the response cache.
+        
+        The RAG system caches query embeddings, so retrieval reuses this
+        vector instead of embedding the query a second time.
+        
+        Args:
+            query: User's question
+        
+        Returns:
+            Query embedding, or None if the cache is disabled or embedding fails
+        """
+        if self.response_cache is None or self.rag is None:
+            return None
+        
+        try:
+            return self.rag.embed_query(query)
+        except Exception as e:
+            logger.warning(f"Could not embed query for response cache: {e}")
+            return None
+    
+    def _get_cached_response(
+        self,
+        query_embedding: Optional[List[float]],
+        cache_scope: tuple
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Look up a cached response for a semantically similar question.
+        
+        Args:
+            query_embedding: Query embedding (None skips the lookup)
+            cache_scope: Cache scope for the model and response options
+        
+        Returns:
+            Cached response dictionary, or None on a miss
+        """
+        if self.response_cache is None or query_embedding is None:
+            return None
+        
+        cached = self.response_cache.lookup(query_embedding, cache_scope)
+        if cached is None:
+            return None
+        
+        response, similarity, cached_query = cached
+        logger.info(f"⚡ Response cache hit (similarity {similarity:.3f}) for cached query: {cached_query[:100]}")
+        
+        metadata = response.setdefault('metadata', {})
+        metadata['cache_hit'] = True
+        metadata['cache_similarity'] = round(similarity, 4)
+        metadata['tokens_used'] = 0
+        return response
+    
     def _generate_response(
         self,
         query: str,
         context_data: Dict,
         diagrams: List[Dict],
-        model: Optional[Any] = None
+        model: Optional[Any] = None,
+        quiz_questions: int = 0
     ) -> Dict[str, Any]:
         """
         Generate response using LLM with prompt engineering.
@@ -239,6 +712,8 @@ class QueryHandler:
             context_data: Retrieved context from RAG
             diagrams: List of relevant diagrams
             model: Model to use (defaults to self.llm)
+            quiz_questions: Ask for a JSON envelope with this many quiz
+                questions (combined mode; the text is then the raw envelope)
         
         Returns:
             Dictionary with generated text and metadata
@@ -247,26 +722,13 @@ class QueryHandler:
         if model is None:
             model = self.llm
         
-        # Build prompt with NCERT-grounded instructions
-        prompt = self._build_prompt(query, context_data, diagrams)
-        
-        # Check prompt length and truncate context if needed
-        # Rough estimate: 1 token ≈ 4 characters
-        estimated_tokens = len(prompt) // 4
-        max_context_tokens = Config.LLM_N_CTX - Config.LLM_MAX_TOKENS - 200  # Reserve space for response
-        
-        if estimated_tokens > max_context_tokens:
-            logger.warning(f"Prompt too long ({estimated_tokens} tokens), truncating context...")
-            # Reduce context by using fewer passages
-            context_data['passages'] = context_data['passages'][:2]  # Use only top 2 passages
-            context_data['context'] = '\n\n'.join(context_data['passages'])
-            # Rebuild prompt with reduced context
-            prompt = self._build_prompt(query, context_data, diagrams[:2])  # Also reduce diagrams
+        prompt = self._prepare_prompt(query, context_data, diagrams, quiz_questions)
+        generate_options = self._generate_options(model, quiz_questions)
         
         # Generate response using the selected model
         try:
             # Check if model has chat_with_context method (Cloudflare AI)
-            if hasattr(model, 'chat_with_context'):
+            if hasattr(model, 'chat_with_context') and not quiz_questions:
                 logger.info("Using chat_with_context method")
                 response_text = model.chat_with_context(
                     question=query,
@@ -283,12 +745,7 @@ class QueryHandler:
             else:
                 # Use standard generate method (Gemini, local models)
                 logger.info("Using generate method")
-                result = model.generate(
-                    prompt=prompt,
-                    max_tokens=2000,  # More tokens for detailed responses
-                    temperature=0.1 if model == self.problem_solver else 0.7,
-                    stop=["Student's question:", "Context from NCERT"]
-                )
+                result = model.generate(prompt=prompt, **generate_options)
                 
                 # If rate limit hit and we have Cloudflare as fallback
                 if not result.get('success') and result.get('error') == 'RATE_LIMIT_EXCEEDED':
@@ -302,9 +759,7 @@ class QueryHandler:
                                 logger.info("🔄 Falling back to Cloudflare AI")
                                 result = self.llm.generate(
                                     prompt=prompt,
-                                    max_tokens=2000,
-                                    temperature=0.7,
-                                    stop=["Student's question:", "Context from NCERT"]
+                                    **self._generate_options(self.llm, quiz_questions)
                                 )
                         except Exception as fallback_error:
                             logger.error(f"Cloudflare fallback failed: {fallback_error}")
@@ -320,11 +775,137 @@ class QueryHandler:
                 'tokens_used': 0
             }
     
+    def _stream_response(
+        self,
+        query: str,
+        context_data: Dict,
+        diagrams: List[Dict],
+        model: Optional[Any] = None,
+        quiz_questions: int = 0
+    ) -> Iterator[str]:
+        """
+        Generate the response, yielding text as the model produces it.
+        
+        Uses the model's streaming method (chat_with_context_stream for
+        Cloudflare AI, generate_stream for Gemini and local models). If the
+        model cannot stream, or streaming fails before the first fragment,
+        the response is generated with _generate_response (including its
+        rate-limit fallback) and sent in one piece.
+        
+        Args:
+            query: User's question
+            context_data: Retrieved context from RAG
+            diagrams: List of relevant diagrams
+            model: Model to use (defaults to self.llm)
+            quiz_questions: Ask for a JSON envelope with this many quiz
+                questions (combined mode; the raw envelope is yielded)
+        
+        Yields:
+            Response text fragments
+        
+        Raises:
+            Exception: If generation fails
+        """
+        if model is None:
+            model = self.llm
+        
+        stream = None
+        if hasattr(model, 'chat_with_context_stream') and not quiz_questions:
+            stream = model.chat_with_context_stream(
+                question=query,
+                context=context_data.get('context', '')
+            )
+        elif hasattr(model, 'generate_stream'):
+            stream = model.generate_stream(
+                prompt=self._prepare_prompt(query, context_data, diagrams, quiz_questions),
+                **self._generate_options(model, quiz_questions)
+            )
+        
+        if stream is not None:
+            started = False
+            try:
+                for fragment in stream:
+                    if fragment:
+                        started = True
+                        yield fragment
+                if started:
+                    return
+            except Exception as e:
+                if started:
+                    raise
+                logger.warning(f"Streaming failed before the first token, generating without streaming: {e}")
+        
+        result = self._generate_response(query, context_data, diagrams, model=model, quiz_questions=quiz_questions)
+        if not result.get('success'):
+            raise Exception(result.get('error') or "Failed to generate response")
+        yield result['text']
+    
+    def _prepare_prompt(
+        self,
+        query: str,
+        context_data: Dict,
+        diagrams: List[Dict],
+        quiz_questions: int = 0
+    ) -> str:
+        """
+        Build the prompt, truncating the context if it would not fit the context window.
+        
+        Args:
+            query: User's question
+            context_data: Retrieved context from RAG (not modified: other stages
+                read it concurrently, so a truncated copy is used if needed)
+            diagrams: List of relevant diagrams
+            quiz_questions: Ask for a JSON envelope with this many quiz questions
+        
+        Returns:
+            Formatted prompt string
+        """
+        # Build prompt with NCERT-grounded instructions
+        prompt = self._build_prompt(query, context_data, diagrams, quiz_questions)
+        
+        # Check prompt length and truncate context if needed
+        # Rough estimate: 1 token ≈ 4 characters
+        estimated_tokens = len(prompt) // 4
+        max_context_tokens = Config.LLM_N_CTX - Config.LLM_MAX_TOKENS - 200  # Reserve space for response
+        
+        if estimated_tokens > max_context_tokens:
+            logger.warning(f"Prompt too long ({estimated_tokens} tokens), truncating context...")
+            # Reduce context by using fewer passages
+            passages = context_data['passages'][:2]  # Use only top 2 passages
+            context_data = {**context_data, 'passages': passages, 'context': '\n\n'.join(passages)}
+            # Rebuild prompt with reduced context
+            prompt = self._build_prompt(query, context_data, diagrams[:2], quiz_questions)  # Also reduce diagrams
+        
+        return prompt
+    
+    def _generate_options(self, model: Any, quiz_questions: int = 0) -> Dict[str, Any]:
+        """
+        Get the generate()/generate_stream() options for a model.
+        
+        Args:
+            model: Model generating the response
+            quiz_questions: Number of quiz questions in a JSON envelope (0: plain answer)
+        
+        Returns:
+            Keyword arguments for the model's generate methods
+        """
+        options = {
+            'max_tokens': 2000,  # More tokens for detailed responses
+            'temperature': 0.1 if model == self.problem_solver else 0.7,
+            'stop': ["Student's question:", "Context from NCERT"]
+        }
+        if quiz_questions:
+            # JSON mode (Gemini), grammar (llama.cpp) or schema prompt (Cloudflare)
+            options['max_tokens'] += 250 * quiz_questions
+            options['json_schema'] = ANSWER_SCHEMA
+        return options
+    
     def _build_prompt(
         self,
         query: str,
         context_data: Dict,
-        diagrams: List[Dict]
+        diagrams: List[Dict],
+        quiz_questions: int = 0
     ) -> str:
         """
         Build a well-engineered prompt for NCERT-grounded responses.
@@ -333,6 +914,8 @@ class QueryHandler:
             query: User's question
             context_data: Retrieved context from RAG
             diagrams: List of relevant diagrams
+            quiz_questions: Ask for a JSON envelope with the explanation and
+                this many quiz questions (0: plain answer)
         
         Returns:
             Formatted prompt string
@@ -384,6 +967,15 @@ Relevant diagrams available:
         if context_data.get('multi_chapter'):
             multi_chapter_note = "\n\nNote: This topic spans multiple chapters. Clearly indicate which chapter each part of your explanation comes from."
         
+        # Closing instructions
+        answer_instructions = """Provide a comprehensive answer based on the NCERT context above. Structure your response clearly and reference the relevant chapters.
+
+Answer:"""
+        if quiz_questions:
+            answer_instructions = """Provide a comprehensive answer based on the NCERT context above. Structure it clearly and reference the relevant chapters.
+
+""" + envelope_instructions(quiz_questions)
+
         # Complete prompt
         prompt = f"""{system_prompt}
 
@@ -391,9 +983,7 @@ Relevant diagrams available:
 
 Student's question: {query}
 
-Provide a comprehensive answer based on the NCERT context above. Structure your response clearly and reference the relevant chapters.
-
-Answer:"""
+{answer_instructions}"""
         
         return prompt
     
@@ -414,7 +1004,7 @@ Answer:"""
         Returns:
             List of diagram information dictionaries
         """
-        if not self.diagram_session or not self.DiagramPage:
+        if not self.diagrams:
             logger.warning("Diagram retrieval not available")
             return []
         
@@ -423,6 +1013,7 @@ Answer:"""
             
             # Extract subject and chapter from context
             chapter_groups = context_data.get('chapter_groups', {})
+            chapters = []
             
             for chapter_id, results in chapter_groups.items():
                 # Parse chapter identifier
@@ -440,15 +1031,12 @@ Answer:"""
                         logger.warning(f"Could not parse chapter ID '{chapter_id}': {ve}")
                         continue
                     
-                    # Query diagrams for this chapter
-                    chapter_diagrams = self.diagram_session.query(self.DiagramPage).filter_by(
-                        subject=subject,
-                        class_level=class_level,
-                        chapter=chapter
-                    ).limit(max_diagrams).all()
-                    
-                    for diag in chapter_diagrams:
-                        diagrams.append(diag.to_dict())
+                    chapters.append((subject, class_level, chapter))
+            
+            # Diagrams of all these chapters (one query for the uncached ones)
+            chapter_diagrams = self.diagrams.get_chapter_diagrams(chapters, limit=max_diagrams)
+            for chapter_key in chapters:
+                diagrams.extend(chapter_diagrams[chapter_key])
             
             # If no diagrams found from chapters, try keyword matching
             if not diagrams:
@@ -480,26 +1068,11 @@ Answer:"""
             # Extract keywords from query
             keywords = self._extract_keywords(query)
             
-            if not keywords:
+            if not keywords or not self.diagrams:
                 return []
             
-            # Search in captions (simple keyword matching)
-            diagrams = []
-            all_diagrams = self.diagram_session.query(self.DiagramPage).all()
-            
-            for diag in all_diagrams:
-                captions_str = diag.captions.lower() if diag.captions else ""
-                
-                # Check if any keyword matches
-                for keyword in keywords:
-                    if keyword.lower() in captions_str:
-                        diagrams.append(diag.to_dict())
-                        break
-                
-                if len(diagrams) >= max_results:
-                    break
-            
-            return diagrams
+            # Ranked caption index query (substring scan if the index is unavailable)
+            return self.diagrams.search_captions(keywords, limit=max_results)
             
         except Exception as e:
             logger.error(f"Error in keyword search: {e}")
@@ -531,16 +1104,19 @@ Answer:"""
     def _generate_quiz(
         self,
         query: str,
-        explanation: str,
+        explanation: Optional[str],
         context_data: Dict,
         num_questions: int = 3
     ) -> Optional[Dict]:
         """
         Generate adaptive quiz questions based on the explanation.
         
+        Without an explanation the questions are based on the retrieved
+        context, so the quiz can be generated while the explanation is.
+        
         Args:
             query: Original user question
-            explanation: Generated explanation
+            explanation: Generated explanation (None: use the retrieved context)
             context_data: Retrieved context
             num_questions: Number of questions to generate (2-4)
         
@@ -548,44 +1124,13 @@ Answer:"""
             Dictionary with quiz questions or None if generation fails
         """
         try:
-            # Ensure num_questions is between 2 and 4
-            num_questions = max(2, min(4, num_questions))
-            
-            # Build quiz generation prompt
-            quiz_prompt = f"""Based on the following explanation about "{query}", generate {num_questions} multiple-choice questions to test understanding.
-
-Explanation:
-{explanation[:500]}...
-
-Generate {num_questions} questions in this exact JSON format:
-{{
-    "questions": [
-        {{
-            "question": "Question text here?",
-            "options": ["Option A", "Option B", "Option C", "Option D"],
-            "correct_answer": 0,
-            "explanation": "Why this answer is correct"
-        }}
-    ]
-}}
-
-Focus on conceptual understanding, not rote memorization. Make questions clear and unambiguous.
-
-JSON:"""
+            quiz_prompt = self._build_quiz_prompt(query, explanation, context_data, num_questions)
             
             # Generate quiz using Cloudflare AI or local model
             if is_cloudflare_ai_enabled():
                 try:
                     logger.info("Using Cloudflare AI for quiz generation")
-                    cf_ai = get_cloudflare_ai()
-                    
-                    # Use Cloudflare AI for quiz
-                    messages = [
-                        {"role": "system", "content": "You are a quiz generator. Generate questions in valid JSON format only."},
-                        {"role": "user", "content": quiz_prompt}
-                    ]
-                    
-                    quiz_text = cf_ai.chat(messages, temperature=0.8, max_tokens=800)
+                    quiz_text = get_cloudflare_ai().chat(self._quiz_messages(quiz_prompt), temperature=0.8, max_tokens=800)
                     
                     result = {
                         'success': True,
@@ -608,19 +1153,114 @@ JSON:"""
                 logger.warning("Quiz generation failed")
                 return None
             
-            # Parse JSON response
-            quiz_data = self._parse_quiz_json(result['text'])
-            
-            if quiz_data and 'questions' in quiz_data:
-                logger.info(f"Generated {len(quiz_data['questions'])} quiz questions")
-                return quiz_data
-            
-            return None
+            return self._quiz_from_text(result['text'])
             
         except Exception as e:
             logger.error(f"Error generating quiz: {e}")
             return None
     
+    async def _generate_quiz_async(self, query: str, context_data: Dict, num_questions: int = 3) -> Optional[Dict]:
+        """
+        Generate quiz questions from the retrieved context with the async Cloudflare client.
+        
+        Used as the context quiz stage when Cloudflare AI is enabled: the
+        request waits on the event loop instead of holding a stage thread.
+        The call runs on the worker's shared async client, so quizzes reuse
+        its keep-alive connections across requests.
+        
+        Args:
+            query: Original user question
+            context_data: Retrieved context
+            num_questions: Number of questions to generate (2-4)
+        
+        Returns:
+            Dictionary with quiz questions or None if generation fails
+        """
+        try:
+            quiz_prompt = self._build_quiz_prompt(query, None, context_data, num_questions)
+            logger.info("Using Cloudflare AI (async) for quiz generation")
+            quiz_text = await run_on_async_client(
+                lambda cf_ai: cf_ai.chat(self._quiz_messages(quiz_prompt), temperature=0.8, max_tokens=800)
+            )
+            return self._quiz_from_text(quiz_text)
+        except Exception as e:
+            logger.error(f"Cloudflare quiz generation failed: {e}")
+            return None
+    
+    def _build_quiz_prompt(
+        self,
+        query: str,
+        explanation: Optional[str],
+        context_data: Dict,
+        num_questions: int
+    ) -> str:
+        """
+        Build the quiz generation prompt.
+        
+        Args:
+            query: Original user question
+            explanation: Generated explanation (None: use the retrieved context)
+            context_data: Retrieved context
+            num_questions: Number of questions to generate (clamped to 2-4)
+        
+        Returns:
+            Prompt text
+        """
+        # Ensure num_questions is between 2 and 4
+        num_questions = max(2, min(4, num_questions))
+        
+        if explanation is None:
+            source_label, source_text = 'NCERT content', context_data.get('context', '')
+        else:
+            source_label, source_text = 'explanation', explanation
+        
+        return f"""Based on the following {source_label} about "{query}", generate {num_questions} multiple-choice questions to test understanding.
+
+{source_label[0].upper() + source_label[1:]}:
+{source_text[:500]}...
+
+Generate {num_questions} questions in this exact JSON format:
+{{
+    "questions": [
+        {{
+            "question": "Question text here?",
+            "options": ["Option A", "Option B", "Option C", "Option D"],
+            "correct_answer": 0,
+            "explanation": "Why this answer is correct"
+        }}
+    ]
+}}
+
+Focus on conceptual understanding, not rote memorization. Make questions clear and unambiguous.
+
+JSON:"""
+
+    @staticmethod
+    def _quiz_messages(quiz_prompt: str) -> List[Dict[str, str]]:
+        """Chat messages for quiz generation with Cloudflare AI."""
+        return [
+            {"role": "system", "content": "You are a quiz generator. Generate questions in valid JSON format only."},
+            {"role": "user", "content": quiz_prompt}
+        ]
+    
+    def _quiz_from_text(self, text: str) -> Optional[Dict]:
+        """
+        Parse generated quiz text.
+        
+        Args:
+            text: Model output
+        
+        Returns:
+            Dictionary with quiz questions or None if it could not be parsed
+        """
+        quiz_data = self._parse_quiz_json(text)
+        
+        if quiz_data and 'questions' in quiz_data:
+            logger.info(f"Generated {len(quiz_data['questions'])} quiz questions")
+            return quiz_data
+        
+        return None
+    
     def _parse_quiz_json(self, text: str) -> Optional[Dict]:
         """
         Parse quiz JSON from LLM response.
@@ -728,13 +1368,19 @@ JSON:"""
         stats = {
             'rag_stats': self.rag.get_stats(),
             'model_status': self.llm.get_status(),
-            'diagram_db_path': str(self.diagram_db_path)
+            'diagram_db_path': str(self.diagram_db_path),
+            'response_cache': (
+                self.response_cache.get_stats() if self.response_cache is not None
+                else {'enabled': False}
+            ),
+            'single_flight': get_single_flight_stats(),
+            'stage_pools': get_stage_pool_stats()
         }
         
         # Add diagram count if available
-        if self.diagram_session and self.DiagramPage:
+        if self.diagrams:
             try:
-                diagram_count = self.diagram_session.query(self.DiagramPage).count()
+                diagram_count = self.diagrams.count()
                 stats['total_diagrams'] = diagram_count
             except Exception:
                 stats['total_diagrams'] = 0
@@ -0,0 +1,373 @@
+"""
+Async Stage Graph for Query Processing
+
+Runs the stages of a query (retrieval, diagram lookup, answer generation,
+quiz generation) as asyncio tasks wired by their dependencies, so stages
+that do not depend on each other run at the same time. Most stages are
+blocking calls (vector search, SQLite, LLM HTTP calls); they run on
+shared thread pools and the event loop only waits on them.
+
+Features:
+- StageGraph: named stages with dependencies; each stage starts as soon as
+  the stages it depends on have finished and gets their results as
+  keyword arguments
+- Per-stage timeouts (asyncio.wait_for around the executor call)
+- Optional stages: a failure or timeout yields a fallback value (e.g. no
+  diagrams) instead of failing the query; required stages raise StageError
+- Per-stage timings for logging and response metadata
+- Coroutine-function stages (e.g. calls through an async HTTP client) are
+  awaited on the event loop instead of taking a pool thread; a timeout
+  cancels them
+- run_blocking for single stages that must finish before anything else
+  can start (e.g. retrieval, which decides whether the query is answered)
+- Process-wide stage pools, shared by the event loops that Flask request
+  threads create per request: 'default' (Config.QUERY_STAGE_WORKERS
+  threads) for retrieval and diagram lookups, and a smaller 'generation'
+  pool (Config.QUERY_GENERATION_WORKERS) for LLM calls, so slow
+  generations cannot take the threads retrieval needs
+
+A blocking stage that times out is cancelled if it has not started yet.
+A running one cannot be interrupted: its thread finishes the call in the
+background, the result is dropped, and the pool counts it as abandoned.
+While a pool's threads are all held by abandoned calls, new stages for it
+fail at once (and fall back, if optional) instead of queuing behind them.
+"""
+
+import time
+import asyncio
+import inspect
+import logging
+import functools
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Marks stages without a fallback value
+REQUIRED = object()
+
+DEFAULT_POOL = 'default'
+GENERATION_POOL = 'generation'
+
+
+class PoolSaturatedError(RuntimeError):
+    """Every thread of a stage pool is held by an abandoned call."""
+
+
+class StagePool:
+    """
+    Thread pool for blocking stages that keeps count of abandoned calls.
+    """
+    
+    def __init__(self, name: str, max_workers: int):
+        """
+        Create the pool.
+        
+        Args:
+            name: Pool name (thread names and statistics)
+            max_workers: Number of threads
+        """
+        self.name = name
+        self.max_workers = max(1, int(max_workers))
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f'query-{name}')
+        self._lock = threading.Lock()
+        self.abandoned = 0
+        self.abandoned_running = 0
+    
+    def submit(self, func: Callable[..., Any], *args, **kwargs) -> Future:
+        """
+        Start a blocking call.
+        
+        Raises:
+            PoolSaturatedError: If abandoned calls hold every thread
+        """
+        with self._lock:
+            if self.abandoned_running >= self.max_workers:
+                raise PoolSaturatedError(
+                    f"All {self.max_workers} '{self.name}' stage threads are held by timed-out calls"
+                )
+        return self.executor.submit(func, *args, **kwargs)
+    
+    def abandon(self, future: Future) -> None:
+        """
+        Give up on a call: cancel it if it has not started, otherwise count it until it ends.
+        
+        Args:
+            future: Future returned by submit()
+        """
+        if future.cancel() or future.done():
+            return
+        with self._lock:
+            self.abandoned += 1
+            self.abandoned_running += 1
+        logger.warning(f"Abandoned a running '{self.name}' stage ({self.abandoned_running} still running)")
+        future.add_done_callback(self._release)
+    
+    def _release(self, _future: Future) -> None:
+        with self._lock:
+            self.abandoned_running -= 1
+    
+    async def run(self, func: Callable[..., Any], timeout: Optional[float] = None) -> Any:
+        """
+        Run a blocking call and wait for it on the event loop.
+        
+        Args:
+            func: Blocking callable without arguments
+            timeout: Seconds the call may take (None: no limit)
+        
+        Returns:
+            The call's result
+        """
+        future = self.submit(func)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except BaseException:
+            # Timed out, or the request was cancelled while waiting
+            if not future.done():
+                self.abandon(future)
+            raise
+    
+    def get_stats(self) -> Dict[str, int]:
+        """Threads, abandoned calls in total and abandoned calls still running."""
+        with self._lock:
+            return {
+                'workers': self.max_workers,
+                'abandoned': self.abandoned,
+                'abandoned_running': self.abandoned_running
+            }
+
+
+_pools: Dict[str, StagePool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_stage_pool(name: str = DEFAULT_POOL) -> StagePool:
+    """
+    Get a process-wide stage pool.
+    
+    Args:
+        name: DEFAULT_POOL or GENERATION_POOL
+    
+    Returns:
+        Shared StagePool
+    """
+    with _pools_lock:
+        pool = _pools.get(name)
+        if pool is None:
+            workers = Config.QUERY_GENERATION_WORKERS if name == GENERATION_POOL else Config.QUERY_STAGE_WORKERS
+            pool = _pools[name] = StagePool(name, workers)
+        return pool
+
+
+def get_stage_pool_stats() -> Dict[str, Dict[str, int]]:
+    """
+    Statistics of every stage pool.
+    
+    Returns:
+        Dictionary of pool statistics by name
+    """
+    with _pools_lock:
+        pools = list(_pools.values())
+    return {pool.name: pool.get_stats() for pool in pools}
+
+
+def reset_stage_executor_after_fork() -> None:
+    """Forget the pools inherited from a parent process (their threads do not survive fork)."""
+    global _pools_lock
+    _pools_lock = threading.Lock()
+    _pools.clear()
+
+
+async def run_blocking(
+    name: str,
+    func: Callable[..., Any],
+    *args,
+    timeout: Optional[float] = None,
+    pool: str = DEFAULT_POOL
+) -> Any:
+    """
+    Run one blocking call on a stage pool and wait for it.
+    
+    Args:
+        name: Stage name (for errors)
+        func: Blocking callable
+        *args: Positional arguments for func
+        timeout: Seconds the call may take (None: no limit)
+        pool: Stage pool to run it on
+    
+    Returns:
+        The call's result
+    
+    Raises:
+        StageError: If the call fails or times out
+    """
+    try:
+        return await get_stage_pool(pool).run(functools.partial(func, *args), timeout)
+    except Exception as e:
+        raise StageError(name, e) from e
+
+
+class StageError(Exception):
+    """A required stage failed or timed out."""
+    
+    def __init__(self, stage: str, cause: BaseException):
+        self.stage = stage
+        self.cause = cause
+        reason = 'timed out' if isinstance(cause, asyncio.TimeoutError) else str(cause)
+        super().__init__(f"Stage '{stage}' failed: {reason}")
+
+
+class _Stage:
+    def __init__(
+        self,
+        name: str,
+        func: Callable[..., Any],
+        depends_on: Iterable[str],
+        timeout: Optional[float],
+        fallback: Any,
+        pool: str
+    ):
+        self.name = name
+        self.func = func
+        self.depends_on = tuple(depends_on)
+        self.timeout = timeout
+        self.fallback = fallback
+        self.pool = pool
+
+
+class StageGraph:
+    """
+    Dependency graph of stages, executed concurrently where possible.
+    """
+    
+    def __init__(self):
+        """Create an empty graph."""
+        self.stages: Dict[str, _Stage] = {}
+        self.timings: Dict[str, float] = {}
+    
+    def add(
+        self,
+        name: str,
+        func: Callable[..., Any],
+        depends_on: Iterable[str] = (),
+        timeout: Optional[float] = None,
+        fallback: Any = REQUIRED,
+        pool: str = DEFAULT_POOL
+    ) -> 'StageGraph':
+        """
+        Add a stage.
+        
+        Args:
+            name: Stage name (also the keyword its result is passed as)
+            func: Blocking callable or coroutine function, called with the results of
+                depends_on as keyword arguments
+            depends_on: Names of stages (or initial values) this stage needs
+            timeout: Seconds the stage may take (None: no limit)
+            fallback: Result used if the stage fails or times out (default: the stage is required)
+            pool: Stage pool for a blocking func (GENERATION_POOL for LLM calls)
+        
+        Returns:
+            The graph (for chaining)
+        """
+        if name in self.stages:
+            raise ValueError(f"Duplicate stage: {name}")
+        self.stages[name] = _Stage(name, func, depends_on, timeout, fallback, pool)
+        return self
+    
+    def _ordered_stages(self, results: Dict[str, Any]) -> List[_Stage]:
+        """
+        Topologically sort the stages that still have to run.
+        
+        Args:
+            results: Values already available (their stages are not run)
+        
+        Returns:
+            Stages in an order where every stage follows its dependencies
+        
+        Raises:
+            ValueError: If a dependency is unknown or the stages form a cycle
+        """
+        pending = {name: stage for name, stage in self.stages.items() if name not in results}
+        waiting_on: Dict[str, int] = {}
+        dependents: Dict[str, List[str]] = {name: [] for name in pending}
+        for stage in pending.values():
+            missing = [dep for dep in stage.depends_on if dep not in self.stages and dep not in results]
+            if missing:
+                raise ValueError(f"Stage '{stage.name}' depends on unknown stages: {missing}")
+            deps = {dep for dep in stage.depends_on if dep in pending}
+            waiting_on[stage.name] = len(deps)
+            for dep in deps:
+                dependents[dep].append(stage.name)
+        
+        # Kahn's algorithm, keeping insertion order among ready stages
+        ready = [name for name in pending if not waiting_on[name]]
+        ordered = []
+        while ready:
+            name = ready.pop(0)
+            ordered.append(pending[name])
+            for dependent in dependents[name]:
+                waiting_on[dependent] -= 1
+                if not waiting_on[dependent]:
+                    ready.append(dependent)
+        
+        if len(ordered) < len(pending):
+            cycle = [name for name in pending if waiting_on[name]]
+            raise ValueError(f"Stages depend on each other in a cycle: {cycle}")
+        return ordered
+    
+    async def run(self, initial: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Run every stage, each as soon as its dependencies are done.
+        
+        Args:
+            initial: Values available to stages without running anything
+        
+        Returns:
+            Dictionary of results by stage name (including the initial values)
+        
+        Raises:
+            ValueError: If a dependency is unknown or the stages form a cycle
+            StageError: If a required stage fails or times out (the other
+                stages are cancelled)
+        """
+        results: Dict[str, Any] = dict(initial or {})
+        ordered = self._ordered_stages(results)
+        
+        tasks: Dict[str, asyncio.Task] = {}
+        
+        async def run_stage(stage: _Stage) -> Any:
+            kwargs = {}
+            for dep in stage.depends_on:
+                kwargs[dep] = await tasks[dep] if dep in tasks else results[dep]
+            
+            start = time.perf_counter()
+            try:
+                if inspect.iscoroutinefunction(stage.func):
+                    return await asyncio.wait_for(stage.func(**kwargs), stage.timeout)
+                return await get_stage_pool(stage.pool).run(functools.partial(stage.func, **kwargs), stage.timeout)
+            except Exception as e:
+                if stage.fallback is REQUIRED:
+                    raise StageError(stage.name, e) from e
+                reason = 'timed out' if isinstance(e, asyncio.TimeoutError) else e
+                logger.warning(f"Stage '{stage.name}' {reason}; continuing without it")
+                return stage.fallback
+            finally:
+                self.timings[stage.name] = round((time.perf_counter() - start) * 1000, 1)
+        
+        # Tasks are created in dependency order; a stage awaits the tasks it depends on
+        for stage in ordered:
+            tasks[stage.name] = asyncio.ensure_future(run_stage(stage))
+        
+        try:
+            for name, task in tasks.items():
+                results[name] = await task
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+        
+        return results
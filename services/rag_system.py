@@ -5,15 +5,23 @@ This module implements the RAG system for retrieving relevant NCERT content
 to ground AI responses in factual information.
 
 Features:
-- Semantic search using ChromaDB vector store
+- Semantic search using ChromaDB or a memory-mapped flat index (pluggable backends)
+- Versioned embedding collections, switched in place when a re-embed completes
+- Batched multi-query retrieval (one embedding batch, one vector query per filter set)
+- Subject/class-partitioned collections, searched only where the filters point
+- Hybrid BM25 + vector retrieval with reciprocal-rank fusion
+- Neighbor-chunk lookups and merging of adjacent hits
 - Result reranking by relevance
 - Multi-chapter detection and reference extraction
-- Out-of-scope query handling
+- Out-of-scope query handling, with a keyword pre-classifier that answers
+  obvious off-topic requests before any embedding or vector query
+- LRU+TTL cache for query embeddings
 
 Requirements: 1.1, 1.2, 1.4, 1.5
 """
 
 import logging
+import threading
 from typing import List, Dict, Optional, Tuple
 from pathlib import Path
 import re
@@ -22,14 +30,7 @@ import re
 from dotenv import load_dotenv
 load_dotenv()
 
-# Embeddings and Vector Store
-try:
-    from sentence_transformers import SentenceTransformer
-    SENTENCE_TRANSFORMERS_AVAILABLE = True
-except ImportError:
-    SENTENCE_TRANSFORMERS_AVAILABLE = False
-    SentenceTransformer = None
-
+# Vector Store
 try:
     import chromadb
     from chromadb.config import Settings
@@ -42,14 +43,46 @@ except ImportError:
 # Configuration
 from config import Config
 
-# Cloudflare AI
-from services.cloudflare_ai import get_cloudflare_ai, is_cloudflare_ai_enabled
+# Versioned embedding collections (alias -> collection + embedding model)
+from services.embedding_collections import CollectionAliases, Embedder, open_serving_collection
+
+# Query embedding cache
+from services.embedding_cache import EmbeddingCache
+from services.single_flight import flight_key, get_single_flight
+
+# Sparse (BM25) index for hybrid retrieval
+from services.sparse_index import BM25Index, index_path_for
+
+# Neighbor-chunk lookups
+from services.chunk_neighbors import NeighborIndexProvider, join_overlapping
+
+# Pluggable vector search backends
+from services.vector_backends import VectorBackend, create_vector_backend
+from services.vector_partitions import PartitionedBackend
+
+# Cheap out-of-scope pre-classifier
+from services.scope_classifier import ScopeClassifier, scope_model_path_for
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 
+class _ServingState:
+    """
+    Everything retrieval needs from one embedding collection, swapped as a unit.
+    """
+    
+    __slots__ = ('collection', 'embedder', 'vector_backend', 'sparse_index', 'neighbor_index')
+    
+    def __init__(self, collection, embedder, vector_backend, sparse_index, neighbor_index):
+        self.collection = collection
+        self.embedder = embedder
+        self.vector_backend = vector_backend
+        self.sparse_index = sparse_index
+        self.neighbor_index = neighbor_index
+
+
 class RAGSystem:
     """
     Retrieval-Augmented Generation system for NCERT content.
@@ -69,25 +102,22 @@ class RAGSystem:
         
         Args:
             vector_store_path: Path to ChromaDB vector store (default: from config)
-            embedding_model_name: Name of the embedding model (default: from config)
-            collection_name: Name of the ChromaDB collection (default: from config)
+            embedding_model_name: Embedding model for a new collection (default: from config;
+                an existing collection is always queried with the model it was built with)
+            collection_name: Logical collection name, resolved through the alias file (default: from config)
         """
         self.vector_store_path = Path(vector_store_path or Config.CHROMA_DB_PATH)
-        self.embedding_model_name = embedding_model_name or Config.EMBEDDING_MODEL_NAME
-        self.collection_name = collection_name or Config.CHROMA_COLLECTION_NAME
+        self.default_embedding_model = embedding_model_name
+        self.collection_alias = collection_name or Config.CHROMA_COLLECTION_NAME
+        self.retrieval_mode = Config.RAG_RETRIEVAL_MODE
         
-        # Initialize embedding model (only if Cloudflare is not enabled)
-        if is_cloudflare_ai_enabled():
-            logger.info("Using Cloudflare AI for embeddings (768d) - skipping local model load")
-            self.embedding_model = None
-        else:
-            logger.info(f"Loading local embedding model: {self.embedding_model_name}")
-            try:
-                self.embedding_model = SentenceTransformer(self.embedding_model_name)
-                logger.info("Local embedding model loaded successfully")
-            except Exception as e:
-                logger.error(f"Failed to load embedding model: {e}")
-                raise
+        # Query embedding cache (repeat queries skip the embedding hop)
+        self.embedding_cache = None
+        if Config.EMBEDDING_CACHE_ENABLED:
+            self.embedding_cache = EmbeddingCache(
+                max_size=Config.EMBEDDING_CACHE_MAX_SIZE,
+                ttl=Config.EMBEDDING_CACHE_TTL
+            )
         
         # Initialize ChromaDB client
         logger.info(f"Initializing ChromaDB at: {self.vector_store_path}")
@@ -96,31 +126,162 @@ class RAGSystem:
                 path=str(self.vector_store_path),
                 settings=Settings(anonymized_telemetry=False)
             )
-            
-            # Get or create the collection
-            try:
-                self.collection = self.chroma_client.get_collection(
-                    name=self.collection_name
-                )
-                count = self.collection.count()
-                logger.info(f"Connected to existing collection '{self.collection_name}' with {count} documents")
-            except Exception:
-                logger.warning(f"Collection '{self.collection_name}' not found, creating new collection")
-                self.collection = self.chroma_client.create_collection(
-                    name=self.collection_name,
-                    metadata={"description": "NCERT textbook content for JEE/NEET preparation"}
-                )
-                logger.info(f"Created new collection '{self.collection_name}'")
-            
         except Exception as e:
             logger.error(f"Failed to initialize ChromaDB: {e}")
             raise
+        
+        # The alias file names the collection (and embedding model) to serve;
+        # a re-embed job switches it and retrieval picks the change up in place
+        self.aliases = CollectionAliases(self.vector_store_path)
+        self._serving_lock = threading.Lock()
+        self._serving = self._open_serving_state()
+        self._aliases_mtime = self.aliases.mtime()
+        
+        # Off-topic pre-classifier (trained from the NCERT vocabulary once, then loaded)
+        self.scope_classifier: Optional[ScopeClassifier] = None
+        if Config.SCOPE_PRECLASSIFIER_ENABLED:
+            try:
+                self.scope_classifier = ScopeClassifier.load_or_train(
+                    scope_model_path_for(self.vector_store_path, self.collection_alias),
+                    self._serving.collection,
+                    self._serving.sparse_index
+                )
+            except Exception as e:
+                logger.error(f"Failed to load scope pre-classifier: {e}")
+    
+    def _open_serving_state(self) -> '_ServingState':
+        """
+        Open the serving collection with its embedder, vector backend and indexes.
+        
+        Returns:
+            Serving state
+        """
+        collection, embedder = open_serving_collection(
+            self.chroma_client,
+            self.vector_store_path,
+            self.collection_alias,
+            self.default_embedding_model
+        )
+        logger.info(
+            f"Connected to collection '{collection.name}' with {collection.count()} documents "
+            f"({embedder.model_id}, {embedder.dimension}d)"
+        )
+        
+        # Load a local model before the first query needs it
+        try:
+            embedder.warm_up()
+        except Exception as e:
+            logger.error(f"Embedding model warm-up failed: {e}")
+        
+        # Vector search backend (ChromaDB, or a flat index exported from it)
+        vector_backend = create_vector_backend(Config.VECTOR_BACKEND, collection)
+        
+        # Route filtered queries to per-(subject, class) partitions (the flat
+        # backend already prefilters rows with bitmasks, so it is left as is)
+        if Config.VECTOR_PARTITIONS_ENABLED and vector_backend.name == 'chroma':
+            partitioned = PartitionedBackend.load(
+                self.chroma_client,
+                collection,
+                self.vector_store_path,
+                vector_backend
+            )
+            if partitioned is not None:
+                vector_backend = partitioned
+        logger.info(f"Using '{vector_backend.name}' vector backend")
+        
+        # Sparse (BM25) index for hybrid retrieval. Workers never rebuild it:
+        # ingestion and 'python -m services.sparse_index build' persist it,
+        # and without one retrieval falls back to vector-only
+        sparse_index = None
+        if self.retrieval_mode == 'hybrid':
+            sparse_path = index_path_for(self.vector_store_path, collection.name)
+            try:
+                sparse_index = BM25Index.load_shared(sparse_path)
+            except Exception as e:
+                logger.error(f"Failed to load sparse index: {e}")
+            if sparse_index is None:
+                logger.warning(
+                    f"No sparse index at {sparse_path}, using vector-only retrieval "
+                    f"(build it with 'python -m services.sparse_index build')"
+                )
+            elif len(sparse_index) != collection.count():
+                logger.warning(
+                    f"Sparse index has {len(sparse_index)} chunks but collection has {collection.count()}; "
+                    f"serving it as is (refresh it with 'python -m services.sparse_index build')"
+                )
+        
+        # Chunk ID -> position index for neighbor lookups (built on first use)
+        neighbor_index = NeighborIndexProvider(
+            self.vector_store_path,
+            collection.name,
+            collection
+        )
+        
+        return _ServingState(collection, embedder, vector_backend, sparse_index, neighbor_index)
+    
+    def _current_state(self) -> '_ServingState':
+        """
+        Get the serving state, switching to a new collection if the alias changed.
+        
+        Returns:
+            Serving state to use for one whole request
+        """
+        mtime = self.aliases.mtime()
+        if mtime != self._aliases_mtime:
+            with self._serving_lock:
+                if mtime != self._aliases_mtime:
+                    entry = self.aliases.get(self.collection_alias)
+                    if entry and entry['collection'] != self._serving.collection.name:
+                        try:
+                            # Requests in flight finish on the state they started with
+                            self._serving = self._open_serving_state()
+                            logger.info(f"Switched to collection '{self._serving.collection.name}'")
+                        except Exception as e:
+                            logger.error(f"Could not switch to collection '{entry['collection']}': {e}")
+                    self._aliases_mtime = mtime
+        return self._serving
+    
+    @property
+    def collection(self):
+        """Serving ChromaDB collection."""
+        return self._serving.collection
+    
+    @property
+    def collection_name(self) -> str:
+        """Name of the serving collection."""
+        return self._serving.collection.name
+    
+    @property
+    def embedder(self) -> Embedder:
+        """Embedder of the serving collection."""
+        return self._serving.embedder
+    
+    @property
+    def embedding_model_name(self) -> str:
+        """Embedding model of the serving collection."""
+        return self._serving.embedder.model_id
+    
+    @property
+    def vector_backend(self) -> VectorBackend:
+        """Vector backend of the serving collection."""
+        return self._serving.vector_backend
+    
+    @property
+    def sparse_index(self) -> Optional[BM25Index]:
+        """BM25 index of the serving collection (None for vector-only retrieval)."""
+        return self._serving.sparse_index
+    
+    @property
+    def neighbor_index(self) -> NeighborIndexProvider:
+        """Chunk neighbor index of the serving collection."""
+        return self._serving.neighbor_index
     
     def retrieve(
         self,
         query: str,
         top_k: int = 5,
-        filters: Optional[Dict[str, str]] = None
+        filters: Optional[Dict[str, str]] = None,
+        mode: Optional[str] = None
     ) -> List[Dict]:
         """
         Retrieve relevant context from NCERT content.
@@ -129,6 +290,7 @@ class RAGSystem:
             query: User query string
             top_k: Number of results to retrieve
             filters: Optional metadata filters (e.g., {'subject': 'Physics'})
+            mode: 'hybrid' (BM25 + vector with RRF) or 'vector' (default: from config)
         
         Returns:
             List of dictionaries containing retrieved context with metadata
@@ -137,37 +299,20 @@ class RAGSystem:
             logger.warning("Empty query provided")
             return []
         
+        mode = mode or self.retrieval_mode
+        state = self._current_state()
+        
         try:
-            # Generate query embedding using Cloudflare AI or local model
-            logger.debug(f"Encoding query: {query[:100]}...")
-            
-            if is_cloudflare_ai_enabled():
-                try:
-                    logger.debug("Using Cloudflare AI (BGE) for embeddings")
-                    cf_ai = get_cloudflare_ai()
-                    query_embedding = [cf_ai.generate_embeddings(query)]
-                except Exception as e:
-                    logger.error(f"Cloudflare embeddings failed, using local model: {e}")
-                    query_embedding = self.embedding_model.encode([query]).tolist()
-            else:
-                query_embedding = self.embedding_model.encode([query]).tolist()
-            
-            # Prepare query parameters
-            query_params = {
-                'query_embeddings': query_embedding,
-                'n_results': top_k
-            }
+            # Generate query embedding (cached per embedding model)
+            query_embedding = self.embed_query(query, state)
             
-            # Add filters if provided
-            if filters:
-                query_params['where'] = filters
+            if mode == 'hybrid' and state.sparse_index is not None and len(state.sparse_index) > 0:
+                results = self._hybrid_retrieve(query, query_embedding, top_k, filters, state=state)
+                logger.info(f"Retrieved {len(results)} results for query (hybrid)")
+                return results
             
             # Query the collection
-            logger.debug(f"Querying collection with top_k={top_k}")
-            results = self.collection.query(**query_params)
-            
-            # Format results
-            formatted_results = self._format_results(results, query)
+            formatted_results = self._vector_search(query, query_embedding, top_k, filters, state)
             
             # Rerank results by relevance
             reranked_results = self._rerank_results(formatted_results, query)
@@ -179,27 +324,273 @@ class RAGSystem:
             logger.error(f"Error during retrieval: {e}")
             return []
     
-    def _format_results(self, raw_results: Dict, query: str) -> List[Dict]:
+    def retrieve_many(
+        self,
+        queries: List[str],
+        top_k: int = 5,
+        filters: Optional[List[Optional[Dict[str, str]]]] = None,
+        mode: Optional[str] = None
+    ) -> List[List[Dict]]:
+        """
+        Retrieve context for several queries at once.
+        
+        All queries are embedded in one batch, and queries sharing the same
+        filters are sent to the vector backend as one multi-query request.
+        
+        Args:
+            queries: User query strings
+            top_k: Number of results to retrieve per query
+            filters: Optional metadata filters per query (same length as queries)
+            mode: 'hybrid' (BM25 + vector with RRF) or 'vector' (default: from config)
+        
+        Returns:
+            List of result lists, one per query, in input order
+        """
+        filters = filters or [None] * len(queries)
+        if len(filters) != len(queries):
+            raise ValueError("filters must have one entry per query")
+        
+        mode = mode or self.retrieval_mode
+        state = self._current_state()
+        use_hybrid = mode == 'hybrid' and state.sparse_index is not None and len(state.sparse_index) > 0
+        n_results = max(top_k, Config.RAG_HYBRID_CANDIDATES) if use_hybrid else top_k
+        
+        all_results: List[List[Dict]] = [[] for _ in queries]
+        positions = [i for i, query in enumerate(queries) if query and query.strip()]
+        if not positions:
+            return all_results
+        
+        try:
+            embeddings = self.embed_queries([queries[i] for i in positions], state)
+            embedding_of = dict(zip(positions, embeddings))
+            
+            # One vector query per distinct filter set
+            groups: Dict[str, List[int]] = {}
+            for i in positions:
+                groups.setdefault(repr(sorted((filters[i] or {}).items())), []).append(i)
+            
+            for group in groups.values():
+                group_filters = filters[group[0]]
+                raw = state.vector_backend.query_many(
+                    [embedding_of[i] for i in group],
+                    n_results,
+                    where=group_filters
+                )
+                
+                for position, i in enumerate(group):
+                    dense_results = self._format_results(raw, queries[i], position)
+                    if use_hybrid:
+                        all_results[i] = self._hybrid_retrieve(
+                            queries[i], embedding_of[i], top_k, group_filters, dense_results, state
+                        )
+                    else:
+                        all_results[i] = self._rerank_results(dense_results, queries[i])
+            
+            logger.info(
+                f"Retrieved results for {len(positions)} queries with {len(groups)} vector "
+                f"{'query' if len(groups) == 1 else 'queries'}"
+            )
+        except Exception as e:
+            logger.error(f"Error during batched retrieval: {e}")
+        
+        return all_results
+    
+    def _vector_search(
+        self,
+        query: str,
+        query_embedding: List[float],
+        n_results: int,
+        filters: Optional[Dict[str, str]] = None,
+        state: Optional[_ServingState] = None
+    ) -> List[Dict]:
+        """
+        Run a dense vector query against the collection.
+        
+        Args:
+            query: User query string
+            query_embedding: Query embedding
+            n_results: Number of results to retrieve
+            filters: Optional metadata filters
+            state: Serving state of the request (default: current)
+        
+        Returns:
+            List of formatted results, nearest first
+        """
+        vector_backend = (state or self._serving).vector_backend
+        logger.debug(f"Querying {vector_backend.name} backend with n_results={n_results}")
+        results = vector_backend.query(query_embedding, n_results, where=filters)
+        
+        return self._format_results(results, query)
+    
+    def _hybrid_retrieve(
+        self,
+        query: str,
+        query_embedding: List[float],
+        top_k: int,
+        filters: Optional[Dict[str, str]] = None,
+        dense_results: Optional[List[Dict]] = None,
+        state: Optional[_ServingState] = None
+    ) -> List[Dict]:
+        """
+        Retrieve with BM25 and vector search, fused by reciprocal-rank fusion.
+        
+        Each ranking contributes 1 / (k + rank) for every chunk it returns.
+        Chunks found only by BM25 are fetched from the collection, and their
+        vector distance is computed so relevance scores stay comparable.
+        
+        Args:
+            query: User query string
+            query_embedding: Query embedding
+            top_k: Number of results to return
+            filters: Optional metadata filters
+            dense_results: Vector search candidates already fetched (batched retrieval)
+            state: Serving state of the request (default: current)
+        
+        Returns:
+            List of results ordered by fused score
+        """
+        state = state or self._serving
+        n_candidates = max(top_k, Config.RAG_HYBRID_CANDIDATES)
+        rrf_k = Config.RAG_RRF_K
+        
+        if dense_results is None:
+            dense_results = self._vector_search(query, query_embedding, n_candidates, filters, state)
+        sparse_results = state.sparse_index.search(query, top_k=n_candidates, filters=filters)
+        
+        fused: Dict[str, float] = {}
+        for rank, result in enumerate(dense_results, start=1):
+            fused[result['id']] = fused.get(result['id'], 0.0) + 1.0 / (rrf_k + rank)
+        for rank, (chunk_id, _) in enumerate(sparse_results, start=1):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (rrf_k + rank)
+        
+        top_ids = [chunk_id for chunk_id, _ in sorted(fused.items(), key=lambda item: item[1], reverse=True)[:top_k]]
+        
+        by_id = {result['id']: result for result in dense_results}
+        dense_ranks = {result['id']: rank for rank, result in enumerate(dense_results, start=1)}
+        sparse_scores = {chunk_id: score for chunk_id, score in sparse_results}
+        sparse_ranks = {chunk_id: rank for rank, (chunk_id, _) in enumerate(sparse_results, start=1)}
+        
+        # Fetch chunks that only BM25 found; the backend scores them in the
+        # collection's own distance space so thresholds stay comparable
+        missing_ids = [chunk_id for chunk_id in top_ids if chunk_id not in by_id]
+        if missing_ids:
+            fetched = state.vector_backend.get(missing_ids, include=['documents', 'metadatas'])
+            distances = state.vector_backend.distances(query_embedding, missing_ids)
+            for chunk_id, doc, metadata in zip(fetched['ids'], fetched['documents'], fetched['metadatas']):
+                distance = distances.get(chunk_id)
+                if distance is None:
+                    continue
+                by_id[chunk_id] = {
+                    'content': doc,
+                    'metadata': metadata,
+                    'distance': distance,
+                    'id': chunk_id,
+                    'relevance_score': 1.0 / (1.0 + distance)
+                }
+        
+        results = []
+        for chunk_id in top_ids:
+            result = by_id.get(chunk_id)
+            if result is None:
+                continue
+            result['rank'] = len(results) + 1
+            result['rrf_score'] = fused[chunk_id]
+            result['dense_rank'] = dense_ranks.get(chunk_id)
+            result['sparse_rank'] = sparse_ranks.get(chunk_id)
+            result['bm25_score'] = sparse_scores.get(chunk_id, 0.0)
+            results.append(result)
+        
+        return results
+    
+    def embed_query(self, query: str, state: Optional[_ServingState] = None) -> List[float]:
+        """
+        Generate the embedding for a query, using the embedding cache when enabled.
+        
+        The query is embedded with the model of the serving collection, so
+        its vectors always match the stored ones.
+        
+        Args:
+            query: User query string
+            state: Serving state of the request (default: current)
+        
+        Returns:
+            Query embedding as a list of floats
+        """
+        embedder = (state or self._current_state()).embedder
+        
+        if self.embedding_cache is not None:
+            cached = self.embedding_cache.get(embedder.model_id, query)
+            if cached is not None:
+                logger.debug(f"Embedding cache hit for query: {query[:100]}")
+                return cached
+        
+        # Concurrent identical queries share one embedding call
+        logger.debug(f"Encoding query with {embedder.model_id}: {query[:100]}...")
+        key = flight_key(embedder.model_id, EmbeddingCache.normalize_query(query))
+        embedding = get_single_flight('query-embedding').do(key, embedder.embed_one, query)
+        
+        if self.embedding_cache is not None:
+            self.embedding_cache.put(embedder.model_id, query, embedding)
+        
+        return embedding
+    
+    def embed_queries(self, queries: List[str], state: Optional[_ServingState] = None) -> List[List[float]]:
+        """
+        Generate embeddings for several queries in one batch.
+        
+        Cached queries are served from the embedding cache; the rest (each
+        distinct text once) are embedded with a single batched call.
+        
+        Args:
+            queries: User query strings
+            state: Serving state of the request (default: current)
+        
+        Returns:
+            Query embeddings, in input order
+        """
+        embedder = (state or self._current_state()).embedder
+        
+        embeddings: Dict[str, List[float]] = {}
+        if self.embedding_cache is not None:
+            for query in queries:
+                cached = self.embedding_cache.get(embedder.model_id, query)
+                if cached is not None:
+                    embeddings[query] = cached
+        
+        missing = [query for query in dict.fromkeys(queries) if query not in embeddings]
+        if missing:
+            logger.debug(f"Encoding {len(missing)} queries in one batch")
+            vectors = embedder.embed(missing)
+            
+            for query, vector in zip(missing, vectors):
+                embeddings[query] = vector
+                if self.embedding_cache is not None:
+                    self.embedding_cache.put(embedder.model_id, query, vector)
+        
+        return [embeddings[query] for query in queries]
+    
+    def _format_results(self, raw_results: Dict, query: str, position: int = 0) -> List[Dict]:
         """
         Format raw ChromaDB results into structured dictionaries.
         
         Args:
             raw_results: Raw results from ChromaDB query
             query: Original query string
+            position: Which query's results to format (multi-query results)
         
         Returns:
             List of formatted result dictionaries
         """
         formatted = []
         
-        if not raw_results or not raw_results.get('documents'):
+        if not raw_results or not raw_results.get('documents') or position >= len(raw_results['documents']):
             return formatted
         
-        # ChromaDB returns results as lists of lists
-        documents = raw_results['documents'][0] if raw_results['documents'] else []
-        metadatas = raw_results['metadatas'][0] if raw_results['metadatas'] else []
-        distances = raw_results['distances'][0] if raw_results['distances'] else []
-        ids = raw_results['ids'][0] if raw_results['ids'] else []
+        # ChromaDB returns results as lists of lists (one list per query)
+        documents = raw_results['documents'][position] if raw_results['documents'] else []
+        metadatas = raw_results['metadatas'][position] if raw_results['metadatas'] else []
+        distances = raw_results['distances'][position] if raw_results['distances'] else []
+        ids = raw_results['ids'][position] if raw_results['ids'] else []
         
         for i, (doc, metadata, distance, doc_id) in enumerate(
             zip(documents, metadatas, distances, ids)
@@ -261,6 +652,148 @@ class RAGSystem:
         
         return reranked
     
+    def get_chunks(self, ids: List[str]) -> Dict[str, Dict]:
+        """
+        Fetch chunks by ID in one batched request.
+        
+        Args:
+            ids: Chunk IDs
+        
+        Returns:
+            Dictionary mapping chunk ID to {'content', 'metadata'} (missing IDs are omitted)
+        """
+        ids = list(dict.fromkeys(ids))
+        if not ids:
+            return {}
+        
+        try:
+            fetched = self.vector_backend.get(ids, include=['documents', 'metadatas'])
+        except Exception as e:
+            logger.error(f"Error fetching chunks by ID: {e}")
+            return {}
+        
+        return {
+            chunk_id: {'content': doc, 'metadata': metadata}
+            for chunk_id, doc, metadata in zip(fetched['ids'], fetched['documents'], fetched['metadatas'])
+        }
+    
+    def get_neighbor_chunks(self, results: List[Dict], window: int = 1) -> Dict[str, Dict[str, List[Dict]]]:
+        """
+        Get the chunks just before and after each result.
+        
+        Positions come from the chunk neighbor index, and all neighbors are
+        fetched with a single batched get. Merged results (see
+        merge_adjacent_results) take neighbors around their whole run.
+        
+        Args:
+            results: Retrieved results
+            window: Number of neighboring chunks on each side
+        
+        Returns:
+            Dictionary mapping result ID to {'before': [...], 'after': [...]} chunk lists
+        """
+        if not results or window <= 0:
+            return {}
+        
+        try:
+            index = self.neighbor_index.get()
+        except Exception as e:
+            logger.error(f"Error building chunk neighbor index: {e}")
+            return {}
+        
+        neighbor_ids = {}
+        for result in results:
+            run_ids = result.get('merged_ids') or [result.get('id')]
+            before, _ = index.neighbors(run_ids[0], window)
+            _, after = index.neighbors(run_ids[-1], window)
+            neighbor_ids[result.get('id')] = (before, after)
+        
+        chunks = self.get_chunks([
+            chunk_id for before, after in neighbor_ids.values() for chunk_id in before + after
+        ])
+        
+        return {
+            result_id: {
+                'before': [chunks[chunk_id] for chunk_id in before if chunk_id in chunks],
+                'after': [chunks[chunk_id] for chunk_id in after if chunk_id in chunks]
+            }
+            for result_id, (before, after) in neighbor_ids.items()
+        }
+    
+    def merge_adjacent_results(self, results: List[Dict]) -> List[Dict]:
+        """
+        Merge results that are consecutive chunks of the same PDF into one passage.
+        
+        The overlap the chunker repeats between consecutive chunks is kept
+        only once. A merged result keeps the ID, metadata and rank of its best
+        chunk, the highest relevance score, and lists its chunk IDs in
+        'merged_ids' (document order).
+        
+        Args:
+            results: Retrieved results
+        
+        Returns:
+            Results with adjacent hits merged, in their original order
+        """
+        if len(results) < 2:
+            return results
+        
+        try:
+            index = self.neighbor_index.get()
+        except Exception as e:
+            logger.error(f"Error building chunk neighbor index: {e}")
+            return results
+        
+        # Order hits by position within their file, keeping unknown chunks apart
+        located = []
+        for order, result in enumerate(results):
+            location = index.position(result.get('id'))
+            if location is not None:
+                located.append((location[0], location[1], order))
+        located.sort()
+        
+        # Runs of consecutive positions in the same file (indexes into located)
+        groups = []
+        for i, (file_name, position, _) in enumerate(located):
+            if groups:
+                last_file, last_position, _ = located[groups[-1][-1]]
+                if file_name == last_file and position == last_position + 1:
+                    groups[-1].append(i)
+                    continue
+            groups.append([i])
+        group_of = {located[i][2]: group_index for group_index, members in enumerate(groups) for i in members}
+        
+        merged_results = []
+        emitted = set()
+        for order, result in enumerate(results):
+            group_index = group_of.get(order)
+            if group_index is None:
+                merged_results.append(result)
+                continue
+            if group_index in emitted:
+                continue
+            emitted.add(group_index)
+            
+            members = [results[located[i][2]] for i in groups[group_index]]
+            if len(members) == 1:
+                merged_results.append(result)
+                continue
+            
+            content = members[0]['content']
+            for member in members[1:]:
+                content = join_overlapping(content, member['content'])
+            
+            merged = dict(result)
+            merged['content'] = content
+            merged['merged_ids'] = [member['id'] for member in members]
+            merged['relevance_score'] = max(member.get('relevance_score', 0.0) for member in members)
+            merged_results.append(merged)
+        
+        for i, result in enumerate(merged_results):
+            result['rank'] = i + 1
+        
+        return merged_results
+    
     def detect_multi_chapter_references(self, results: List[Dict]) -> Dict[str, List[Dict]]:
         """
         Detect and group results by chapter when multiple chapters are referenced.
@@ -337,8 +870,8 @@ class RAGSystem:
         if not results:
             return True
         
-        # Check if best result meets threshold
-        best_score = results[0].get('relevance_score', 0.0)
+        # Check if best result meets threshold (hybrid results are ordered by fused score)
+        best_score = max(result.get('relevance_score', 0.0) for result in results)
         
         if best_score < threshold:
             logger.info(f"Query appears out of scope (best score: {best_score:.3f})")
@@ -346,6 +879,33 @@ class RAGSystem:
         
         return False
     
+    def prescreen_query(self, query: str, threshold: Optional[float] = None) -> Optional[Dict]:
+        """
+        Answer obviously off-topic queries without embedding or retrieval.
+        
+        Args:
+            query: User query string
+            threshold: Off-topic confidence needed (default: Config.SCOPE_PRECLASSIFIER_CONFIDENCE)
+        
+        Returns:
+            Out-of-scope response (see handle_out_of_scope_query) if the query is
+            confidently off-topic, otherwise None
+        """
+        if self.scope_classifier is None or not query or not query.strip():
+            return None
+        
+        decision = self.scope_classifier.classify(query)
+        if decision['off_topic_confidence'] < (threshold if threshold is not None else Config.SCOPE_PRECLASSIFIER_CONFIDENCE):
+            return None
+        
+        logger.info(
+            f"Query pre-classified as out of scope ({decision['reason']}, "
+            f"confidence {decision['off_topic_confidence']:.2f})"
+        )
+        response = self.handle_out_of_scope_query(query)
+        response['prescreen'] = decision
+        return response
+    
     def handle_out_of_scope_query(self, query: str) -> Dict:
         """
         Handle queries that are out of NCERT scope.
@@ -423,7 +983,8 @@ class RAGSystem:
         self,
         query: str,
         top_k: int = 5,
-        include_references: bool = True
+        include_references: bool = True,
+        merge_adjacent: Optional[bool] = None
     ) -> Dict:
         """
         Get formatted context for LLM prompt generation.
@@ -432,6 +993,7 @@ class RAGSystem:
             query: User query string
             top_k: Number of results to retrieve
             include_references: Whether to include reference information
+            merge_adjacent: Merge consecutive chunks into one passage (default: from config)
         
         Returns:
             Dictionary with context, references, and metadata
@@ -443,6 +1005,12 @@ class RAGSystem:
         if self.is_out_of_scope(query, results):
             return self.handle_out_of_scope_query(query)
         
+        # Merge adjacent chunks so their overlap reaches the prompt once
+        if merge_adjacent is None:
+            merge_adjacent = Config.RAG_MERGE_ADJACENT
+        if merge_adjacent:
+            results = self.merge_adjacent_results(results)
+        
         # Extract context passages
         context_passages = [result['content'] for result in results]
         
@@ -461,7 +1029,7 @@ class RAGSystem:
             'multi_chapter': len(chapter_groups) > 1,
             'chapter_groups': chapter_groups,
             'num_results': len(results),
-            'top_relevance_score': results[0]['relevance_score'] if results else 0.0
+            'top_relevance_score': max(result['relevance_score'] for result in results) if results else 0.0
         }
         
         return formatted_context
@@ -509,13 +1077,22 @@ class RAGSystem:
             Dictionary containing collection statistics
         """
         try:
-            count = self.collection.count()
+            state = self._current_state()
+            count = state.collection.count()
             
             return {
                 'total_documents': count,
-                'collection_name': self.collection_name,
-                'embedding_model': self.embedding_model_name,
-                'vector_store_path': str(self.vector_store_path)
+                'collection_name': state.collection.name,
+                'collection_alias': self.collection_alias,
+                'embedding_model': state.embedder.model_id,
+                'vector_store_path': str(self.vector_store_path),
+                'retrieval_mode': self.retrieval_mode if state.sparse_index is not None else 'vector',
+                'vector_backend': state.vector_backend.get_stats(),
+                'sparse_index_chunks': len(state.sparse_index) if state.sparse_index is not None else 0,
+                'embedding_cache': (
+                    self.embedding_cache.get_stats() if self.embedding_cache is not None
+                    else {'enabled': False}
+                )
             }
         except Exception as e:
             logger.error(f"Error getting stats: {e}")
@@ -0,0 +1,245 @@
+"""
+Semantic Response Cache for GuruAI
+
+Caches complete answers (explanation, references, diagrams and quiz) keyed
+by the query embedding. A new query whose embedding is within a cosine
+similarity threshold of a recently answered query, in the same scope
+(model, RAG filters and response options), is served from the cache and
+skips retrieval, diagram lookup and both LLM calls.
+
+Features:
+- Cosine-similarity lookup over recently answered queries
+- Scoping by model, RAG filters and response options, and by the numbers
+  in the query: "a 2 kg mass" and "a 5 kg mass" embed almost identically
+  but need different answers
+- Eviction by size (oldest first) and age (TTL)
+- Hit/miss counters for monitoring
+"""
+
+import re
+import copy
+import time
+import threading
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_NUMBER_PATTERN = re.compile(r'\d+(?:,\d{3})*(?:\.\d+)?(?:[eE][-+]?\d+)?')
+
+
+def query_numbers(query: str) -> Tuple[str, ...]:
+    """
+    Extract the numbers of a query in a normalized form.
+    
+    Args:
+        query: User's question
+    
+    Returns:
+        Numbers in order of appearance ("3,000" -> "3000", "2.50" -> "2.5")
+    """
+    numbers = []
+    for match in _NUMBER_PATTERN.findall(query):
+        value = float(match.replace(',', ''))
+        numbers.append(str(int(value)) if value.is_integer() else repr(value))
+    return tuple(numbers)
+
+
+def make_scope(
+    model_name: str,
+    filters: Optional[Dict[str, str]] = None,
+    **options: Any
+) -> Tuple:
+    """
+    Build a hashable cache scope.
+    
+    Args:
+        model_name: Name of the model that generated the answer
+        filters: RAG metadata filters used for retrieval
+        **options: Response options that change the answer (e.g. include_quiz)
+    
+    Returns:
+        Hashable scope tuple
+    """
+    filters_key = tuple(sorted((str(k), str(v)) for k, v in (filters or {}).items()))
+    options_key = tuple(sorted((str(k), repr(v)) for k, v in options.items()))
+    return (model_name, filters_key, options_key)
+
+
+class SemanticResponseCache:
+    """
+    Thread-safe semantic cache of generated responses.
+    """
+    
+    def __init__(
+        self,
+        similarity_threshold: float = 0.95,
+        max_size: int = 1000,
+        ttl: Optional[float] = 3600
+    ):
+        """
+        Initialize the semantic response cache.
+        
+        Args:
+            similarity_threshold: Minimum cosine similarity for a cache hit
+            max_size: Maximum number of cached responses
+            ttl: Time-to-live for each entry in seconds (None or 0 disables expiry)
+        """
+        self.similarity_threshold = similarity_threshold
+        self.max_size = max(1, int(max_size))
+        self.ttl = ttl if ttl and ttl > 0 else None
+        
+        # entry_id -> (scope, unit vector, response, stored_at, query)
+        self._entries: "OrderedDict[int, Tuple[Tuple, np.ndarray, Dict, float, str]]" = OrderedDict()
+        # scope -> entry ids in that scope
+        self._scopes: Dict[Tuple, List[int]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+    
+    @staticmethod
+    def _normalize(embedding: List[float]) -> Optional[np.ndarray]:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(vector))
+        if norm == 0.0:
+            return None
+        return vector / norm
+    
+    def _remove_entry(self, entry_id: int) -> None:
+        scope = self._entries.pop(entry_id)[0]
+        ids = self._scopes.get(scope)
+        if ids is not None:
+            ids.remove(entry_id)
+            if not ids:
+                del self._scopes[scope]
+    
+    def _expire(self, now: float) -> None:
+        if self.ttl is None:
+            return
+        # Entries are kept in insertion order, so the oldest are first
+        while self._entries:
+            entry_id, entry = next(iter(self._entries.items()))
+            if now - entry[3] <= self.ttl:
+                break
+            self._remove_entry(entry_id)
+            self.expirations += 1
+    
+    def lookup(
+        self,
+        embedding: List[float],
+        scope: Tuple
+    ) -> Optional[Tuple[Dict[str, Any], float, str]]:
+        """
+        Find a cached response for a semantically similar query.
+        
+        Args:
+            embedding: Query embedding
+            scope: Cache scope from make_scope()
+        
+        Returns:
+            Tuple of (response copy, similarity, cached query) or None on a miss
+        """
+        vector = self._normalize(embedding)
+        
+        with self._lock:
+            self._expire(time.monotonic())
+            
+            ids = self._scopes.get(scope)
+            if vector is None or not ids:
+                self.misses += 1
+                return None
+            
+            # Never compare vectors from embedding models of different dimensions
+            candidates = [
+                self._entries[entry_id] for entry_id in ids
+                if self._entries[entry_id][1].shape == vector.shape
+            ]
+            if not candidates:
+                self.misses += 1
+                return None
+            
+            similarities = np.stack([entry[1] for entry in candidates]) @ vector
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            
+            if similarity < self.similarity_threshold:
+                self.misses += 1
+                return None
+            
+            self.hits += 1
+            entry = candidates[best]
+            return copy.deepcopy(entry[2]), similarity, entry[4]
+    
+    def store(
+        self,
+        embedding: List[float],
+        scope: Tuple,
+        response: Dict[str, Any],
+        query: str = ''
+    ) -> None:
+        """
+        Store a generated response.
+        
+        Args:
+            embedding: Query embedding
+            scope: Cache scope from make_scope()
+            response: Complete response dictionary
+            query: Original query (kept for logging/debugging)
+        """
+        vector = self._normalize(embedding)
+        if vector is None:
+            return
+        
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (scope, vector, copy.deepcopy(response), now, query)
+            self._scopes.setdefault(scope, []).append(entry_id)
+            
+            while len(self._entries) > self.max_size:
+                self._remove_entry(next(iter(self._entries)))
+                self.evictions += 1
+    
+    def clear(self) -> None:
+        """Remove all cached responses (statistics are kept)."""
+        with self._lock:
+            self._entries.clear()
+            self._scopes.clear()
+        logger.info("Response cache cleared")
+    
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get cache statistics.
+        
+        Returns:
+            Dictionary with size, capacity, threshold, hits, misses and hit rate
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'similarity_threshold': self.similarity_threshold,
+                'scopes': len(self._scopes),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': (self.hits / lookups) if lookups else 0.0
+            }
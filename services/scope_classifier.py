@@ -0,0 +1,270 @@
+"""
+Out-of-Scope Pre-Classifier for NCERT Queries
+
+Decides, before any embedding or vector query, whether a request is
+obviously not about NCERT content (greetings, "write me a poem", cricket
+scores), so QueryHandler can answer it with the out-of-scope response
+straight away. Everything else still goes through retrieval, where
+RAGSystem.is_out_of_scope makes the final call.
+
+Features:
+- Vocabulary trained from the NCERT chapters: each term is weighted by
+  how many chapters use it (taken from the BM25 index, or read from the
+  collection in vector-only mode)
+- Built-in lexicon of off-topic terms and a greeting pattern
+- Off-topic confidence = off-topic evidence / all evidence; unknown words
+  alone never reach the default threshold, so typos are not rejected
+- Persisted next to the collection and retrained when the chunk count changes
+- Classification is a tokenize plus a few dictionary lookups (microseconds)
+"""
+
+import re
+import json
+import math
+import logging
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from services.sparse_index import tokenize
+from utils.atomic_file import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+SCOPE_MODEL_VERSION = 1
+
+# Terms used in this many chapters count as full NCERT evidence
+CHAPTER_SATURATION = 5
+
+# Evidence from a word NCERT never uses (typos, names, slang)
+UNKNOWN_WEIGHT = 0.6
+
+# Unknown words alone cap the confidence below the default threshold
+UNKNOWN_ONLY_MAX_CONFIDENCE = 0.75
+
+_GREETING = re.compile(
+    r"^\s*(?:hi+|hello+|hey+|hii+|namaste|namaskar|yo|sup|"
+    r"good\s+(?:morning|afternoon|evening|night)|how\s+are\s+(?:you|u)|what'?s\s+up|"
+    r"thanks?(?:\s+you)?|thank\s+(?:you|u)|ok(?:ay)?|bye|goodbye|see\s+you)"
+    r"(?:\s+(?:guru|guruai|there|bro|sir|ma'?am|buddy))?[\s!.?,]*$",
+    re.IGNORECASE
+)
+
+# Words that carry no topic either way
+GENERIC_TERMS = frozenset({
+    'i', 'me', 'my', 'you', 'your', 'we', 'us', 'our', 'he', 'she', 'they', 'them',
+    'please', 'pls', 'plz', 'can', 'could', 'would', 'will', 'shall', 'should', 'do', 'does',
+    'did', 'tell', 'write', 'give', 'show', 'make', 'want', 'need', 'know', 'about', 'some',
+    'get', 'let', 'have', 'has', 'had', 'am', 'were', 'been', 'being', 'there', 'here', 'now',
+    'so', 'very', 'just', 'any', 'all', 'something', 'anything', 'help', 'like', 'm', 't', 'u',
+})
+
+# Terms that mark a request as off-topic for an NCERT tutor
+OFF_TOPIC_TERMS = frozenset({
+    # Small talk
+    'hi', 'hello', 'hey', 'namaste', 'thanks', 'thank', 'bye', 'goodbye', 'lol', 'bro',
+    # Creative writing and fun
+    'poem', 'poems', 'poetry', 'shayari', 'story', 'stories', 'song', 'songs', 'lyrics',
+    'joke', 'jokes', 'riddle', 'riddles', 'rap', 'meme', 'memes',
+    # Entertainment
+    'movie', 'movies', 'film', 'films', 'actor', 'actress', 'bollywood', 'hollywood',
+    'netflix', 'episode', 'anime', 'celebrity', 'singer', 'gaming', 'pubg', 'minecraft',
+    'fortnite', 'spotify',
+    # Sports
+    'cricket', 'ipl', 'football', 'fifa', 'tennis', 'kohli', 'dhoni', 'score', 'scores',
+    'wicket', 'tournament', 'worldcup', 'match', 'matches', 'playoffs',
+    # News, politics, weather
+    'news', 'election', 'elections', 'minister', 'politics', 'politician', 'weather',
+    'forecast', 'today', 'tonight', 'tomorrow', 'yesterday', 'latest',
+    # Shopping, food, money
+    'recipe', 'recipes', 'restaurant', 'pizza', 'biryani', 'buy', 'shopping', 'amazon',
+    'flipkart', 'discount', 'lottery', 'bitcoin', 'crypto', 'stocks', 'horoscope', 'zodiac',
+    'astrology',
+    # Social
+    'instagram', 'facebook', 'whatsapp', 'youtube', 'tiktok', 'girlfriend', 'boyfriend',
+    'dating', 'crush',
+})
+
+
+def scope_model_path_for(vector_store_path: Path, collection_name: str) -> Path:
+    """
+    Get the scope model file path for a collection.
+    
+    Args:
+        vector_store_path: ChromaDB directory
+        collection_name: (Logical) collection name
+    
+    Returns:
+        Path of the persisted model
+    """
+    return Path(vector_store_path) / f"{collection_name}_scope.json"
+
+
+class ScopeClassifier:
+    """
+    Keyword model of the NCERT vocabulary for cheap off-topic detection.
+    """
+    
+    def __init__(self, chapter_counts: Dict[str, int], chunks: int = 0, path: Optional[Path] = None):
+        """
+        Create a classifier from term chapter counts.
+        
+        Args:
+            chapter_counts: Term -> number of chapters using it
+            chunks: Number of chunks the model was trained on
+            path: File the model is persisted to
+        """
+        self.chunks = chunks
+        self.path = Path(path) if path else None
+        saturation = math.log1p(CHAPTER_SATURATION)
+        self.weights: Dict[str, float] = {
+            term: min(1.0, math.log1p(count) / saturation)
+            for term, count in chapter_counts.items()
+            if term not in OFF_TOPIC_TERMS
+        }
+        self._chapter_counts = chapter_counts
+    
+    @classmethod
+    def from_sparse_index(cls, sparse_index, path: Optional[Path] = None) -> 'ScopeClassifier':
+        """
+        Train from the BM25 index (no extra pass over the collection).
+        
+        Args:
+            sparse_index: BM25Index over the collection
+            path: File the model is persisted to
+        
+        Returns:
+            The classifier
+        """
+        return cls(sparse_index.chapter_frequencies(), len(sparse_index), path)
+    
+    @classmethod
+    def from_collection(cls, collection, path: Optional[Path] = None, page_size: int = 1000) -> 'ScopeClassifier':
+        """
+        Train from the chunk text of a ChromaDB collection.
+        
+        Args:
+            collection: ChromaDB collection
+            path: File the model is persisted to
+            page_size: Chunks fetched per request
+        
+        Returns:
+            The classifier
+        """
+        chapters: Dict[str, set] = {}
+        chunks = 0
+        offset = 0
+        while True:
+            page = collection.get(include=['documents', 'metadatas'], limit=page_size, offset=offset)
+            ids = page.get('ids') or []
+            if not ids:
+                break
+            for doc, meta in zip(page['documents'], page['metadatas']):
+                meta = meta or {}
+                chapter = (meta.get('subject'), meta.get('class_level'), meta.get('chapter'))
+                for term in set(tokenize(doc or '')):
+                    chapters.setdefault(term, set()).add(chapter)
+            chunks += len(ids)
+            offset += len(ids)
+        
+        return cls({term: len(found) for term, found in chapters.items()}, chunks, path)
+    
+    def save(self) -> None:
+        """Persist the model atomically (temp file + rename)."""
+        if self.path is None:
+            return
+        
+        write_json_atomic(
+            self.path,
+            {'version': SCOPE_MODEL_VERSION, 'chunks': self.chunks, 'chapters': self._chapter_counts}
+        )
+    
+    @classmethod
+    def load(cls, path: Path) -> Optional['ScopeClassifier']:
+        """
+        Load a persisted model.
+        
+        Args:
+            path: Model file path
+        
+        Returns:
+            The classifier, or None if the file is missing, unreadable or outdated
+        """
+        path = Path(path)
+        if not path.exists():
+            return None
+        
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable scope model {path}: {e}")
+            return None
+        
+        if data.get('version') != SCOPE_MODEL_VERSION:
+            return None
+        return cls(data['chapters'], data.get('chunks', 0), path)
+    
+    @classmethod
+    def load_or_train(cls, path: Path, collection, sparse_index=None) -> 'ScopeClassifier':
+        """
+        Load the persisted model, retraining it if the collection changed.
+        
+        Args:
+            path: Model file path
+            collection: ChromaDB collection the model describes
+            sparse_index: BM25 index over the collection (used for training when given)
+        
+        Returns:
+            The classifier
+        """
+        model = cls.load(path)
+        count = collection.count()
+        if model is not None and model.chunks == count:
+            return model
+        
+        if sparse_index is not None and len(sparse_index) == count:
+            model = cls.from_sparse_index(sparse_index, path)
+        else:
+            model = cls.from_collection(collection, path)
+        
+        try:
+            model.save()
+        except Exception as e:
+            logger.warning(f"Could not save scope model: {e}")
+        
+        logger.info(f"Trained scope model on {model.chunks} chunks ({len(model.weights)} terms)")
+        return model
+    
+    def classify(self, query: str) -> Dict[str, Any]:
+        """
+        Estimate how confidently a query is off-topic.
+        
+        Args:
+            query: User query string
+        
+        Returns:
+            Dictionary with 'off_topic_confidence' (0-1), 'reason' and the
+            matched 'off_topic_terms' and 'unknown_terms'
+        """
+        if _GREETING.match(query):
+            return {'off_topic_confidence': 1.0, 'reason': 'greeting', 'off_topic_terms': [], 'unknown_terms': []}
+        
+        terms = [term for term in tokenize(query) if term not in GENERIC_TERMS]
+        if not terms:
+            return {'off_topic_confidence': 0.0, 'reason': 'no_terms', 'off_topic_terms': [], 'unknown_terms': []}
+        
+        off_topic = [term for term in terms if term in OFF_TOPIC_TERMS]
+        unknown = [term for term in terms if term not in OFF_TOPIC_TERMS and term not in self.weights]
+        in_scope = sum(self.weights.get(term, 0.0) for term in terms)
+        off_scope = len(off_topic) + UNKNOWN_WEIGHT * len(unknown)
+        
+        confidence = off_scope / (off_scope + in_scope) if off_scope + in_scope > 0 else 0.0
+        if not off_topic:
+            confidence = min(confidence, UNKNOWN_ONLY_MAX_CONFIDENCE)
+        
+        return {
+            'off_topic_confidence': round(confidence, 4),
+            'reason': 'off_topic_terms' if off_topic else ('unknown_terms' if unknown else 'ncert_terms'),
+            'off_topic_terms': off_topic,
+            'unknown_terms': unknown
+        }
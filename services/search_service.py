@@ -3,9 +3,11 @@ Search Service for GuruAI - Semantic search across NCERT content.
 
 This module implements comprehensive search functionality including:
 - Semantic search across NCERT content
+- Batched multi-query search (one embedding batch, shared diagram lookups)
 - Metadata extraction (subject, class, chapter, page)
 - Result ranking by relevance
-- Context display with surrounding paragraphs
+- Context display with neighboring chunks (batched lookup by chunk ID)
+- Optional merging of adjacent hits into one passage
 - Diagram inclusion in search results when captions match
 - Semantic suggestions for no-results scenarios
 
@@ -14,10 +16,11 @@ Requirements: 9.1, 9.2, 9.3, 9.4, 9.5
 
 import logging
 import re
-from typing import List, Dict, Optional, Any
-from pathlib import Path
+from typing import List, Dict, Optional, Any, Tuple, Union
 
 from services.rag_system import RAGSystem
+from services.chunk_neighbors import overlap_size
+from services.diagram_repository import get_diagram_repository
 from config import Config
 
 # Setup logging
@@ -51,7 +54,7 @@ class SearchService:
         self.rag = rag_system
         
         # Initialize diagram search
-        self.diagram_db_path = diagram_db_path or (Path(__file__).parent.parent / 'diagrams.db')
+        self.diagram_db_path = diagram_db_path or Config.DIAGRAM_DB_PATH
         self._init_diagram_search()
         
         logger.info("SearchService initialized successfully")
@@ -59,20 +62,12 @@ class SearchService:
     def _init_diagram_search(self):
         """Initialize diagram search system."""
         try:
-            from sqlalchemy import create_engine
-            from sqlalchemy.orm import sessionmaker
-            from services.diagram_processor_final import DiagramPage
-            
-            self.diagram_engine = create_engine(f'sqlite:///{self.diagram_db_path}')
-            Session = sessionmaker(bind=self.diagram_engine)
-            self.diagram_session = Session()
-            self.DiagramPage = DiagramPage
-            
+            # Shared, thread-safe read-only access (one engine per process)
+            self.diagrams = get_diagram_repository(self.diagram_db_path)
             logger.info(f"Diagram search initialized with database: {self.diagram_db_path}")
         except Exception as e:
             logger.warning(f"Could not initialize diagram search: {e}")
-            self.diagram_session = None
-            self.DiagramPage = None
+            self.diagrams = None
     
     def search(
         self,
@@ -82,7 +77,9 @@ class SearchService:
         chapter: Optional[int] = None,
         top_k: int = 10,
         include_context: bool = True,
-        include_diagrams: bool = True
+        include_diagrams: bool = True,
+        context_window: int = 1,
+        merge_adjacent: bool = False
     ) -> Dict[str, Any]:
         """
         Perform comprehensive search across NCERT content.
@@ -95,6 +92,8 @@ class SearchService:
             top_k: Number of results to return
             include_context: Whether to include surrounding context
             include_diagrams: Whether to search and include diagrams
+            context_window: Number of neighboring chunks on each side used as context
+            merge_adjacent: Whether to merge consecutive chunks into one result
         
         Returns:
             Dictionary containing:
@@ -126,11 +125,16 @@ class SearchService:
             if not raw_results:
                 return self._handle_no_results(query, filters)
             
+            # Merge consecutive chunks into single passages
+            if merge_adjacent:
+                raw_results = self.rag.merge_adjacent_results(raw_results)
+            
             # Format results with metadata and context
             formatted_results = self._format_search_results(
                 raw_results,
                 query,
-                include_context=include_context
+                include_context=include_context,
+                context_window=context_window
             )
             
             # Search for matching diagrams
@@ -148,7 +152,8 @@ class SearchService:
                     'query': query,
                     'filters': filters,
                     'has_filters': bool(filters),
-                    'top_k': top_k
+                    'top_k': top_k,
+                    'merge_adjacent': merge_adjacent
                 }
             }
             
@@ -159,6 +164,143 @@ class SearchService:
             logger.error(f"Error during search: {e}", exc_info=True)
             return self._format_error_response(f"Search failed: {str(e)}")
     
+    def search_many(
+        self,
+        queries: List[Union[str, Dict[str, Any]]],
+        subject: Optional[str] = None,
+        class_level: Optional[int] = None,
+        chapter: Optional[int] = None,
+        top_k: int = 10,
+        include_context: bool = True,
+        include_diagrams: bool = True,
+        context_window: int = 1,
+        merge_adjacent: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Search NCERT content for several queries in one pass.
+        
+        All queries are embedded in one batch and sent to the vector store as
+        one multi-query request per distinct filter set. Neighbor chunks are
+        fetched in one lookup, and diagram lookups shared by several queries
+        (same chapter or same caption keywords) run once.
+        
+        Args:
+            queries: Query strings, or dicts with 'q' and optional 'subject',
+                'class' and 'chapter' overriding the shared filters
+            subject: Shared subject filter
+            class_level: Shared class level filter
+            chapter: Shared chapter filter
+            top_k: Number of results to return per query
+            include_context: Whether to include surrounding context
+            include_diagrams: Whether to search and include diagrams
+            context_window: Number of neighboring chunks on each side used as context
+            merge_adjacent: Whether to merge consecutive chunks into one result
+        
+        Returns:
+            Dictionary containing:
+                - results: Per-entry responses (as returned by search), in input order
+                - total_queries: Number of distinct (query, filters) searches
+                - query_info: Information about the batch
+        """
+        try:
+            logger.info(f"Batch search for {len(queries)} queries")
+            
+            # Normalize entries; repeated (query, filters) pairs are searched once
+            entries: Dict[Tuple, Tuple[str, Optional[Dict[str, Any]]]] = {}
+            responses: Dict[Tuple, Dict[str, Any]] = {}
+            order: List[Tuple] = []
+            for entry in queries:
+                if isinstance(entry, dict):
+                    query = str(entry.get('q', '')).strip()
+                    filters = self._build_filters(
+                        entry.get('subject', subject),
+                        entry.get('class', class_level),
+                        entry.get('chapter', chapter)
+                    )
+                else:
+                    query = str(entry).strip()
+                    filters = self._build_filters(subject, class_level, chapter)
+                
+                key = (query, tuple(sorted((filters or {}).items())))
+                order.append(key)
+                if key in entries or key in responses:
+                    continue
+                is_valid, error_msg = self._validate_query(query)
+                if not is_valid:
+                    responses[key] = self._format_error_response(error_msg)
+                    continue
+                entries[key] = (query, filters)
+            
+            batch_keys = list(entries)
+            raw_lists = self.rag.retrieve_many(
+                [entries[key][0] for key in batch_keys],
+                top_k=top_k,
+                filters=[entries[key][1] for key in batch_keys]
+            )
+            
+            if merge_adjacent:
+                raw_lists = [self.rag.merge_adjacent_results(raw_results) for raw_results in raw_lists]
+            
+            # Neighboring chunks for every query's results in one batched lookup
+            neighbor_chunks = {}
+            if include_context:
+                neighbor_chunks = self.rag.get_neighbor_chunks(
+                    [result for raw_results in raw_lists for result in raw_results],
+                    window=context_window
+                )
+            
+            diagram_cache: Dict[Any, List[Dict]] = {}
+            for key, raw_results in zip(batch_keys, raw_lists):
+                query, filters = entries[key]
+                if not raw_results:
+                    responses[key] = self._handle_no_results(query, filters)
+                    continue
+                
+                formatted_results = self._format_search_results(
+                    raw_results,
+                    query,
+                    include_context=include_context,
+                    context_window=context_window,
+                    neighbor_chunks=neighbor_chunks
+                )
+                
+                diagrams = []
+                if include_diagrams:
+                    diagrams = self._search_diagrams(query, formatted_results, filters, cache=diagram_cache)
+                
+                responses[key] = {
+                    'success': True,
+                    'results': formatted_results,
+                    'total': len(formatted_results),
+                    'diagrams': diagrams,
+                    'query_info': {
+                        'query': query,
+                        'filters': filters,
+                        'has_filters': bool(filters),
+                        'top_k': top_k,
+                        'merge_adjacent': merge_adjacent
+                    }
+                }
+            
+            logger.info(
+                f"Batch search completed: {len(responses)} queries, "
+                f"{len(diagram_cache)} diagram lookups"
+            )
+            return {
+                'success': True,
+                'results': [responses[key] for key in order],
+                'total_queries': len(responses),
+                'query_info': {
+                    'top_k': top_k,
+                    'context_window': context_window,
+                    'merge_adjacent': merge_adjacent
+                }
+            }
+        
+        except Exception as e:
+            logger.error(f"Error during batch search: {e}", exc_info=True)
+            return self._format_error_response(f"Batch search failed: {str(e)}")
+    
     def _validate_query(self, query: str) -> tuple[bool, Optional[str]]:
         """
         Validate search query.
@@ -216,7 +358,9 @@ class SearchService:
         self,
         raw_results: List[Dict],
         query: str,
-        include_context: bool = True
+        include_context: bool = True,
+        context_window: int = 1,
+        neighbor_chunks: Optional[Dict[str, Dict[str, List[Dict]]]] = None
     ) -> List[Dict]:
         """
         Format search results with complete metadata and context.
@@ -225,12 +369,20 @@ class SearchService:
             raw_results: Raw results from RAG system
             query: Original search query
             include_context: Whether to include surrounding context
+            context_window: Number of neighboring chunks on each side used as context
+            neighbor_chunks: Neighboring chunks already fetched (batch search)
         
         Returns:
             List of formatted search result dictionaries
         """
         formatted_results = []
         
+        # Fetch neighboring chunks for all results in one batched lookup
+        if neighbor_chunks is None:
+            neighbor_chunks = {}
+            if include_context:
+                neighbor_chunks = self.rag.get_neighbor_chunks(raw_results, window=context_window)
+        
         for result in raw_results:
             metadata = result.get('metadata', {})
             content = result.get('content', '')
@@ -266,12 +418,16 @@ class SearchService:
                 'highlight': self._highlight_query_terms(content, query)
             }
             
+            if result.get('merged_ids'):
+                formatted_result['merged_ids'] = result['merged_ids']
+            
             # Add surrounding context if requested
             if include_context:
                 formatted_result['context'] = self._get_surrounding_context(
                     content,
                     result.get('id', ''),
-                    metadata
+                    metadata,
+                    neighbor_chunks.get(result.get('id', ''))
                 )
             
             formatted_results.append(formatted_result)
@@ -356,31 +512,50 @@ class SearchService:
         self,
         content: str,
         doc_id: str,
-        metadata: Dict
+        metadata: Dict,
+        neighbors: Optional[Dict[str, List[Dict]]] = None
     ) -> Dict[str, str]:
         """
         Get surrounding context paragraphs for a search result.
         
+        Uses the neighboring chunks from the same PDF. The words each chunk
+        repeats from its predecessor are dropped, so 'full' reads as one
+        continuous passage.
+        
         Args:
             content: Main content text
             doc_id: Document ID
             metadata: Document metadata
+            neighbors: Chunks before and after this result (from RAGSystem.get_neighbor_chunks)
         
         Returns:
             Dictionary with before and after context
         """
-        # For now, return the content itself as context
-        # In a full implementation, this would query adjacent chunks
-        # from the vector store based on doc_id and metadata
+        neighbors = neighbors or {}
+        content_words = content.split()
+        
+        # Text before the result, without the overlap it shares with the result
+        before_words = []
+        for chunk in neighbors.get('before', []):
+            chunk_words = chunk['content'].split()
+            before_words += chunk_words[overlap_size(before_words, chunk_words):]
+        before_words = before_words[:len(before_words) - overlap_size(before_words, content_words)]
         
-        # Split content into sentences
-        sentences = re.split(r'[.!?]+', content)
+        # Text after the result, without the overlap it shares with the result
+        after_words = []
+        previous_words = content_words
+        for chunk in neighbors.get('after', []):
+            chunk_words = chunk['content'].split()
+            after_words += chunk_words[overlap_size(previous_words, chunk_words):]
+            previous_words = chunk_words
+        
+        before = ' '.join(before_words)
+        after = ' '.join(after_words)
         
-        # Return first and last sentences as context
         context = {
-            'before': sentences[0].strip() if sentences else '',
-            'after': sentences[-1].strip() if len(sentences) > 1 else '',
-            'full': content
+            'before': before,
+            'after': after,
+            'full': ' '.join(part for part in (before, content, after) if part)
         }
         
         return context
@@ -389,7 +564,8 @@ class SearchService:
         self,
         query: str,
         search_results: List[Dict],
-        filters: Optional[Dict[str, str]]
+        filters: Optional[Dict[str, str]],
+        cache: Optional[Dict[Any, List[Dict]]] = None
     ) -> List[Dict]:
         """
         Search for diagrams matching the query and search results.
@@ -398,11 +574,12 @@ class SearchService:
             query: Search query
             search_results: Text search results
             filters: Applied filters
+            cache: Lookup results shared across the queries of a batch search
         
         Returns:
             List of matching diagrams
         """
-        if not self.diagram_session or not self.DiagramPage:
+        if not self.diagrams:
             logger.warning("Diagram search not available")
             return []
         
@@ -425,20 +602,20 @@ class SearchService:
                     except (ValueError, TypeError):
                         continue
             
-            # Query diagrams from these chapters
-            for subject, class_level, chapter in chapters_found:
-                chapter_diagrams = self.diagram_session.query(self.DiagramPage).filter_by(
-                    subject=subject,
-                    class_level=class_level,
-                    chapter=chapter
-                ).limit(3).all()
-                
-                for diag in chapter_diagrams:
-                    diagrams.append(diag.to_dict())
+            # Query diagrams from these chapters (one query for the uncached ones)
+            chapter_diagrams = self.diagrams.get_chapter_diagrams(chapters_found, limit=3)
+            for chapter_key in chapters_found:
+                diagrams.extend(chapter_diagrams[chapter_key])
             
             # Strategy 2: Search by caption keywords
             if len(diagrams) < 5:
-                caption_diagrams = self._search_diagrams_by_caption(query, filters)
+                cache_key = ('caption', tuple(self._extract_keywords(query)), repr(sorted((filters or {}).items())))
+                if cache is not None and cache_key in cache:
+                    caption_diagrams = cache[cache_key]
+                else:
+                    caption_diagrams = self._search_diagrams_by_caption(query, filters)
+                    if cache is not None:
+                        cache[cache_key] = caption_diagrams
                 diagrams.extend(caption_diagrams)
             
             # Remove duplicates and limit results
@@ -480,38 +657,11 @@ class SearchService:
             # Extract keywords from query
             keywords = self._extract_keywords(query)
             
-            if not keywords:
+            if not keywords or not self.diagrams:
                 return []
             
-            # Build base query
-            base_query = self.diagram_session.query(self.DiagramPage)
-            
-            # Apply filters if provided
-            if filters:
-                if 'subject' in filters:
-                    base_query = base_query.filter_by(subject=filters['subject'])
-                if 'class_level' in filters:
-                    base_query = base_query.filter_by(class_level=int(filters['class_level']))
-                if 'chapter' in filters:
-                    base_query = base_query.filter_by(chapter=int(filters['chapter']))
-            
-            # Search in captions
-            diagrams = []
-            all_diagrams = base_query.all()
-            
-            for diag in all_diagrams:
-                captions_str = diag.captions.lower() if diag.captions else ""
-                
-                # Check if any keyword matches
-                for keyword in keywords:
-                    if keyword.lower() in captions_str:
-                        diagrams.append(diag.to_dict())
-                        break
-                
-                if len(diagrams) >= max_results:
-                    break
-            
-            return diagrams
+            # Ranked caption index query, filters and limit in SQL (substring scan if the index is unavailable)
+            return self.diagrams.search_captions(keywords, filters, limit=max_results)
             
         except Exception as e:
             logger.error(f"Error in caption search: {e}")
@@ -712,9 +862,9 @@ class SearchService:
         }
         
         # Add diagram count if available
-        if self.diagram_session and self.DiagramPage:
+        if self.diagrams:
             try:
-                diagram_count = self.diagram_session.query(self.DiagramPage).count()
+                diagram_count = self.diagrams.count()
                 stats['total_diagrams'] = diagram_count
             except Exception:
                 stats['total_diagrams'] = 0
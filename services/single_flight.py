@@ -0,0 +1,272 @@
+"""
+Single-Flight Request Coalescing
+
+When a question is shared with a class, many identical requests arrive at
+the same moment. Caches do not help with that: they are only filled once
+the first call returns. A single-flight group makes concurrent duplicates
+wait for the call already in flight and share its result, so the model or
+embedding API is called once.
+
+Features:
+- SingleFlight.do(key, func, ...): the first caller for a key runs func,
+  callers arriving while it runs wait for it and get the same result (or
+  exception); the key is forgotten as soon as the call finishes, so nothing
+  is cached beyond the call itself
+- SingleFlight.do_async: the same for coroutine functions; async and
+  blocking callers of one group coalesce with each other, and async
+  callers wait without blocking their event loop
+- flight_key: hash of everything that determines a call's result (model,
+  prompt or messages, sampling parameters)
+- Every caller gets its own result: when anyone waited, the leader takes
+  a private snapshot before it wakes them, and each waiter deep-copies
+  that snapshot, so no caller can modify what another is still copying
+- Named process-wide groups (LLM backends, embeddings) with counters of
+  calls and coalesced calls for monitoring
+- Config.SINGLE_FLIGHT_ENABLED turns coalescing off (every call runs)
+
+Coalescing only spans the threads of one process; gunicorn workers each
+have their own groups. Streaming generations are not coalesced.
+"""
+
+import copy
+import asyncio
+import json
+import hashlib
+import logging
+import threading
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def flight_key(*parts: Any) -> str:
+    """
+    Build a single-flight key from the parameters of a call.
+    
+    Args:
+        *parts: Values that determine the call's result (JSON-serializable,
+            others are converted with str())
+    
+    Returns:
+        SHA-256 hex digest
+    """
+    payload = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+        self.async_waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+    
+    def shared_result(self) -> Any:
+        """The result for one waiter (its own copy of the leader's snapshot)."""
+        if self.error is not None:
+            raise self.error
+        return copy.deepcopy(self.result)
+
+
+def _wake(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class SingleFlight:
+    """
+    Thread-safe group of in-flight calls, by key.
+    """
+    
+    def __init__(self, name: str):
+        """
+        Create an empty group.
+        
+        Args:
+            name: Group name (for logging and statistics)
+        """
+        self.name = name
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.coalesced = 0
+    
+    def _join(self, key: str, waiter: Optional[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = None) -> Tuple[_Call, bool]:
+        """
+        Get the call in flight for key, or start one.
+        
+        Args:
+            key: Identity of the call
+            waiter: Event loop and future to wake when the call finishes (async callers)
+        
+        Returns:
+            Tuple of (call, whether this caller leads it)
+        """
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                return call, True
+            call.waiters += 1
+            self.coalesced += 1
+            if waiter is not None:
+                call.async_waiters.append(waiter)
+            return call, False
+    
+    def _finish(self, key: str, call: _Call, result: Any, error: Optional[BaseException]) -> None:
+        """
+        Publish the leader's outcome and wake every waiter.
+        
+        The key is forgotten under the lock, so no waiter can join after the
+        snapshot is taken; the snapshot is never handed out itself, only
+        copied, and the leader keeps the original.
+        """
+        with self._lock:
+            del self._calls[key]
+            async_waiters = call.async_waiters
+            if error is None and call.waiters:
+                call.result = copy.deepcopy(result)
+            call.error = error
+        
+        call.done.set()
+        for loop, future in async_waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, future)
+            except RuntimeError:
+                # The waiter's event loop has been closed
+                pass
+        if call.waiters:
+            logger.info(f"[{self.name}] shared one call with {call.waiters} identical request(s)")
+    
+    def do(self, key: str, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Run func, or wait for the identical call already running.
+        
+        If the call in flight was an async one that got cancelled, waiters
+        run func themselves instead of failing with it.
+        
+        Args:
+            key: Identity of the call (see flight_key)
+            func: Callable producing the result
+            *args: Positional arguments for func
+            **kwargs: Keyword arguments for func
+        
+        Returns:
+            The call's result (a copy of it for callers that waited)
+        
+        Raises:
+            Exception: Whatever the call raised, re-raised in every waiting caller
+        """
+        if not Config.SINGLE_FLIGHT_ENABLED:
+            return func(*args, **kwargs)
+        
+        call, leader = self._join(key)
+        if not leader:
+            logger.debug(f"[{self.name}] waiting for identical call in flight")
+            call.done.wait()
+            if isinstance(call.error, asyncio.CancelledError):
+                return func(*args, **kwargs)
+            return call.shared_result()
+        
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            self._finish(key, call, None, e)
+            raise
+        self._finish(key, call, result, None)
+        return result
+    
+    async def do_async(self, key: str, func: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """
+        Await func, or wait for the identical call already running.
+        
+        If the call in flight is cancelled (its caller timed out), waiters
+        run func themselves instead of failing with it.
+        
+        Args:
+            key: Identity of the call (see flight_key)
+            func: Coroutine function producing the result
+            *args: Positional arguments for func
+            **kwargs: Keyword arguments for func
+        
+        Returns:
+            The call's result (a copy of it for callers that waited)
+        
+        Raises:
+            Exception: Whatever the call raised, re-raised in every waiting caller
+        """
+        if not Config.SINGLE_FLIGHT_ENABLED:
+            return await func(*args, **kwargs)
+        
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        call, leader = self._join(key, (loop, future))
+        if not leader:
+            logger.debug(f"[{self.name}] waiting for identical call in flight")
+            await future
+            if isinstance(call.error, asyncio.CancelledError):
+                return await func(*args, **kwargs)
+            return call.shared_result()
+        
+        try:
+            result = await func(*args, **kwargs)
+        except BaseException as e:
+            self._finish(key, call, None, e)
+            raise
+        self._finish(key, call, result, None)
+        return result
+    
+    def after_fork(self) -> None:
+        """Forget calls and the lock inherited from the parent process."""
+        self._lock = threading.Lock()
+        self._calls = {}
+    
+    def get_stats(self) -> Dict[str, int]:
+        """Calls, coalesced calls and calls in flight."""
+        with self._lock:
+            return {'calls': self.calls, 'coalesced': self.coalesced, 'in_flight': len(self._calls)}
+
+
+_groups: Dict[str, SingleFlight] = {}
+_groups_lock = threading.Lock()
+
+
+def get_single_flight(name: str) -> SingleFlight:
+    """
+    Get the process-wide single-flight group with this name.
+    
+    Args:
+        name: Group name (e.g. 'gemini', 'cloudflare-chat', 'local-llm', 'query-embedding')
+    
+    Returns:
+        Shared SingleFlight
+    """
+    with _groups_lock:
+        group = _groups.get(name)
+        if group is None:
+            group = _groups[name] = SingleFlight(name)
+        return group
+
+
+def get_single_flight_stats() -> Dict[str, Dict[str, int]]:
+    """
+    Statistics of every single-flight group.
+    
+    Returns:
+        Dictionary of group statistics by name
+    """
+    with _groups_lock:
+        groups = list(_groups.values())
+    return {group.name: group.get_stats() for group in groups}
+
+
+def reset_single_flights_after_fork() -> None:
+    """Reset every group in a forked worker (calls in flight belong to the parent)."""
+    global _groups_lock
+    _groups_lock = threading.Lock()
+    for group in _groups.values():
+        group.after_fork()
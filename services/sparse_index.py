@@ -0,0 +1,459 @@
+"""
+Sparse (BM25) Index for NCERT Content
+
+In-process BM25 keyword index over chunk text, kept alongside the ChromaDB
+collection. Dense embeddings are good at paraphrases but often miss exact
+terms such as "Bernoulli", "SN2" or formula names; BM25 catches those, and
+RAGSystem fuses both rankings with reciprocal-rank fusion.
+
+Features:
+- Incremental add/update/remove (driven by NCERTProcessor at ingest)
+- Metadata equality filters matching the RAG filter dictionaries
+- Persisted next to the collection by ingestion or the build command; serving
+  processes only load it (retrieval is vector-only until it exists)
+- Read-only serving copies shared per process (and across pre-forked workers)
+
+Usage:
+    python -m services.sparse_index build
+"""
+
+import re
+import math
+import pickle
+import logging
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from utils.atomic_file import atomic_write
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+
+# Metadata fields kept in the index so filtered searches need no extra lookups
+INDEXED_METADATA_FIELDS = ('subject', 'class_level', 'chapter', 'file_name', 'page_number', 'chunk_index')
+
+_TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+_STOPWORDS = frozenset({
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'how', 'in',
+    'is', 'it', 'its', 'of', 'on', 'or', 's', 'that', 'the', 'this', 'to', 'was',
+    'what', 'when', 'where', 'which', 'who', 'why', 'with', 'explain', 'describe'
+})
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split text into lowercase alphanumeric terms, dropping stopwords.
+    
+    Alphanumeric runs are kept whole, so "SN2" and "H2O" stay single terms.
+    
+    Args:
+        text: Text to tokenize
+    
+    Returns:
+        List of terms
+    """
+    return [term for term in _TOKEN_PATTERN.findall(text.lower()) if term not in _STOPWORDS]
+
+
+def index_path_for(vector_store_path: Path, collection_name: str) -> Path:
+    """
+    Get the sparse index file path for a collection.
+    
+    Args:
+        vector_store_path: ChromaDB directory
+        collection_name: Collection name
+    
+    Returns:
+        Path of the persisted index
+    """
+    return Path(vector_store_path) / f"{collection_name}_bm25.pkl"
+
+
+def _matches(metadata: Dict[str, str], filters: Optional[Dict[str, Any]]) -> bool:
+    """Check a chunk's metadata against Chroma-style equality filters."""
+    if not filters:
+        return True
+    
+    for key, value in filters.items():
+        if key == '$and':
+            if not all(_matches(metadata, clause) for clause in value):
+                return False
+        elif key == '$or':
+            if not any(_matches(metadata, clause) for clause in value):
+                return False
+        elif isinstance(value, dict):
+            if '$eq' in value and metadata.get(key) != str(value['$eq']):
+                return False
+            if '$in' in value and metadata.get(key) not in {str(v) for v in value['$in']}:
+                return False
+        elif metadata.get(key) != str(value):
+            return False
+    
+    return True
+
+
+class BM25Index:
+    """
+    Thread-safe BM25 index keyed by chunk ID.
+    """
+    
+    def __init__(self, path: Optional[Path] = None, k1: float = 1.5, b: float = 0.75):
+        """
+        Initialize an empty index.
+        
+        Args:
+            path: File the index is persisted to (None keeps it in memory only)
+            k1: BM25 term-frequency saturation
+            b: BM25 length normalization
+        """
+        self.path = Path(path) if path else None
+        self.k1 = k1
+        self.b = b
+        
+        # chunk_id -> (term counts, length, filter metadata)
+        self._docs: Dict[str, Tuple[Dict[str, int], int, Dict[str, str]]] = {}
+        # term -> {chunk_id: term frequency}
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._total_length = 0
+        self._lock = threading.RLock()
+    
+    def __len__(self) -> int:
+        return len(self._docs)
+    
+    def __contains__(self, chunk_id: str) -> bool:
+        return chunk_id in self._docs
+    
+    def _remove(self, chunk_id: str) -> None:
+        entry = self._docs.pop(chunk_id, None)
+        if entry is None:
+            return
+        
+        terms, length, _ = entry
+        self._total_length -= length
+        for term in terms:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(chunk_id, None)
+                if not postings:
+                    del self._postings[term]
+    
+    def add(
+        self,
+        ids: List[str],
+        documents: List[str],
+        metadatas: Optional[List[Dict[str, Any]]] = None
+    ) -> None:
+        """
+        Add (or replace) chunks.
+        
+        Args:
+            ids: Chunk IDs
+            documents: Chunk texts
+            metadatas: Chunk metadata
+        """
+        metadatas = metadatas or [{}] * len(ids)
+        
+        with self._lock:
+            for chunk_id, document, metadata in zip(ids, documents, metadatas):
+                self._remove(chunk_id)
+                
+                terms = dict(Counter(tokenize(document or '')))
+                length = sum(terms.values())
+                self._docs[chunk_id] = (terms, length, self._filter_metadata(metadata))
+                self._total_length += length
+                
+                for term, tf in terms.items():
+                    self._postings.setdefault(term, {})[chunk_id] = tf
+    
+    def update_metadata(self, ids: List[str], metadatas: List[Dict[str, Any]]) -> None:
+        """
+        Replace the stored metadata of existing chunks.
+        
+        Args:
+            ids: Chunk IDs
+            metadatas: New chunk metadata
+        """
+        with self._lock:
+            for chunk_id, metadata in zip(ids, metadatas):
+                entry = self._docs.get(chunk_id)
+                if entry is not None:
+                    self._docs[chunk_id] = (entry[0], entry[1], self._filter_metadata(metadata))
+    
+    def remove(self, ids: Iterable[str]) -> None:
+        """
+        Remove chunks.
+        
+        Args:
+            ids: Chunk IDs
+        """
+        with self._lock:
+            for chunk_id in ids:
+                self._remove(chunk_id)
+    
+    @staticmethod
+    def _filter_metadata(metadata: Optional[Dict[str, Any]]) -> Dict[str, str]:
+        metadata = metadata or {}
+        return {
+            field: str(metadata[field])
+            for field in INDEXED_METADATA_FIELDS
+            if field in metadata
+        }
+    
+    def search(
+        self,
+        query: str,
+        top_k: int = 10,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> List[Tuple[str, float]]:
+        """
+        Rank chunks against a query with BM25.
+        
+        Args:
+            query: Query text
+            top_k: Number of results to return
+            filters: Optional metadata filters (e.g. {'subject': 'Physics'})
+        
+        Returns:
+            List of (chunk_id, score), best first
+        """
+        query_terms = set(tokenize(query))
+        if not query_terms:
+            return []
+        
+        with self._lock:
+            num_docs = len(self._docs)
+            if num_docs == 0:
+                return []
+            
+            avg_length = self._total_length / num_docs
+            scores: Dict[str, float] = {}
+            
+            for term in query_terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                
+                df = len(postings)
+                idf = math.log(1.0 + (num_docs - df + 0.5) / (df + 0.5))
+                
+                for chunk_id, tf in postings.items():
+                    length = self._docs[chunk_id][1]
+                    norm = self.k1 * (1.0 - self.b + self.b * length / avg_length)
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (self.k1 + 1.0) / (tf + norm)
+            
+            if filters:
+                scores = {
+                    chunk_id: score for chunk_id, score in scores.items()
+                    if _matches(self._docs[chunk_id][2], filters)
+                }
+        
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return ranked[:top_k]
+    
+    def chapter_frequencies(self) -> Dict[str, int]:
+        """
+        Count, for every term, the chapters whose chunks contain it.
+        
+        Returns:
+            Dictionary mapping term to number of distinct (subject, class, chapter)
+        """
+        with self._lock:
+            chapter_of = {
+                chunk_id: (meta.get('subject'), meta.get('class_level'), meta.get('chapter'))
+                for chunk_id, (_, _, meta) in self._docs.items()
+            }
+            return {
+                term: len({chapter_of[chunk_id] for chunk_id in postings})
+                for term, postings in self._postings.items()
+            }
+    
+    def after_fork(self) -> None:
+        """Replace the lock, which another thread may have held when the process forked."""
+        self._lock = threading.RLock()
+    
+    def save(self) -> None:
+        """
+        Persist the index atomically (temp file + rename).
+        
+        Each save writes its own temp file, so processes saving at the same
+        time cannot interleave their writes; the last rename wins.
+        """
+        if self.path is None:
+            return
+        
+        with self._lock:
+            data = {
+                'version': INDEX_VERSION,
+                'k1': self.k1,
+                'b': self.b,
+                'docs': self._docs
+            }
+            with atomic_write(self.path, 'wb') as f:
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        
+        logger.info(f"Saved sparse index ({len(self._docs)} chunks) to {self.path}")
+    
+    @classmethod
+    def load(cls, path: Path) -> Optional['BM25Index']:
+        """
+        Load a persisted index.
+        
+        Args:
+            path: Index file path
+        
+        Returns:
+            The index, or None if the file is missing or unreadable
+        """
+        path = Path(path)
+        if not path.exists():
+            return None
+        
+        try:
+            with open(path, 'rb') as f:
+                data = pickle.load(f)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable sparse index {path}: {e}")
+            return None
+        
+        if data.get('version') != INDEX_VERSION:
+            logger.info("Sparse index version changed, it will be rebuilt")
+            return None
+        
+        index = cls(path, k1=data.get('k1', 1.5), b=data.get('b', 0.75))
+        index._docs = data['docs']
+        for chunk_id, (terms, length, _) in index._docs.items():
+            index._total_length += length
+            for term, tf in terms.items():
+                index._postings.setdefault(term, {})[chunk_id] = tf
+        
+        logger.info(f"Loaded sparse index with {len(index)} chunks")
+        return index
+    
+    @classmethod
+    def load_shared(cls, path: Path) -> Optional['BM25Index']:
+        """
+        Load a persisted index read-only, sharing one copy per process.
+        
+        The copy is reloaded when the file changes. Callers must not modify
+        it (NCERTProcessor loads its own copy with load()).
+        
+        Args:
+            path: Index file path
+        
+        Returns:
+            The shared index, or None if the file is missing or unreadable
+        """
+        from services.preload import shared_asset
+        return shared_asset('sparse_index', path, lambda: cls.load(path))
+    
+    def rebuild_from_collection(self, collection, page_size: int = 1000) -> None:
+        """
+        Rebuild the index from every chunk in a ChromaDB collection.
+        
+        Args:
+            collection: ChromaDB collection
+            page_size: Chunks fetched per request
+        """
+        with self._lock:
+            self._docs.clear()
+            self._postings.clear()
+            self._total_length = 0
+            
+            offset = 0
+            while True:
+                page = collection.get(
+                    include=['documents', 'metadatas'],
+                    limit=page_size,
+                    offset=offset
+                )
+                ids = page.get('ids') or []
+                if not ids:
+                    break
+                self.add(ids, page['documents'], page['metadatas'])
+                offset += len(ids)
+        
+        logger.info(f"Rebuilt sparse index from collection ({len(self._docs)} chunks)")
+    
+    @classmethod
+    def load_or_build(cls, path: Path, collection, save: bool = True) -> 'BM25Index':
+        """
+        Load the persisted index, rebuilding it if it is missing or out of sync.
+        
+        Used by ingestion and the build command; serving processes only load
+        the persisted index (load_shared) and never rebuild it.
+        
+        Args:
+            path: Index file path
+            collection: ChromaDB collection the index describes
+            save: Persist a rebuilt index
+        
+        Returns:
+            The index
+        """
+        index = cls.load(path)
+        
+        try:
+            count = collection.count()
+        except Exception as e:
+            logger.warning(f"Could not count collection for sparse index check: {e}")
+            return index or cls(path)
+        
+        if index is not None and len(index) == count:
+            return index
+        
+        if index is not None:
+            logger.info(f"Sparse index has {len(index)} chunks but collection has {count}, rebuilding")
+        
+        index = cls(path)
+        if count:
+            index.rebuild_from_collection(collection)
+            if save:
+                try:
+                    index.save()
+                except Exception as e:
+                    logger.warning(f"Could not save rebuilt sparse index: {e}")
+        
+        return index
+
+
+def main():
+    """
+    Command-line entry point for building the BM25 index of a collection.
+    """
+    import argparse
+    import json
+    
+    parser = argparse.ArgumentParser(description='Manage the BM25 sparse index')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    build_parser = subparsers.add_parser('build', help='Build (or refresh) the index from the collection')
+    build_parser.add_argument('--collection', help='Collection (default: the one serving Config.CHROMA_COLLECTION_NAME)')
+    
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    
+    import chromadb
+    from chromadb.config import Settings
+    from config import Config
+    from services.embedding_collections import resolve_collection_name
+    
+    client = chromadb.PersistentClient(
+        path=str(Config.CHROMA_DB_PATH),
+        settings=Settings(anonymized_telemetry=False)
+    )
+    collection_name = args.collection or resolve_collection_name(Config.CHROMA_DB_PATH, Config.CHROMA_COLLECTION_NAME)
+    collection = client.get_collection(name=collection_name)
+    
+    if args.command == 'build':
+        path = index_path_for(Config.CHROMA_DB_PATH, collection_name)
+        index = BM25Index.load_or_build(path, collection)
+        print(json.dumps({'collection': collection_name, 'chunks': len(index), 'path': str(path)}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
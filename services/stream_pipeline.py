@@ -0,0 +1,107 @@
+"""
+Streaming Pipeline Helpers
+
+Small generator utilities for building staged pipelines with bounded
+memory, used by NCERT ingestion (extract -> chunk -> embed -> store):
+
+- batched groups an iterator into lists of a fixed size
+- prefetch runs an iterator in a background thread and hands its items
+  over through a bounded queue, so a stage can work ahead of its consumer
+  by at most maxsize items (backpressure instead of buffering everything)
+
+Exceptions raised by a prefetched stage are re-raised in the consumer.
+"""
+
+import queue
+import threading
+from typing import Iterable, Iterator, List, TypeVar
+
+T = TypeVar('T')
+
+# Seconds between checks for a consumer that stopped early
+_PUT_TIMEOUT = 0.1
+
+_DONE = object()
+
+
+class _StageError:
+    """Wraps an exception raised inside a prefetched stage."""
+    
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def batched(iterable: Iterable[T], size: int) -> Iterator[List[T]]:
+    """
+    Group items into lists of up to size items.
+    
+    Args:
+        iterable: Items
+        size: Batch size
+    
+    Yields:
+        Lists of items, in order
+    """
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def prefetch(iterable: Iterable[T], maxsize: int = 4, name: str = 'prefetch') -> Iterator[T]:
+    """
+    Iterate in a background thread, buffering at most maxsize items.
+    
+    Args:
+        iterable: Items (a generator is consumed in the background thread)
+        maxsize: Maximum number of items waiting to be consumed
+        name: Thread name
+    
+    Yields:
+        The items of iterable, in order
+    """
+    items: queue.Queue = queue.Queue(maxsize=max(1, maxsize))
+    stop = threading.Event()
+    
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=_PUT_TIMEOUT)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def produce() -> None:
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+            put(_DONE)
+        except BaseException as e:
+            put(_StageError(e))
+        finally:
+            # Let an upstream prefetched stage shut down too
+            close = getattr(iterable, 'close', None)
+            if close is not None:
+                close()
+    
+    thread = threading.Thread(target=produce, name=name, daemon=True)
+    thread.start()
+    
+    try:
+        while True:
+            item = items.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _StageError):
+                raise item.error
+            yield item
+    finally:
+        # Unblock and finish the producer if the consumer stopped early
+        stop.set()
+        thread.join()
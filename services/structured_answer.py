@@ -0,0 +1,305 @@
+"""
+Structured Answers - Explanation and Quiz from One Generation
+
+In combined mode (Config.STRUCTURED_ANSWER) the model is asked for one JSON
+envelope holding both the explanation and the quiz, instead of generating
+the quiz with a second call that re-sends part of the explanation:
+
+    {"explanation": "...", "quiz": [{"question": ..., "options": [...],
+                                     "correct_answer": 0, "explanation": ...}]}
+
+Features:
+- ANSWER_SCHEMA: JSON schema of the envelope, used for Gemini's JSON mode
+  and converted to a llama.cpp grammar for the local model
+- envelope_instructions: the schema prompt (the only constraint on
+  Cloudflare AI, and a reminder for the other backends)
+- StructuredAnswerParser: incremental parser that releases the explanation
+  while it is still being generated (decoding JSON string escapes as they
+  arrive) and parses the quiz once the generation is complete
+- Models that ignore the format still work: output that is not a JSON
+  object is passed through as the explanation, without a quiz
+
+The explanation is the first key of the envelope so it can be streamed
+before the quiz; Gemini's JSON mode orders keys alphabetically, which
+gives the same order.
+"""
+
+import re
+import json
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+ANSWER_SCHEMA: Dict[str, Any] = {
+    'type': 'object',
+    'properties': {
+        'explanation': {'type': 'string'},
+        'quiz': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': {
+                    'question': {'type': 'string'},
+                    'options': {'type': 'array', 'items': {'type': 'string'}},
+                    'correct_answer': {'type': 'integer'},
+                    'explanation': {'type': 'string'}
+                },
+                'required': ['question', 'options', 'correct_answer', 'explanation']
+            }
+        }
+    },
+    'required': ['explanation', 'quiz']
+}
+
+_FIRST_KEY = re.compile(r'\{\s*"([^"]*)"')
+_EXPLANATION_START = re.compile(r'\{\s*"explanation"\s*:\s*"')
+_QUIZ_ARRAY = re.compile(r'"quiz"\s*:\s*(\[.*\])', re.DOTALL)
+_SIMPLE_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+
+def envelope_instructions(num_questions: int) -> str:
+    """
+    Describe the JSON envelope to the model.
+    
+    Args:
+        num_questions: Number of quiz questions to ask for
+    
+    Returns:
+        Instructions to end the prompt with
+    """
+    return f"""Reply with a single JSON object and nothing else, in exactly this format:
+{{
+    "explanation": "Your complete answer (Markdown allowed)",
+    "quiz": [
+        {{
+            "question": "Question text here?",
+            "options": ["Option A", "Option B", "Option C", "Option D"],
+            "correct_answer": 0,
+            "explanation": "Why this answer is correct"
+        }}
+    ]
+}}
+
+Write the explanation first. Then add {num_questions} multiple-choice questions that test conceptual understanding of the explanation, not rote memorization.
+
+JSON:"""
+
+
+def normalize_quiz(items: Any) -> Optional[Dict[str, List[Dict[str, Any]]]]:
+    """
+    Keep the well-formed questions of a generated quiz.
+    
+    Args:
+        items: Parsed "quiz" value
+    
+    Returns:
+        Quiz dictionary ({'questions': [...]}), or None if no question is usable
+    """
+    if not isinstance(items, list):
+        return None
+    
+    questions = []
+    for item in items:
+        if not isinstance(item, dict) or not item.get('question'):
+            continue
+        options = item.get('options')
+        answer = item.get('correct_answer')
+        if not isinstance(options, list) or len(options) < 2:
+            continue
+        if not isinstance(answer, int) or not 0 <= answer < len(options):
+            continue
+        questions.append({
+            'question': str(item['question']),
+            'options': [str(option) for option in options],
+            'correct_answer': answer,
+            'explanation': str(item.get('explanation', ''))
+        })
+    return {'questions': questions} if questions else None
+
+
+class StructuredAnswerParser:
+    """
+    Incremental parser of a generated answer envelope.
+    
+    feed() returns the explanation text decoded so far (only the new part);
+    finish() returns the rest of the explanation and the quiz (also kept
+    in the quiz attribute).
+    """
+    
+    def __init__(self):
+        self.raw = ''
+        self.emitted = ''
+        self._state = 'start'  # start -> explanation -> rest, or start -> plain / deferred
+        self._pos = 0  # next unread character of raw (explanation state)
+        self.quiz: Optional[Dict[str, List[Dict[str, Any]]]] = None
+    
+    def feed(self, fragment: str) -> str:
+        """
+        Add generated text.
+        
+        Args:
+            fragment: Next piece of the model output
+        
+        Returns:
+            Newly available explanation text (may be empty)
+        """
+        self.raw += fragment
+        
+        if self._state == 'start':
+            head = self.raw.lstrip()
+            if '```'.startswith(head):
+                return ''
+            if head.startswith('```'):
+                # Markdown code fence: wait for the end of the fence line
+                if '\n' not in head:
+                    return ''
+                head = head.split('\n', 1)[1].lstrip()
+            if not head:
+                return ''
+            if not head.startswith('{'):
+                self._state = 'plain'
+                return self._emit(self.raw)
+            
+            key = _FIRST_KEY.match(head)
+            if key is None:
+                return ''
+            if key.group(1) != 'explanation':
+                # Explanation is not first: nothing to release before the end
+                self._state = 'deferred'
+                return ''
+            match = _EXPLANATION_START.match(head)
+            if match is None:
+                return ''
+            self._state = 'explanation'
+            self._pos = len(self.raw) - len(head) + match.end()
+        
+        if self._state == 'plain':
+            return self._emit(fragment)
+        if self._state == 'explanation':
+            return self._emit(self._decode_string())
+        return ''
+    
+    def _emit(self, text: str) -> str:
+        self.emitted += text
+        return text
+    
+    def _decode_string(self) -> str:
+        """Decode the explanation string up to the end of the received text."""
+        raw, pos, out = self.raw, self._pos, []
+        while pos < len(raw):
+            char = raw[pos]
+            if char == '"':
+                self._state = 'rest'
+                pos += 1
+                break
+            if char != '\\':
+                out.append(char)
+                pos += 1
+                continue
+            
+            # Escapes are decoded only once complete
+            if pos + 1 >= len(raw):
+                break
+            code = raw[pos + 1]
+            if code in _SIMPLE_ESCAPES:
+                out.append(_SIMPLE_ESCAPES[code])
+                pos += 2
+                continue
+            if code != 'u':
+                out.append(code)
+                pos += 2
+                continue
+            if pos + 6 > len(raw):
+                break
+            try:
+                codepoint = int(raw[pos + 2:pos + 6], 16)
+            except ValueError:
+                out.append(raw[pos + 2:pos + 6])
+                pos += 6
+                continue
+            if 0xD800 <= codepoint < 0xDC00:
+                # High surrogate: needs the following \\uXXXX low surrogate
+                if pos + 12 > len(raw):
+                    break
+                if raw[pos + 6:pos + 8] == '\\u':
+                    try:
+                        low = int(raw[pos + 8:pos + 12], 16)
+                    except ValueError:
+                        low = 0
+                    if 0xDC00 <= low < 0xE000:
+                        out.append(chr(0x10000 + ((codepoint - 0xD800) << 10) + (low - 0xDC00)))
+                        pos += 12
+                        continue
+            out.append(chr(codepoint))
+            pos += 6
+        
+        self._pos = pos
+        return ''.join(out)
+    
+    def finish(self) -> Tuple[str, Optional[Dict[str, List[Dict[str, Any]]]]]:
+        """
+        Complete parsing once the generation has ended.
+        
+        Returns:
+            (explanation text not returned by feed() yet, quiz or None)
+        """
+        rest, self.quiz = self._complete()
+        return rest, self.quiz
+    
+    def _complete(self) -> Tuple[str, Optional[Dict[str, List[Dict[str, Any]]]]]:
+        if self._state == 'plain':
+            return '', None
+        
+        data = _load_envelope(self.raw)
+        if data is not None:
+            explanation = str(data.get('explanation', ''))
+            quiz = normalize_quiz(data.get('quiz'))
+            if explanation.startswith(self.emitted):
+                return self._emit(explanation[len(self.emitted):]), quiz
+            return '', quiz
+        
+        if self._state in ('start', 'deferred'):
+            # Never found an explanation: pass the output through as it is
+            logger.warning("Generated answer is not a JSON envelope, using it as the explanation")
+            self._state = 'plain'
+            return self._emit(self.raw.strip()), None
+        
+        # The explanation was complete, only the quiz is malformed or truncated
+        quiz = None
+        match = _QUIZ_ARRAY.search(self.raw, self._pos)
+        if match:
+            try:
+                quiz = normalize_quiz(json.loads(match.group(1)))
+            except ValueError:
+                pass
+        if quiz is None:
+            logger.warning("Could not parse the quiz of the generated answer")
+        return '', quiz
+
+
+def _load_envelope(text: str) -> Optional[Dict[str, Any]]:
+    match = re.search(r'\{.*\}', text, re.DOTALL)
+    if not match:
+        return None
+    try:
+        data = json.loads(match.group(0))
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) and 'explanation' in data else None
+
+
+def parse_structured_answer(text: str) -> Tuple[str, Optional[Dict[str, List[Dict[str, Any]]]]]:
+    """
+    Parse a complete generated answer envelope.
+    
+    Args:
+        text: Model output
+    
+    Returns:
+        (explanation, quiz or None)
+    """
+    parser = StructuredAnswerParser()
+    explanation = parser.feed(text)
+    rest, quiz = parser.finish()
+    return (explanation + rest).strip(), quiz
@@ -0,0 +1,287 @@
+"""
+Sentence-Based Text Chunking for NCERT Content
+
+Splits page text into ~500-word chunks made of whole sentences, with a
+sentence overlap between consecutive chunks. Used by NCERTProcessor.
+
+Each sentence's word count is computed once and memoized (page headers,
+footers and repeated lines are only tokenized once per process); the
+overlap window reuses the counts instead of re-tokenizing.
+
+Two word counters are available (Config.INGEST_TOKENIZER):
+- 'nltk': NLTK word_tokenize, the reference
+- 'regex': the same NLTKWordTokenizer rules (nltk 3.8.1, including the
+  curly and guillemet quote rules) as compiled substitutions, without the
+  Punkt sentence split word_tokenize runs again on every sentence
+
+Chunk boundaries (and therefore content-hashed chunk IDs) follow the word
+counts, so check the regex counter against NLTK before switching:
+
+    python -m services.text_chunking parity [--limit 20]
+"""
+
+import re
+import json
+import logging
+import argparse
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from nltk.tokenize import word_tokenize, sent_tokenize
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Distinct sentences whose word counts are memoized
+WORD_COUNT_CACHE_SIZE = 65536
+
+# NLTKWordTokenizer rules (what NLTK word_tokenize runs on each sentence), in its order
+_STARTING_QUOTES = [
+    (re.compile(r'([«“‘„]|[`]+)'), r' \1 '),
+    (re.compile(r'^\"'), r'``'),
+    (re.compile(r'(``)'), r' \1 '),
+    (re.compile(r'([ \(\[{<])(\"|\'{2})'), r'\1 `` '),
+    (re.compile(r"(?i)(\')(?!re|ve|ll|m|t|s|d|n)(\w)\b"), r'\1 \2'),
+]
+
+_PUNCTUATION = [
+    (re.compile(r'([^\.])(\.)([\]\)}>"\'»”’ ]*)\s*$'), r'\1 \2 \3 '),
+    (re.compile(r'([:,])([^\d])'), r' \1 \2'),
+    (re.compile(r'([:,])$'), r' \1 '),
+    (re.compile(r'\.{2,}'), r' \g<0> '),
+    (re.compile(r'[;@#$%&]'), r' \g<0> '),
+    (re.compile(r'([^\.])(\.)([\]\)}>"\']*)\s*$'), r'\1 \2\3 '),
+    (re.compile(r'[?!]'), r' \g<0> '),
+    (re.compile(r"([^'])' "), r"\1 ' "),
+    (re.compile(r'[*]'), r' \g<0> '),
+]
+
+_PARENS_BRACKETS = (re.compile(r'[\]\[\(\)\{\}\<\>]'), r' \g<0> ')
+
+_DOUBLE_DASHES = (re.compile(r'--'), r' -- ')
+
+_ENDING_QUOTES = [
+    (re.compile(r'([»”’])'), r' \1 '),
+    (re.compile(r"''"), " '' "),
+    (re.compile(r'"'), " '' "),
+    (re.compile(r"([^' ])('[sS]|'[mM]|'[dD]|') "), r"\1 \2 "),
+    (re.compile(r"([^' ])('ll|'LL|'re|'RE|'ve|'VE|n't|N'T) "), r"\1 \2 "),
+]
+
+_CONTRACTIONS = [
+    re.compile(pattern, re.IGNORECASE) for pattern in (
+        r'\b(can)(not)\b', r"\b(d)('ye)\b", r'\b(gim)(me)\b', r'\b(gon)(na)\b',
+        r'\b(got)(ta)\b', r'\b(lem)(me)\b', r"\b(more)('n)\b", r'\b(wan)(na)(?=\s)',
+        r" ('t)(is)\b", r" ('t)(was)\b"
+    )
+]
+
+
+def fast_word_tokenize(sentence: str) -> List[str]:
+    """
+    Tokenize one sentence with the NLTKWordTokenizer rules NLTK word_tokenize uses.
+    
+    Args:
+        sentence: A single sentence
+    
+    Returns:
+        List of tokens
+    """
+    text = sentence
+    for pattern, substitution in _STARTING_QUOTES:
+        text = pattern.sub(substitution, text)
+    for pattern, substitution in _PUNCTUATION:
+        text = pattern.sub(substitution, text)
+    
+    pattern, substitution = _PARENS_BRACKETS
+    text = pattern.sub(substitution, text)
+    pattern, substitution = _DOUBLE_DASHES
+    text = pattern.sub(substitution, text)
+    
+    text = ' ' + text + ' '
+    for pattern, substitution in _ENDING_QUOTES:
+        text = pattern.sub(substitution, text)
+    for pattern in _CONTRACTIONS:
+        text = pattern.sub(r' \1 \2 ', text)
+    
+    return text.split()
+
+
+@lru_cache(maxsize=WORD_COUNT_CACHE_SIZE)
+def _count_words_nltk(sentence: str) -> int:
+    return len(word_tokenize(sentence))
+
+
+@lru_cache(maxsize=WORD_COUNT_CACHE_SIZE)
+def _count_words_regex(sentence: str) -> int:
+    return len(fast_word_tokenize(sentence))
+
+
+_WORD_COUNTERS: Dict[str, Callable[[str], int]] = {
+    'nltk': _count_words_nltk,
+    'regex': _count_words_regex,
+}
+
+
+def get_word_counter(tokenizer: Optional[str] = None) -> Callable[[str], int]:
+    """
+    Get a memoized sentence word counter.
+    
+    Args:
+        tokenizer: 'nltk' or 'regex' (default: Config.INGEST_TOKENIZER)
+    
+    Returns:
+        Function mapping a sentence to its number of word tokens
+    """
+    tokenizer = tokenizer or Config.INGEST_TOKENIZER
+    if tokenizer not in _WORD_COUNTERS:
+        raise ValueError(f"Unknown tokenizer: {tokenizer} (expected one of {sorted(_WORD_COUNTERS)})")
+    return _WORD_COUNTERS[tokenizer]
+
+
+def chunk_sentences(
+    sentences: List[str],
+    chunk_size: int = 500,
+    overlap: int = 50,
+    count_words: Callable[[str], int] = _count_words_nltk
+) -> List[str]:
+    """
+    Group sentences into chunks of about chunk_size words with a sentence overlap.
+    
+    Args:
+        sentences: Sentences in reading order
+        chunk_size: Target number of words per chunk
+        overlap: Maximum number of words repeated from the previous chunk
+        count_words: Sentence word counter
+    
+    Returns:
+        List of text chunks
+    """
+    chunks = []
+    current_chunk: List[str] = []
+    current_counts: List[int] = []
+    current_word_count = 0
+    
+    for sentence in sentences:
+        word_count = count_words(sentence)
+        
+        # If adding this sentence exceeds chunk_size, save current chunk
+        if current_word_count + word_count > chunk_size and current_chunk:
+            chunks.append(' '.join(current_chunk))
+            
+            # Keep the last few sentences for overlap (counts are already known)
+            keep = 0
+            overlap_words = 0
+            for sent_words in reversed(current_counts):
+                if overlap_words + sent_words <= overlap:
+                    keep += 1
+                    overlap_words += sent_words
+                else:
+                    break
+            
+            current_chunk = current_chunk[len(current_chunk) - keep:]
+            current_counts = current_counts[len(current_counts) - keep:]
+            current_word_count = overlap_words
+        
+        current_chunk.append(sentence)
+        current_counts.append(word_count)
+        current_word_count += word_count
+    
+    # Add the last chunk
+    if current_chunk:
+        chunks.append(' '.join(current_chunk))
+    
+    return chunks
+
+
+def chunk_text(text: str, chunk_size: int = 500, overlap: int = 50, tokenizer: Optional[str] = None) -> List[str]:
+    """
+    Split text into chunks of approximately chunk_size words with overlap.
+    
+    Args:
+        text: Text to chunk
+        chunk_size: Target number of words per chunk
+        overlap: Number of words to overlap between chunks
+        tokenizer: Word counter to use ('nltk' or 'regex', default: from config)
+    
+    Returns:
+        List of text chunks
+    """
+    return chunk_sentences(sent_tokenize(text), chunk_size, overlap, get_word_counter(tokenizer))
+
+
+def check_parity(texts: List[str], chunk_size: int = 500, overlap: int = 50) -> Dict[str, float]:
+    """
+    Compare the regex word counter with NLTK on sample texts.
+    
+    Args:
+        texts: Page texts
+        chunk_size: Chunk size used for the chunk comparison
+        overlap: Overlap used for the chunk comparison
+    
+    Returns:
+        Dictionary with sentence count agreement and identical-chunk rates
+    """
+    sentences = 0
+    same_counts = 0
+    max_difference = 0
+    pages_same_chunks = 0
+    mismatches = []
+    
+    for text in texts:
+        page_sentences = sent_tokenize(text)
+        for sentence in page_sentences:
+            expected = _count_words_nltk(sentence)
+            actual = _count_words_regex(sentence)
+            sentences += 1
+            if expected == actual:
+                same_counts += 1
+            else:
+                max_difference = max(max_difference, abs(expected - actual))
+                if len(mismatches) < 10:
+                    mismatches.append({'sentence': sentence[:200], 'nltk': expected, 'regex': actual})
+        
+        nltk_chunks = chunk_sentences(page_sentences, chunk_size, overlap, _count_words_nltk)
+        regex_chunks = chunk_sentences(page_sentences, chunk_size, overlap, _count_words_regex)
+        if nltk_chunks == regex_chunks:
+            pages_same_chunks += 1
+    
+    return {
+        'pages': len(texts),
+        'sentences': sentences,
+        'sentence_count_agreement': round(same_counts / sentences, 4) if sentences else None,
+        'max_count_difference': max_difference,
+        'pages_with_identical_chunks': round(pages_same_chunks / len(texts), 4) if texts else None,
+        'examples': mismatches
+    }
+
+
+def main():
+    """
+    Command-line entry point for the tokenizer parity check.
+    """
+    parser = argparse.ArgumentParser(description='Sentence chunking utilities')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    parity_parser = subparsers.add_parser('parity', help='Compare the regex word counter with NLTK')
+    parity_parser.add_argument('--pdf-dir', default=str(Config.NCERT_PDF_DIR), help='Directory of NCERT PDFs')
+    parity_parser.add_argument('--limit', type=int, default=20, help='Number of PDFs to sample')
+    
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    
+    if args.command == 'parity':
+        from services.ncert_processor import NCERTProcessor
+        
+        texts = []
+        for pdf_path in sorted(Path(args.pdf_dir).glob('*.pdf'))[:args.limit]:
+            texts.extend(page['text'] for page in NCERTProcessor.iter_pdf_pages(pdf_path))
+        
+        print(json.dumps(check_parity(texts), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,914 @@
+"""
+Vector Backends for the RAG System
+
+Pluggable storage/search backends behind RAGSystem. Every backend returns
+results in ChromaDB's shape, so result formatting, reranking and hybrid
+fusion work unchanged whichever backend is active.
+
+Backends:
+- ChromaBackend: the existing ChromaDB collection (HNSW + SQLite)
+- FlatMemmapBackend: exact search over a memory-mapped embedding matrix
+  with one NumPy matmul per query. The files load instantly and are shared
+  through the OS page cache by every web worker. Metadata filters are
+  applied up front through precomputed subject/class/chapter bitmasks.
+  Optionally a quantized copy (int8 or float16) is scanned for the coarse
+  pass and only the top candidates are rescored with exact float32 rows,
+  so the resident set per worker is 1/4 (int8) or 1/2 (float16) of float32.
+  Opened indexes are shared per process (open_flat_index) and can be
+  opened before workers fork (services.preload).
+
+Flat indexes are exported from the Chroma collections (text chunks and
+diagram pages), which stay the source of truth for ingestion. Text indexes
+live in one directory per collection under Config.FLAT_INDEX_DIR
+(flat_index_dir_for), so each embedding model version keeps its own:
+
+    python -m services.vector_backends export [--target diagrams] [--quantization int8]
+    python -m services.vector_backends recall [--target diagrams] [--queries queries.txt]
+"""
+
+import os
+import json
+import time
+import shutil
+import logging
+import argparse
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+FLAT_INDEX_VERSION = 1
+
+# Metadata fields with precomputed filter bitmasks
+BITMASK_FIELDS = ('subject', 'class_level', 'chapter')
+
+# Rows scored per block when the scanned matrix is not float32
+SCORE_BLOCK_ROWS = 8192
+
+# Quantized storage modes for the coarse pass
+QUANTIZATION_MODES = ('none', 'float16', 'int8')
+
+# Candidates rescored with float32 per requested result (quantized indexes)
+DEFAULT_RESCORE_FACTOR = 10
+MIN_RESCORE_CANDIDATES = 50
+
+
+def embedding_distance(query_embedding: List[float], embedding: List[float], space: str = 'l2') -> float:
+    """
+    ChromaDB-compatible distance between two embeddings.
+    
+    Args:
+        query_embedding: Query embedding
+        embedding: Stored embedding
+        space: Distance space ('l2' squared L2, 'cosine' or 'ip')
+    
+    Returns:
+        Distance (smaller is nearer)
+    """
+    query = np.asarray(query_embedding, dtype=np.float32)
+    vector = np.asarray(embedding, dtype=np.float32)
+    dot = float(query @ vector)
+    
+    if space == 'ip':
+        return 1.0 - dot
+    if space == 'cosine':
+        denom = float(np.linalg.norm(query)) * float(np.linalg.norm(vector))
+        return 1.0 - dot / max(denom, 1e-12)
+    return float(np.sum((query - vector) ** 2))
+
+
+class VectorBackend:
+    """
+    Interface for vector storage and search.
+    """
+    
+    name = 'base'
+    space = 'l2'
+    
+    def query(
+        self,
+        query_embedding: List[float],
+        n_results: int,
+        where: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, List[List[Any]]]:
+        """
+        Find the nearest chunks to a query embedding.
+        
+        Args:
+            query_embedding: Query embedding
+            n_results: Number of results to return
+            where: Optional metadata filters (ChromaDB syntax)
+        
+        Returns:
+            ChromaDB-style results: {'ids', 'documents', 'metadatas', 'distances'},
+            each a list containing one list per query
+        """
+        raise NotImplementedError
+    
+    def query_many(
+        self,
+        query_embeddings: List[List[float]],
+        n_results: int,
+        where: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, List[List[Any]]]:
+        """
+        Find the nearest chunks to several query embeddings at once.
+        
+        Args:
+            query_embeddings: Query embeddings
+            n_results: Number of results to return per query
+            where: Optional metadata filters shared by all queries
+        
+        Returns:
+            ChromaDB-style results with one list per query, in input order
+        """
+        merged = {'ids': [], 'documents': [], 'metadatas': [], 'distances': []}
+        for query_embedding in query_embeddings:
+            results = self.query(query_embedding, n_results, where)
+            for field in merged:
+                merged[field].append(results[field][0] if results.get(field) else [])
+        return merged
+    
+    def get(self, ids: List[str], include: Optional[List[str]] = None) -> Dict[str, List[Any]]:
+        """
+        Fetch chunks by ID.
+        
+        Args:
+            ids: Chunk IDs
+            include: Fields to include ('documents', 'metadatas', 'embeddings')
+        
+        Returns:
+            ChromaDB-style results: {'ids', 'documents', 'metadatas', 'embeddings'}
+            (missing IDs are omitted)
+        """
+        raise NotImplementedError
+    
+    def distances(self, query_embedding: List[float], ids: List[str]) -> Dict[str, float]:
+        """
+        Distances from a query embedding to stored chunks, on the scale query() uses.
+        
+        Args:
+            query_embedding: Query embedding
+            ids: Chunk IDs
+        
+        Returns:
+            Distance by chunk ID (missing IDs are omitted)
+        """
+        fetched = self.get(ids, include=['embeddings'])
+        return {
+            chunk_id: embedding_distance(query_embedding, embedding, self.space)
+            for chunk_id, embedding in zip(fetched['ids'], fetched['embeddings'])
+        }
+    
+    def count(self) -> int:
+        """Number of chunks in the backend."""
+        raise NotImplementedError
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get backend statistics.
+        
+        Returns:
+            Dictionary with backend name and size
+        """
+        return {'backend': self.name, 'count': self.count()}
+
+
+class ChromaBackend(VectorBackend):
+    """
+    Backend wrapping a ChromaDB collection.
+    """
+    
+    name = 'chroma'
+    
+    def __init__(self, collection):
+        """
+        Initialize the backend.
+        
+        Args:
+            collection: ChromaDB collection
+        """
+        self.collection = collection
+    
+    @property
+    def space(self) -> str:
+        """Distance space the collection was created with."""
+        return (self.collection.metadata or {}).get('hnsw:space', 'l2')
+    
+    def query(self, query_embedding, n_results, where=None):
+        query_params = {
+            'query_embeddings': [query_embedding],
+            'n_results': n_results
+        }
+        if where:
+            query_params['where'] = where
+        return self.collection.query(**query_params)
+    
+    def query_many(self, query_embeddings, n_results, where=None):
+        if not query_embeddings:
+            return {'ids': [], 'documents': [], 'metadatas': [], 'distances': []}
+        
+        # One multi-query request instead of one round-trip per query
+        query_params = {
+            'query_embeddings': list(query_embeddings),
+            'n_results': n_results
+        }
+        if where:
+            query_params['where'] = where
+        return self.collection.query(**query_params)
+    
+    def get(self, ids, include=None):
+        return self.collection.get(ids=list(ids), include=include or ['documents', 'metadatas'])
+    
+    def count(self):
+        return self.collection.count()
+
+
+def _normalize_filter_value(value: Any) -> str:
+    return str(value)
+
+
+class FlatMemmapBackend(VectorBackend):
+    """
+    Exact search over a memory-mapped embedding matrix.
+    
+    Directory layout (written by export_chroma_collection):
+    - index.json: version, dtype, dimension, distance space, ids, metadatas
+    - embeddings.bin: row-major N x D float32 matrix
+    - coarse.bin: quantized copy for the coarse pass (int8/float16 modes only)
+    - quantization.npz: per-dimension int8 scale and offset (int8 mode only)
+    - norms.npy: squared L2 norm of every row (float32)
+    - documents.bin / doc_offsets.npy: UTF-8 chunk texts and their offsets
+    - bitmasks.npz: packed row bitmasks, one per subject/class/chapter value
+    
+    Distances match ChromaDB's for the same space: squared L2 ('l2'),
+    1 - cosine ('cosine') or 1 - dot product ('ip'). Returned distances are
+    always exact float32 values, also for quantized indexes.
+    """
+    
+    name = 'flat'
+    
+    def __init__(self, index_dir: Path, rescore_factor: int = DEFAULT_RESCORE_FACTOR):
+        """
+        Open a flat index.
+        
+        Args:
+            index_dir: Directory written by export_chroma_collection
+            rescore_factor: Candidates rescored with float32 per requested
+                result (quantized indexes only)
+        
+        Raises:
+            FileNotFoundError: If the index has not been exported
+        """
+        self.index_dir = Path(index_dir)
+        self.rescore_factor = max(1, int(rescore_factor))
+        
+        info_path = self.index_dir / 'index.json'
+        if not info_path.exists():
+            raise FileNotFoundError(f"Flat vector index not found at {self.index_dir}")
+        
+        with open(info_path, 'r', encoding='utf-8') as f:
+            info = json.load(f)
+        
+        if info.get('version') != FLAT_INDEX_VERSION:
+            raise ValueError(f"Unsupported flat index version: {info.get('version')}")
+        
+        self.dtype = np.dtype(info['dtype'])
+        self.dimension = int(info['dimension'])
+        self.space = info.get('space', 'l2')
+        self.collection_name: Optional[str] = info.get('collection')
+        self.ids: List[str] = info['ids']
+        self.metadatas: List[Dict[str, Any]] = info['metadatas']
+        self._row_of = {chunk_id: row for row, chunk_id in enumerate(self.ids)}
+        
+        num_rows = len(self.ids)
+        self.embeddings = np.memmap(
+            self.index_dir / 'embeddings.bin',
+            dtype=self.dtype,
+            mode='r',
+            shape=(num_rows, self.dimension)
+        ) if num_rows else np.zeros((0, self.dimension), dtype=self.dtype)
+        self.norms = np.load(self.index_dir / 'norms.npy', mmap_mode='r')
+        
+        self._documents = np.memmap(self.index_dir / 'documents.bin', dtype=np.uint8, mode='r') \
+            if (self.index_dir / 'documents.bin').stat().st_size else np.zeros(0, dtype=np.uint8)
+        self._doc_offsets = np.load(self.index_dir / 'doc_offsets.npy', mmap_mode='r')
+        
+        # Quantized copy for the coarse pass
+        self.quantization = info.get('quantization', 'none')
+        self.coarse = None
+        self._int8_scale = None
+        self._int8_offset = None
+        if self.quantization != 'none' and num_rows:
+            coarse_dtype = np.int8 if self.quantization == 'int8' else np.float16
+            self.coarse = np.memmap(
+                self.index_dir / 'coarse.bin',
+                dtype=coarse_dtype,
+                mode='r',
+                shape=(num_rows, self.dimension)
+            )
+            if self.quantization == 'int8':
+                with np.load(self.index_dir / 'quantization.npz') as params:
+                    self._int8_scale = params['scale'].astype(np.float32)
+                    self._int8_offset = params['offset'].astype(np.float32)
+        
+        self._bitmasks: Dict[str, Dict[str, np.ndarray]] = {}
+        with np.load(self.index_dir / 'bitmasks.npz') as masks:
+            for key in masks.files:
+                field, value = key.split('=', 1)
+                self._bitmasks.setdefault(field, {})[value] = np.unpackbits(masks[key], count=num_rows).astype(bool)
+        
+        logger.info(
+            f"Opened flat vector index: {num_rows} x {self.dimension} {self.dtype.name}, "
+            f"space={self.space}, quantization={self.quantization}"
+        )
+    
+    def count(self):
+        return len(self.ids)
+    
+    def _document(self, row: int) -> str:
+        start, end = int(self._doc_offsets[row]), int(self._doc_offsets[row + 1])
+        return bytes(self._documents[start:end]).decode('utf-8')
+    
+    def _field_mask(self, field: str, condition: Any) -> np.ndarray:
+        """Row mask for one field condition (value, {'$eq': v} or {'$in': [...]})."""
+        if isinstance(condition, dict):
+            if '$eq' in condition:
+                values = [condition['$eq']]
+            elif '$in' in condition:
+                values = list(condition['$in'])
+            else:
+                raise ValueError(f"Unsupported filter operator for {field}: {condition}")
+        else:
+            values = [condition]
+        
+        values = {_normalize_filter_value(value) for value in values}
+        masks = self._bitmasks.get(field)
+        
+        if masks is not None:
+            mask = np.zeros(len(self.ids), dtype=bool)
+            for value in values:
+                if value in masks:
+                    mask |= masks[value]
+            return mask
+        
+        # No precomputed bitmask for this field: scan the metadata
+        return np.fromiter(
+            (_normalize_filter_value(metadata.get(field)) in values for metadata in self.metadatas),
+            dtype=bool,
+            count=len(self.ids)
+        )
+    
+    def _filter_mask(self, where: Dict[str, Any]) -> np.ndarray:
+        """Row mask for a ChromaDB-style where clause."""
+        mask = np.ones(len(self.ids), dtype=bool)
+        for key, condition in where.items():
+            if key == '$and':
+                for clause in condition:
+                    mask &= self._filter_mask(clause)
+            elif key == '$or':
+                any_mask = np.zeros(len(self.ids), dtype=bool)
+                for clause in condition:
+                    any_mask |= self._filter_mask(clause)
+                mask &= any_mask
+            else:
+                mask &= self._field_mask(key, condition)
+        return mask
+    
+    @staticmethod
+    def _block_dot(matrix: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """Dot products of every row of matrix with query, in float32."""
+        if matrix.dtype == np.float32:
+            return matrix @ query
+        
+        # Upcast block by block to keep BLAS and bound memory
+        scores = np.empty(matrix.shape[0], dtype=np.float32)
+        for start in range(0, matrix.shape[0], SCORE_BLOCK_ROWS):
+            block = np.asarray(matrix[start:start + SCORE_BLOCK_ROWS], dtype=np.float32)
+            scores[start:start + SCORE_BLOCK_ROWS] = block @ query
+        return scores
+    
+    def _dot(self, rows: Optional[np.ndarray], query: np.ndarray, coarse: bool = False) -> np.ndarray:
+        """Dot products of the selected rows (all rows if None) with the query."""
+        if not coarse:
+            matrix = self.embeddings if rows is None else self.embeddings[rows]
+            return self._block_dot(matrix, query)
+        
+        matrix = self.coarse if rows is None else self.coarse[rows]
+        if self.quantization == 'int8':
+            # x ~= offset + scale * code, so q.x ~= (q * scale).code + q.offset
+            return self._block_dot(matrix, query * self._int8_scale) + float(query @ self._int8_offset)
+        return self._block_dot(matrix, query)
+    
+    def _distances(self, rows: Optional[np.ndarray], query: np.ndarray, coarse: bool = False) -> np.ndarray:
+        """ChromaDB-compatible distances for the selected rows."""
+        dots = self._dot(rows, query, coarse)
+        
+        if self.space == 'ip':
+            return 1.0 - dots
+        
+        norms = self.norms if rows is None else self.norms[rows]
+        if self.space == 'cosine':
+            denom = np.sqrt(np.asarray(norms, dtype=np.float32)) * float(np.linalg.norm(query))
+            return 1.0 - dots / np.maximum(denom, 1e-12)
+        
+        return np.asarray(norms, dtype=np.float32) - 2.0 * dots + float(query @ query)
+    
+    @staticmethod
+    def _top_n(distances: np.ndarray, n: int) -> np.ndarray:
+        """Indexes of the n smallest distances, nearest first."""
+        if n < distances.shape[0]:
+            top = np.argpartition(distances, n - 1)[:n]
+        else:
+            top = np.arange(distances.shape[0])
+        return top[np.argsort(distances[top], kind='stable')]
+    
+    def search_rows(
+        self,
+        query_embedding: List[float],
+        n_results: int,
+        where: Optional[Dict[str, Any]] = None,
+        exact: bool = False
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the rows nearest to a query embedding.
+        
+        Quantized indexes scan the coarse copy, then rescore the best
+        n_results * rescore_factor candidates with float32 rows.
+        
+        Args:
+            query_embedding: Query embedding
+            n_results: Number of results to return
+            where: Optional metadata filters (ChromaDB syntax)
+            exact: Scan the float32 matrix even if a quantized copy exists
+        
+        Returns:
+            Tuple of (row indexes, exact distances), nearest first
+        """
+        query = np.asarray(query_embedding, dtype=np.float32)
+        if query.shape[0] != self.dimension:
+            raise ValueError(
+                f"Query embedding has {query.shape[0]} dimensions, index has {self.dimension}"
+            )
+        
+        rows = None
+        if where:
+            rows = np.flatnonzero(self._filter_mask(where))
+        
+        num_candidates = len(self.ids) if rows is None else rows.size
+        n = min(n_results, num_candidates)
+        if n <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        
+        if self.coarse is None or exact:
+            distances = self._distances(rows, query)
+            top = self._top_n(distances, n)
+            result_rows = top if rows is None else rows[top]
+            return result_rows, distances[top]
+        
+        # Coarse pass over the quantized copy
+        coarse_distances = self._distances(rows, query, coarse=True)
+        num_rescore = min(num_candidates, max(n * self.rescore_factor, MIN_RESCORE_CANDIDATES))
+        candidates = self._top_n(coarse_distances, num_rescore)
+        candidate_rows = candidates if rows is None else rows[candidates]
+        
+        # Exact float32 rescoring of the candidates (sorted rows read the memmap sequentially)
+        candidate_rows = np.sort(candidate_rows)
+        distances = self._distances(candidate_rows, query)
+        top = self._top_n(distances, n)
+        return candidate_rows[top], distances[top]
+    
+    def query(self, query_embedding, n_results, where=None):
+        result_rows, distances = self.search_rows(query_embedding, n_results, where)
+        return {
+            'ids': [[self.ids[row] for row in result_rows]],
+            'documents': [[self._document(row) for row in result_rows]],
+            'metadatas': [[self.metadatas[row] for row in result_rows]],
+            'distances': [[float(distance) for distance in distances]]
+        }
+    
+    def get(self, ids, include=None):
+        include = include or ['documents', 'metadatas']
+        rows = [self._row_of[chunk_id] for chunk_id in ids if chunk_id in self._row_of]
+        
+        result = {'ids': [self.ids[row] for row in rows]}
+        if 'documents' in include:
+            result['documents'] = [self._document(row) for row in rows]
+        if 'metadatas' in include:
+            result['metadatas'] = [self.metadatas[row] for row in rows]
+        if 'embeddings' in include:
+            result['embeddings'] = [np.asarray(self.embeddings[row], dtype=np.float32).tolist() for row in rows]
+        return result
+    
+    def distances(self, query_embedding, ids):
+        rows = np.array([self._row_of[chunk_id] for chunk_id in ids if chunk_id in self._row_of], dtype=np.int64)
+        if rows.size == 0:
+            return {}
+        distances = self._distances(rows, np.asarray(query_embedding, dtype=np.float32))
+        return {self.ids[row]: float(distance) for row, distance in zip(rows, distances)}
+    
+    def get_stats(self):
+        return {
+            'backend': self.name,
+            'count': self.count(),
+            'dimension': self.dimension,
+            'dtype': self.dtype.name,
+            'space': self.space,
+            'quantization': self.quantization,
+            'rescore_factor': self.rescore_factor,
+            'index_dir': str(self.index_dir),
+            'embedding_bytes': int(self.embeddings.nbytes),
+            'coarse_bytes': int(self.coarse.nbytes) if self.coarse is not None else 0
+        }
+
+
+def _write_coarse_copy(index_dir: Path, num_rows: int, dimension: int, quantization: str) -> None:
+    """
+    Write the quantized coarse-pass copy of embeddings.bin.
+    
+    int8 uses per-dimension scalar quantization: each dimension's [min, max]
+    range is mapped onto the 256 codes, x ~= offset + scale * code.
+    
+    Args:
+        index_dir: Index directory holding embeddings.bin
+        num_rows: Number of rows
+        dimension: Embedding dimension
+        quantization: 'float16' or 'int8'
+    """
+    embeddings = np.memmap(index_dir / 'embeddings.bin', dtype=np.float32, mode='r', shape=(num_rows, dimension))
+    
+    if quantization == 'int8':
+        minimum = np.full(dimension, np.inf, dtype=np.float32)
+        maximum = np.full(dimension, -np.inf, dtype=np.float32)
+        for start in range(0, num_rows, SCORE_BLOCK_ROWS):
+            block = np.asarray(embeddings[start:start + SCORE_BLOCK_ROWS])
+            minimum = np.minimum(minimum, block.min(axis=0))
+            maximum = np.maximum(maximum, block.max(axis=0))
+        
+        scale = np.maximum((maximum - minimum) / 255.0, 1e-12).astype(np.float32)
+        offset = (minimum + 128.0 * scale).astype(np.float32)
+        np.savez(index_dir / 'quantization.npz', scale=scale, offset=offset)
+    
+    with open(index_dir / 'coarse.bin', 'wb') as coarse_file:
+        for start in range(0, num_rows, SCORE_BLOCK_ROWS):
+            block = np.asarray(embeddings[start:start + SCORE_BLOCK_ROWS])
+            if quantization == 'int8':
+                codes = np.clip(np.rint((block - offset) / scale), -128, 127).astype(np.int8)
+                coarse_file.write(codes.tobytes())
+            else:
+                coarse_file.write(block.astype(np.float16).tobytes())
+    
+    del embeddings
+
+
+def export_chroma_collection(
+    collection,
+    index_dir: Path,
+    quantization: str = 'none',
+    page_size: int = 1000
+) -> Dict[str, Any]:
+    """
+    Export a ChromaDB collection to a flat memory-mapped index.
+    
+    The index is written to a temporary directory and swapped in at the
+    end, so readers never see a half-written index.
+    
+    Args:
+        collection: ChromaDB collection
+        index_dir: Output directory
+        quantization: Coarse-pass storage ('none', 'float16' or 'int8');
+            float32 embeddings are always kept for exact rescoring
+        page_size: Chunks fetched per request
+    
+    Returns:
+        Dictionary with export statistics
+    """
+    index_dir = Path(index_dir)
+    if quantization not in QUANTIZATION_MODES:
+        raise ValueError(f"Unsupported quantization: {quantization}")
+    
+    tmp_dir = index_dir.with_name(index_dir.name + '.tmp')
+    if tmp_dir.exists():
+        shutil.rmtree(tmp_dir)
+    tmp_dir.mkdir(parents=True)
+    
+    ids: List[str] = []
+    metadatas: List[Dict[str, Any]] = []
+    norms: List[np.ndarray] = []
+    doc_offsets = [0]
+    dimension = None
+    
+    with open(tmp_dir / 'embeddings.bin', 'wb') as emb_file, open(tmp_dir / 'documents.bin', 'wb') as doc_file:
+        offset = 0
+        while True:
+            page = collection.get(
+                include=['documents', 'metadatas', 'embeddings'],
+                limit=page_size,
+                offset=offset
+            )
+            page_ids = page.get('ids') or []
+            if not page_ids:
+                break
+            
+            embeddings = np.asarray(page['embeddings'], dtype=np.float32)
+            if dimension is None:
+                dimension = embeddings.shape[1]
+            elif embeddings.shape[1] != dimension:
+                raise ValueError(f"Mixed embedding dimensions in collection: {dimension} and {embeddings.shape[1]}")
+            
+            emb_file.write(embeddings.tobytes())
+            norms.append(np.einsum('ij,ij->i', embeddings, embeddings))
+            
+            # Diagram pages are stored without documents
+            for doc in page.get('documents') or [None] * len(page_ids):
+                encoded = (doc or '').encode('utf-8')
+                doc_file.write(encoded)
+                doc_offsets.append(doc_offsets[-1] + len(encoded))
+            
+            ids.extend(page_ids)
+            metadatas.extend(metadata or {} for metadata in (page.get('metadatas') or [None] * len(page_ids)))
+            offset += len(page_ids)
+            logger.info(f"Exported {offset} chunks...")
+    
+    np.save(tmp_dir / 'norms.npy', np.concatenate(norms) if norms else np.zeros(0, dtype=np.float32))
+    np.save(tmp_dir / 'doc_offsets.npy', np.asarray(doc_offsets, dtype=np.int64))
+    
+    if quantization != 'none' and ids:
+        _write_coarse_copy(tmp_dir, len(ids), int(dimension), quantization)
+    
+    # Precomputed filter bitmasks, packed 8 rows per byte
+    masks = {}
+    for field in BITMASK_FIELDS:
+        values: Dict[str, np.ndarray] = {}
+        for row, metadata in enumerate(metadatas):
+            if field in metadata:
+                value = _normalize_filter_value(metadata[field])
+                if value not in values:
+                    values[value] = np.zeros(len(ids), dtype=bool)
+                values[value][row] = True
+        for value, mask in values.items():
+            masks[f"{field}={value}"] = np.packbits(mask)
+    np.savez(tmp_dir / 'bitmasks.npz', **masks)
+    
+    space = (collection.metadata or {}).get('hnsw:space', 'l2')
+    info = {
+        'version': FLAT_INDEX_VERSION,
+        'collection': collection.name,
+        'dtype': 'float32',
+        'dimension': int(dimension or 0),
+        'space': space,
+        'quantization': quantization,
+        'ids': ids,
+        'metadatas': metadatas
+    }
+    with open(tmp_dir / 'index.json', 'w', encoding='utf-8') as f:
+        json.dump(info, f)
+    
+    # Swap the new index in
+    old_dir = index_dir.with_name(index_dir.name + '.old')
+    if old_dir.exists():
+        shutil.rmtree(old_dir)
+    if index_dir.exists():
+        os.replace(index_dir, old_dir)
+    os.replace(tmp_dir, index_dir)
+    if old_dir.exists():
+        shutil.rmtree(old_dir, ignore_errors=True)
+    
+    stats = {
+        'chunks': len(ids),
+        'dimension': int(dimension or 0),
+        'quantization': quantization,
+        'space': space,
+        'bitmasks': len(masks),
+        'index_dir': str(index_dir)
+    }
+    logger.info(f"Flat vector index exported: {stats}")
+    return stats
+
+
+def open_flat_index(index_dir: Path, rescore_factor: int = DEFAULT_RESCORE_FACTOR) -> FlatMemmapBackend:
+    """
+    Open a flat index, sharing one instance per process.
+    
+    The index is read-only, so every RAG system (and, when opened before
+    fork, every worker) can use the same instance. It is reopened when
+    index.json changes (a new export).
+    
+    Args:
+        index_dir: Directory written by export_chroma_collection
+        rescore_factor: Candidates rescored with float32 per requested result
+    
+    Returns:
+        The flat index
+    
+    Raises:
+        FileNotFoundError: If the index has not been exported
+    """
+    from services.preload import shared_asset
+    index_dir = Path(index_dir)
+    return shared_asset(
+        'flat_index',
+        index_dir,
+        lambda: FlatMemmapBackend(index_dir, rescore_factor),
+        stamp_path=index_dir / 'index.json'
+    )
+
+
+def flat_index_dir_for(collection_name: str, index_root: Optional[Path] = None) -> Path:
+    """
+    Get the flat index directory of a text collection.
+    
+    Every collection has its own directory, so exporting a re-embedded
+    collection never touches the index the alias is still serving, and
+    switching the alias (or rolling it back) finds the matching index.
+    
+    Args:
+        collection_name: Resolved collection name (not the alias)
+        index_root: Parent directory (default: Config.FLAT_INDEX_DIR)
+    
+    Returns:
+        Path of the collection's flat index
+    """
+    return Path(index_root or Config.FLAT_INDEX_DIR) / collection_name
+
+
+def create_vector_backend(kind: str, collection, index_dir: Optional[Path] = None) -> VectorBackend:
+    """
+    Create the configured vector backend.
+    
+    Falls back to ChromaDB if the flat index cannot be opened.
+    
+    Args:
+        kind: 'chroma' or 'flat'
+        collection: ChromaDB collection
+        index_dir: Flat index directory (default: the collection's directory
+            under Config.FLAT_INDEX_DIR)
+    
+    Returns:
+        Vector backend
+    """
+    if kind == 'flat':
+        try:
+            backend = open_flat_index(index_dir or flat_index_dir_for(collection.name), Config.VECTOR_RESCORE_FACTOR)
+            if backend.collection_name and backend.collection_name != collection.name:
+                # Vectors from another embedding model would not match the query embeddings
+                raise ValueError(
+                    f"it was exported from '{backend.collection_name}', not '{collection.name}'"
+                )
+            try:
+                collection_count = collection.count()
+                if collection_count != backend.count():
+                    logger.warning(
+                        f"Flat vector index has {backend.count()} chunks but the collection has "
+                        f"{collection_count}; re-export it with 'python -m services.vector_backends export'"
+                    )
+            except Exception:
+                pass
+            return backend
+        except Exception as e:
+            logger.error(f"Could not open flat vector index, using ChromaDB: {e}")
+    elif kind != 'chroma':
+        logger.warning(f"Unknown vector backend '{kind}', using ChromaDB")
+    
+    return ChromaBackend(collection)
+
+
+def measure_recall(
+    backend: FlatMemmapBackend,
+    query_embeddings: List[List[float]],
+    k: int = 10,
+    where: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    Compare quantized search against exact float32 search.
+    
+    Args:
+        backend: Flat index with a quantized coarse copy
+        query_embeddings: Query embeddings
+        k: Results compared per query
+        where: Optional metadata filters
+    
+    Returns:
+        Dictionary with recall@k (mean/min) and per-query latencies
+    """
+    recalls = []
+    quantized_ms = []
+    exact_ms = []
+    
+    for embedding in query_embeddings:
+        start = time.perf_counter()
+        exact_rows, _ = backend.search_rows(embedding, k, where, exact=True)
+        exact_ms.append((time.perf_counter() - start) * 1000)
+        
+        start = time.perf_counter()
+        rows, _ = backend.search_rows(embedding, k, where)
+        quantized_ms.append((time.perf_counter() - start) * 1000)
+        
+        if exact_rows.size:
+            recalls.append(len(set(rows.tolist()) & set(exact_rows.tolist())) / exact_rows.size)
+    
+    return {
+        'quantization': backend.quantization,
+        'rescore_factor': backend.rescore_factor,
+        'queries': len(recalls),
+        'k': k,
+        'recall_mean': round(float(np.mean(recalls)), 4) if recalls else None,
+        'recall_min': round(float(np.min(recalls)), 4) if recalls else None,
+        'exact_ms_mean': round(float(np.mean(exact_ms)), 3) if exact_ms else None,
+        'quantized_ms_mean': round(float(np.mean(quantized_ms)), 3) if quantized_ms else None
+    }
+
+
+def _sample_stored_queries(backend: FlatMemmapBackend, num_queries: int, seed: int = 0) -> List[np.ndarray]:
+    """Pick stored float32 rows (plus a little noise) as recall-check queries."""
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(backend.count(), size=min(num_queries, backend.count()), replace=False)
+    queries = []
+    for row in rows:
+        vector = np.asarray(backend.embeddings[row], dtype=np.float32)
+        noise = rng.normal(scale=0.05 * (float(np.std(vector)) or 1.0), size=vector.shape)
+        queries.append(vector + noise.astype(np.float32))
+    return queries
+
+
+def main():
+    """
+    Command-line entry point for exporting flat vector indexes and checking their recall.
+    """
+    parser = argparse.ArgumentParser(description='Manage flat memory-mapped vector indexes')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    targets = {
+        'text': (Config.CHROMA_DB_PATH, Config.CHROMA_COLLECTION_NAME, Config.FLAT_INDEX_DIR),
+        'diagrams': (Config.CHROMA_DB_PATH / 'diagrams', 'ncert_diagram_pages', Config.DIAGRAM_FLAT_INDEX_DIR)
+    }
+    
+    export_parser = subparsers.add_parser('export', help='Export a Chroma collection to a flat index')
+    export_parser.add_argument('--target', default='text', choices=sorted(targets), help='Index to export')
+    export_parser.add_argument('--collection', help='Collection to export (default: from target)')
+    export_parser.add_argument('--out', help='Output directory (default: from target and collection)')
+    export_parser.add_argument(
+        '--quantization', default=Config.VECTOR_QUANTIZATION, choices=QUANTIZATION_MODES,
+        help='Coarse-pass storage; float32 rows are kept for rescoring'
+    )
+    
+    recall_parser = subparsers.add_parser('recall', help='Check quantized recall@k against exact float32 search')
+    recall_parser.add_argument('--target', default='text', choices=sorted(targets), help='Index to check')
+    recall_parser.add_argument('--index', help='Flat index directory (default: from target and serving collection)')
+    recall_parser.add_argument('--queries', help='Text file with one query per line (text target only)')
+    recall_parser.add_argument('--samples', type=int, default=200, help='Stored vectors sampled as queries')
+    recall_parser.add_argument('-k', type=int, default=10, help='Results compared per query')
+    recall_parser.add_argument('--rescore-factor', type=int, default=Config.VECTOR_RESCORE_FACTOR, help='Candidates rescored per result')
+    
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    
+    db_path, collection_name, index_dir = targets[args.target]
+    if args.target == 'text':
+        # Text collections are versioned per embedding model, each with its own flat index
+        if not getattr(args, 'collection', None):
+            from services.embedding_collections import resolve_collection_name
+            collection_name = resolve_collection_name(db_path, collection_name)
+        else:
+            collection_name = args.collection
+        index_dir = flat_index_dir_for(collection_name, index_dir)
+    
+    if args.command == 'export':
+        import chromadb
+        from chromadb.config import Settings
+        
+        client = chromadb.PersistentClient(
+            path=str(db_path),
+            settings=Settings(anonymized_telemetry=False)
+        )
+        collection = client.get_collection(name=args.collection or collection_name)
+        stats = export_chroma_collection(collection, Path(args.out or index_dir), quantization=args.quantization)
+        print(json.dumps(stats, indent=2))
+    
+    elif args.command == 'recall':
+        backend = FlatMemmapBackend(Path(args.index or index_dir), args.rescore_factor)
+        if backend.coarse is None:
+            parser.error(f"{backend.index_dir} was exported without quantization")
+        
+        if args.queries:
+            if args.target != 'text':
+                parser.error('--queries needs the text target; diagram recall uses sampled vectors')
+            from services.rag_system import RAGSystem
+            
+            rag = RAGSystem()
+            with open(args.queries, 'r', encoding='utf-8') as f:
+                queries = [line.strip() for line in f if line.strip()]
+            query_embeddings = [rag.embed_query(query) for query in queries]
+        else:
+            query_embeddings = _sample_stored_queries(backend, args.samples)
+        
+        print(json.dumps(measure_recall(backend, query_embeddings, k=args.k), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,438 @@
+"""
+Subject/Class-Partitioned Vector Indexes for NCERT Content
+
+Nearly every search is restricted to one subject and often one class, but
+a single ChromaDB collection walks one global HNSW graph and applies the
+`where` filter afterwards. That wastes work on other subjects' chunks and
+can return fewer than top_k hits when the graph neighborhood is dominated
+by filtered-out chunks.
+
+This module keeps one ChromaDB collection per (subject, class_level) next
+to the main collection, which stays the source of truth for ingestion:
+
+- sync_partitions copies new chunks (with their embeddings) from the main
+  collection, refreshes metadata and deletes orphans, then writes a small
+  registry file listing the partitions
+- PartitionedBackend is a VectorBackend that routes each query to the
+  partitions matching its subject/class filter (all partitions when there
+  is none) and merges their results by distance
+
+    python -m services.vector_partitions sync
+"""
+
+import re
+import json
+import logging
+import argparse
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from config import Config
+from services.vector_backends import VectorBackend
+from utils.atomic_file import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+REGISTRY_VERSION = 1
+
+# Metadata fields partitions are keyed on
+PARTITION_FIELDS = ('subject', 'class_level')
+
+
+def registry_path_for(vector_store_path: Path, collection_name: str) -> Path:
+    """
+    Get the partition registry file path for a collection.
+    
+    Args:
+        vector_store_path: ChromaDB directory
+        collection_name: Main collection name
+    
+    Returns:
+        Path of the registry file
+    """
+    return Path(vector_store_path) / f"{collection_name}_partitions.json"
+
+
+def partition_key(subject: Any, class_level: Any) -> str:
+    """
+    Build the partition key for a subject and class level.
+    
+    Args:
+        subject: Subject metadata value
+        class_level: Class level metadata value
+    
+    Returns:
+        Key such as 'physics_11'
+    """
+    raw = f"{subject}_{class_level}".lower()
+    return re.sub(r'[^a-z0-9]+', '_', raw).strip('_') or 'unknown'
+
+
+def partition_collection_name(collection_name: str, key: str) -> str:
+    """
+    Name of the ChromaDB collection holding one partition.
+    
+    Args:
+        collection_name: Main collection name
+        key: Partition key
+    
+    Returns:
+        Collection name (at most 63 characters, as ChromaDB requires)
+    """
+    return f"{collection_name}__{key}"[:63].rstrip('_')
+
+
+def _values(condition: Any) -> Optional[Set[str]]:
+    """Allowed values of an equality/$eq/$in condition, or None if it is something else."""
+    if isinstance(condition, dict):
+        if '$eq' in condition and len(condition) == 1:
+            return {str(condition['$eq'])}
+        if '$in' in condition and len(condition) == 1:
+            return {str(value) for value in condition['$in']}
+        return None
+    return {str(condition)}
+
+
+def split_filters(filters: Optional[Dict[str, Any]]) -> Tuple[Dict[str, Set[str]], Optional[Dict[str, Any]]]:
+    """
+    Split ChromaDB filters into partition routing values and the rest.
+    
+    Top-level and $and equality/$eq/$in conditions on subject and class_level
+    select partitions; every other condition is kept as a residual filter
+    applied inside each partition.
+    
+    Args:
+        filters: Metadata filters (e.g. {'subject': 'Physics', 'class_level': '11'})
+    
+    Returns:
+        Tuple of ({field: allowed values}, residual filters or None)
+    """
+    if not filters:
+        return {}, None
+    
+    clauses = []
+    for key, value in filters.items():
+        if key == '$and':
+            clauses.extend(value)
+        else:
+            clauses.append({key: value})
+    
+    routing: Dict[str, Set[str]] = {}
+    residual = []
+    for clause in clauses:
+        if len(clause) == 1:
+            field, condition = next(iter(clause.items()))
+            values = _values(condition) if field in PARTITION_FIELDS else None
+            if values is not None:
+                routing[field] = routing[field] & values if field in routing else values
+                continue
+        residual.append(clause)
+    
+    if not residual:
+        return routing, None
+    if len(residual) == 1:
+        return routing, residual[0]
+    return routing, {'$and': residual}
+
+
+def _load_registry(path: Path) -> Optional[Dict[str, Any]]:
+    if not path.exists():
+        return None
+    
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable partition registry {path}: {e}")
+        return None
+    
+    if data.get('version') != REGISTRY_VERSION:
+        return None
+    return data
+
+
+def _save_registry(path: Path, collection_name: str, partitions: Dict[str, Dict[str, Any]]) -> None:
+    data = {
+        'version': REGISTRY_VERSION,
+        'collection': collection_name,
+        'partitions': partitions
+    }
+    write_json_atomic(path, data, indent=2)
+
+
+def sync_partitions(
+    client,
+    collection,
+    vector_store_path: Path,
+    page_size: int = 1000,
+    batch_size: int = 100
+) -> Dict[str, int]:
+    """
+    Bring the per-(subject, class) partition collections in line with the main collection.
+    
+    Chunk IDs are content hashes, so only IDs missing from a partition are
+    copied (embeddings are reused, nothing is re-embedded). Metadata of kept
+    chunks is refreshed when it changed, orphans are deleted, and partitions
+    that became empty are dropped.
+    
+    Args:
+        client: ChromaDB client holding the main collection
+        collection: Main ChromaDB collection
+        vector_store_path: ChromaDB directory (for the registry file)
+        page_size: Chunks fetched per request
+        batch_size: Chunks written per request
+    
+    Returns:
+        Dictionary mapping partition keys to chunk counts
+    """
+    # One metadata pass over the main collection
+    wanted: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    labels: Dict[str, Tuple[str, str]] = {}
+    offset = 0
+    while True:
+        page = collection.get(include=['metadatas'], limit=page_size, offset=offset)
+        ids = page.get('ids') or []
+        if not ids:
+            break
+        for chunk_id, metadata in zip(ids, page['metadatas']):
+            metadata = metadata or {}
+            subject = str(metadata.get('subject', 'Unknown'))
+            class_level = str(metadata.get('class_level', 'Unknown'))
+            key = partition_key(subject, class_level)
+            labels.setdefault(key, (subject, class_level))
+            wanted.setdefault(key, {})[chunk_id] = metadata
+        offset += len(ids)
+    
+    registry_path = registry_path_for(vector_store_path, collection.name)
+    previous = (_load_registry(registry_path) or {}).get('partitions', {})
+    
+    partitions: Dict[str, Dict[str, Any]] = {}
+    for key, chunks in sorted(wanted.items()):
+        name = partition_collection_name(collection.name, key)
+        partition = client.get_or_create_collection(
+            name=name,
+            metadata={**(collection.metadata or {}), 'partition_of': collection.name, 'partition': key}
+        )
+        
+        current = partition.get(include=['metadatas'])
+        current_meta = dict(zip(current.get('ids') or [], current.get('metadatas') or []))
+        
+        new_ids = [chunk_id for chunk_id in chunks if chunk_id not in current_meta]
+        orphan_ids = [chunk_id for chunk_id in current_meta if chunk_id not in chunks]
+        changed_ids = [
+            chunk_id for chunk_id, metadata in current_meta.items()
+            if chunk_id in chunks and (metadata or {}) != chunks[chunk_id]
+        ]
+        
+        for i in range(0, len(new_ids), batch_size):
+            fetched = collection.get(
+                ids=new_ids[i:i+batch_size],
+                include=['documents', 'metadatas', 'embeddings']
+            )
+            partition.upsert(
+                ids=fetched['ids'],
+                documents=fetched['documents'],
+                metadatas=fetched['metadatas'],
+                embeddings=fetched['embeddings']
+            )
+        for i in range(0, len(changed_ids), batch_size):
+            batch = changed_ids[i:i+batch_size]
+            partition.update(ids=batch, metadatas=[chunks[chunk_id] for chunk_id in batch])
+        for i in range(0, len(orphan_ids), batch_size):
+            partition.delete(ids=orphan_ids[i:i+batch_size])
+        
+        subject, class_level = labels[key]
+        partitions[key] = {
+            'collection': name,
+            'subject': subject,
+            'class_level': class_level,
+            'count': len(chunks)
+        }
+        
+        if new_ids or changed_ids or orphan_ids:
+            logger.info(
+                f"Partition {key}: +{len(new_ids)} new, {len(changed_ids)} updated, "
+                f"-{len(orphan_ids)} removed ({len(chunks)} chunks)"
+            )
+    
+    # Drop partitions with no chunks left
+    for key, entry in previous.items():
+        if key not in partitions:
+            try:
+                client.delete_collection(name=entry['collection'])
+                logger.info(f"Dropped empty partition {key}")
+            except Exception as e:
+                logger.warning(f"Could not drop partition {key}: {e}")
+    
+    _save_registry(registry_path, collection.name, partitions)
+    return {key: entry['count'] for key, entry in partitions.items()}
+
+
+class PartitionedBackend(VectorBackend):
+    """
+    Routes queries to per-(subject, class) partition collections and merges the results.
+    """
+    
+    name = 'partitioned'
+    
+    def __init__(self, base: VectorBackend, partitions: Dict[str, Dict[str, Any]], collections: Dict[str, Any]):
+        """
+        Initialize the backend.
+        
+        Args:
+            base: Backend over the main collection (used for get and count)
+            partitions: Registry entries by partition key
+            collections: ChromaDB collection of each partition, by key
+        """
+        self.base = base
+        self.partitions = partitions
+        self.collections = collections
+    
+    @classmethod
+    def load(cls, client, collection, vector_store_path: Path, base: VectorBackend) -> Optional['PartitionedBackend']:
+        """
+        Open the partitions of a collection.
+        
+        Args:
+            client: ChromaDB client holding the partitions
+            collection: Main ChromaDB collection
+            vector_store_path: ChromaDB directory holding the registry
+            base: Backend over the main collection
+        
+        Returns:
+            The backend, or None if there are no partitions or they are out of date
+        """
+        registry = _load_registry(registry_path_for(vector_store_path, collection.name))
+        if not registry or registry.get('collection') != collection.name or not registry.get('partitions'):
+            return None
+        
+        partitions = registry['partitions']
+        total = sum(entry['count'] for entry in partitions.values())
+        if total != collection.count():
+            logger.warning(
+                f"Partitions hold {total} chunks but the collection has {collection.count()}; "
+                f"run 'python -m services.vector_partitions sync'. Using the global index."
+            )
+            return None
+        
+        collections = {}
+        for key, entry in partitions.items():
+            try:
+                collections[key] = client.get_collection(name=entry['collection'])
+            except Exception as e:
+                logger.warning(f"Partition {key} is missing ({e}), using the global index")
+                return None
+        
+        logger.info(f"Loaded {len(partitions)} subject/class partitions")
+        return cls(base, partitions, collections)
+    
+    def route(self, filters: Optional[Dict[str, Any]]) -> Tuple[List[str], Optional[Dict[str, Any]]]:
+        """
+        Pick the partitions a query has to search.
+        
+        Args:
+            filters: Metadata filters
+        
+        Returns:
+            Tuple of (partition keys, residual filters for each partition)
+        """
+        routing, residual = split_filters(filters)
+        keys = [
+            key for key, entry in self.partitions.items()
+            if all(entry[field] in values for field, values in routing.items())
+        ]
+        return keys, residual
+    
+    def query(self, query_embedding, n_results, where=None):
+        results = self.query_many([query_embedding], n_results, where)
+        return {field: values[:1] for field, values in results.items()}
+    
+    def query_many(self, query_embeddings, n_results, where=None):
+        keys, residual = self.route(where)
+        
+        # One multi-query request per routed partition
+        hits = [[] for _ in query_embeddings]
+        for key in keys:
+            n = min(n_results, self.partitions[key]['count'])
+            if n <= 0 or not query_embeddings:
+                continue
+            query_params = {
+                'query_embeddings': list(query_embeddings),
+                'n_results': n
+            }
+            if residual:
+                query_params['where'] = residual
+            results = self.collections[key].query(**query_params)
+            for position in range(len(query_embeddings)):
+                if not results['ids'] or position >= len(results['ids']):
+                    continue
+                hits[position].extend(zip(
+                    results['distances'][position],
+                    results['ids'][position],
+                    results['documents'][position],
+                    results['metadatas'][position]
+                ))
+        
+        merged = {'ids': [], 'documents': [], 'metadatas': [], 'distances': []}
+        for query_hits in hits:
+            query_hits.sort(key=lambda hit: hit[0])
+            query_hits = query_hits[:n_results]
+            merged['ids'].append([hit[1] for hit in query_hits])
+            merged['documents'].append([hit[2] for hit in query_hits])
+            merged['metadatas'].append([hit[3] for hit in query_hits])
+            merged['distances'].append([hit[0] for hit in query_hits])
+        return merged
+    
+    @property
+    def space(self) -> str:
+        return self.base.space
+    
+    def get(self, ids, include=None):
+        return self.base.get(ids, include)
+    
+    def distances(self, query_embedding, ids):
+        return self.base.distances(query_embedding, ids)
+    
+    def count(self):
+        return self.base.count()
+    
+    def get_stats(self):
+        return {
+            'backend': self.name,
+            'count': self.count(),
+            'partitions': {key: entry['count'] for key, entry in self.partitions.items()}
+        }
+
+
+def main():
+    """
+    Command-line entry point for syncing the partition collections.
+    """
+    parser = argparse.ArgumentParser(description='Manage subject/class-partitioned vector indexes')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    sync_parser = subparsers.add_parser('sync', help='Sync partitions with the main collection')
+    sync_parser.add_argument('--collection', help='Main collection (default: the one serving Config.CHROMA_COLLECTION_NAME)')
+    
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    
+    import chromadb
+    from chromadb.config import Settings
+    from services.embedding_collections import resolve_collection_name
+    
+    client = chromadb.PersistentClient(
+        path=str(Config.CHROMA_DB_PATH),
+        settings=Settings(anonymized_telemetry=False)
+    )
+    collection_name = args.collection or resolve_collection_name(Config.CHROMA_DB_PATH, Config.CHROMA_COLLECTION_NAME)
+    collection = client.get_collection(name=collection_name)
+    
+    if args.command == 'sync':
+        counts = sync_partitions(client, collection, Config.CHROMA_DB_PATH)
+        print(json.dumps(counts, indent=2))
+
+
+if __name__ == "__main__":
+    main()
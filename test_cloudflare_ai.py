@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Tests for the Cloudflare Workers AI clients.
+
+Runs the sync and async clients against the local API stub
+(utils/cloudflare_stub_server.py), so no credentials or network are needed.
+
+    python -m pytest test_cloudflare_ai.py
+"""
+
+import os
+import sys
+import asyncio
+
+import pytest
+
+# Add project root to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from config import Config
+from utils.cloudflare_stub_server import CloudflareStubServer, EMBEDDING_DIMENSION, stub_embedding
+import services.cloudflare_ai as cloudflare_ai
+from services.cloudflare_ai import AsyncCloudflareAI, CloudflareAI, run_on_async_client
+
+MESSAGES = [{"role": "user", "content": "What is photosynthesis?"}]
+TEXTS = ["Photosynthesis", "Newton's laws of motion", "Photosynthesis"]
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    """Stub server the clients created in the test talk to."""
+    server = CloudflareStubServer().start()
+    monkeypatch.setattr(Config, 'CLOUDFLARE_API_BASE_URL', server.base_url)
+    monkeypatch.setattr(Config, 'CLOUDFLARE_ACCOUNT_ID', 'stub')
+    monkeypatch.setattr(Config, 'CLOUDFLARE_API_TOKEN', 'stub')
+    monkeypatch.setattr(cloudflare_ai, 'RETRY_DELAY', 0.01)  # keep the retry backoff short
+
+    # Every test starts with fresh connection pools
+    cloudflare_ai.close_async_client()
+    cloudflare_ai.reset_http_session_after_fork()
+    try:
+        yield server
+    finally:
+        cloudflare_ai.close_async_client()
+        cloudflare_ai.reset_http_session_after_fork()
+        server.stop()
+
+
+def test_sync_calls_share_one_connection(stub):
+    ai = CloudflareAI(enable_fallback=False)
+
+    reply = ai.chat(MESSAGES, use_fallback=False)
+    embedding = ai.generate_embeddings(TEXTS[0], use_fallback=False)
+    embeddings = ai.generate_embeddings_batch(TEXTS, use_fallback=False)
+
+    assert reply.endswith(MESSAGES[0]['content'])
+    assert embedding == stub_embedding(TEXTS[0])
+    assert len(embedding) == EMBEDDING_DIMENSION
+    assert len(embeddings) == len(TEXTS)
+    assert embeddings[0] == embeddings[2] != embeddings[1]
+
+    # One request per call (the batch fits in one request), over one connection
+    assert stub.get_stats() == {'requests': 3, 'connections': 1, 'failures': 0}
+
+
+def test_sync_chat_stream_matches_chat(stub):
+    ai = CloudflareAI(enable_fallback=False)
+
+    reply = ai.chat(MESSAGES, use_fallback=False)
+    stub.fail_requests = 1
+    streamed = ''.join(ai.chat_stream(MESSAGES, use_fallback=False))
+
+    assert streamed.split() == reply.split()
+    assert stub.get_stats()['requests'] == 3
+
+
+def test_sync_client_retries_server_errors(stub):
+    ai = CloudflareAI(enable_fallback=False)
+    stub.fail_requests = 2
+
+    assert ai.chat(MESSAGES, use_fallback=False)
+    assert stub.get_stats()['requests'] == 3
+    assert stub.get_stats()['failures'] == 2
+
+
+def test_sync_client_gives_up_after_max_retries(stub):
+    ai = CloudflareAI(enable_fallback=False)
+    stub.fail_requests = cloudflare_ai.MAX_RETRIES
+
+    with pytest.raises(Exception):
+        ai.chat(MESSAGES, use_fallback=False)
+    assert stub.get_stats()['requests'] == cloudflare_ai.MAX_RETRIES
+
+
+def test_sync_client_does_not_retry_client_errors(stub):
+    ai = CloudflareAI(enable_fallback=False)
+
+    with pytest.raises(Exception):
+        ai._make_request(Config.CLOUDFLARE_CHAT_MODEL, {'unsupported': True})
+    assert stub.get_stats()['requests'] == 1
+
+
+def test_async_client_retries_server_errors(stub):
+    async def calls():
+        async with AsyncCloudflareAI(enable_fallback=False) as ai:
+            reply = await ai.chat(MESSAGES, use_fallback=False)
+            embeddings = await ai.generate_embeddings_batch(TEXTS, use_fallback=False)
+        return reply, embeddings
+
+    stub.fail_requests = 2
+    reply, embeddings = asyncio.run(calls())
+
+    assert reply.endswith(MESSAGES[0]['content'])
+    assert embeddings == [stub_embedding(text) for text in TEXTS]
+    assert stub.get_stats()['requests'] == 4
+    assert stub.get_stats()['failures'] == 2
+
+
+def test_shared_async_client_outlives_request_loops(stub):
+    # Flask request threads each run their own event loop
+    for _ in range(3):
+        loop = asyncio.new_event_loop()
+        try:
+            reply = loop.run_until_complete(
+                run_on_async_client(lambda ai: ai.chat(MESSAGES, use_fallback=False))
+            )
+        finally:
+            loop.close()
+        assert reply.endswith(MESSAGES[0]['content'])
+
+    assert stub.get_stats() == {'requests': 3, 'connections': 1, 'failures': 0}
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Parity tests for the regex word counter used in NCERT chunking.
+
+Chunk boundaries (and content-hashed chunk IDs) follow sentence word counts,
+so INGEST_TOKENIZER=regex must tokenize exactly like NLTK word_tokenize.
+
+    python -m pytest test_text_chunking.py
+"""
+
+import os
+import sys
+
+import pytest
+from nltk.tokenize import NLTKWordTokenizer
+
+# Add project root to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services.text_chunking import chunk_sentences, fast_word_tokenize
+
+SENTENCES = [
+    "Good muffins cost $3.88 (roughly 3,36 euros) in New York.",
+    "“Photosynthesis,” the teacher said, “is how plants make food.”",
+    "The student asked, ‘What’s the unit of force?’",
+    "He wrote „Kraft“ and «force» side by side.",
+    "Newton’s first law isn’t about motion alone…",
+    "Wait... the reaction doesn't stop; it can't, you'll see!",
+    "'Tis the season: gonna, wanna, gimme and cannot all split.",
+    "The block moves 'slowly' -- see Fig. 5.2 [p. 34] for details.",
+    "Read the ``quoted'' term and the \"plain\" one.",
+    "Ram said 'ello to the class, and they're ready at 10:30.",
+    "The value of g is 9.8 m/s² on the Earth’s surface.”",
+    "Is energy conserved? Yes!",
+]
+
+
+@pytest.mark.parametrize('sentence', SENTENCES)
+def test_regex_tokens_match_nltk(sentence):
+    assert fast_word_tokenize(sentence) == NLTKWordTokenizer().tokenize(sentence)
+
+
+def test_regex_chunks_match_nltk():
+    tokenizer = NLTKWordTokenizer()
+
+    def count_nltk(sentence):
+        return len(tokenizer.tokenize(sentence))
+
+    def count_regex(sentence):
+        return len(fast_word_tokenize(sentence))
+
+    sentences = SENTENCES * 10
+    assert chunk_sentences(sentences, 60, 15, count_regex) == chunk_sentences(sentences, 60, 15, count_nltk)
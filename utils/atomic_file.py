@@ -0,0 +1,58 @@
+"""
+Atomic file writes for GuruAI.
+
+Index sidecar files (manifests, registries, aliases, classifiers) are
+written by every worker process, so a fixed "<file>.tmp" path lets two
+writers interleave into the same temp file or race on the rename. Each
+write here goes through its own uniquely named temp file in the target
+directory and is then moved into place with os.replace; the last rename
+wins and readers never see a partial file.
+"""
+
+import os
+import json
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import IO, Any, Iterator
+
+
+@contextmanager
+def atomic_write(path: Path, mode: str = 'w', encoding: str = 'utf-8') -> Iterator[IO]:
+    """
+    Open a unique temp file next to `path` and rename it over `path` on success.
+
+    Args:
+        path: Destination file
+        mode: 'w' for text or 'wb' for binary
+        encoding: Text encoding (ignored for binary mode)
+
+    Yields:
+        The open temp file; if the block raises, the temp file is removed
+        and `path` is left untouched
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    with tempfile.NamedTemporaryFile(
+        mode=mode,
+        encoding=None if 'b' in mode else encoding,
+        dir=path.parent,
+        prefix=path.name + '.',
+        suffix='.tmp',
+        delete=False
+    ) as f:
+        tmp_path = f.name
+        try:
+            yield f
+        except BaseException:
+            f.close()
+            os.unlink(tmp_path)
+            raise
+    os.replace(tmp_path, path)
+
+
+def write_json_atomic(path: Path, data: Any, **dump_kwargs) -> None:
+    """Serialize `data` as JSON to `path` atomically."""
+    with atomic_write(path) as f:
+        json.dump(data, f, **dump_kwargs)
@@ -0,0 +1,235 @@
+"""
+Local stub of the Cloudflare Workers AI REST API.
+
+Answers the chat and embedding calls made by services/cloudflare_ai.py with
+deterministic canned responses, so the HTTP clients (connection pooling,
+retries, the async client) can be exercised without credentials or network
+access.
+
+Features:
+- POST /client/v4/accounts/<account>/ai/run/<model>: chat payloads get an
+  echo of the last user message, embedding payloads one unit vector per text
+  (768 dimensions, derived from the text, so equal texts embed equally)
+- Chat payloads with "stream": true are answered word by word as
+  server-sent events (chunked), ending with "data: [DONE]"
+- HTTP/1.1 keep-alive; GET /stats reports requests and accepted connections,
+  which shows whether a client reuses its connections
+- Optional artificial latency (before the answer and between streamed
+  tokens) and injected 503 failures (retry testing)
+
+Usage:
+    python -m utils.cloudflare_stub_server --port 8787 [--latency 0.05] [--token-delay 0.02] [--fail 2]
+
+    CLOUDFLARE_API_BASE_URL=http://127.0.0.1:8787/client/v4 \\
+    CLOUDFLARE_ACCOUNT_ID=stub CLOUDFLARE_API_TOKEN=stub python app.py
+"""
+
+import re
+import json
+import math
+import time
+import random
+import hashlib
+import argparse
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DIMENSION = 768
+
+_RUN_PATH = re.compile(r'^/client/v4/accounts/[^/]+/ai/run/(?P<model>.+)$')
+
+
+def stub_embedding(text: str, dimension: int = EMBEDDING_DIMENSION) -> List[float]:
+    """
+    Deterministic unit vector for a text.
+    
+    Args:
+        text: Input text
+        dimension: Vector size
+    
+    Returns:
+        Embedding values
+    """
+    rng = random.Random(hashlib.sha256(text.encode('utf-8')).digest())
+    vector = [rng.gauss(0.0, 1.0) for _ in range(dimension)]
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    server: 'CloudflareStubServer'
+    
+    def setup(self):
+        super().setup()
+        self.server.count('connections')
+    
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+    
+    def _send_json(self, status: int, payload: Dict[str, Any]) -> None:
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def _send_event_stream(self, fragments: List[str]) -> None:
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        events = [f"data: {json.dumps({'response': fragment})}\n\n" for fragment in fragments] + ['data: [DONE]\n\n']
+        for event in events:
+            data = event.encode('utf-8')
+            self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+            self.wfile.flush()
+            if self.server.token_delay:
+                time.sleep(self.server.token_delay)
+        self.wfile.write(b"0\r\n\r\n")
+    
+    def _send_error(self, status: int, message: str) -> None:
+        self._send_json(status, {'success': False, 'errors': [{'message': message}], 'result': None})
+    
+    def do_GET(self):
+        if self.path == '/stats':
+            self._send_json(200, self.server.get_stats())
+        else:
+            self._send_error(404, 'Not found')
+    
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        self.server.count('requests')
+        
+        match = _RUN_PATH.match(self.path)
+        if not match:
+            return self._send_error(404, 'Not found')
+        if not self.headers.get('Authorization', '').startswith('Bearer '):
+            return self._send_error(401, 'Authentication error')
+        if self.server.take_failure():
+            return self._send_error(503, 'Injected failure')
+        
+        try:
+            payload = json.loads(raw or b'{}')
+        except ValueError:
+            return self._send_error(400, 'Invalid JSON')
+        
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        
+        if 'text' in payload:
+            texts = payload['text'] if isinstance(payload['text'], list) else [payload['text']]
+            result = {'shape': [len(texts), EMBEDDING_DIMENSION], 'data': [stub_embedding(str(text)) for text in texts]}
+        elif 'messages' in payload:
+            questions = [m.get('content', '') for m in payload['messages'] if m.get('role') == 'user']
+            answer = f"[stub {match.group('model')}] {questions[-1] if questions else ''}"
+            if payload.get('stream'):
+                return self._send_event_stream(re.findall(r'\S+\s*', answer))
+            result = {'response': answer}
+        else:
+            return self._send_error(400, 'Unsupported payload')
+        
+        self._send_json(200, {'success': True, 'errors': [], 'messages': [], 'result': result})
+
+
+class CloudflareStubServer(ThreadingHTTPServer):
+    """
+    Threaded stub server, started in a background thread with start().
+    """
+    
+    daemon_threads = True
+    
+    def __init__(
+        self,
+        host: str = '127.0.0.1',
+        port: int = 0,
+        latency: float = 0.0,
+        fail_requests: int = 0,
+        token_delay: float = 0.0
+    ):
+        """
+        Create the server (port 0 picks a free port).
+        
+        Args:
+            host: Interface to bind
+            port: Port to bind
+            latency: Seconds to wait before answering each API call
+            fail_requests: Number of API calls to answer with 503 first
+            token_delay: Seconds between the events of a streamed answer
+        """
+        super().__init__((host, port), _StubHandler)
+        self.latency = latency
+        self.fail_requests = fail_requests
+        self.token_delay = token_delay
+        self._stats = {'requests': 0, 'connections': 0, 'failures': 0}
+        self._stats_lock = threading.Lock()
+        self._thread = None
+    
+    @property
+    def base_url(self) -> str:
+        """Value for Config.CLOUDFLARE_API_BASE_URL."""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/client/v4"
+    
+    def count(self, name: str) -> None:
+        with self._stats_lock:
+            self._stats[name] += 1
+    
+    def take_failure(self) -> bool:
+        """Whether the current API call should fail (consumes one injected failure)."""
+        with self._stats_lock:
+            if self.fail_requests <= 0:
+                return False
+            self.fail_requests -= 1
+            self._stats['failures'] += 1
+            return True
+    
+    def get_stats(self) -> Dict[str, int]:
+        """Requests, accepted connections and injected failures so far."""
+        with self._stats_lock:
+            return dict(self._stats)
+    
+    def start(self) -> 'CloudflareStubServer':
+        """Serve in a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever, name='cloudflare-stub', daemon=True)
+        self._thread.start()
+        return self
+    
+    def stop(self) -> None:
+        """Stop serving and close the socket."""
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def main():
+    """Command-line entry point."""
+    parser = argparse.ArgumentParser(description='Local stub of the Cloudflare Workers AI API')
+    parser.add_argument('--host', default='127.0.0.1', help='Interface to bind')
+    parser.add_argument('--port', type=int, default=8787, help='Port to bind')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds to wait before each answer')
+    parser.add_argument('--token-delay', type=float, default=0.0, help='Seconds between streamed tokens')
+    parser.add_argument('--fail', type=int, default=0, help='Answer the first N API calls with 503')
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    
+    server = CloudflareStubServer(args.host, args.port, args.latency, args.fail, args.token_delay)
+    print(f"Cloudflare AI stub listening, set CLOUDFLARE_API_BASE_URL={server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()